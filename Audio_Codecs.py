@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+import audioop
+import math
+import os
+import struct
+import zlib
+
+VOICE_RATE = 44100  # the recording rate of the voice chat
+# The audio in every voice packet. Every frame is recorded before it is sent and waits in the buffers of the receiver,
+# so shorter frames cut the delay from mouth to ear, for more packets a second. 10 or 20 ms, 1024-sample chunks were
+# 23.2 ms.
+VOICE_FRAME_MILLISECONDS = 20
+VOICE_FRAME_SIZE = VOICE_RATE * VOICE_FRAME_MILLISECONDS / 1000  # samples, a whole number of ADPCM samples too
+
+# Codec names, as they are announced to the server and to the other participants of a call.
+PCM_CODEC = "pcm"  # raw 16-bit PCM at the recording rate, what the voice chat always sent.
+ZLIB_PCM_CODEC = "zlib-pcm"  # lossless fallback, the raw PCM compressed with zlib.
+ADPCM_16K_CODEC = "adpcm-16k"  # speech codec, resampled to 16 kHz and encoded as 4-bit IMA ADPCM (64 kbit/s).
+ADPCM_8K_CODEC = "adpcm-8k"  # narrowband speech codec, 8 kHz 4-bit IMA ADPCM (32 kbit/s).
+# Not a codec of the speech, like the comfort noise of RTP - the loudness of the background noise while the user is
+# silent, so the receivers play noise instead of dead air. Only sent to participants that announced it.
+COMFORT_NOISE_CODEC = "cn"
+
+# The codecs of a call are chosen in this order - the first codec that every participant supports is used.
+AUDIO_CODECS_PREFERENCE = [ADPCM_16K_CODEC, ADPCM_8K_CODEC, ZLIB_PCM_CODEC, PCM_CODEC]
+SUPPORTED_AUDIO_CODECS = AUDIO_CODECS_PREFERENCE + [COMFORT_NOISE_CODEC]
+DEFAULT_AUDIO_CODEC = PCM_CODEC  # every client can decode raw PCM
+
+CODEC_NAME_ID_DICT = {PCM_CODEC: 0, ZLIB_PCM_CODEC: 1, ADPCM_16K_CODEC: 2, ADPCM_8K_CODEC: 3, COMFORT_NOISE_CODEC: 4}
+CODEC_ID_NAME_DICT = dict((codec_id, codec_name) for codec_name, codec_id in CODEC_NAME_ID_DICT.iteritems())
+ADPCM_CODEC_RATE_DICT = {ADPCM_16K_CODEC: 16000, ADPCM_8K_CODEC: 8000}
+
+SAMPLE_WIDTH = 2  # 16-bit samples
+CHANNELS = 1
+ZLIB_COMPRESSION_LEVEL = 1  # the fastest level, speech does not compress much better on the higher levels
+CODEC_ID_STRUCT = struct.Struct(">B")
+# ADPCM decoding depends on the state of the encoder, so every packet starts with the state of the encoder before it.
+# This way every packet can be decoded by itself, even if the packets before it were lost.
+ADPCM_STATE_STRUCT = struct.Struct(">hB")  # predicted sample, step index
+ADPCM_SAMPLES_PER_BYTE = 2
+COMFORT_NOISE_STRUCT = struct.Struct(">BH")  # the loudness of the noise in decibels, the samples in a frame
+COMFORT_NOISE_ID_BYTE = CODEC_ID_STRUCT.pack(CODEC_NAME_ID_DICT[COMFORT_NOISE_CODEC])
+MAX_COMFORT_NOISE_DECIBELS = 80  # louder "noise" is not background noise
+UNIFORM_NOISE_RMS = 32768 / math.sqrt(3)  # the RMS of random 16-bit samples
+
+
+class AudioCodecException(Exception):
+    pass
+
+
+class PcmCodec(object):
+    """
+    Sends the audio as it was recorded.
+    """
+    def __init__(self, rate):
+        """
+        :param rate: int, the sample rate of the recorded audio.
+        """
+        self.rate = rate
+
+    def encode(self, pcm_data):
+        """
+        :param pcm_data: str, a chunk of 16-bit mono PCM at the recording rate.
+        :return: str, the encoded chunk.
+        """
+        return pcm_data
+
+    def decode(self, encoded_data):
+        """
+        :param encoded_data: str, a chunk that was encoded by the codec.
+        :return: str, 16-bit mono PCM at the recording rate.
+        """
+        return encoded_data
+
+
+class ZlibPcmCodec(PcmCodec):
+    """
+    A lossless codec - the recorded audio compressed with zlib.
+    """
+    def encode(self, pcm_data):
+        return zlib.compress(pcm_data, ZLIB_COMPRESSION_LEVEL)
+
+    def decode(self, encoded_data):
+        try:
+            return zlib.decompress(encoded_data)
+        except zlib.error:
+            raise AudioCodecException("Invalid zlib audio data")
+
+
+class AdpcmCodec(object):
+    """
+    A speech codec - the audio is resampled to a lower sample rate and encoded as IMA ADPCM, 4 bits per sample.
+    The resampling state is kept between chunks, so an instance should be used for a single audio stream.
+    """
+    def __init__(self, rate, codec_rate):
+        """
+        resample_state - the state of audioop.ratecv between chunks.
+        pending_samples - str, a sample that was left over from the last chunk. ADPCM packs two samples into
+        a byte, so odd samples wait for the next chunk.
+        :param rate: int, the sample rate of the recorded audio.
+        :param codec_rate: int, the sample rate that the audio is encoded in.
+        """
+        self.rate = rate
+        self.codec_rate = codec_rate
+        self.resample_state = None
+        self.adpcm_state = None
+        self.pending_samples = ""
+
+    def encode(self, pcm_data):
+        """
+        :param pcm_data: str, a chunk of 16-bit mono PCM at the recording rate.
+        :return: str, the encoded chunk.
+        """
+        resampled_data, self.resample_state = audioop.ratecv(pcm_data, SAMPLE_WIDTH, CHANNELS, self.rate, self.codec_rate, self.resample_state)
+        samples = self.pending_samples + resampled_data
+        even_length = len(samples) - len(samples) % (SAMPLE_WIDTH * ADPCM_SAMPLES_PER_BYTE)
+        self.pending_samples = samples[even_length:]
+        predicted_sample, step_index = self.adpcm_state or (0, 0)
+        adpcm_data, self.adpcm_state = audioop.lin2adpcm(samples[:even_length], SAMPLE_WIDTH, self.adpcm_state)
+        return ADPCM_STATE_STRUCT.pack(predicted_sample, step_index) + adpcm_data
+
+    def decode(self, encoded_data):
+        """
+        :param encoded_data: str, a chunk that was encoded by the codec.
+        :return: str, 16-bit mono PCM at the recording rate.
+        """
+        if len(encoded_data) < ADPCM_STATE_STRUCT.size:
+            raise AudioCodecException("ADPCM audio data is too short")
+        adpcm_state = ADPCM_STATE_STRUCT.unpack_from(encoded_data)
+        try:
+            samples, adpcm_state = audioop.adpcm2lin(encoded_data[ADPCM_STATE_STRUCT.size:], SAMPLE_WIDTH, adpcm_state)
+        except (audioop.error, ValueError):  # an out of range step index
+            raise AudioCodecException("Invalid ADPCM audio data")
+        pcm_data, self.resample_state = audioop.ratecv(samples, SAMPLE_WIDTH, CHANNELS, self.codec_rate, self.rate, self.resample_state)
+        return pcm_data
+
+
+class ComfortNoiseCodec(object):
+    """
+    Sends the loudness of a frame of background noise instead of the noise itself, and plays random noise as loud.
+    """
+    def __init__(self, rate):
+        """
+        :param rate: int, the sample rate of the recorded audio.
+        """
+        self.rate = rate
+
+    def encode(self, pcm_data):
+        """
+        :param pcm_data: str, a silent chunk of 16-bit mono PCM at the recording rate.
+        :return: str, the encoded loudness of the chunk.
+        """
+        rms = audioop.rms(pcm_data, SAMPLE_WIDTH)
+        decibel_volume = int(round(20 * math.log10(rms))) if rms > 1 else 0
+        return COMFORT_NOISE_STRUCT.pack(min(decibel_volume, MAX_COMFORT_NOISE_DECIBELS), len(pcm_data) / SAMPLE_WIDTH)
+
+    def decode(self, encoded_data):
+        """
+        :param encoded_data: str, the loudness that was encoded by the codec.
+        :return: str, a chunk of random noise as loud as the encoded chunk, 16-bit mono PCM at the recording rate.
+        """
+        if len(encoded_data) < COMFORT_NOISE_STRUCT.size:
+            raise AudioCodecException("Comfort noise data is too short")
+        decibel_volume, samples_num = COMFORT_NOISE_STRUCT.unpack_from(encoded_data)
+        if not decibel_volume:
+            return "\0" * samples_num * SAMPLE_WIDTH
+        return audioop.mul(os.urandom(samples_num * SAMPLE_WIDTH), SAMPLE_WIDTH,
+                           10 ** (decibel_volume / 20.0) / UNIFORM_NOISE_RMS)
+
+
+def is_comfort_noise_packet(packet):
+    """
+    :param packet: str, a voice packet.
+    :return: Bool, True if the packet carries comfort noise instead of speech.
+    """
+    return packet[:CODEC_ID_STRUCT.size] == COMFORT_NOISE_ID_BYTE
+
+
+def create_codec(codec_name, rate):
+    """
+    Creates a codec object.
+    :param codec_name: str, one of SUPPORTED_AUDIO_CODECS.
+    :param rate: int, the sample rate of the recorded audio.
+    :return: PcmCodec, ZlibPcmCodec, AdpcmCodec or ComfortNoiseCodec, the codec.
+    """
+    if codec_name == PCM_CODEC:
+        return PcmCodec(rate)
+    elif codec_name == ZLIB_PCM_CODEC:
+        return ZlibPcmCodec(rate)
+    elif codec_name in ADPCM_CODEC_RATE_DICT:
+        return AdpcmCodec(rate, ADPCM_CODEC_RATE_DICT[codec_name])
+    elif codec_name == COMFORT_NOISE_CODEC:
+        return ComfortNoiseCodec(rate)
+    raise AudioCodecException("Unknown audio codec " + str(codec_name))
+
+
+def choose_audio_codec(participants_audio_codecs):
+    """
+    Chooses the codec of a call - the most preferred codec that all the participants can decode.
+    :param participants_audio_codecs: [[str]], the codecs that every participant supports.
+    :return: str, the name of the chosen codec.
+    """
+    for codec_name in AUDIO_CODECS_PREFERENCE:
+        if all(codec_name in audio_codecs for audio_codecs in participants_audio_codecs):
+            return codec_name
+    return DEFAULT_AUDIO_CODEC
+
+
+class AudioEncoder(object):
+    """
+    Encodes the recorded audio chunks into voice packets. Every packet starts with the id of its codec,
+    so the codec of a call can change without informing the receivers.
+    """
+    def __init__(self, codec_name, rate):
+        """
+        :param codec_name: str, one of SUPPORTED_AUDIO_CODECS.
+        :param rate: int, the sample rate of the recorded audio.
+        """
+        self.codec_name = codec_name
+        self.codec = create_codec(codec_name, rate)
+        self.codec_id_byte = CODEC_ID_STRUCT.pack(CODEC_NAME_ID_DICT[codec_name])
+
+    def encode(self, pcm_data):
+        """
+        :param pcm_data: str, a chunk of 16-bit mono PCM at the recording rate.
+        :return: str, the voice packet.
+        """
+        return self.codec_id_byte + self.codec.encode(pcm_data)
+
+
+class AudioDecoder(object):
+    """
+    Decodes the voice packets of a single participant, with whatever codec each packet was encoded.
+    """
+    def __init__(self, rate):
+        """
+        codec_id_codec_dict - {int:codec}, the codecs that were used by the participant so far.
+        :param rate: int, the sample rate that the audio is played in.
+        """
+        self.rate = rate
+        self.codec_id_codec_dict = {}
+
+    def decode(self, packet):
+        """
+        Raises AudioCodecException if the packet is invalid.
+        :param packet: str, a voice packet.
+        :return: str, 16-bit mono PCM at the playing rate.
+        """
+        if not packet:
+            raise AudioCodecException("Empty voice packet")
+        codec_id = CODEC_ID_STRUCT.unpack_from(packet)[0]
+        if codec_id not in self.codec_id_codec_dict:
+            if codec_id not in CODEC_ID_NAME_DICT:
+                raise AudioCodecException("Unknown audio codec id " + str(codec_id))
+            self.codec_id_codec_dict[codec_id] = create_codec(CODEC_ID_NAME_DICT[codec_id], self.rate)
+        return self.codec_id_codec_dict[codec_id].decode(packet[CODEC_ID_STRUCT.size:])
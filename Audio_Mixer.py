@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import numpy as np
+from Audio_Codecs import AudioEncoder, AudioDecoder, AudioCodecException, choose_audio_codec, is_comfort_noise_packet, \
+    VOICE_RATE, VOICE_FRAME_SIZE
+from Jitter_Buffer import JitterBuffer, LOST_PACKET
+from Media_Header import MediaStreamSender, VOICE_STREAM_ID
+
+MIXING_RATE = VOICE_RATE
+MIXING_CHUNK = VOICE_FRAME_SIZE  # the mixed chunks are as long as the chunks that the participants record
+MIXING_PARTICIPANTS_THRESHOLD = 8  # relayed calls with more participants than this get a single mixed voice stream
+SAMPLE_MIN_VALUE = -32768
+SAMPLE_MAX_VALUE = 32767
+# Every mixed voice packet starts with the source ids of the participants that were mixed into it, like the
+# contributing sources of RTP, so the listeners can still show who is speaking.
+CONTRIBUTING_SOURCES_COUNT_STRUCT = struct.Struct(">B")
+CONTRIBUTING_SOURCE_STRUCT = struct.Struct(">I")
+
+
+class AudioMixerException(Exception):
+    pass
+
+
+def pack_mixed_voice_data(contributing_source_ids, voice_packet):
+    """
+    :param contributing_source_ids: [int], the source ids of the participants that were mixed.
+    :param voice_packet: str, the encoded mixed voice.
+    :return: str, the data of a mixed voice packet.
+    """
+    return CONTRIBUTING_SOURCES_COUNT_STRUCT.pack(len(contributing_source_ids)) + \
+        "".join(CONTRIBUTING_SOURCE_STRUCT.pack(source_id) for source_id in contributing_source_ids) + voice_packet
+
+
+def parse_mixed_voice_data(data):
+    """
+    Splits the data of a mixed voice packet.
+    Raises AudioMixerException if the data is too short.
+    :param data: str, the data of a mixed voice packet.
+    :return: [0]: [int], the source ids of the participants that were mixed.
+    [1]: str, the encoded mixed voice.
+    """
+    if len(data) < CONTRIBUTING_SOURCES_COUNT_STRUCT.size:
+        raise AudioMixerException("Mixed voice data is too short")
+    sources_count = CONTRIBUTING_SOURCES_COUNT_STRUCT.unpack_from(data)[0]
+    voice_start = CONTRIBUTING_SOURCES_COUNT_STRUCT.size + sources_count * CONTRIBUTING_SOURCE_STRUCT.size
+    if len(data) < voice_start:
+        raise AudioMixerException("Mixed voice data is too short")
+    contributing_source_ids = [CONTRIBUTING_SOURCE_STRUCT.unpack_from(data, offset)[0] for offset in
+                               xrange(CONTRIBUTING_SOURCES_COUNT_STRUCT.size, voice_start, CONTRIBUTING_SOURCE_STRUCT.size)]
+    return contributing_source_ids, data[voice_start:]
+
+
+def fit_chunk(samples, chunk_size):
+    """
+    Cuts or pads decoded samples to exactly a chunk. Resampling codecs decode a sample more or less than a chunk.
+    :param samples: numpy.ndarray, 16-bit samples.
+    :param chunk_size: int, the number of samples in a chunk.
+    :return: numpy.ndarray, chunk_size samples.
+    """
+    if len(samples) >= chunk_size:
+        return samples[:chunk_size]
+    return np.concatenate((samples, np.zeros(chunk_size - len(samples), dtype=np.int16)))
+
+
+class MixedParticipant(object):
+    """
+    A participant of a mixed call - the voice that it sends is mixed into the voice of the others, and it gets
+    the voice of all the others mixed.
+    """
+    def __init__(self, source_id, address, audio_codecs, mixer_source_id, rate, chunk_size):
+        """
+        *jitter_buffer - JitterBuffer, holds the participant's voice packets until they are mixed.
+        *encoder - AudioEncoder or None, encodes the mix without the participant's own voice, which only the
+        participant gets. Created when the participant first speaks.
+        *sender - MediaStreamSender, the mixed voice stream that is sent to the participant.
+        :param source_id: int, the source id of the participant's media packets.
+        :param address: (IP, PORT), the address of the participant's call socket.
+        :param audio_codecs: [str], the names of the audio codecs that the participant can decode.
+        :param mixer_source_id: int, the source id of the mixed voice packets.
+        :param rate: int, the sample rate of the voice.
+        :param chunk_size: int, the number of samples in a voice packet.
+        """
+        self.source_id = source_id
+        self.address = address
+        self.audio_codecs = audio_codecs
+        self.jitter_buffer = JitterBuffer(rate, chunk_size)
+        self.decoder = AudioDecoder(rate)
+        self.encoder = None
+        self.sender = MediaStreamSender(mixer_source_id, VOICE_STREAM_ID)
+
+
+class AudioMixer(object):
+    """
+    Mixes the voice of a call on the server (an MCU), so every participant gets a single voice stream no matter
+    how many participants speak, and plays a single output stream.
+    Every chunk, the voice of all the active speakers is decoded and summed once, and every speaker gets the sum
+    without its own voice - all with a few vectorized operations. The participants that do not speak all get the
+    same full mix, so it is encoded only once, and the encoding work grows with the number of speakers and not with
+    the size of the call.
+    Voice packets are put by the relay thread and mixed by the mixing thread.
+    """
+    def __init__(self, mixer_source_id, rate=MIXING_RATE, chunk_size=MIXING_CHUNK):
+        """
+        source_id_participant_dict - {int:MixedParticipant}, the participants by their source ids. Never changed in
+        place, it is replaced by a changed copy, so the mixing thread can go over it while the server's thread
+        changes the participants.
+        full_mix_encoder - AudioEncoder or None, encodes the mix of all the speakers for the participants who do not
+        speak.
+        timestamp - int, the media timestamp of the next mixed chunk, in samples.
+        :param mixer_source_id: int, the source id of the mixed voice packets.
+        :param rate: int, the sample rate of the voice.
+        :param chunk_size: int, the number of samples in a voice packet.
+        """
+        self.mixer_source_id = mixer_source_id
+        self.rate = rate
+        self.chunk_size = chunk_size
+        self.source_id_participant_dict = {}
+        self.codec_name = None
+        self.full_mix_encoder = None
+        self.timestamp = 0
+        self.mixed_chunks = 0
+        self.encoded_chunks = 0
+
+    def add_participant(self, source_id, address, audio_codecs):
+        """
+        :param source_id: int, the source id of the participant's media packets.
+        :param address: (IP, PORT), the address of the participant's call socket.
+        :param audio_codecs: [str], the names of the audio codecs that the participant can decode.
+        """
+        source_id_participant_dict = dict(self.source_id_participant_dict)
+        source_id_participant_dict[source_id] = MixedParticipant(source_id, address, audio_codecs, self.mixer_source_id,
+                                                                 self.rate, self.chunk_size)
+        self.source_id_participant_dict = source_id_participant_dict
+        self.update_codec()
+
+    def remove_participant(self, source_id):
+        """
+        :param source_id: int, the source id of the participant's media packets.
+        """
+        source_id_participant_dict = dict(self.source_id_participant_dict)
+        source_id_participant_dict.pop(source_id, None)
+        self.source_id_participant_dict = source_id_participant_dict
+        self.update_codec()
+
+    def update_codec(self):
+        """
+        Chooses the codec of the mixed voice - the most preferred codec that all the participants can decode.
+        The encoders are recreated when the codec changes.
+        """
+        codec_name = choose_audio_codec([participant.audio_codecs for participant in
+                                         self.source_id_participant_dict.itervalues()])
+        if codec_name != self.codec_name:
+            self.codec_name = codec_name
+            self.full_mix_encoder = None
+            for participant in self.source_id_participant_dict.itervalues():
+                participant.encoder = None
+
+    def put(self, header, voice_packet, arrival_time):
+        """
+        Adds a voice packet of a participant, to be mixed on its turn.
+        :param header: MediaHeader, the header of the packet.
+        :param voice_packet: str, the encoded voice.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        participant = self.source_id_participant_dict.get(header.source_id)
+        if participant is not None:
+            participant.jitter_buffer.put(header.sequence_number, header.timestamp, voice_packet, arrival_time)
+
+    def get_speakers_chunks(self, participants):
+        """
+        Takes the current chunk of every participant that speaks, decoded.
+        :param participants: [MixedParticipant], the participants of the call.
+        :return: [0]: [MixedParticipant], the participants that speak.
+        [1]: numpy.ndarray, their chunks, a row of 16-bit samples for every speaker.
+        """
+        speakers = []
+        chunks = []
+        for participant in participants:
+            voice_packet = participant.jitter_buffer.pop()
+            if voice_packet is None or voice_packet == LOST_PACKET:  # a lost chunk is left out of the mix
+                continue
+            if is_comfort_noise_packet(voice_packet):  # the participant is silent
+                continue
+            try:
+                samples = np.frombuffer(participant.decoder.decode(voice_packet), dtype=np.int16)
+            except AudioCodecException as e:
+                print "DEBUG - invalid voice packet in the mixer: " + str(e)
+                continue
+            speakers.append(participant)
+            chunks.append(fit_chunk(samples, self.chunk_size))
+        return speakers, np.array(chunks, dtype=np.int16).reshape(len(chunks), self.chunk_size)
+
+    def mix(self):
+        """
+        Mixes the current chunk of the call. Should be called once every chunk duration.
+        :return: [((IP, PORT), str)], the mixed voice packets and the addresses of the participants to send them to.
+        """
+        timestamp = self.timestamp
+        self.timestamp += self.chunk_size
+        participants = self.source_id_participant_dict.values()
+        speakers, chunks = self.get_speakers_chunks(participants)
+        if not speakers:
+            return []
+        self.mixed_chunks += 1
+        full_mix = chunks.sum(axis=0, dtype=np.int32)
+        # every speaker hears everyone but itself, the row of a speaker is the full mix without its chunk
+        speakers_mixes = np.clip(full_mix - chunks, SAMPLE_MIN_VALUE, SAMPLE_MAX_VALUE).astype(np.int16)
+        speakers_source_ids = [speaker.source_id for speaker in speakers]
+        packets = []
+        for speaker_index, speaker in enumerate(speakers):
+            if len(speakers) == 1:  # nobody else speaks
+                break
+            if speaker.encoder is None:
+                speaker.encoder = AudioEncoder(self.codec_name, self.rate)
+            voice_packet = speaker.encoder.encode(speakers_mixes[speaker_index].tostring())
+            self.encoded_chunks += 1
+            contributing_source_ids = speakers_source_ids[:speaker_index] + speakers_source_ids[speaker_index + 1:]
+            packets.append((speaker.address, speaker.sender.create_packet(
+                pack_mixed_voice_data(contributing_source_ids, voice_packet), timestamp)))
+        speaking_source_ids = set(speakers_source_ids)
+        listeners = [participant for participant in participants if participant.source_id not in speaking_source_ids]
+        if listeners:
+            if self.full_mix_encoder is None:
+                self.full_mix_encoder = AudioEncoder(self.codec_name, self.rate)
+            full_mix_data = pack_mixed_voice_data(speakers_source_ids, self.full_mix_encoder.encode(
+                np.clip(full_mix, SAMPLE_MIN_VALUE, SAMPLE_MAX_VALUE).astype(np.int16).tostring()))
+            self.encoded_chunks += 1
+            for listener in listeners:
+                packets.append((listener.address, listener.sender.create_packet(full_mix_data, timestamp)))
+        return packets
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+CAPTURE_BUFFER_FRAMES = 8  # recorded frames that can wait for the sending thread, if it falls behind for a moment
+# The mixed audio that waits for the speaker, enough for the mixing thread to be woken up a little late. All of it
+# adds to the delay.
+PLAYBACK_BUFFER_MILLISECONDS = 20
+RING_BUFFER_WAIT_TIME = 0.5  # seconds, so the threads that wait on the buffers notice when the call ends
+
+
+def get_playback_buffer_frames(frame_milliseconds):
+    """
+    :param frame_milliseconds: int, the duration of a voice frame.
+    :return: int, the number of mixed frames that wait for the speaker, at least one.
+    """
+    return max(1, PLAYBACK_BUFFER_MILLISECONDS / frame_milliseconds)
+
+
+class AudioRingBuffer(object):
+    """
+    A fixed-size circular buffer of audio bytes between the callback of an audio stream and a thread of the client -
+    a single writer and a single reader.
+    The writer only moves the write count and the reader only moves the read count, so the buffer needs no lock and
+    the audio callback never waits for the thread - audio that does not fit is dropped instead. The events only wake
+    up the thread that waits for data or for space, they do not guard the buffer.
+    """
+    def __init__(self, capacity):
+        """
+        buffer - bytearray, the audio bytes.
+        written_bytes - int, all the bytes that were ever written, only changed by the writer.
+        read_bytes - int, all the bytes that were ever read, only changed by the reader.
+        overruns - int, how many writes were dropped since the buffer was full.
+        :param capacity: int, the most bytes that the buffer holds.
+        """
+        self.capacity = capacity
+        self.buffer = bytearray(capacity)
+        self.written_bytes = 0
+        self.read_bytes = 0
+        self.data_event = threading.Event()
+        self.space_event = threading.Event()
+        self.is_closed = False
+        self.overruns = 0
+
+    def get_available(self):
+        """
+        :return: int, the number of bytes that can be read.
+        """
+        return self.written_bytes - self.read_bytes
+
+    def get_free_space(self):
+        """
+        :return: int, the number of bytes that can be written.
+        """
+        return self.capacity - self.get_available()
+
+    def write(self, data):
+        """
+        Writes audio to the buffer, without waiting. Audio that does not fit is dropped as a whole.
+        :param data: str, the audio bytes.
+        :return: Bool, True if the audio was written, False if the buffer was too full for it.
+        """
+        if len(data) > self.get_free_space():
+            self.overruns += 1
+            return False
+        start = self.written_bytes % self.capacity
+        first_part_length = min(len(data), self.capacity - start)
+        self.buffer[start:start + first_part_length] = data[:first_part_length]
+        self.buffer[:len(data) - first_part_length] = data[first_part_length:]
+        self.written_bytes += len(data)  # only after the bytes are in place, so the reader never sees missing bytes
+        self.data_event.set()
+        return True
+
+    def read(self, max_length):
+        """
+        Reads audio from the buffer, without waiting.
+        :param max_length: int, the most bytes to read.
+        :return: str, the audio bytes, shorter than max_length if less audio is available.
+        """
+        length = min(max_length, self.get_available())
+        start = self.read_bytes % self.capacity
+        first_part_length = min(length, self.capacity - start)
+        data = str(self.buffer[start:start + first_part_length]) + str(self.buffer[:length - first_part_length])
+        self.read_bytes += length
+        self.space_event.set()
+        return data
+
+    def wait(self, event, is_ready, timeout):
+        """
+        Waits until the buffer is ready for the waiting thread.
+        :param event: threading.Event, the event that the other side sets when the buffer changes.
+        :param is_ready: function, returns True when the waiting thread can go on.
+        :param timeout: float, the most seconds to wait.
+        :return: Bool, True if the buffer is ready, False if the timeout passed or the buffer was closed.
+        """
+        if is_ready():
+            return True
+        event.clear()
+        if not is_ready() and not self.is_closed:  # checked again, the other side may have set the event just before
+            event.wait(timeout)
+        return is_ready() and not self.is_closed
+
+    def wait_for_data(self, length, timeout):
+        """
+        Waits until there is enough audio to read.
+        :param length: int, the number of bytes that the reader needs.
+        :param timeout: float, the most seconds to wait.
+        :return: Bool, True if the audio can be read.
+        """
+        return self.wait(self.data_event, lambda: self.get_available() >= length, timeout)
+
+    def wait_for_space(self, length, timeout):
+        """
+        Waits until there is enough room to write.
+        :param length: int, the number of bytes that the writer needs to write.
+        :param timeout: float, the most seconds to wait.
+        :return: Bool, True if the audio can be written.
+        """
+        return self.wait(self.space_event, lambda: self.get_free_space() >= length, timeout)
+
+    def close(self):
+        """
+        Wakes up the waiting thread for good.
+        """
+        self.is_closed = True
+        self.data_event.set()
+        self.space_event.set()
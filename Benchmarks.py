@@ -0,0 +1,1720 @@
+# -*- coding: utf-8 -*-
+
+import audioop
+import base64
+import collections
+import hashlib
+import heapq
+import math
+import multiprocessing
+import os
+import pickle
+import random
+import zlib
+import select
+import shutil
+import socket
+import sqlite3 as sqlite
+import struct
+import sys
+import tempfile
+import threading
+import time
+import timeit
+import numpy as np
+import Audio_Codecs
+import Audio_Mixer
+import Audio_Ring_Buffer
+import Call_Socket
+import Common_Elements
+import Frame_Fragments
+import DataBase_Worker
+import DataBaseHandler
+import Jitter_Buffer
+import Media_Header
+import Media_Relay
+import Media_Statistics
+import Playback_Mixer
+import Rate_Control
+import Screen_Encoder
+import Simulcast
+import Video_Pipeline
+import Voice_Activity
+
+CODEC_BENCHMARK_REPETITIONS = 2000
+FRAMING_BENCHMARK_REPETITIONS = 20
+FRAMING_BENCHMARK_PICTURE_SIZES = [16 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+LOGIN_BENCHMARK_CONNECTED_USERS_NUM = 10000
+LOGIN_BENCHMARK_CONTACTS_NUM = 200
+LOGIN_BENCHMARK_REPETITIONS = 20
+LOGIN_BENCHMARK_PASSWORD = "password"
+DATABASE_BENCHMARK_REQUESTS_NUM = 500
+AUDIO_BENCHMARK_RATE = Audio_Codecs.VOICE_RATE
+AUDIO_BENCHMARK_CHUNK = Audio_Codecs.VOICE_FRAME_SIZE  # frames per recorded chunk
+AUDIO_BENCHMARK_CHUNKS_NUM = 100
+JITTER_BENCHMARK_CHUNKS_NUM = 5000  # over a minute and a half of speech
+JITTER_BENCHMARK_BASE_DELAY = 0.03  # seconds
+JITTER_BENCHMARK_MEAN_JITTER = 0.01  # seconds, the mean of the exponentially distributed extra delay
+JITTER_BENCHMARK_LOSS_RATE = 0.02
+JITTER_BENCHMARK_SPIKE_PERIOD = 500  # chunks between delay spikes, like a wifi scan or a competing download
+JITTER_BENCHMARK_SPIKE_DELAY = 0.3  # seconds
+OLD_MAX_QUEUE_DELAY = 20  # the queue size that the voice queue was cleared at
+MEDIA_BENCHMARK_REPETITIONS = 20000
+CALL_SOCKETS_BENCHMARK_PARTICIPANTS_NUMS = [2, 8, 16]
+CALL_SOCKETS_BENCHMARK_DURATION = 3.0  # seconds of sending for every model and call size
+CALL_SOCKETS_BENCHMARK_CAMERA_FPS = 24
+CALL_SOCKETS_BENCHMARK_CAMERA_FRAME_SIZE = 8 * 1024
+CALL_SOCKETS_BENCHMARK_VOICE_PACKET_SIZE = 1024  # about a compressed chunk
+CALL_SOCKETS_BENCHMARK_IP = "127.0.0.1"
+OLD_PARTICIPANT_SOCKETS_NUM = 3  # voice, camera and screen sockets for every participant
+OLD_PARTICIPANT_THREADS_NUM = 5  # receive voice, process voice, camera, screen and indication threads
+NEW_PARTICIPANT_THREADS_NUM = 0  # the call socket, the playback stream and the indicators timer serve everyone
+RELAY_BENCHMARK_CALL_SIZES = [4, 8, 16]
+RELAY_BENCHMARK_DURATION = 3.0  # seconds of load for every call size and packet size
+RELAY_BENCHMARK_PACKET_SIZES = [("voice", CALL_SOCKETS_BENCHMARK_VOICE_PACKET_SIZE),
+                                ("camera", CALL_SOCKETS_BENCHMARK_CAMERA_FRAME_SIZE)]
+RELAY_BENCHMARK_TIME_CHECK_PACKETS = 100  # packets that the load generator sends between checks of the time
+MIXING_BENCHMARK_CALL_SIZES = [9, 16, 32]
+MIXING_BENCHMARK_SPEAKERS_NUMS = [1, 3]
+MIXING_BENCHMARK_REPETITIONS = 50
+PLAYBACK_BENCHMARK_CALL_SIZES = [2, 4, 8]
+PLAYBACK_BENCHMARK_REPETITIONS = 200
+OLD_VOICE_CHUNK = 1024  # the chunk that was recorded and played with blocking reads and writes
+OLD_PLAYBACK_BUFFER_FRAMES = 1  # a blocking write returns once the previous chunk is played
+LATENCY_BENCHMARK_FRAME_MILLISECONDS = [20, 10]
+LATENCY_BENCHMARK_REPETITIONS = 20000
+UDP_IP_HEADERS_BYTES = 28
+VAD_BENCHMARK_DURATION = 120.0  # seconds of conversation
+VAD_BENCHMARK_MEAN_TALK_SPURT = 1.5  # seconds, like the on-off model of conversational speech
+VAD_BENCHMARK_MEAN_PAUSE = 1.5
+VAD_BENCHMARK_SPEECH_GAIN = 0.3  # a normal voice instead of the loud benchmark chunks
+VAD_BENCHMARK_ONSET_GAINS = [0.1, 0.3, 0.6]  # the starts of words are quieter than the words
+VAD_BENCHMARK_ROOMS = [("quiet room", 25), ("fan", 45), ("loud office", 55)]  # noise loudness in decibels
+OLD_MINIMUM_DECIBEL_VOLUME = 40  # the fixed gate that was used instead of voice activity detection
+INDICATORS_BENCHMARK_PARTICIPANTS_NUM = 8
+INDICATORS_BENCHMARK_DURATION = 3.0  # seconds of an idle call for every model
+INDICATORS_BENCHMARK_INTERVAL = 0.1  # seconds, the speaking indicators timer of the GUI
+CAMERA_BENCHMARK_FPS = 24
+CAMERA_BENCHMARK_DEVICE_FPS = 30  # the rate that a webcam gives pictures in
+CAMERA_BENCHMARK_ENCODE_TIMES = [0.01, 0.025]  # seconds of JPEG encoding, a fast and a slow computer
+CAMERA_BENCHMARK_DURATION = 3.0  # seconds of sending for every model and encoding time
+FRAGMENTS_BENCHMARK_FRAME_SIZES = [40 * 1024, 120 * 1024, 512 * 1024]  # a camera picture, a sharp screenshot, 1080p
+FRAGMENTS_BENCHMARK_LOSS_RATES = [0.0, 0.001, 0.01]
+FRAGMENTS_BENCHMARK_FRAMES_NUM = 200
+OLD_MAX_FRAME_SIZE = 65000  # frames were sent as a single datagram and bigger frames were dropped
+SCREEN_BENCHMARK_SIZE = (800, 600)
+SCREEN_BENCHMARK_FPS = 24
+SCREEN_BENCHMARK_DURATION = 5.0  # seconds of every scene
+SCREEN_BENCHMARK_SCROLL_PIXELS = 4  # rows that the text scrolls by every frame
+SCREEN_BENCHMARK_VIDEO_SIZE = (320, 240)
+SCREEN_BENCHMARK_CURSOR_BLINK_FRAMES = 12  # half a second
+RATE_CONTROL_BENCHMARK_DURATION = 30.0  # seconds of every trace
+RATE_CONTROL_BENCHMARK_STEP = 0.005  # seconds that the simulation moves by
+RATE_CONTROL_BENCHMARK_BASE_DELAY = 0.03  # seconds from the sender to the receiver without a queue
+RATE_CONTROL_BENCHMARK_QUEUE_BYTES = 150000  # the buffer of the bottleneck router, drop-tail
+RATE_CONTROL_BENCHMARK_CAMERA_BYTES_PER_PIXEL = 0.1  # a webcam JPEG of quality 75
+RATE_CONTROL_BENCHMARK_SCREEN_BYTES_PER_PIXEL = 0.15  # a screenshot JPEG of quality 75, text is sharper than faces
+RATE_CONTROL_BENCHMARK_SCREEN_CHANGED_FRACTION = 0.2  # the part of the screen in every delta update, a busy screen
+RATE_CONTROL_BENCHMARK_FRAME_SIZE_DEVIATION = 0.15  # of the size of every frame, for the changing content
+RATE_CONTROL_BENCHMARK_RECEIVER_SOURCE_ID = 31415926
+# Every trace is a list of (start time, bottleneck bits per second, random loss rate) segments.
+RATE_CONTROL_BENCHMARK_TRACES = [("steady 4M", [(0, 4000000, 0.0)]),
+                                 ("8M-1.5M-8M", [(0, 8000000, 0.0), (10, 1500000, 0.0), (20, 8000000, 0.0)]),
+                                 ("5M 3% loss", [(0, 5000000, 0.03)])]
+OLD_CAMERA_SETTINGS = Rate_Control.VideoSettings((848, 480), 24, 75)  # the fixed camera settings
+OLD_SCREEN_SETTINGS = Rate_Control.VideoSettings((800, 600), 24, 76)  # the screen settings that the quality started at
+# The screen quality was changed by the size of every keyframe, to keep it around 65000 bytes.
+OLD_QUALITY_CHANGE_RATE = 3
+OLD_MIN_QUALITY_THRESHOLD = 45 + OLD_QUALITY_CHANGE_RATE
+OLD_MAX_QUALITY_THRESHOLD = 100 - OLD_QUALITY_CHANGE_RATE
+OLD_HIGHER_QUALITY_SIGN_BYTES = 55000
+OLD_SCREEN_FRAME_TARGET_SIZE = 65000
+SIMULCAST_BENCHMARK_FPS = 24
+SIMULCAST_BENCHMARK_HIGH_LAYER_SETTINGS = Rate_Control.CAMERA_SETTINGS_LADDER[-1]
+# The camera windows of the other participants of an 8 participants call, None for a closed window.
+SIMULCAST_BENCHMARK_SCENARIOS = [("nobody watches", [None] * 7),
+                                 ("one big window", [(848, 480)] + [None] * 6),
+                                 ("mixed", [(848, 480), (320, 180), (320, 180)] + [None] * 4),
+                                 ("gallery", [(320, 180)] * 7),
+                                 ("everyone big", [(848, 480)] * 7)]
+SAMPLE_PICTURE_BYTES_NUM = 16 * 1024
+SAMPLE_NAMES_NUM = 5
+
+SAMPLE_NAMES_LIST = ["user_" + str(i) for i in xrange(SAMPLE_NAMES_NUM)]
+SAMPLE_ENCODED_PICTURE_BYTES = base64.b64encode(os.urandom(SAMPLE_PICTURE_BYTES_NUM))
+SAMPLE_PICTURE_DIGEST = hashlib.sha1(SAMPLE_ENCODED_PICTURE_BYTES).hexdigest()
+SAMPLE_PORTS_PAIR = Common_Elements.CommunicationPortsPair(50001, 50002)
+SAMPLE_MEDIA_SOURCE_ID = 2718281828
+SAMPLE_VOICE_CHAT_PEER = Common_Elements.VoiceChatPeer("some_user", "192.168.1.20", SAMPLE_PORTS_PAIR,
+                                                       SAMPLE_PICTURE_DIGEST, Audio_Codecs.SUPPORTED_AUDIO_CODECS,
+                                                       SAMPLE_MEDIA_SOURCE_ID)
+# every contact and peer gets a digest of its own, since pickle writes repeated objects only once.
+SAMPLE_CONTACTS_INFO_LIST = [Common_Elements.ContactInfo(name, True, hashlib.sha1(name).hexdigest())
+                             for name in SAMPLE_NAMES_LIST]
+SAMPLE_VOICE_CHAT_PEERS_LIST = [Common_Elements.VoiceChatPeer(name, "192.168.1.20", SAMPLE_PORTS_PAIR,
+                                                              hashlib.sha1(name).hexdigest(),
+                                                              Audio_Codecs.SUPPORTED_AUDIO_CODECS,
+                                                              SAMPLE_MEDIA_SOURCE_ID + index)
+                                for index, name in enumerate(SAMPLE_NAMES_LIST)]
+
+# realistic values for every field name that appears in Common_Elements.MESSAGE_TYPES_REGISTRY.
+FIELD_SAMPLE_VALUES = {
+    "supported_versions": Common_Elements.SUPPORTED_PROTOCOL_VERSIONS,
+    "protocol_version": Common_Elements.PROTOCOL_VERSION,
+    "send_to_port": 50001,
+    "receive_port": 50002,
+    "username": "some_user",
+    "password": "some_password",
+    "ip": "192.168.1.20",
+    "media_ports_pair": SAMPLE_PORTS_PAIR,
+    "peer_media_source_id": SAMPLE_MEDIA_SOURCE_ID,
+    "media_source_id": SAMPLE_MEDIA_SOURCE_ID,
+    "peer_picture_digest": SAMPLE_PICTURE_DIGEST,
+    "peer_audio_codecs": Audio_Codecs.SUPPORTED_AUDIO_CODECS,
+    "audio_codecs": Audio_Codecs.SUPPORTED_AUDIO_CODECS,
+    "picture_digest": SAMPLE_PICTURE_DIGEST,
+    "user_picture_digest": SAMPLE_PICTURE_DIGEST,
+    "encoded_picture_bytes": SAMPLE_ENCODED_PICTURE_BYTES,
+    "digest_owner_dict": dict((hashlib.sha1(name).hexdigest(), name) for name in SAMPLE_NAMES_LIST),
+    "digest_encoded_picture_dict": {SAMPLE_PICTURE_DIGEST: SAMPLE_ENCODED_PICTURE_BYTES},
+    "contact_name": "some_contact",
+    "is_connected": True,
+    "does_exist": True,
+    "is_online": False,
+    "new_open_ports": [50001, 50002, 50003, 50004, 50005, 50006],
+    "message": "Some text that is long enough to look like a real chat message.",
+    "error_message": "Calling Error - The user is already being called right now.",
+    "in_call_participants": SAMPLE_NAMES_LIST,
+    "request_username": "some_user",
+    "asked_by_username": "some_user",
+    "requesting_username": "some_user",
+    "reject_username": "some_user",
+    "contacts_info_list": SAMPLE_CONTACTS_INFO_LIST,
+    "pending_contacts_list": SAMPLE_NAMES_LIST,
+    "call_username": "some_user",
+    "called_username": "some_user",
+    "other_participants_names": SAMPLE_NAMES_LIST,
+    "new_other_participants_names": SAMPLE_NAMES_LIST,
+    "call_group_name": "user_0 -> user_1",
+    "new_call_group_name": "user_0 -> user_1",
+    "call_name": "user_0 -> user_1",
+    "active_call_group_name": "user_0 -> user_1",
+    "relay_port": 9998,
+    "mixer_source_id": SAMPLE_MEDIA_SOURCE_ID,
+    "host_name": "user_0",
+    "new_host_name": "user_1",
+    "not_in_call_members": SAMPLE_NAMES_LIST,
+    "new_not_in_call_members": SAMPLE_NAMES_LIST,
+    "called_by_names": SAMPLE_NAMES_LIST,
+    "voice_chat_peers_list": SAMPLE_VOICE_CHAT_PEERS_LIST,
+    "voice_chat_peer": SAMPLE_VOICE_CHAT_PEER,
+    "stop_calling_username": "some_user",
+    "participant_username": "some_user",
+    "members_names": SAMPLE_NAMES_LIST,
+    "other_group_members_names": SAMPLE_NAMES_LIST,
+    "remove_username": "some_user",
+    "chat_name": "some_chat",
+    "chat_participants_list": SAMPLE_NAMES_LIST,
+    "sender_username": "some_user",
+    "send_time": "12:34",
+    "participants_names_list": SAMPLE_NAMES_LIST,
+    "sending_user": "some_user",
+}
+
+
+def create_sample_message(message_class, fields):
+    """
+    Creates a message with sample values in all of its fields.
+    :param message_class: class, a registered message class.
+    :param fields: ((str, field type)), the fields of the class.
+    :return: an instance of the class.
+    """
+    sample_message = message_class.__new__(message_class)
+    for field, field_type in fields:
+        setattr(sample_message, field, FIELD_SAMPLE_VALUES[field])
+    return sample_message
+
+
+def measure_microseconds_per_call(function, repetitions):
+    """
+    :param function: a function without parameters.
+    :param repetitions: int, the number of times to call the function.
+    :return: float, the best average time of a single call in microseconds (out of 3 rounds).
+    """
+    return min(timeit.repeat(function, number=repetitions, repeat=3)) / repetitions * 1000000
+
+
+def benchmark_message_codec():
+    """
+    Compares the MessageCodec with pickle, which was used as the wire format before it.
+    Prints the encode time, the decode time and the encoded size of every registered message type,
+    and the totals of all the types together.
+    """
+    codec = Common_Elements.MESSAGE_CODEC
+    print "{0:<42}{1:>10}{2:>10}{3:>10}{4:>10}{5:>10}{6:>10}".format("message type", "pkl enc", "codec enc", "pkl dec",
+                                                                    "codec dec", "pkl size", "codec size")
+    totals = [0.0] * 6
+    for type_id, message_class, fields in Common_Elements.MESSAGE_TYPES_REGISTRY:
+        sample_message = create_sample_message(message_class, fields)
+        pickled_message = pickle.dumps(sample_message)
+        encoded_message = codec.encode(sample_message)
+        results = [measure_microseconds_per_call(lambda: pickle.dumps(sample_message), CODEC_BENCHMARK_REPETITIONS),
+                   measure_microseconds_per_call(lambda: codec.encode(sample_message), CODEC_BENCHMARK_REPETITIONS),
+                   measure_microseconds_per_call(lambda: pickle.loads(pickled_message), CODEC_BENCHMARK_REPETITIONS),
+                   measure_microseconds_per_call(lambda: codec.decode(encoded_message), CODEC_BENCHMARK_REPETITIONS),
+                   len(pickled_message),
+                   len(encoded_message)]
+        totals = [total + result for total, result in zip(totals, results)]
+        print "{0:<42}{1:>10.1f}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>10}{6:>10}".format(message_class.__name__, *results)
+    print "{0:<42}{1:>10.1f}{2:>10.1f}{3:>10.1f}{4:>10.1f}{5:>10.0f}{6:>10.0f}".format("TOTAL", *totals)
+    print "times are in microseconds per message, sizes are in bytes."
+
+
+def benchmark_framing():
+    """
+    Compares the ASCII framing (tail-only encryption with a marker) with the binary framing (AES-CTR over the whole
+    message) for chat picture messages of different sizes.
+    Prints the time it takes to build a frame and to decode it back on the receiving side.
+    """
+    communicator = Common_Elements.BasicCommunicator()
+    print "{0:<14}{1:<10}{2:>14}{3:>14}{4:>14}".format("picture size", "framing", "encode (ms)", "decode (ms)",
+                                                       "frame size")
+    for picture_size in FRAMING_BENCHMARK_PICTURE_SIZES:
+        message = Common_Elements.ChatPictureMessage("some_chat", "some_user", "12:34",
+                                                     base64.b64encode(os.urandom(picture_size)))
+        for framing in [Common_Elements.ASCII_FRAMING, Common_Elements.BINARY_FRAMING]:
+            frame_decoder = Common_Elements.FrameDecoder()
+            frame_decoder.framing = framing
+            frame = communicator.encode_frame(message, framing)
+
+            def decode_frame():
+                frame_decoder.feed(frame)
+                return communicator.decode_message(frame_decoder.get_complete_frames()[0], framing)
+
+            encode_time = measure_microseconds_per_call(lambda: communicator.encode_frame(message, framing),
+                                                        FRAMING_BENCHMARK_REPETITIONS) / 1000
+            decode_time = measure_microseconds_per_call(decode_frame, FRAMING_BENCHMARK_REPETITIONS) / 1000
+            print "{0:<14}{1:<10}{2:>14.2f}{3:>14.2f}{4:>14}".format(picture_size, framing, encode_time, decode_time,
+                                                                     len(frame))
+    print "decode includes taking the frame out of a FrameDecoder, like the server does."
+
+
+class BenchmarkSocket(object):
+    """
+    Stands for the socket of a connected user in the login benchmark. Only needs to be a unique dictionary key.
+    """
+    def close(self):
+        pass
+
+
+def create_login_benchmark_database(database_path):
+    """
+    Creates a database with LOGIN_BENCHMARK_CONNECTED_USERS_NUM connected users. The first user is the user that logs in
+    during the benchmark and LOGIN_BENCHMARK_CONTACTS_NUM of the others are its contacts.
+    The users share the default profile picture, so no picture files are created.
+    :param database_path: str, the path of the new database file.
+    :return: [0]: DataBaseStore, the database.
+    [1]: DataBaseHandler, the available database with the connected users.
+    [2]: str, the name of the user that logs in.
+    """
+    store = DataBaseHandler.DataBaseStore(database_path)
+    db = DataBaseHandler.DataBaseHandler()
+    usernames = ["user_" + str(i) for i in xrange(LOGIN_BENCHMARK_CONNECTED_USERS_NUM + 1)]
+    login_username = usernames[0]
+    contact_names = usernames[1:LOGIN_BENCHMARK_CONTACTS_NUM + 1]
+    hashed_password = hashlib.sha256(LOGIN_BENCHMARK_PASSWORD).hexdigest()
+    store.cursor.execute("BEGIN")
+    store.cursor.executemany(DataBaseHandler.ADD_USER_QUERY,
+                             [(name, hashed_password, DataBaseHandler.DEFAULT_USER_PICTURE_PATH) for name in usernames])
+    store.cursor.executemany(DataBaseHandler.INSERT_CONTACT_QUERY,
+                             [(login_username, name, DataBaseHandler.CONTACT_STATE) for name in contact_names] +
+                             [(name, login_username, DataBaseHandler.CONTACT_STATE) for name in contact_names])
+    store.cursor.execute("COMMIT")
+    for name in usernames[1:]:
+        user_socket = BenchmarkSocket()
+        db.pending_users[user_socket] = ("127.0.0.1", 0)
+        login_message = Common_Elements.LoginMessage(name, LOGIN_BENCHMARK_PASSWORD, Audio_Codecs.SUPPORTED_AUDIO_CODECS,
+                                                     Media_Header.create_media_source_id())
+        db.connect_user_to_server(user_socket, login_message, store.load_login_information(name, LOGIN_BENCHMARK_PASSWORD))
+    return store, db, login_username
+
+
+def benchmark_login():
+    """
+    Measures the work of a login while LOGIN_BENCHMARK_CONNECTED_USERS_NUM users are connected to the server:
+    loading the login information from the database (done by the database worker), then connecting the user,
+    creating its contacts information and finding its connected contacts (done by the event loop).
+    Also measures the connected user lookups with the username index and with the linear scan that it replaced.
+    """
+    database_folder = tempfile.mkdtemp()
+    try:
+        store, db, login_username = create_login_benchmark_database(os.path.join(database_folder, "Benchmark.db"))
+
+        def load_login_information():
+            return store.load_login_information(login_username, LOGIN_BENCHMARK_PASSWORD)
+
+        def load_login_information_with_empty_picture_cache():
+            store.picture_cache = DataBaseHandler.PictureCache()
+            return load_login_information()
+
+        login_information = load_login_information()
+        login_message = Common_Elements.LoginMessage(login_username, LOGIN_BENCHMARK_PASSWORD,
+                                                     Audio_Codecs.SUPPORTED_AUDIO_CODECS, SAMPLE_MEDIA_SOURCE_ID)
+
+        def connect():
+            login_socket = BenchmarkSocket()
+            db.pending_users[login_socket] = ("127.0.0.1", 0)
+            db.connect_user_to_server(login_socket, login_message, login_information)
+            db.create_contacts_info_list(login_information.contact_name_digest_dict)
+            db.create_user_objects_list_of_connected_contacts(login_username)
+            db.disconnect_user(login_socket)
+
+        def find_contacts_with_index():
+            for contact_name in contact_names:
+                db.find_connected_user_through_username(contact_name)
+
+        def find_contacts_with_linear_scan():
+            for contact_name in contact_names:
+                for user in db.connected_users.values():
+                    if user.username == contact_name:
+                        break
+
+        contact_names = list(login_information.contact_name_digest_dict)
+        successful_login_message = Common_Elements.SuccessfulLoginMessage(db.create_contacts_info_list(login_information.contact_name_digest_dict),
+                                                                          login_information.pending_contacts_list, login_information.picture_digest)
+        login_message_size = len(Common_Elements.MESSAGE_CODEC.encode(successful_login_message))
+        load_time = measure_microseconds_per_call(load_login_information, LOGIN_BENCHMARK_REPETITIONS) / 1000
+        cold_load_time = measure_microseconds_per_call(load_login_information_with_empty_picture_cache,
+                                                       LOGIN_BENCHMARK_REPETITIONS) / 1000
+        sys.stdout = open(os.devnull, "w")  # disconnect prints debug lines
+        try:
+            connect_time = measure_microseconds_per_call(connect, LOGIN_BENCHMARK_REPETITIONS) / 1000
+        finally:
+            sys.stdout = sys.__stdout__
+        index_time = measure_microseconds_per_call(find_contacts_with_index, LOGIN_BENCHMARK_REPETITIONS) / 1000
+        scan_time = measure_microseconds_per_call(find_contacts_with_linear_scan, LOGIN_BENCHMARK_REPETITIONS) / 1000
+        store.close()
+    finally:
+        shutil.rmtree(database_folder)
+    print "connected users: {0}, contacts of the logging in user: {1}".format(len(db.connected_users),
+                                                                            LOGIN_BENCHMARK_CONTACTS_NUM)
+    print "{0:<50}{1:>10.2f} ms".format("login information (database worker)", load_time)
+    print "{0:<50}{1:>10.2f} ms".format("login information with an empty picture cache", cold_load_time)
+    print "{0:<50}{1:>10.2f} ms".format("connect, contacts info, connected contacts", connect_time)
+    print "{0:<50}{1:>10.2f} ms".format("finding the contacts with the username index", index_time)
+    print "{0:<50}{1:>10.2f} ms".format("finding the contacts with a linear scan", scan_time)
+    print "{0:<50}{1:>10} bytes".format("successful login message", login_message_size)
+
+
+def benchmark_database_worker():
+    """
+    Compares writing contact requests the way the server used to - a commit per request on the event loop, with the
+    default rollback journal - with submitting them to the DataBaseWorker, which commits them in batches in WAL mode.
+    For the worker, prints both the time until all the requests were completed and the time that the event loop
+    spent on submitting them.
+    """
+    database_folder = tempfile.mkdtemp()
+    try:
+        requests = [("user_" + str(i), "some_user") for i in xrange(DATABASE_BENCHMARK_REQUESTS_NUM)]
+        conn = sqlite.connect(os.path.join(database_folder, "Old.db"))
+        conn.execute(DataBaseHandler.CREATE_CONTACTS_TABLE_QUERY)
+        start_time = timeit.default_timer()
+        for request in requests:
+            conn.execute(DataBaseHandler.INSERT_CONTACT_QUERY, request + (DataBaseHandler.PENDING_CONTACT_STATE,))
+            conn.commit()
+        commit_per_request_time = timeit.default_timer() - start_time
+        conn.close()
+
+        worker = DataBase_Worker.DataBaseWorker(os.path.join(database_folder, "Worker.db"))
+        worker.start()
+        completed_futures = []
+        start_time = timeit.default_timer()
+        for request in requests:
+            worker.submit(DataBaseHandler.DataBaseStore.add_user_pending_contact, request, completed_futures.append)
+        submit_time = timeit.default_timer() - start_time
+        while len(completed_futures) < len(requests):
+            select.select([worker.wakeup_socket], [], [])
+            worker.run_completed_callbacks()
+        worker_time = timeit.default_timer() - start_time
+        worker.stop()
+        assert all(future.result() for future in completed_futures)
+    finally:
+        shutil.rmtree(database_folder)
+    print "contact requests: {0}".format(DATABASE_BENCHMARK_REQUESTS_NUM)
+    print "{0:<50}{1:>10.1f} us per request".format("commit per request on the event loop",
+                                                   commit_per_request_time / len(requests) * 1000000)
+    print "{0:<50}{1:>10.1f} us per request".format("database worker, until completed",
+                                                   worker_time / len(requests) * 1000000)
+    print "{0:<50}{1:>10.1f} us per request".format("database worker, event loop time to submit",
+                                                   submit_time / len(requests) * 1000000)
+
+
+def create_speech_like_chunks():
+    """
+    Creates recorded chunks that look like speech to the codecs - a voice with harmonics whose pitch and loudness change
+    over time, and a little noise.
+    :return: [str], AUDIO_BENCHMARK_CHUNKS_NUM chunks of 16-bit mono PCM at AUDIO_BENCHMARK_RATE.
+    """
+    chunks = []
+    noise = os.urandom(AUDIO_BENCHMARK_CHUNKS_NUM * AUDIO_BENCHMARK_CHUNK * 2)
+    for chunk_index in xrange(AUDIO_BENCHMARK_CHUNKS_NUM):
+        samples = []
+        for frame_index in xrange(AUDIO_BENCHMARK_CHUNK):
+            time = float(chunk_index * AUDIO_BENCHMARK_CHUNK + frame_index) / AUDIO_BENCHMARK_RATE
+            pitch = 120 + 40 * math.sin(2 * math.pi * 3 * time)
+            loudness = 6000 * (1 + math.sin(2 * math.pi * 4 * time))
+            samples.append(int(loudness * sum(math.sin(2 * math.pi * pitch * harmonic * time) / harmonic
+                                               for harmonic in xrange(1, 6))))
+        chunk = struct.pack("<{0}h".format(len(samples)), *samples)
+        noise_chunk = noise[chunk_index * len(chunk):(chunk_index + 1) * len(chunk)]
+        chunks.append(audioop.add(chunk, audioop.mul(noise_chunk, 2, 0.01), 2))
+    return chunks
+
+
+def benchmark_audio_codecs():
+    """
+    Measures the encoding and decoding time of every audio codec for a recorded chunk, and the bandwidth that a
+    speaker uses with it.
+    """
+    chunks = create_speech_like_chunks()
+    chunks_per_second = float(AUDIO_BENCHMARK_RATE) / AUDIO_BENCHMARK_CHUNK
+    print "{0:<12}{1:>16}{2:>16}{3:>16}{4:>12}".format("codec", "encode us/chunk", "decode us/chunk", "bytes/chunk",
+                                                       "kbit/s")
+    for codec_name in Audio_Codecs.AUDIO_CODECS_PREFERENCE:
+        encoder = Audio_Codecs.AudioEncoder(codec_name, AUDIO_BENCHMARK_RATE)
+        decoder = Audio_Codecs.AudioDecoder(AUDIO_BENCHMARK_RATE)
+        start_time = timeit.default_timer()
+        packets = [encoder.encode(chunk) for chunk in chunks]
+        encode_time = (timeit.default_timer() - start_time) / len(chunks) * 1000000
+        start_time = timeit.default_timer()
+        for packet in packets:
+            decoder.decode(packet)
+        decode_time = (timeit.default_timer() - start_time) / len(chunks) * 1000000
+        bytes_per_chunk = float(sum(len(packet) for packet in packets)) / len(packets)
+        print "{0:<12}{1:>16.1f}{2:>16.1f}{3:>16.0f}{4:>12.1f}".format(codec_name, encode_time, decode_time,
+                                                                        bytes_per_chunk,
+                                                                        bytes_per_chunk * 8 * chunks_per_second / 1000)
+
+
+def simulate_voice_network(chunk_duration):
+    """
+    Simulates sending voice chunks over a network with jitter, random loss and delay spikes. The network keeps the
+    order of the packets, so the packets that are sent during a spike wait behind it and arrive in a burst.
+    :param chunk_duration: float, the duration of a chunk in seconds.
+    :return: [(float, int)], the arrival times and sequence numbers of the chunks that arrived, in arrival order.
+    """
+    random.seed(JITTER_BENCHMARK_CHUNKS_NUM)
+    arrivals = []
+    last_arrival_time = 0.0
+    for sequence_number in xrange(JITTER_BENCHMARK_CHUNKS_NUM):
+        delay = JITTER_BENCHMARK_BASE_DELAY + random.expovariate(1 / JITTER_BENCHMARK_MEAN_JITTER)
+        if sequence_number % JITTER_BENCHMARK_SPIKE_PERIOD == 0:
+            delay += JITTER_BENCHMARK_SPIKE_DELAY
+        last_arrival_time = max(last_arrival_time, sequence_number * chunk_duration + delay)
+        if random.random() >= JITTER_BENCHMARK_LOSS_RATE:
+            arrivals.append((last_arrival_time, sequence_number))
+    return arrivals
+
+
+def simulate_old_voice_queue(arrivals, chunk_duration):
+    """
+    Plays the arrived chunks the way the voice queue did - in arrival order, as soon as the stream is free, clearing
+    the whole queue when it gets longer than OLD_MAX_QUEUE_DELAY.
+    :param arrivals: [(float, int)], the arrival times and sequence numbers of the chunks.
+    :param chunk_duration: float, the duration of a chunk in seconds.
+    :return: [0]: [float], the delay of every played chunk from its recording.
+    [1]: int, the number of chunks that were dropped.
+    [2]: float, the seconds of silence in the middle of the speech.
+    """
+    delays = []
+    dropped_chunks = 0
+    silence_time = 0.0
+    play_time = 0.0
+    arrival_index = 0
+    queue = []
+    while arrival_index < len(arrivals) or queue:
+        if not queue:
+            arrival_time, sequence_number = arrivals[arrival_index]
+            if delays:
+                silence_time += max(0.0, arrival_time - play_time)
+            play_time = max(play_time, arrival_time)
+        while arrival_index < len(arrivals) and arrivals[arrival_index][0] <= play_time:
+            queue.append(arrivals[arrival_index][1])
+            arrival_index += 1
+        sequence_number = queue.pop(0)
+        if len(queue) > OLD_MAX_QUEUE_DELAY:
+            dropped_chunks += len(queue)
+            queue = []
+        delays.append(play_time - sequence_number * chunk_duration)
+        play_time += chunk_duration
+    return delays, dropped_chunks, silence_time
+
+
+def simulate_jitter_buffer(arrivals, chunk_duration, chunk_size=AUDIO_BENCHMARK_CHUNK):
+    """
+    Plays the arrived chunks through a JitterBuffer, the way the voice chat does.
+    :param arrivals: [(float, int)], the arrival times and sequence numbers of the chunks.
+    :param chunk_duration: float, the duration of a chunk in seconds.
+    :param chunk_size: int, the number of samples in a chunk.
+    :return: [0]: [float], the delay of every played chunk from its recording.
+    [1]: JitterBufferStatistics, the statistics of the buffer.
+    [2]: float, the seconds of silence in the middle of the speech, not counting concealed chunks.
+    """
+    jitter_buffer = Jitter_Buffer.JitterBuffer(AUDIO_BENCHMARK_RATE, chunk_size)
+    delays = []
+    silence_time = 0.0
+    play_time = 0.0
+    arrival_index = 0
+    while True:
+        while arrival_index < len(arrivals) and arrivals[arrival_index][0] <= play_time:
+            arrival_time, sequence_number = arrivals[arrival_index]
+            jitter_buffer.put(sequence_number % Media_Header.SEQUENCE_NUMBER_MODULO,
+                              sequence_number * chunk_size, str(sequence_number), arrival_time)
+            arrival_index += 1
+        packet = jitter_buffer.pop()
+        if packet is None:  # the player waits for the next packet
+            if arrival_index == len(arrivals):
+                break
+            if delays:
+                silence_time += arrivals[arrival_index][0] - play_time
+            play_time = arrivals[arrival_index][0]
+            continue
+        if packet != Jitter_Buffer.LOST_PACKET:
+            delays.append(play_time - int(packet) * chunk_duration)
+        play_time += chunk_duration
+    return delays, jitter_buffer.get_statistics(), silence_time
+
+
+def benchmark_jitter_buffer():
+    """
+    Compares playing voice chunks that arrive with jitter, loss and delay spikes through the old voice queue and
+    through the jitter buffer: the delay of the played chunks, the chunks that were thrown away or lost and the gaps
+    in the speech.
+    """
+    chunk_duration = float(AUDIO_BENCHMARK_CHUNK) / AUDIO_BENCHMARK_RATE
+    arrivals = simulate_voice_network(chunk_duration)
+    old_delays, old_dropped_chunks, old_silence_time = simulate_old_voice_queue(arrivals, chunk_duration)
+    new_delays, statistics, new_silence_time = simulate_jitter_buffer(arrivals, chunk_duration)
+    old_delays.sort()
+    new_delays.sort()
+    print "chunks: {0}, lost in the network: {1}".format(JITTER_BENCHMARK_CHUNKS_NUM,
+                                                         JITTER_BENCHMARK_CHUNKS_NUM - len(arrivals))
+    print "{0:<34}{1:>14}{2:>14}".format("", "voice queue", "jitter buffer")
+    print "{0:<34}{1:>14.1f}{2:>14.1f}".format("mean delay (ms)", 1000 * sum(old_delays) / len(old_delays),
+                                               1000 * sum(new_delays) / len(new_delays))
+    print "{0:<34}{1:>14.1f}{2:>14.1f}".format("95th percentile delay (ms)", 1000 * old_delays[len(old_delays) * 95 / 100],
+                                               1000 * new_delays[len(new_delays) * 95 / 100])
+    print "{0:<34}{1:>14.1f}{2:>14.1f}".format("max delay (ms)", 1000 * old_delays[-1], 1000 * new_delays[-1])
+    print "{0:<34}{1:>14}{2:>14}".format("chunks played", len(old_delays), len(new_delays))
+    print "{0:<34}{1:>14}{2:>14}".format("chunks thrown away", old_dropped_chunks,
+                                         statistics.discarded_packets + statistics.late_packets)
+    print "{0:<34}{1:>14}{2:>14}".format("chunks concealed", 0, statistics.lost_packets)
+    print "{0:<34}{1:>14.2f}{2:>14.2f}".format("silent gaps (s)", old_silence_time, new_silence_time)
+    print "jitter buffer: " + str(statistics)
+
+
+def benchmark_media_header():
+    """
+    Measures the cost of the media header on every datagram - creating and parsing a packet and updating the receiver
+    statistics with it - and checks the statistics against the simulated network of the jitter benchmark.
+    """
+    chunk_duration = float(AUDIO_BENCHMARK_CHUNK) / AUDIO_BENCHMARK_RATE
+    sender = Media_Header.MediaStreamSender(SAMPLE_MEDIA_SOURCE_ID, Media_Header.VOICE_STREAM_ID)
+    voice_data = os.urandom(200)
+    packet = sender.create_packet(voice_data, 0)
+    header, data = Media_Header.parse_media_packet(packet)
+    statistics = Media_Statistics.MediaStreamStatistics(Media_Header.VOICE_STREAM_ID, AUDIO_BENCHMARK_RATE)
+    create_time = measure_microseconds_per_call(lambda: sender.create_packet(voice_data, 0), MEDIA_BENCHMARK_REPETITIONS)
+    parse_time = measure_microseconds_per_call(lambda: Media_Header.parse_media_packet(packet),
+                                               MEDIA_BENCHMARK_REPETITIONS)
+    update_time = measure_microseconds_per_call(lambda: statistics.update(header, len(data), 0.0),
+                                                MEDIA_BENCHMARK_REPETITIONS)
+    print "{0:<40}{1:>10} bytes".format("media header", Media_Header.MEDIA_HEADER_STRUCT.size)
+    print "{0:<40}{1:>10.2f} us".format("create a packet", create_time)
+    print "{0:<40}{1:>10.2f} us".format("parse a packet", parse_time)
+    print "{0:<40}{1:>10.2f} us".format("update the receiver statistics", update_time)
+
+    arrivals = simulate_voice_network(chunk_duration)
+    start_time = 1000000.0  # the wall clock of the sender when the first chunk was sent
+    statistics = Media_Statistics.MediaStreamStatistics(Media_Header.VOICE_STREAM_ID, AUDIO_BENCHMARK_RATE)
+    for arrival_time, sequence_number in arrivals:
+        send_time = Media_Header.get_send_time(start_time + sequence_number * chunk_duration)
+        header = Media_Header.MediaHeader(SAMPLE_MEDIA_SOURCE_ID, Media_Header.VOICE_STREAM_ID,
+                                          sequence_number % Media_Header.SEQUENCE_NUMBER_MODULO,
+                                          sequence_number * AUDIO_BENCHMARK_CHUNK, send_time)
+        statistics.update(header, len(voice_data), start_time + arrival_time)
+    actual_loss = 100.0 * (JITTER_BENCHMARK_CHUNKS_NUM - len(arrivals)) / JITTER_BENCHMARK_CHUNKS_NUM
+    print "simulated network: loss {0:.1f}%, delay at least {1:.1f} ms".format(actual_loss,
+                                                                              JITTER_BENCHMARK_BASE_DELAY * 1000)
+    print "measured:          " + str(statistics)
+
+
+def send_call_media(source_addresses_list, duration):
+    """
+    Sends the voice and camera packets of the remote participants of a call, at the rates that clients send them.
+    Runs in a process of its own, so the sending does not count in the receiver's CPU time.
+    :param source_addresses_list: [(int, (IP, PORT), (IP, PORT))], the source id of every remote participant,
+    with the addresses that its voice and camera packets are sent to.
+    :param duration: float, how many seconds to send for.
+    """
+    cipher = Common_Elements.AESCipher()
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    voice_interval = float(AUDIO_BENCHMARK_CHUNK) / AUDIO_BENCHMARK_RATE
+    camera_interval = 1.0 / CALL_SOCKETS_BENCHMARK_CAMERA_FPS
+    events = []  # (send time, interval, sender, address)
+    start_time = time.time()
+    for source_id, voice_address, camera_address in source_addresses_list:
+        events.append((start_time + random.random() * voice_interval, voice_interval,
+                       Media_Header.MediaStreamSender(source_id, Media_Header.VOICE_STREAM_ID), voice_address,
+                       os.urandom(CALL_SOCKETS_BENCHMARK_VOICE_PACKET_SIZE)))
+        events.append((start_time + random.random() * camera_interval, camera_interval,
+                       Media_Header.MediaStreamSender(source_id, Media_Header.CAMERA_STREAM_ID), camera_address,
+                       os.urandom(CALL_SOCKETS_BENCHMARK_CAMERA_FRAME_SIZE)))
+    heapq.heapify(events)
+    while events[0][0] < start_time + duration:
+        send_time, interval, sender, address, data = heapq.heappop(events)
+        wait_time = send_time - time.time()
+        if wait_time > 0:
+            time.sleep(wait_time)
+        sock.sendto(cipher.encrypt_message(sender.create_packet(data, sender.sent_packets)), address)
+        heapq.heappush(events, (send_time + interval, interval, sender, address, data))
+    sock.close()
+
+
+def receive_old_participant_socket(sock, cipher, statistics, received_packets):
+    """
+    The receiving thread of a socket of a single participant and a single data type, like calls had before all the
+    media of a call was sent through one socket.
+    :param sock: socket, the participant's socket of the data type.
+    :param cipher: AESCipher, decrypts the packets.
+    :param statistics: MediaStreamStatistics, the statistics of the participant's stream.
+    :param received_packets: [int], counts the received packets of all the threads.
+    """
+    try:
+        while True:
+            encrypted_packet = sock.recvfrom(Call_Socket.MAX_DATAGRAM_SIZE)[0]
+            if not encrypted_packet:
+                return
+            arrival_time = time.time()
+            header, data = Media_Header.parse_media_packet(cipher.decrypt_message(encrypted_packet))
+            statistics.update(header, len(data), arrival_time)
+            received_packets[0] += 1
+    except socket.error:
+        pass
+
+
+def run_old_call_receiver(participants_num):
+    """
+    Receives a call with a socket and a receiving thread for every data type of every remote participant.
+    :param participants_num: int, the number of participants in the call, including the user.
+    :return: [0]: float, the CPU seconds of the receiver.
+    [1]: int, the received packets.
+    [2]: int, the sockets that were used.
+    """
+    cipher = Common_Elements.AESCipher()
+    sockets = []
+    threads = []
+    source_addresses_list = []
+    received_packets = [0]
+    for source_id in xrange(1, participants_num):
+        addresses = []
+        for stream_id in [Media_Header.VOICE_STREAM_ID, Media_Header.CAMERA_STREAM_ID, Media_Header.SCREEN_STREAM_ID]:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((CALL_SOCKETS_BENCHMARK_IP, 0))
+            statistics = Media_Statistics.MediaStreamStatistics(stream_id, AUDIO_BENCHMARK_RATE)
+            threads.append(threading.Thread(target=receive_old_participant_socket,
+                                            args=[sock, cipher, statistics, received_packets]))
+            sockets.append(sock)
+            addresses.append(sock.getsockname())
+        source_addresses_list.append((source_id, addresses[0], addresses[1]))
+    return run_call_receiver(source_addresses_list, threads, sockets, received_packets)
+
+
+def run_new_call_receiver(participants_num):
+    """
+    Receives a call with a single call socket, that hands the packets of every participant to its handler.
+    :param participants_num: int, the number of participants in the call, including the user.
+    :return: [0]: float, the CPU seconds of the receiver.
+    [1]: int, the received packets.
+    [2]: int, the sockets that were used.
+    """
+    call_socket = Call_Socket.CallSocket()
+    call_socket.bind(0)
+    address = (CALL_SOCKETS_BENCHMARK_IP, call_socket.get_port())
+    received_packets = [0]
+    source_addresses_list = []
+    for source_id in xrange(1, participants_num):
+        statistics_dict = {stream_id: Media_Statistics.MediaStreamStatistics(stream_id, AUDIO_BENCHMARK_RATE)
+                           for stream_id in Media_Header.STREAM_IDS}
+
+        def handle_packet(header, data, arrival_time, statistics_dict=statistics_dict):
+            statistics_dict[header.stream_id].update(header, len(data), arrival_time)
+            received_packets[0] += 1
+
+        call_socket.add_source(source_id, handle_packet)
+        source_addresses_list.append((source_id, address, address))
+    receive_thread = threading.Thread(target=call_socket.receive_loop)
+    return run_call_receiver(source_addresses_list, [receive_thread], [call_socket], received_packets)
+
+
+def run_call_receiver(source_addresses_list, threads, sockets, received_packets):
+    """
+    Runs the receiving threads while a process sends them the call's media, and measures their CPU time.
+    :param source_addresses_list: [(int, (IP, PORT), (IP, PORT))], the addresses that every remote participant sends to.
+    :param threads: [Thread], the receiving threads.
+    :param sockets: [socket or CallSocket], the receiving sockets, closed at the end.
+    :param received_packets: [int], counts the received packets of all the threads.
+    :return: [0]: float, the CPU seconds of the receiver.
+    [1]: int, the received packets.
+    [2]: int, the sockets that were used.
+    """
+    for thread in threads:
+        thread.start()
+    sender = multiprocessing.Process(target=send_call_media, args=[source_addresses_list, CALL_SOCKETS_BENCHMARK_DURATION])
+    start_times = os.times()
+    sender.start()
+    sender.join()
+    time.sleep(0.1)  # the last packets
+    end_times = os.times()
+    for sock in sockets:
+        if isinstance(sock, Call_Socket.CallSocket):
+            sock.close()
+        else:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)  # wakes up the receiving thread
+            except socket.error:
+                pass
+            sock.close()
+    for thread in threads:
+        thread.join()
+    cpu_time = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+    return cpu_time, received_packets[0], len(sockets)
+
+
+def benchmark_call_sockets():
+    """
+    Measures the receiver of a call with a socket and a thread for every data type of every participant,
+    against a single call socket with one receiving loop, for calls of a few sizes.
+    Every remote participant sends voice and camera packets, which are received, decrypted, parsed and counted in
+    the statistics.
+    """
+    print "{0:<14}{1:>10}{2:>10}{3:>10}{4:>12}{5:>12}".format("participants", "model", "sockets", "threads",
+                                                              "packets", "CPU (%)")
+    for participants_num in CALL_SOCKETS_BENCHMARK_PARTICIPANTS_NUMS:
+        remote_participants_num = participants_num - 1
+        for model_name, run_receiver, threads_num in [
+                ("old", run_old_call_receiver, OLD_PARTICIPANT_THREADS_NUM * remote_participants_num),
+                ("new", run_new_call_receiver, NEW_PARTICIPANT_THREADS_NUM * remote_participants_num + 1)]:
+            cpu_time, received_packets, sockets_num = run_receiver(participants_num)
+            print "{0:<14}{1:>10}{2:>10}{3:>10}{4:>12}{5:>12.1f}".format(
+                participants_num, model_name, sockets_num, threads_num, received_packets,
+                100.0 * cpu_time / CALL_SOCKETS_BENCHMARK_DURATION)
+
+
+def run_relay_process(connection, participant_addresses):
+    """
+    Runs a media relay in a process of its own, so its CPU time is measured apart from the load generator.
+    Sends the port of the relay through the connection, relays from a "start" message until a "stop" message, and
+    then sends back its counters and CPU time.
+    :param connection: Connection, the end of a pipe to the load generator.
+    :param participant_addresses: [(IP, PORT)], the call sockets of the participants of a single relayed call,
+    whose source ids are 1, 2, 3...
+    """
+    relay = Media_Relay.MediaRelay(0)
+    relay.open()
+    for source_id, address in enumerate(participant_addresses, 1):
+        relay.add_participant("benchmark call", source_id, address, Audio_Codecs.SUPPORTED_AUDIO_CODECS)
+    connection.send(relay.get_port())
+    connection.recv()
+    start_times = os.times()
+    relay.start()
+    connection.recv()
+    end_times = os.times()
+    cpu_time = (end_times[0] - start_times[0]) + (end_times[1] - start_times[1])
+    connection.send((relay.received_packets, relay.forwarded_packets, relay.dropped_packets, cpu_time))
+    relay.stop()
+
+
+def generate_relay_load(connection, participants_num, packet_size, duration):
+    """
+    The load generator - sends the packets of all the participants of a call to the relay, one participant after
+    the other, as fast as it can. Every participant sends from a call socket of its own, since the relay only accepts
+    the packets of a participant from its address, and the relay forwards the packets to the same sockets.
+    Sends the addresses of the sockets through the connection and then receives the address of the relay.
+    :param connection: Connection, a pipe to the benchmark process.
+    :param participants_num: int, the number of participants in the call.
+    :param packet_size: int, the number of data bytes in every packet.
+    :param duration: float, how many seconds to send for.
+    """
+    cipher = Common_Elements.AESCipher()
+    participant_sockets = []
+    for _ in xrange(participants_num):
+        participant_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        participant_socket.bind((CALL_SOCKETS_BENCHMARK_IP, 0))  # never read, the kernel drops what does not fit
+        participant_sockets.append(participant_socket)
+    connection.send([participant_socket.getsockname() for participant_socket in participant_sockets])
+    relay_address = connection.recv()
+    data = os.urandom(packet_size)
+    packets = [cipher.encrypt_message(Media_Header.MediaStreamSender(source_id, Media_Header.VOICE_STREAM_ID)
+                                      .create_packet(data, 0)) for source_id in xrange(1, participants_num + 1)]
+    end_time = time.time() + duration
+    while time.time() < end_time:
+        for _ in xrange(RELAY_BENCHMARK_TIME_CHECK_PACKETS):
+            for participant_socket, packet in zip(participant_sockets, packets):
+                try:
+                    participant_socket.sendto(packet, relay_address)
+                except socket.error:
+                    pass  # the loopback buffers are full
+    for participant_socket in participant_sockets:
+        participant_socket.close()
+
+
+def run_relay_load(participants_num, packet_size):
+    """
+    Runs the relay under the load of a single call.
+    :param participants_num: int, the number of participants in the call.
+    :param packet_size: int, the number of data bytes in every packet.
+    :return: [0]: int, the packets that the relay received.
+    [1]: int, the packets that the relay forwarded.
+    [2]: float, the CPU seconds of the relay.
+    """
+    load_connection, load_generator_connection = multiprocessing.Pipe()
+    load_generator = multiprocessing.Process(target=generate_relay_load,
+                                             args=[load_generator_connection, participants_num, packet_size,
+                                                   RELAY_BENCHMARK_DURATION])
+    load_generator.start()
+    participant_addresses = load_connection.recv()
+    connection, relay_connection = multiprocessing.Pipe()
+    relay_process = multiprocessing.Process(target=run_relay_process, args=[relay_connection, participant_addresses])
+    relay_process.start()
+    relay_address = (CALL_SOCKETS_BENCHMARK_IP, connection.recv())
+    connection.send("start")
+    load_connection.send(relay_address)
+    load_generator.join()
+    time.sleep(0.1)  # the packets that are still in the relay's buffer
+    connection.send("stop")
+    received_packets, forwarded_packets, dropped_packets, cpu_time = connection.recv()
+    relay_process.join()
+    return received_packets, forwarded_packets, cpu_time
+
+
+def benchmark_media_relay():
+    """
+    Measures how many packets per second a single core of the media relay forwards, with a load generator that sends
+    the packets of a call as fast as it can, for a few call sizes.
+    Also shows how many times every packet leaves a client with and without the relay.
+    """
+    print "calls of more than {0} participants are relayed".format(Media_Relay.RELAY_PARTICIPANTS_THRESHOLD)
+    print "{0:<14}{1:>8}{2:>12}{3:>14}{4:>10}{5:>18}{6:>12}{7:>12}".format(
+        "participants", "packets", "received/s", "forwarded/s", "CPU (%)", "forwarded/s/core", "mesh sends", "relay sends")
+    for participants_num in RELAY_BENCHMARK_CALL_SIZES:
+        for packet_name, packet_size in RELAY_BENCHMARK_PACKET_SIZES:
+            received_packets, forwarded_packets, cpu_time = run_relay_load(participants_num, packet_size)
+            print "{0:<14}{1:>8}{2:>12.0f}{3:>14.0f}{4:>10.1f}{5:>18.0f}{6:>12}{7:>12}".format(
+                participants_num, packet_name, received_packets / RELAY_BENCHMARK_DURATION,
+                forwarded_packets / RELAY_BENCHMARK_DURATION, 100.0 * cpu_time / RELAY_BENCHMARK_DURATION,
+                forwarded_packets / cpu_time if cpu_time else 0.0, participants_num - 1, 1)
+
+
+def mix_per_listener(listeners_encoders, speakers_chunks):
+    """
+    Mixes a chunk the straightforward way - for every listener, adds the chunks of all the other speakers and encodes
+    the result. This is what an MCU without the shared sum and the shared full mix encoding does.
+    :param listeners_encoders: [AudioEncoder], an encoder for every participant of the call.
+    :param speakers_chunks: [str], the decoded chunks of the speakers, the first participants of the call.
+    :return: [str], the encoded mix of every listener.
+    """
+    encoded_mixes = []
+    for listener_index, encoder in enumerate(listeners_encoders):
+        mix = "\0" * len(speakers_chunks[0])
+        for speaker_index, speaker_chunk in enumerate(speakers_chunks):
+            if speaker_index != listener_index:
+                mix = audioop.add(mix, speaker_chunk, 2)
+        encoded_mixes.append(encoder.encode(mix))
+    return encoded_mixes
+
+
+def benchmark_audio_mixer():
+    """
+    Measures the work of the server's audio mixer for every mixed chunk - decoding the speakers, mixing and encoding
+    the mixes - against mixing and encoding for every listener separately, for a few call sizes.
+    Also shows the voice streams that every client receives and plays, with and without the mixer.
+    """
+    chunks = create_speech_like_chunks()
+    chunk_duration_microseconds = 1000000.0 * AUDIO_BENCHMARK_CHUNK / AUDIO_BENCHMARK_RATE
+    codec_name = Audio_Codecs.choose_audio_codec([Audio_Codecs.SUPPORTED_AUDIO_CODECS])
+    print "codec: {0}, a chunk is {1:.0f} us".format(codec_name, chunk_duration_microseconds)
+    print "{0:<14}{1:>10}{2:>16}{3:>20}{4:>12}{5:>14}{6:>14}".format(
+        "participants", "speakers", "mixer (us)", "per listener (us)", "mixer CPU", "mesh streams", "mixed streams")
+    for participants_num in MIXING_BENCHMARK_CALL_SIZES:
+        for speakers_num in MIXING_BENCHMARK_SPEAKERS_NUMS:
+            audio_mixer = Audio_Mixer.AudioMixer(SAMPLE_MEDIA_SOURCE_ID)
+            for source_id in xrange(participants_num):
+                audio_mixer.add_participant(source_id, ("127.0.0.1", 50001), Audio_Codecs.SUPPORTED_AUDIO_CODECS)
+            speakers_packets = [[Audio_Codecs.AudioEncoder(codec_name, AUDIO_BENCHMARK_RATE).encode(chunk)
+                                 for chunk in chunks] for _ in xrange(speakers_num)]
+            sequence_number = [0]
+
+            def put_and_mix():
+                for speaker_index, packets in enumerate(speakers_packets):
+                    header = Media_Header.MediaHeader(speaker_index, Media_Header.VOICE_STREAM_ID,
+                                                      sequence_number[0] % Media_Header.SEQUENCE_NUMBER_MODULO,
+                                                      sequence_number[0] * AUDIO_BENCHMARK_CHUNK, 0)
+                    audio_mixer.put(header, packets[sequence_number[0] % len(packets)], 0.0)
+                sequence_number[0] += 1
+                return audio_mixer.mix()
+
+            for _ in xrange(Jitter_Buffer.MAX_TARGET_DEPTH):  # fills the jitter buffers
+                put_and_mix()
+            mixer_time = measure_microseconds_per_call(put_and_mix, MIXING_BENCHMARK_REPETITIONS)
+            listeners_encoders = [Audio_Codecs.AudioEncoder(codec_name, AUDIO_BENCHMARK_RATE)
+                                  for _ in xrange(participants_num)]
+            speakers_decoders = [Audio_Codecs.AudioDecoder(AUDIO_BENCHMARK_RATE) for _ in xrange(speakers_num)]
+
+            def decode_and_mix_per_listener():
+                speakers_chunks = [decoder.decode(packets[sequence_number[0] % len(packets)])[:AUDIO_BENCHMARK_CHUNK * 2]
+                                   for decoder, packets in zip(speakers_decoders, speakers_packets)]
+                sequence_number[0] += 1
+                return mix_per_listener(listeners_encoders, speakers_chunks)
+
+            per_listener_time = measure_microseconds_per_call(decode_and_mix_per_listener, MIXING_BENCHMARK_REPETITIONS)
+            print "{0:<14}{1:>10}{2:>16.0f}{3:>20.0f}{4:>11.1f}%{5:>14}{6:>14}".format(
+                participants_num, speakers_num, mixer_time, per_listener_time,
+                100.0 * mixer_time / chunk_duration_microseconds, participants_num - 1, 1)
+
+
+class PlaybackBenchmarkSource(object):
+    """
+    Stands for a participant whose voice the playback mixer plays - only the voice attributes of a Participant.
+    """
+    def __init__(self, packets):
+        """
+        :param packets: [str], the encoded chunks that the participant sends, over and over.
+        """
+        self.packets = packets
+        self.jitter_buffer = Jitter_Buffer.JitterBuffer(AUDIO_BENCHMARK_RATE, AUDIO_BENCHMARK_CHUNK)
+        self.audio_decoder = Audio_Codecs.AudioDecoder(AUDIO_BENCHMARK_RATE)
+        self.loss_concealer = Jitter_Buffer.PacketLossConcealer()
+        self.voice_gain = Playback_Mixer.DEFAULT_VOICE_GAIN
+        self.sequence_number = 0
+
+    def receive_packet(self):
+        """
+        Puts the next packet in the jitter buffer, like the call socket does.
+        """
+        self.jitter_buffer.put(self.sequence_number % Media_Header.SEQUENCE_NUMBER_MODULO,
+                               self.sequence_number * AUDIO_BENCHMARK_CHUNK,
+                               self.packets[self.sequence_number % len(self.packets)], 0.0)
+        self.sequence_number += 1
+
+
+def benchmark_playback_mixer():
+    """
+    Measures the work of the client's playback mixer for every played chunk - taking the chunk of every participant
+    out of its jitter buffer, decoding and mixing - for a few call sizes, and shows the output streams and playing
+    threads that a client uses with and without it.
+    """
+    chunks = create_speech_like_chunks()
+    chunk_duration_microseconds = 1000000.0 * AUDIO_BENCHMARK_CHUNK / AUDIO_BENCHMARK_RATE
+    codec_name = Audio_Codecs.choose_audio_codec([Audio_Codecs.SUPPORTED_AUDIO_CODECS])
+    print "codec: {0}, a chunk is {1:.0f} us".format(codec_name, chunk_duration_microseconds)
+    print "{0:<14}{1:>16}{2:>14}{3:>12}{4:>12}{5:>16}{6:>16}".format("participants", "callback (us)", "callback CPU",
+                                                                     "limited", "clipped", "old streams",
+                                                                     "new streams")
+    for participants_num in PLAYBACK_BENCHMARK_CALL_SIZES:
+        playback_mixer = Playback_Mixer.PlaybackMixer(AUDIO_BENCHMARK_CHUNK)
+        sources = []
+        for _ in xrange(participants_num - 1):
+            encoder = Audio_Codecs.AudioEncoder(codec_name, AUDIO_BENCHMARK_RATE)
+            source = PlaybackBenchmarkSource([encoder.encode(chunk) for chunk in chunks])
+            sources.append(source)
+            playback_mixer.add_source(source)
+
+        def receive_and_play():
+            for source in sources:
+                source.receive_packet()
+            return playback_mixer.get_frames(AUDIO_BENCHMARK_CHUNK)
+
+        for _ in xrange(Jitter_Buffer.MAX_TARGET_DEPTH):  # fills the jitter buffers
+            receive_and_play()
+        callback_time = measure_microseconds_per_call(receive_and_play, PLAYBACK_BENCHMARK_REPETITIONS)
+        # every participant had an output stream and a playing thread of its own, now the output stream's callback
+        # plays everyone
+        print "{0:<14}{1:>16.0f}{2:>13.1f}%{3:>12}{4:>12}{5:>16}{6:>16}".format(
+            participants_num, callback_time, 100.0 * callback_time / chunk_duration_microseconds,
+            playback_mixer.limited_samples, playback_mixer.clipped_samples,
+            "{0} + {0} threads".format(participants_num - 1), "1 + 0 threads")
+
+
+def benchmark_voice_latency():
+    """
+    Estimates the delay of the voice from mouth to ear - recording a frame, the network and the jitter buffer, and the
+    audio that waits to be played - with the old 1024-sample chunks and with shorter frames, over the simulated
+    network of the jitter benchmark. Also shows the packets and the header bandwidth that every frame size costs, and
+    measures the work that an audio callback does with the ring buffers.
+    """
+    ring_buffer = Audio_Ring_Buffer.AudioRingBuffer(Audio_Ring_Buffer.CAPTURE_BUFFER_FRAMES * AUDIO_BENCHMARK_CHUNK * 2)
+    frame_bytes = "\0" * AUDIO_BENCHMARK_CHUNK * 2
+    callback_time = measure_microseconds_per_call(lambda: (ring_buffer.write(frame_bytes),
+                                                           ring_buffer.read(len(frame_bytes))),
+                                                  LATENCY_BENCHMARK_REPETITIONS)
+    print "ring buffer write and read of a frame: {0:.1f} us".format(callback_time)
+    print "{0:<18}{1:>10}{2:>14}{3:>12}{4:>22}{5:>12}{6:>18}".format(
+        "model", "frame", "packets/s", "headers", "network + jitter buf", "playback", "mouth to ear")
+    frame_sizes = [("blocking chunks", OLD_VOICE_CHUNK, OLD_PLAYBACK_BUFFER_FRAMES)]
+    for frame_milliseconds in LATENCY_BENCHMARK_FRAME_MILLISECONDS:
+        frame_sizes.append(("callbacks", AUDIO_BENCHMARK_RATE * frame_milliseconds / 1000,
+                            Audio_Ring_Buffer.get_playback_buffer_frames(frame_milliseconds)))
+    for model_name, chunk_size, playback_buffer_frames in frame_sizes:
+        chunk_duration = float(chunk_size) / AUDIO_BENCHMARK_RATE
+        delays = simulate_jitter_buffer(simulate_voice_network(chunk_duration), chunk_duration, chunk_size)[0]
+        network_delay = sum(delays) / len(delays)
+        playback_delay = playback_buffer_frames * chunk_duration
+        headers_bytes_per_packet = Media_Header.MEDIA_HEADER_STRUCT.size + UDP_IP_HEADERS_BYTES
+        print "{0:<18}{1:>8.1f}ms{2:>14.1f}{3:>7.1f}kbit/s{4:>20.1f}ms{5:>10.1f}ms{6:>16.1f}ms".format(
+            model_name, 1000 * chunk_duration, 1 / chunk_duration, headers_bytes_per_packet * 8 / chunk_duration / 1000,
+            1000 * network_delay, 1000 * playback_delay, 1000 * (chunk_duration + network_delay + playback_delay))
+
+
+def create_vad_benchmark_frames(chunks, noise_decibels):
+    """
+    Creates a conversation of one side of a call - talk spurts and pauses of random lengths over the background noise
+    of a room.
+    :param chunks: [str], speech-like chunks.
+    :param noise_decibels: int, the loudness of the background noise.
+    :return: [0]: [str], the recorded frames.
+    [1]: [Bool], True for the frames that have speech in them.
+    """
+    random.seed(noise_decibels)
+    frames_num = int(VAD_BENCHMARK_DURATION * AUDIO_BENCHMARK_RATE / AUDIO_BENCHMARK_CHUNK)
+    frame_duration = float(AUDIO_BENCHMARK_CHUNK) / AUDIO_BENCHMARK_RATE
+    noise_gain = 10 ** (noise_decibels / 20.0) / Audio_Codecs.UNIFORM_NOISE_RMS
+    frames = []
+    is_speech_list = []
+    while len(frames) < frames_num:
+        pause_frames = int(random.expovariate(1 / VAD_BENCHMARK_MEAN_PAUSE) / frame_duration)
+        talk_spurt_frames = max(1, int(random.expovariate(1 / VAD_BENCHMARK_MEAN_TALK_SPURT) / frame_duration))
+        for frame_index in xrange(pause_frames + talk_spurt_frames):
+            noise = audioop.mul(os.urandom(AUDIO_BENCHMARK_CHUNK * 2), 2, noise_gain)
+            if frame_index < pause_frames:
+                frames.append(noise)
+                is_speech_list.append(False)
+                continue
+            speech_index = frame_index - pause_frames
+            gain = VAD_BENCHMARK_SPEECH_GAIN
+            if speech_index < len(VAD_BENCHMARK_ONSET_GAINS):
+                gain *= VAD_BENCHMARK_ONSET_GAINS[speech_index]
+            speech = audioop.mul(chunks[len(frames) % len(chunks)][:AUDIO_BENCHMARK_CHUNK * 2], 2, gain)
+            frames.append(audioop.add(speech, noise, 2))
+            is_speech_list.append(True)
+    return frames, is_speech_list
+
+
+def benchmark_voice_activity_detection():
+    """
+    Compares the old fixed loudness gate with the voice activity detector over a simulated conversation in a few
+    rooms - the frames that are sent, the speech that is cut, the starts of talk spurts that are clipped and the noise
+    that is sent while the user is silent. Also shows the comfort noise packets that are sent instead of the silence.
+    """
+    chunks = create_speech_like_chunks()
+    frame_duration = float(AUDIO_BENCHMARK_CHUNK) / AUDIO_BENCHMARK_RATE
+    print "{0:<14}{1:<8}{2:>10}{3:>16}{4:>16}{5:>14}{6:>16}".format(
+        "room", "model", "sent", "speech cut", "starts clipped", "noise sent", "comfort noise")
+    for room_name, noise_decibels in VAD_BENCHMARK_ROOMS:
+        frames, is_speech_list = create_vad_benchmark_frames(chunks, noise_decibels)
+        old_sent_list = [Voice_Activity.get_decibel_volume(frame) >= OLD_MINIMUM_DECIBEL_VOLUME for frame in frames]
+        detector = Voice_Activity.VoiceActivityDetector(frame_duration)
+        new_sent_list = [False] * len(frames)
+        comfort_noise_packets = 0
+        for frame_index, frame in enumerate(frames):
+            sent_frames_num = len(detector.process(frame))
+            for sent_index in xrange(frame_index - sent_frames_num + 1, frame_index + 1):
+                new_sent_list[sent_index] = True
+            comfort_noise_packets += detector.should_send_comfort_noise()
+        speech_frames_num = sum(is_speech_list)
+        noise_frames_num = len(frames) - speech_frames_num
+        talk_spurt_starts = [frame_index for frame_index in xrange(len(frames)) if is_speech_list[frame_index] and
+                             (frame_index == 0 or not is_speech_list[frame_index - 1])]
+        for model_name, sent_list, model_comfort_noise_packets in [("gate", old_sent_list, 0),
+                                                                   ("vad", new_sent_list, comfort_noise_packets)]:
+            speech_cut = sum(1 for is_speech, is_sent in zip(is_speech_list, sent_list) if is_speech and not is_sent)
+            noise_sent = sum(1 for is_speech, is_sent in zip(is_speech_list, sent_list) if not is_speech and is_sent)
+            starts_clipped = sum(1 for frame_index in talk_spurt_starts if not sent_list[frame_index])
+            print "{0:<14}{1:<8}{2:>9.1f}%{3:>15.1f}%{4:>11}/{5:<4}{6:>13.1f}%{7:>16}".format(
+                room_name, model_name, 100.0 * sum(sent_list) / len(frames), 100.0 * speech_cut / speech_frames_num,
+                starts_clipped, len(talk_spurt_starts), 100.0 * noise_sent / noise_frames_num,
+                model_comfort_noise_packets)
+    print "speech is {0:.0f}% of the frames, a talk spurt start is clipped if its first frame is not sent".format(
+        100.0 * speech_frames_num / len(frames))
+
+
+class IndicatorBenchmarkParticipant(object):
+    """
+    Stands for a participant of an idle call - only the attributes that the speaking indicators use.
+    """
+    def __init__(self, username):
+        self.username = username
+        self.is_in_call = True
+        self.indication_time = 0
+        self.emphasize_changes = 0
+
+
+def old_voice_indication_loop(participant):
+    """
+    The speaking indicator thread that every participant had, without the GUI calls - it spins while the participant
+    is silent, and spins again while the participant speaks.
+    :param participant: IndicatorBenchmarkParticipant, the participant that the thread indicates.
+    """
+    while participant.is_in_call:
+        if time.time() < participant.indication_time:
+            participant.emphasize_changes += 1
+            while participant.is_in_call and time.time() < participant.indication_time:
+                pass
+            participant.emphasize_changes += 1
+
+
+def speaking_indicators_timer_loop(participants):
+    """
+    Stands for the speaking indicators timer of the GUI - a single timer that checks all the participants at 10 Hz and
+    only updates the panels whose state changed.
+    :param participants: [IndicatorBenchmarkParticipant], the participants of the call.
+    """
+    emphasized_participants_names = set()
+    while any(participant.is_in_call for participant in participants):
+        current_time = time.time()
+        speaking_participants_names = set(participant.username for participant in participants
+                                          if current_time < participant.indication_time)
+        for participant in participants:
+            if (participant.username in speaking_participants_names) != \
+                    (participant.username in emphasized_participants_names):
+                participant.emphasize_changes += 1
+        emphasized_participants_names = speaking_participants_names
+        time.sleep(INDICATORS_BENCHMARK_INTERVAL)
+
+
+def run_indicators_model(run_model):
+    """
+    Runs the speaking indicators of an idle call and measures the CPU time of the process.
+    :param run_model: function, gets the participants, starts the indicators and returns a function that stops them.
+    :return: [0]: float, the CPU time in seconds.
+    [1]: int, the number of indicator threads.
+    """
+    participants = [IndicatorBenchmarkParticipant("user_" + str(i))
+                    for i in xrange(INDICATORS_BENCHMARK_PARTICIPANTS_NUM - 1)]
+    start_times = os.times()
+    threads = run_model(participants)
+    time.sleep(INDICATORS_BENCHMARK_DURATION)
+    end_times = os.times()
+    for participant in participants:
+        participant.is_in_call = False
+    for thread in threads:
+        thread.join()
+    return (end_times[0] - start_times[0]) + (end_times[1] - start_times[1]), len(threads)
+
+
+def benchmark_speaking_indicators():
+    """
+    Measures the CPU usage of the speaking indicators of an idle call - a spinning thread for every participant,
+    against a single timer that updates all the participants at 10 Hz.
+    """
+    def run_old_indicators(participants):
+        threads = [threading.Thread(target=old_voice_indication_loop, args=[participant])
+                   for participant in participants]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    def run_new_indicators(participants):
+        thread = threading.Thread(target=speaking_indicators_timer_loop, args=[participants])
+        thread.start()
+        return [thread]
+
+    print "{0:<14}{1:<18}{2:>10}{3:>12}".format("participants", "model", "threads", "CPU (%)")
+    for model_name, run_model in [("thread each", run_old_indicators), ("one timer", run_new_indicators)]:
+        cpu_time, threads_num = run_indicators_model(run_model)
+        print "{0:<14}{1:<18}{2:>10}{3:>12.1f}".format(INDICATORS_BENCHMARK_PARTICIPANTS_NUM, model_name, threads_num,
+                                                        100.0 * cpu_time / INDICATORS_BENCHMARK_DURATION)
+
+
+class BenchmarkCamera(object):
+    """
+    Stands for a webcam - a new picture is ready every device frame period, and reading waits for the next one.
+    """
+    def __init__(self):
+        self.period = 1.0 / CAMERA_BENCHMARK_DEVICE_FPS
+        self.start_time = time.time()
+
+    def read(self):
+        """
+        :return: float, the time that the picture was ready in, which stands for the picture.
+        """
+        current_time = time.time()
+        next_picture_time = self.start_time + (int((current_time - self.start_time) / self.period) + 1) * self.period
+        time.sleep(next_picture_time - current_time)
+        return next_picture_time
+
+
+def run_old_camera_loop(encode_time):
+    """
+    The old camera thread - reads a picture, encodes it, sends it, and only then sleeps a frame period.
+    :param encode_time: float, the seconds that encoding a picture takes.
+    :return: [0]: float, the frames that were sent every second.
+    [1]: float, the average time from the picture being ready until it was sent, in seconds.
+    """
+    camera = BenchmarkCamera()
+    latencies = []
+    start_time = time.time()
+    while time.time() - start_time < CAMERA_BENCHMARK_DURATION:
+        picture_time = camera.read()
+        time.sleep(encode_time)
+        latencies.append(time.time() - picture_time)
+        time.sleep(1.0 / CAMERA_BENCHMARK_FPS)
+    return len(latencies) / (time.time() - start_time), sum(latencies) / len(latencies)
+
+
+def run_camera_pipeline(encode_time):
+    """
+    Runs the camera pipeline with a simulated camera and encoder.
+    :param encode_time: float, the seconds that encoding a picture takes.
+    :return: Video_Pipeline.VideoPipelineStatistics, the statistics of the run.
+    """
+    camera = BenchmarkCamera()
+    start_time = time.time()
+    pipeline = Video_Pipeline.VideoPipeline("camera", camera.read, lambda picture: time.sleep(encode_time) or "jpeg",
+                                            lambda frame_bytes: None, lambda: True,
+                                            lambda: time.time() - start_time < CAMERA_BENCHMARK_DURATION,
+                                            CAMERA_BENCHMARK_FPS)
+    pipeline.run()
+    return pipeline.statistics
+
+
+def benchmark_camera_pipeline():
+    """
+    Compares the frame rate and the latency of the camera pictures - the old thread that slept a frame period after
+    the work of every picture, against the staged pipeline that is paced by deadlines - with a simulated webcam and
+    simulated JPEG encoding times.
+    """
+    print "{0:<12}{1:>10}{2:>10}{3:>10}{4:>10}{5:>10}{6:>12}".format(
+        "model", "encode", "fps", "queue", "encode", "send", "total")
+    for encode_time in CAMERA_BENCHMARK_ENCODE_TIMES:
+        fps, latency = run_old_camera_loop(encode_time)
+        print "{0:<12}{1:>8.1f}ms{2:>10.1f}{3:>10}{4:>10}{5:>10}{6:>10.1f}ms".format(
+            "old loop", 1000 * encode_time, fps, "-", "-", "-", 1000 * latency)
+        statistics = run_camera_pipeline(encode_time)
+        queue_time, pipeline_encode_time, send_time, total_time = statistics.get_average_latencies()
+        print "{0:<12}{1:>8.1f}ms{2:>10.1f}{3:>8.1f}ms{4:>8.1f}ms{5:>8.1f}ms{6:>10.1f}ms".format(
+            "pipeline", 1000 * encode_time, statistics.get_achieved_fps(), 1000 * queue_time,
+            1000 * pipeline_encode_time, 1000 * send_time, 1000 * total_time)
+
+
+def simulate_fragmented_frames(frame_size, loss_rate):
+    """
+    Sends frames through a fragmenter and a reassembler over a lossy network that reorders the fragments of every
+    frame.
+    :param frame_size: int, the size of every frame in bytes.
+    :param loss_rate: float, the probability of a fragment to be lost.
+    :return: [0]: int, the number of fragments of every frame.
+    [1]: float, the part of the frames that were reassembled.
+    [2]: float, the microseconds that fragmenting and reassembling a frame took.
+    """
+    random.seed(frame_size)
+    fragmenter = Frame_Fragments.FrameFragmenter()
+    reassembler = Frame_Fragments.FrameReassembler()
+    frame_bytes = os.urandom(frame_size)
+    fragments_count = 0
+    work_time = 0.0
+    for frame_index in xrange(FRAGMENTS_BENCHMARK_FRAMES_NUM):
+        arrival_time = frame_index / float(CAMERA_BENCHMARK_FPS)
+        start_time = time.time()
+        fragments = fragmenter.fragment(frame_bytes)
+        work_time += time.time() - start_time
+        fragments_count = len(fragments)
+        arriving_fragments = [fragment for fragment in fragments if random.random() >= loss_rate]
+        random.shuffle(arriving_fragments)
+        start_time = time.time()
+        for fragment in arriving_fragments:
+            reassembler.add_fragment(fragment, arrival_time)
+        work_time += time.time() - start_time
+    return fragments_count, float(reassembler.completed_frames) / FRAGMENTS_BENCHMARK_FRAMES_NUM, \
+        1000000 * work_time / FRAGMENTS_BENCHMARK_FRAMES_NUM
+
+
+def benchmark_frame_fragments():
+    """
+    Shows what sending camera and screen frames in MTU-sized fragments costs - the fragments of every frame, the part
+    of the frames that arrive whole over a lossy network, and the work of fragmenting and reassembling a frame - next
+    to the old single datagram, which dropped every frame over 64 KB.
+    """
+    print "fragment data: {0} bytes, datagram: {1} bytes".format(
+        Frame_Fragments.MAX_FRAGMENT_DATA_SIZE, Frame_Fragments.MTU - Frame_Fragments.UDP_IP_HEADERS_SIZE)
+    print "{0:<10}{1:>8}{2:>12}{3:>14}{4:>14}{5:>12}".format("frame", "loss", "fragments", "old frames", "new frames",
+                                                            "work")
+    for frame_size in FRAGMENTS_BENCHMARK_FRAME_SIZES:
+        for loss_rate in FRAGMENTS_BENCHMARK_LOSS_RATES:
+            fragments_count, delivered_part, work_time = simulate_fragmented_frames(frame_size, loss_rate)
+            # IP fragmented the old datagram to about as many packets, and losing any of them lost the frame
+            old_delivered_part = (1 - loss_rate) ** fragments_count if frame_size <= OLD_MAX_FRAME_SIZE else 0.0
+            print "{0:>6} KB{1:>7.1f}%{2:>12}{3:>13.1f}%{4:>13.1f}%{5:>10.0f}us".format(
+                frame_size / 1024, 100 * loss_rate, fragments_count, 100 * old_delivered_part, 100 * delivered_part,
+                work_time)
+
+
+def create_benchmark_text(height, width):
+    """
+    :param height: int, the height of the text in pixels.
+    :param width: int, the width of the text in pixels.
+    :return: numpy.ndarray, lines of word-like dark blocks on white, height x width x 3.
+    """
+    random.seed(height)
+    text = np.full((height, width, 3), 255, dtype=np.uint8)
+    for line_top in xrange(4, height - 12, 16):
+        x = 8
+        while x < width - 60:
+            word_width = random.randint(12, 60)
+            text[line_top:line_top + 10, x:x + word_width] = np.random.randint(0, 2, (10, word_width, 1)) * 200
+            x += word_width + 6
+    return text
+
+
+def create_benchmark_screen_scenes():
+    """
+    Creates the screenshots of three scenes of a shared screen - an idle desktop with a blinking cursor, text that
+    scrolls, and a video that plays in a window.
+    :return: [(str, [numpy.ndarray])], the name and the screenshots of every scene.
+    """
+    np.random.seed(0)
+    width, height = SCREEN_BENCHMARK_SIZE
+    frames_num = int(SCREEN_BENCHMARK_DURATION * SCREEN_BENCHMARK_FPS)
+    desktop = np.zeros((height, width, 3), dtype=np.uint8)
+    desktop[:, :, 2] = np.linspace(80, 200, height).astype(np.uint8)[:, np.newaxis]
+    desktop[60:540, 100:700] = create_benchmark_text(480, 600)
+    idle_frames = []
+    for frame_index in xrange(frames_num):
+        frame = desktop.copy()
+        if (frame_index / SCREEN_BENCHMARK_CURSOR_BLINK_FRAMES) % 2:
+            frame[300:316, 400:402] = 0
+        idle_frames.append(frame)
+    long_text = create_benchmark_text(480 + frames_num * SCREEN_BENCHMARK_SCROLL_PIXELS, 600)
+    scrolling_frames = []
+    for frame_index in xrange(frames_num):
+        frame = desktop.copy()
+        scroll = frame_index * SCREEN_BENCHMARK_SCROLL_PIXELS
+        frame[60:540, 100:700] = long_text[scroll:scroll + 480]
+        scrolling_frames.append(frame)
+    video_width, video_height = SCREEN_BENCHMARK_VIDEO_SIZE
+    video_x = np.arange(video_width)[np.newaxis, :]
+    video_y = np.arange(video_height)[:, np.newaxis]
+    video_frames = []
+    for frame_index in xrange(frames_num):
+        frame = desktop.copy()
+        for channel, speed in enumerate([3, 5, 7]):
+            frame[180:180 + video_height, 240:240 + video_width, channel] = \
+                (128 + 100 * np.sin((video_x + speed * frame_index) / 20.0) * np.cos((video_y - frame_index) / 15.0) +
+                 np.random.randint(0, 8, (video_height, video_width))).astype(np.uint8)
+        video_frames.append(frame)
+    return [("idle desktop", idle_frames), ("scrolling text", scrolling_frames), ("video playback", video_frames)]
+
+
+def benchmark_screen_encoder():
+    """
+    Compares the bytes per second of screen sharing - the whole screenshot every frame, against the tile updates of
+    the screen encoder - for an idle desktop, scrolling text and a playing video. zlib stands for JPEG, which is not
+    available to the benchmarks, so the numbers compare the two models rather than show real JPEG sizes.
+    """
+    encode_picture = lambda picture: zlib.compress(picture.tostring(), 6)
+    print "{0:<16}{1:>14}{2:>14}{3:>12}{4:>10}{5:>12}".format("scene", "old KB/s", "tiles KB/s", "keyframes",
+                                                               "deltas", "tiles/delta")
+    for scene_name, frames in create_benchmark_screen_scenes():
+        old_bytes = sum(len(encode_picture(frame)) for frame in frames)
+        screen_encoder = Screen_Encoder.ScreenEncoder(encode_picture)
+        new_bytes = 0
+        for frame_index, frame in enumerate(frames):
+            update_bytes = screen_encoder.encode(frame, float(frame_index) / SCREEN_BENCHMARK_FPS)[0]
+            if update_bytes is not None:
+                new_bytes += len(update_bytes)
+        print "{0:<16}{1:>14.1f}{2:>14.1f}{3:>12}{4:>10}{5:>12.1f}".format(
+            scene_name, old_bytes / SCREEN_BENCHMARK_DURATION / 1024, new_bytes / SCREEN_BENCHMARK_DURATION / 1024,
+            screen_encoder.keyframes, screen_encoder.delta_updates,
+            float(screen_encoder.sent_tiles) / max(1, screen_encoder.delta_updates))
+
+
+class RateControlBenchmarkStream(object):
+    """
+    A simulated camera or screen stream of the sender, with the receiver's side of it.
+    """
+    def __init__(self, stream_id, bytes_per_pixel, changed_fraction, settings):
+        """
+        :param stream_id: int, CAMERA_STREAM_ID or SCREEN_STREAM_ID.
+        :param bytes_per_pixel: float, the size of a whole frame of quality 75 for every pixel.
+        :param changed_fraction: float, the part of a whole frame that a delta update holds, 1 for the camera.
+        :param settings: Rate_Control.VideoSettings, the settings that the stream starts with.
+        """
+        self.stream_id = stream_id
+        self.bytes_per_pixel = bytes_per_pixel
+        self.changed_fraction = changed_fraction
+        self.settings = settings
+        self.sender = Media_Header.MediaStreamSender(SAMPLE_MEDIA_SOURCE_ID, stream_id)
+        self.fragmenter = Frame_Fragments.FrameFragmenter()
+        self.statistics = Media_Statistics.MediaStreamStatistics(stream_id, Media_Header.VIDEO_CLOCK_RATE)
+        self.reassembler = Frame_Fragments.FrameReassembler()
+        self.next_frame_time = 0.0
+        self.last_keyframe_time = None
+        self.last_picture_size = None
+        self.delivered_frames = 0
+        self.frame_latency_sum = 0.0
+
+    def create_frame(self, current_time):
+        """
+        :param current_time: float, the time of the frame.
+        :return: [0]: int, the size of the frame in bytes.
+        [1]: Bool, True if the frame is a whole picture - every camera frame, and the screen keyframes.
+        """
+        is_keyframe = self.changed_fraction == 1 or self.settings.picture_size != self.last_picture_size or \
+            current_time - self.last_keyframe_time >= Screen_Encoder.KEYFRAME_INTERVAL
+        if is_keyframe:
+            self.last_keyframe_time = current_time
+            self.last_picture_size = self.settings.picture_size
+        frame_size = self.settings.picture_size[0] * self.settings.picture_size[1] * self.bytes_per_pixel * \
+            Rate_Control.get_jpeg_quality_cost(self.settings.quality) * \
+            random.gauss(1, RATE_CONTROL_BENCHMARK_FRAME_SIZE_DEVIATION)
+        if not is_keyframe:
+            frame_size *= self.changed_fraction
+        return max(1, int(frame_size)), is_keyframe
+
+
+def get_trace_link(trace, current_time):
+    """
+    :param trace: [(float, int, float)], the segments of a trace.
+    :param current_time: float, the time in the trace.
+    :return: [0]: int, the bits per second of the bottleneck.
+    [1]: float, the random loss rate of the bottleneck.
+    """
+    start_time, link_bitrate, loss_rate = trace[0]
+    for start_time, segment_bitrate, segment_loss_rate in trace:
+        if current_time >= start_time:
+            link_bitrate, loss_rate = segment_bitrate, segment_loss_rate
+    return link_bitrate, loss_rate
+
+
+def change_old_screen_quality(settings, frame_size):
+    """
+    The old screen quality logic, that changed the quality by the size of every keyframe.
+    :param settings: Rate_Control.VideoSettings, the current screen settings.
+    :param frame_size: int, the size of the keyframe.
+    :return: Rate_Control.VideoSettings, the settings of the next screenshots.
+    """
+    quality = settings.quality
+    if frame_size < OLD_HIGHER_QUALITY_SIGN_BYTES and quality <= OLD_MAX_QUALITY_THRESHOLD:
+        quality += OLD_QUALITY_CHANGE_RATE
+    elif frame_size > OLD_SCREEN_FRAME_TARGET_SIZE and quality >= OLD_MIN_QUALITY_THRESHOLD:
+        quality -= OLD_QUALITY_CHANGE_RATE
+    return Rate_Control.VideoSettings(settings.picture_size, settings.fps, quality)
+
+
+def simulate_rate_control(trace, is_controlled):
+    """
+    Replays a bandwidth and loss trace of a bottleneck link with a drop-tail queue, while the camera and a busy screen
+    are sent through it in fragments. The receiver reports the streams every report interval, like the call does.
+    :param trace: [(float, int, float)], the segments of the trace.
+    :param is_controlled: Bool, True if a rate controller picks the settings of the streams, False for the old fixed
+    camera settings and the old screen quality logic.
+    :return: [0]: [RateControlBenchmarkStream], the camera and the screen streams.
+    [1]: float, the bits per second that were sent, with all the headers.
+    [2]: float, the bits per second that arrived.
+    [3]: float, the part of the packets that were lost or dropped by the queue.
+    [4]: float, the average time that the packets that arrived waited in the queue, in seconds.
+    """
+    random.seed(len(trace))
+    camera_stream = RateControlBenchmarkStream(Media_Header.CAMERA_STREAM_ID,
+                                               RATE_CONTROL_BENCHMARK_CAMERA_BYTES_PER_PIXEL, 1, OLD_CAMERA_SETTINGS)
+    screen_stream = RateControlBenchmarkStream(Media_Header.SCREEN_STREAM_ID,
+                                               RATE_CONTROL_BENCHMARK_SCREEN_BYTES_PER_PIXEL,
+                                               RATE_CONTROL_BENCHMARK_SCREEN_CHANGED_FRACTION, OLD_SCREEN_SETTINGS)
+    streams = [camera_stream, screen_stream]
+    rate_controller = Rate_Control.RateController([stream.sender for stream in streams]) if is_controlled else None
+    queue = collections.deque()  # (wire size, send time, header, fragment, stream, capture time)
+    in_flight_packets = collections.deque()  # (arrival time, wire size, send time, header, fragment, stream, capture time)
+    in_flight_reports = collections.deque()  # (arrival time, reports data)
+    queue_bytes = 0
+    link_credit = 0.0
+    sent_bytes = sent_packets = delivered_bytes = delivered_packets = 0
+    queuing_delay_sum = 0.0
+    next_report_time = Rate_Control.RECEIVER_REPORT_INTERVAL
+    for step_index in xrange(int(RATE_CONTROL_BENCHMARK_DURATION / RATE_CONTROL_BENCHMARK_STEP)):
+        current_time = step_index * RATE_CONTROL_BENCHMARK_STEP
+        link_bitrate, loss_rate = get_trace_link(trace, current_time)
+        for stream in streams:
+            if current_time < stream.next_frame_time:
+                continue
+            if rate_controller is not None:
+                stream.settings = rate_controller.get_settings(stream.stream_id, current_time)
+            stream.next_frame_time += 1.0 / stream.settings.fps
+            frame_size, is_keyframe = stream.create_frame(current_time)
+            if rate_controller is None and stream is screen_stream and is_keyframe:
+                screen_stream.settings = change_old_screen_quality(screen_stream.settings, frame_size)
+            for fragment in stream.fragmenter.fragment("\0" * frame_size):
+                packet = stream.sender.create_packet(fragment, Media_Header.get_video_timestamp(current_time))
+                header = Media_Header.parse_media_packet(packet)[0]
+                header.send_time = Media_Header.get_send_time(current_time)
+                wire_size = len(packet) + Frame_Fragments.ENCRYPTION_OVERHEAD + Frame_Fragments.UDP_IP_HEADERS_SIZE
+                sent_bytes += wire_size
+                sent_packets += 1
+                if queue_bytes + wire_size <= RATE_CONTROL_BENCHMARK_QUEUE_BYTES:
+                    queue.append((wire_size, current_time, header, fragment, stream, current_time))
+                    queue_bytes += wire_size
+        link_credit += link_bitrate * RATE_CONTROL_BENCHMARK_STEP / 8
+        while queue and queue[0][0] <= link_credit:
+            packet_info = queue.popleft()
+            queue_bytes -= packet_info[0]
+            link_credit -= packet_info[0]
+            if random.random() >= loss_rate:
+                in_flight_packets.append((current_time + RATE_CONTROL_BENCHMARK_BASE_DELAY,) + packet_info)
+        if not queue:
+            link_credit = min(link_credit, Frame_Fragments.MTU)  # an idle link does not save up bandwidth
+        while in_flight_packets and in_flight_packets[0][0] <= current_time:
+            arrival_time, wire_size, send_time, header, fragment, stream, capture_time = in_flight_packets.popleft()
+            delivered_bytes += wire_size
+            delivered_packets += 1
+            queuing_delay_sum += arrival_time - send_time - RATE_CONTROL_BENCHMARK_BASE_DELAY
+            stream.statistics.update(header, len(fragment), arrival_time)
+            if stream.reassembler.add_fragment(fragment, arrival_time) is not None:
+                stream.delivered_frames += 1
+                stream.frame_latency_sum += arrival_time - capture_time
+        if current_time >= next_report_time:
+            next_report_time += Rate_Control.RECEIVER_REPORT_INTERVAL
+            reports = []
+            for stream in streams:
+                if stream.statistics.received_packets:
+                    fraction_lost, receive_rate = stream.statistics.get_interval_report(current_time)
+                    reports.append(Rate_Control.ReceiverReport(SAMPLE_MEDIA_SOURCE_ID, stream.stream_id, fraction_lost,
+                                                               stream.statistics.jitter,
+                                                               stream.statistics.get_queuing_delay(), receive_rate))
+            in_flight_reports.append((current_time + RATE_CONTROL_BENCHMARK_BASE_DELAY,
+                                      "".join(report.pack() for report in reports)))
+        while in_flight_reports and in_flight_reports[0][0] <= current_time:
+            reports_data = in_flight_reports.popleft()[1]
+            if rate_controller is not None:
+                rate_controller.handle_receiver_reports(RATE_CONTROL_BENCHMARK_RECEIVER_SOURCE_ID,
+                                                        Rate_Control.parse_receiver_reports(reports_data), current_time)
+    return streams, 8 * sent_bytes / RATE_CONTROL_BENCHMARK_DURATION, \
+        8 * delivered_bytes / RATE_CONTROL_BENCHMARK_DURATION, 1 - float(delivered_packets) / sent_packets, \
+        queuing_delay_sum / max(1, delivered_packets)
+
+
+def benchmark_rate_control():
+    """
+    Replays bandwidth and loss traces of a bottleneck link while the camera and a busy screen are sent, and compares
+    the old fixed camera settings and screen quality logic against the rate controller, which picks the resolution,
+    frame rate and quality of both streams by the receiver's reports. The frames that arrive whole are what the
+    receiver can show.
+    """
+    print "{0:<12}{1:<12}{2:>8}{3:>8}{4:>8}{5:>9}{6:>10}{7:>10}{8:>11}".format(
+        "trace", "model", "sent", "arrived", "loss", "queue", "camera", "screen", "latency")
+    for trace_name, trace in RATE_CONTROL_BENCHMARK_TRACES:
+        for model_name, is_controlled in [("old", False), ("controlled", True)]:
+            streams, sent_bitrate, delivered_bitrate, lost_part, queuing_delay = simulate_rate_control(trace,
+                                                                                                       is_controlled)
+            delivered_frames = sum(stream.delivered_frames for stream in streams)
+            frame_latency = sum(stream.frame_latency_sum for stream in streams) / max(1, delivered_frames)
+            print "{0:<12}{1:<12}{2:>6.2f}M{3:>7.2f}M{4:>7.1f}%{5:>7.0f}ms{6:>6.1f} fps{7:>6.1f} fps{8:>9.0f}ms".format(
+                trace_name, model_name, sent_bitrate / 1000000, delivered_bitrate / 1000000, 100 * lost_part,
+                1000 * queuing_delay, streams[0].delivered_frames / RATE_CONTROL_BENCHMARK_DURATION,
+                streams[1].delivered_frames / RATE_CONTROL_BENCHMARK_DURATION, 1000 * frame_latency)
+
+
+def get_frame_wire_bytes(frame_size):
+    """
+    :param frame_size: int, the size of an encoded frame.
+    :return: int, the bytes that the fragments of the frame take on the network, with all the headers.
+    """
+    fragments = Frame_Fragments.FrameFragmenter().fragment("\0" * frame_size)
+    return sum(len(fragment) + Media_Header.MEDIA_HEADER_STRUCT.size + Frame_Fragments.ENCRYPTION_OVERHEAD +
+               Frame_Fragments.UDP_IP_HEADERS_SIZE for fragment in fragments)
+
+
+def benchmark_simulcast():
+    """
+    Compares the camera bitrate of a sender in an 8 participants call - the old camera that was sent whole to
+    everyone, against the camera layers that are sent only to the receivers that subscribed to them by the size of
+    their camera windows - for a few states of the receivers' windows. "receivers" is what the receivers get - the
+    sender's upload without the relay, or the relay's upload with it, which forwards by the subscriptions that it
+    read. "to relay" is the sender's upload with the relay. Frame sizes follow the JPEG model of the rate control
+    benchmark.
+    """
+    layer_frame_sizes = {
+        Media_Header.CAMERA_STREAM_ID: SIMULCAST_BENCHMARK_HIGH_LAYER_SETTINGS.picture_size,
+        Media_Header.CAMERA_LOW_STREAM_ID: Simulcast.CAMERA_LOW_LAYER_PICTURE_SIZE}
+    layer_qualities = {Media_Header.CAMERA_STREAM_ID: SIMULCAST_BENCHMARK_HIGH_LAYER_SETTINGS.quality,
+                       Media_Header.CAMERA_LOW_STREAM_ID: Simulcast.CAMERA_LOW_LAYER_QUALITY}
+    layer_bitrates = dict((stream_id, 8 * SIMULCAST_BENCHMARK_FPS * get_frame_wire_bytes(int(
+        picture_size[0] * picture_size[1] * RATE_CONTROL_BENCHMARK_CAMERA_BYTES_PER_PIXEL *
+        Rate_Control.get_jpeg_quality_cost(layer_qualities[stream_id]))))
+        for stream_id, picture_size in layer_frame_sizes.iteritems())
+    print "high layer {0}: {1:.2f} Mbit/s, low layer {2}x{3}: {4:.2f} Mbit/s".format(
+        SIMULCAST_BENCHMARK_HIGH_LAYER_SETTINGS, layer_bitrates[Media_Header.CAMERA_STREAM_ID] / 1000000.0,
+        Simulcast.CAMERA_LOW_LAYER_PICTURE_SIZE[0], Simulcast.CAMERA_LOW_LAYER_PICTURE_SIZE[1],
+        layer_bitrates[Media_Header.CAMERA_LOW_STREAM_ID] / 1000000.0)
+    print "{0:<16}{1:>16}{2:>18}{3:>16}{4:>18}".format("windows", "old receivers", "layers receivers",
+                                                       "old to relay", "layers to relay")
+    for scenario_name, window_sizes in SIMULCAST_BENCHMARK_SCENARIOS:
+        relayed_call = Media_Relay.RelayedCall("benchmark")
+        subscriptions = Simulcast.LayerSubscriptions()
+        relayed_call.add_participant(SAMPLE_MEDIA_SOURCE_ID, ("127.0.0.1", 0), [])
+        for receiver_index, window_size in enumerate(window_sizes):
+            receiver_source_id = receiver_index + 1
+            relayed_call.add_participant(receiver_source_id, ("127.0.0.1", receiver_source_id), [])
+            subscription = Simulcast.pack_subscription(SAMPLE_MEDIA_SOURCE_ID,
+                                                       Simulcast.choose_camera_layer(window_size))
+            sender_source_id, stream_id = Simulcast.parse_subscription(subscription)
+            subscriptions.subscribe(receiver_source_id, stream_id)
+            relayed_call.subscribe(receiver_source_id, sender_source_id, stream_id)
+        old_bitrate = layer_bitrates[Media_Header.CAMERA_STREAM_ID] * len(window_sizes)
+        receivers_bitrate = sum(layer_bitrates[stream_id] * len(relayed_call.get_receiver_addresses(
+            Media_Header.MediaHeader(SAMPLE_MEDIA_SOURCE_ID, stream_id, 0, 0, 0)))
+            for stream_id in Simulcast.CAMERA_LAYER_STREAM_IDS)
+        assert receivers_bitrate == sum(layer_bitrates[stream_id] * len(subscriptions.get_subscribers(stream_id))
+                                        for stream_id in Simulcast.CAMERA_LAYER_STREAM_IDS)
+        to_relay_bitrate = sum(layer_bitrates[stream_id] for stream_id in subscriptions.get_subscribed_stream_ids())
+        print "{0:<16}{1:>11.2f} Mbit{2:>13.2f} Mbit{3:>11.2f} Mbit{4:>13.2f} Mbit".format(
+            scenario_name, old_bitrate / 1000000.0, receivers_bitrate / 1000000.0,
+            layer_bitrates[Media_Header.CAMERA_STREAM_ID] / 1000000.0, to_relay_bitrate / 1000000.0)
+
+
+BENCHMARKS = {
+    "codec": benchmark_message_codec,
+    "framing": benchmark_framing,
+    "login": benchmark_login,
+    "database": benchmark_database_worker,
+    "audio": benchmark_audio_codecs,
+    "jitter": benchmark_jitter_buffer,
+    "media": benchmark_media_header,
+    "call_sockets": benchmark_call_sockets,
+    "relay": benchmark_media_relay,
+    "mixing": benchmark_audio_mixer,
+    "playback": benchmark_playback_mixer,
+    "latency": benchmark_voice_latency,
+    "vad": benchmark_voice_activity_detection,
+    "indicators": benchmark_speaking_indicators,
+    "camera": benchmark_camera_pipeline,
+    "fragments": benchmark_frame_fragments,
+    "screen": benchmark_screen_encoder,
+    "rate_control": benchmark_rate_control,
+    "simulcast": benchmark_simulcast,
+}
+
+
+def main():
+    """
+    Runs the benchmarks whose names are given as arguments, or all of them if no names are given.
+    """
+    benchmark_names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for benchmark_name in benchmark_names:
+        if benchmark_name not in BENCHMARKS:
+            print "Unknown benchmark " + benchmark_name + ", available benchmarks: " + ", ".join(sorted(BENCHMARKS.keys()))
+            continue
+        print "----- " + benchmark_name + " -----"
+        BENCHMARKS[benchmark_name]()
+
+
+if __name__ == '__main__':
+    main()
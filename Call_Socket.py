@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+from Common_Elements import AESCipher
+from Media_Header import parse_media_packet, MediaHeaderException
+
+CALL_SOCKET_IP = "0.0.0.0"
+MAX_DATAGRAM_SIZE = 65536  # the largest UDP datagram, camera and screen frames arrive in much smaller fragments
+
+
+class CallSocket(object):
+    """
+    A single UDP socket that sends and receives all the media of a call - the voice, camera and screen data of
+    every participant.
+    The packets are demultiplexed by the source id in their media header, and handed to the handler of their
+    participant by one receiving loop, instead of a socket and a thread for every data type of every participant.
+    """
+    def __init__(self):
+        """
+        source_id_handler_dict - {int:function}, the handlers of the participants' packets by their source ids.
+        unknown_packets - int, the packets that arrived from sources that are not in the call.
+        invalid_packets - int, the packets that could not be parsed.
+        """
+        self.cipher = AESCipher()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # allows sockets to reuse the same ports.
+        self.source_id_handler_dict = {}
+        self.is_bound = False
+        self.is_open = True
+        self.unknown_packets = 0
+        self.invalid_packets = 0
+
+    def bind(self, port):
+        """
+        Binds the socket to the call port of the user.
+        :param port: int, the port that the other participants send to.
+        """
+        self.sock.bind((CALL_SOCKET_IP, port))
+        self.is_bound = True
+
+    def get_port(self):
+        """
+        :return: int, the port that the socket is bound to.
+        """
+        return self.sock.getsockname()[1]
+
+    def add_source(self, source_id, handler):
+        """
+        Starts handing the packets of a participant to a handler.
+        :param source_id: int, the source id of the participant's packets.
+        :param handler: function, called by the receiving loop with the MediaHeader, the data and the arrival time
+        of every packet of the participant.
+        """
+        self.source_id_handler_dict[source_id] = handler
+
+    def remove_source(self, source_id):
+        """
+        Stops handling the packets of a participant.
+        :param source_id: int, the source id of the participant's packets.
+        """
+        self.source_id_handler_dict.pop(source_id, None)
+
+    def send_packet(self, packet, address):
+        """
+        Encrypts and sends a packet.
+        :param packet: str, the packet, starting with a media header.
+        :param address: (IP, PORT), the address of the call socket of the participant.
+        """
+        self.sock.sendto(self.cipher.encrypt_message(packet), address)
+
+    def receive_packet(self):
+        """
+        Receives a single packet and hands it to the handler of its participant.
+        """
+        encrypted_packet, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+        arrival_time = time.time()
+        try:
+            header, data = parse_media_packet(self.cipher.decrypt_message(encrypted_packet))
+        except (MediaHeaderException, ValueError):
+            self.invalid_packets += 1
+            return
+        handler = self.source_id_handler_dict.get(header.source_id)
+        if handler is None:
+            self.unknown_packets += 1
+            return
+        handler(header, data, arrival_time)
+
+    def receive_loop(self):
+        """
+        Receives the packets of the call until the socket is closed.
+        """
+        while self.is_open:
+            try:
+                self.receive_packet()
+            except socket.error as e:
+                if self.is_open:
+                    print "CALL SOCKET ERROR " + str(e)  # a participant's port is closed, keep receiving the others
+
+    def close(self):
+        """
+        Closes the socket, which also ends the receiving loop.
+        """
+        self.is_open = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # wakes up the receiving loop
+        except socket.error:
+            pass
+        self.sock.close()
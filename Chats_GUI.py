@@ -7,6 +7,7 @@ from io import BytesIO
 from PIL import Image
 from datetime import datetime
 import base64
+from Screen_Encoder import parse_screen_update, ScreenUpdateException, KEYFRAME_UPDATE
 # import os.path
 
 PARTICIPANT_PANEL_NAME = "%sPanel"
@@ -26,6 +27,8 @@ CAMERA_FRAME_TYPE = "Camera"
 SCREEN_SHARE_FRAME_TYPE = "Screen"
 OWN_CAMERA_FRAME_TYPE = "OwnCamera"
 
+SPEAKING_INDICATORS_INTERVAL = 100  # milliseconds, the speaking indicators of all the participants are updated at 10 Hz
+
 
 class GroupChatPanel(wx.lib.scrolledpanel.ScrolledPanel):
     """
@@ -312,12 +315,17 @@ class VoiceChatParticipantViewerPanel(wx.lib.scrolledpanel.ScrolledPanel):
     A panel that contains information about all the voice chat participants. This is a scrollable panel that expands
     itself whenever needed and thus supports an unlimited amount of voice chat participants. Each participant has
     his own block of information that is visible in the participant viewer panel.
+    The panels of the participants that speak are emphasized by a single timer that checks all the participants
+    during a voice chat, and only the panels whose state changed are updated.
     """
     def __init__(self, parent, id=wx.ID_ANY, pos=wx.DefaultPosition, size=wx.DefaultSize, style=wx.TAB_TRAVERSAL, name=wx.PanelNameStr):
         super(VoiceChatParticipantViewerPanel, self).__init__(parent, id, pos, size, style, name)
         self.SetBackgroundColour(wx.LIGHT_GREY)
         self.main_sizer = wx.BoxSizer(wx.VERTICAL)
         self.SetupScrolling(scroll_y=False)
+        self.emphasized_participants_names = set()
+        self.speaking_indicators_timer = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.update_speaking_indicators, self.speaking_indicators_timer)
         self.init_UI()
         self.SetSizer(self.main_sizer)
 
@@ -369,8 +377,7 @@ class VoiceChatParticipantViewerPanel(wx.lib.scrolledpanel.ScrolledPanel):
                 return child.GetWindow()
         return None
 
-    def set_participant_picture(self, participant_name, encoded_picture_bytes):
-        picture_bytes = base64.b64decode(encoded_picture_bytes)
+    def set_participant_picture(self, participant_name, picture_bytes):
         participant_panel = self.get_participant_panel_window(participant_name)
         if participant_panel is not None:
             participant_panel.change_participant_picture(picture_bytes)
@@ -385,6 +392,26 @@ class VoiceChatParticipantViewerPanel(wx.lib.scrolledpanel.ScrolledPanel):
         if participant_panel is not None:
             participant_panel.stop_panel_emphasize()
 
+    def start_speaking_indicators(self):
+        self.speaking_indicators_timer.Start(SPEAKING_INDICATORS_INTERVAL)
+
+    def stop_speaking_indicators(self):
+        self.speaking_indicators_timer.Stop()
+        for participant_name in self.emphasized_participants_names:
+            self.stop_participant_panel_emphasize(participant_name)
+        self.emphasized_participants_names = set()
+
+    def update_speaking_indicators(self, event):
+        voice_chat = wx.GetApp().client.voice_chat
+        if voice_chat is None:
+            return
+        speaking_participants_names = set(voice_chat.voice_chat_server.get_speaking_participants_names())
+        for participant_name in speaking_participants_names - self.emphasized_participants_names:
+            self.emphasize_participant_panel(participant_name)
+        for participant_name in self.emphasized_participants_names - speaking_participants_names:
+            self.stop_participant_panel_emphasize(participant_name)
+        self.emphasized_participants_names = speaking_participants_names
+
     def set_participant_camera_image(self, participant_name, image_bytes):
         participant_panel = self.get_participant_panel_window(participant_name)
         if participant_panel is not None:
@@ -484,10 +511,22 @@ class ParticipantPanel(wx.Panel):
             self.camera_frame = PictureDisplayFrame(self, CAMERA_FRAME_TYPE, title=self.participant_name, size=DEFAULT_CAMERA_DISPLAY_SIZE)
             self.camera_frame.Show()
             self.show_camera_button.SetBackgroundColour((177, 255, 114))
+            self.update_camera_subscription()
         else:
             self.camera_frame.Restore()
             self.camera_frame.Raise()
 
+    def update_camera_subscription(self):
+        """
+        Subscribes to the layer of the participant's camera that fits the camera window, or to none of the layers
+        while the window is closed, so the participant only sends the camera when and how it is shown.
+        """
+        voice_chat = wx.GetApp().client.voice_chat
+        if voice_chat is None:
+            return
+        window_size = tuple(self.camera_frame.GetClientSize()) if self.camera_frame is not None else None
+        voice_chat.voice_chat_server.set_camera_window_size(self.participant_name, window_size)
+
     def set_camera_image(self, image_bytes):
         if self.camera_frame is not None:
             self.camera_frame.set_image(image_bytes)
@@ -501,9 +540,9 @@ class ParticipantPanel(wx.Panel):
             self.screen_frame.Restore()
             self.screen_frame.Raise()
 
-    def set_screen_share_image(self, image_bytes):
+    def set_screen_share_image(self, update_bytes):
         if self.screen_frame is not None:
-            self.screen_frame.set_image(image_bytes)
+            self.screen_frame.apply_screen_update(update_bytes)
 
     def change_participant_picture(self, picture_bytes):
         string_picture = StringIO.StringIO(picture_bytes)
@@ -641,6 +680,8 @@ class PictureDisplayFrame(wx.Frame):
     This panel uses double buffering in order to support quick changing of an image without
     flickering. It is used in order to show different data types that require changing images quickly,
     for example showing camera images or screen share images.
+    A shared screen arrives as updates that only hold the parts of the screen that changed, which are drawn over the
+    shown screen. Until the first keyframe arrives there is nothing to draw them over, so they are ignored.
     """
     def __init__(self, parent, frame_type, id=wx.ID_ANY, title="Discord > Skype (?)", pos=wx.DefaultPosition, size=wx.DefaultSize, style=wx.MINIMIZE_BOX|wx.RESIZE_BORDER|wx.SYSTEM_MENU|wx.CAPTION|wx.CLOSE_BOX|wx.CLIP_CHILDREN, name=wx.FrameNameStr):
         super(PictureDisplayFrame, self).__init__(parent, id, title, pos, size, style, name)
@@ -649,14 +690,26 @@ class PictureDisplayFrame(wx.Frame):
         self.Bind(wx.EVT_CLOSE, self.onClose, self)
         self.Bind(wx.EVT_PAINT, self.OnPaint)
         self.Bind(wx.EVT_ERASE_BACKGROUND, lambda evt: None)
+        if frame_type == CAMERA_FRAME_TYPE:
+            self.Bind(wx.EVT_SIZE, self.OnSize)
         self.SetMaxSize(size)
 
     def OnPaint(self, evt):
         if self.bitmap is not None:
             dc = wx.BufferedPaintDC(self)
             dc.Clear()
+            # The rate control of the sender lowers the resolution on slow networks, the picture still fills the frame.
+            client_width, client_height = self.GetClientSize()
+            bitmap_width, bitmap_height = self.bitmap.GetSize()
+            scale = min(float(client_width) / bitmap_width, float(client_height) / bitmap_height)
+            dc.SetUserScale(scale, scale)
             dc.DrawBitmap(self.bitmap, 0, 0)
 
+    def OnSize(self, evt):
+        evt.Skip()
+        self.Refresh()
+        self.GetParent().update_camera_subscription()
+
     def set_image(self, image_bytes):
         #image_bytes = self.get_resized_image_bytes(image_bytes)
         image_string = StringIO.StringIO(image_bytes)
@@ -664,6 +717,29 @@ class PictureDisplayFrame(wx.Frame):
         self.bitmap = image_bitmap
         self.Refresh()
 
+    def apply_screen_update(self, update_bytes):
+        try:
+            update_type, update_id, screen_size, positioned_pictures = parse_screen_update(update_bytes)
+        except ScreenUpdateException as e:
+            print "DEBUG - invalid screen update: " + str(e)
+            return
+        if update_type == KEYFRAME_UPDATE:
+            self.bitmap = None
+        elif self.bitmap is None or tuple(self.bitmap.GetSize()) != screen_size:
+            return  # the tiles of the update have no screen to be drawn over until a keyframe arrives
+        memory_dc = None
+        for x, y, picture_bytes in positioned_pictures:
+            picture_bitmap = wx.Image(StringIO.StringIO(picture_bytes)).ConvertToBitmap()
+            if self.bitmap is None:
+                self.bitmap = picture_bitmap
+                continue
+            if memory_dc is None:
+                memory_dc = wx.MemoryDC(self.bitmap)
+            memory_dc.DrawBitmap(picture_bitmap, x, y)
+        if memory_dc is not None:
+            memory_dc.SelectObject(wx.NullBitmap)
+        self.Refresh()
+
     def get_resized_image_bytes(self, image_bytes):  # not used right now
         image_save = BytesIO(image_bytes)
         image = Image.open(image_save)
@@ -679,6 +755,7 @@ class PictureDisplayFrame(wx.Frame):
         if self.frame_type == CAMERA_FRAME_TYPE:
             self.GetParent().camera_frame = None
             self.GetParent().show_camera_button.SetBackgroundColour(wx.NullColour)
+            self.GetParent().update_camera_subscription()
         elif self.frame_type == SCREEN_SHARE_FRAME_TYPE:
             self.GetParent().screen_frame = None
             self.GetParent().show_screen_share_button.SetBackgroundColour(wx.NullColour)
@@ -3,8 +3,12 @@
 import socket
 import Common_Elements
 from Voice_Chat import VoiceChat
+from Audio_Codecs import SUPPORTED_AUDIO_CODECS
+from Media_Header import create_media_source_id
 from threading import Thread
 import base64
+import hashlib
+import os
 import wx
 
 
@@ -13,6 +17,9 @@ PORT = 9999
 
 DEFAULT_GROUP_CALL_NAME_TEMPLATE = "{0} -> {1}"
 
+AVATAR_CACHE_FOLDER = os.path.join("UserImages", "AvatarCache")
+DEFAULT_AVATAR_PATH = os.path.join("UserImages", "DefaultProfile.png")
+
 
 class GroupCallDoesNotExistException(Exception):
     pass
@@ -35,13 +42,30 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         """
         client_socket - socket, the socket that connects the server and the client.
         the socket is automatically connecting to the constant server on initiation.
+        protocol_version - int, the protocol version that was negotiated with the server right after connecting.
 
         the function also starts the AESCipher which allows the CommunicationHandler to encrypt/decrypt messages.
         """
-        super(Common_Elements.BasicCommunicator, self).__init__()
+        super(CommunicationHandler, self).__init__()
         self.client_socket = socket.socket()
         self.client_socket.connect((SERVER_IP, PORT))
-        self.cipher = Common_Elements.AESCipher()  # prevent crash
+        self.protocol_version = self.negotiate_protocol_version()
+
+    def negotiate_protocol_version(self):
+        """
+        Offers the server the protocol versions that the client supports and waits for the server's choice.
+        Every message after the server's answer uses the framing mode of the chosen version.
+        Raises UnsupportedProtocolVersionException if the server does not support any of them.
+        :return: int, the chosen protocol version.
+        """
+        self.send_message(Common_Elements.RequestProtocolVersionMessage(Common_Elements.SUPPORTED_PROTOCOL_VERSIONS))
+        protocol_version_message = self.receive_full_message(self.client_socket)
+        if not isinstance(protocol_version_message, Common_Elements.ProtocolVersionMessage) or \
+                protocol_version_message.protocol_version not in Common_Elements.SUPPORTED_PROTOCOL_VERSIONS:
+            self.client_socket.close()
+            raise Common_Elements.UnsupportedProtocolVersionException()
+        self.framing = Common_Elements.PROTOCOL_VERSION_FRAMING_DICT[protocol_version_message.protocol_version]
+        return protocol_version_message.protocol_version
 
     def send_message(self, message):
         """
@@ -153,16 +177,17 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         leave_group_message = Common_Elements.LeaveGroupMessage(call_name, other_group_members_names)
         self.send_message(leave_group_message)
 
-    def attempt_logging_in(self, username, password):
+    def attempt_logging_in(self, username, password, media_source_id):
         """
         Attempts to log into the server with the given username and password and returns
         the server response.
         :param username: str, the username.
         :param password: str, the password
+        :param media_source_id: int, the source id of the client's media packets in calls.
         :return: SuccessfulLoginMessage or LoginFailedMessage, the response of the server to the
         login attempt (either successful or failed attempt).
         """
-        login_message = Common_Elements.LoginMessage(username, password)
+        login_message = Common_Elements.LoginMessage(username, password, SUPPORTED_AUDIO_CODECS, media_source_id)
         self.send_message(login_message)
         response = self.receive_full_message(self.client_socket)  # waiting for answer from the server
         return response
@@ -248,6 +273,14 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         send_chat_text_message = Common_Elements.SendChatTextMessage(chat_name, chat_participants_list, send_time, message)
         self.send_message(send_chat_text_message)
 
+    def request_pictures(self, digest_owner_dict):
+        """
+        Asks the server for profile pictures that are not in the avatar cache.
+        :param digest_owner_dict: {str:str}, the digests of the missing pictures and the names of their owners.
+        """
+        request_pictures_message = Common_Elements.RequestPicturesMessage(digest_owner_dict)
+        self.send_message(request_pictures_message)
+
     def send_chat_picture_message(self, chat_name, chat_participants_list, send_time, encoded_picture_bytes):
         """
         Sends a picture message to a given chat.
@@ -260,6 +293,66 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         self.send_message(send_chat_picture_message)
 
 
+class AvatarCache(object):
+    """
+    A disk cache of profile pictures, stored by the digests of their content.
+    The server only sends the digest of a user's picture, so a picture is downloaded once and
+    then reused by every contact and participant that has it, across logins.
+    """
+    def __init__(self, folder=AVATAR_CACHE_FOLDER):
+        """
+        Constructs the cache and creates its folder if it does not exist.
+        :param folder: str, the folder in which the pictures are saved.
+        """
+        self.folder = folder
+        if not os.path.isdir(self.folder):
+            os.makedirs(self.folder)
+
+    def get_picture_path(self, digest):
+        """
+        :param digest: str, the sha1 hex digest of a picture.
+        :return: str, the path in which the picture is saved.
+        """
+        return os.path.join(self.folder, digest + ".png")
+
+    def has_picture(self, digest):
+        """
+        :param digest: str, the sha1 hex digest of a picture.
+        :return: True if the picture is saved in the cache, else False.
+        """
+        return os.path.isfile(self.get_picture_path(digest))
+
+    def get_picture_bytes(self, digest):
+        """
+        Reads a picture from the cache. Returns the default profile picture if the picture is not cached yet.
+        :param digest: str, the sha1 hex digest of the picture.
+        :return: str, the bytes of the picture.
+        """
+        picture_path = self.get_picture_path(digest)
+        if not os.path.isfile(picture_path):
+            picture_path = DEFAULT_AVATAR_PATH
+        with open(picture_path, "rb") as picture_file:
+            return picture_file.read()
+
+    def save_picture(self, digest, picture_bytes):
+        """
+        Saves a picture in the cache. Pictures whose bytes do not match their digest are ignored.
+        :param digest: str, the sha1 hex digest of the picture.
+        :param picture_bytes: str, the bytes of the picture.
+        :return: True if the picture is in the cache, else False.
+        """
+        if hashlib.sha1(picture_bytes).hexdigest() != digest:
+            print "DEBUG - received a picture that does not match its digest"
+            return False
+        picture_path = self.get_picture_path(digest)
+        if not os.path.isfile(picture_path):
+            temporary_path = picture_path + ".tmp"
+            with open(temporary_path, "wb") as picture_file:
+                picture_file.write(picture_bytes)
+            os.rename(temporary_path, picture_path)  # a half written picture is never read
+        return True
+
+
 class MainClient(object):
     """
     This class represents the client of the main server.
@@ -277,6 +370,9 @@ class MainClient(object):
         and the CallGroup objects as values.
         *calling_username - str or None - name of the user who is currently being called by this client, or None
         if the client is not calling anyone right now.
+        *avatar_cache - AvatarCache, the profile pictures that were already downloaded.
+        *username_picture_digest_dict - {str:str}, the digest of the current profile picture of every known user.
+        *media_source_id - int, identifies the client's media packets in calls.
         """
         self.communication_handler = CommunicationHandler()
         self.username = None
@@ -285,6 +381,9 @@ class MainClient(object):
         self.voice_chat = None
         self.name_call_group_dict = {}  # {call_name: ActiveCallGroup}
         self.username_contact_dict = {}
+        self.avatar_cache = AvatarCache()
+        self.username_picture_digest_dict = {}  # {username: picture digest}
+        self.media_source_id = create_media_source_id()
 
     def is_in_call(self):
         """
@@ -306,19 +405,70 @@ class MainClient(object):
         :param username: str, the name that the client entered.
         :param password: str, the password that the client entered.
         """
-        server_response = self.communication_handler.attempt_logging_in(username, password)
+        server_response = self.communication_handler.attempt_logging_in(username, password, self.media_source_id)
         if isinstance(server_response, Common_Elements.SuccessfulLoginMessage):
             self.username = username
+            username_digest_dict = {username: server_response.user_picture_digest}
+            for contact_info in server_response.contacts_info_list:
+                username_digest_dict[contact_info.contact_name] = contact_info.picture_digest
+            self.fetch_missing_pictures(username_digest_dict)  # a single request for all the pictures of the login
             self.receive_thread = Thread(target=self.receive_from_server)
             self.receive_thread.start()
             wx.GetApp().switch_to_main_program_frame()
-            user_picture_bytes = base64.b64decode(server_response.user_encoded_picture_bytes)
+            user_picture_bytes = self.get_user_picture_bytes(username)
             wx.CallAfter(wx.GetApp().program_frame.secondary_panel.set_profile_picture, user_picture_bytes)
             self.add_pending_contacts(server_response.pending_contacts_list)
             self.add_contacts(server_response.contacts_info_list)
         elif isinstance(server_response, Common_Elements.LoginFailedMessage):
             wx.CallAfter(wx.GetApp().login_frame.panel.display_error_message, server_response.message)
 
+    def fetch_missing_pictures(self, username_digest_dict):
+        """
+        Records the current picture digests of users and asks the server for the pictures that are not cached.
+        :param username_digest_dict: {str:str}, names of users and the digests of their profile pictures.
+        """
+        digest_owner_dict = {}
+        for username, digest in username_digest_dict.iteritems():
+            self.username_picture_digest_dict[username] = digest
+            if not self.avatar_cache.has_picture(digest):
+                digest_owner_dict[digest] = username
+        if digest_owner_dict:
+            self.communication_handler.request_pictures(digest_owner_dict)
+
+    def get_user_picture_bytes(self, username):
+        """
+        Gets the current profile picture of a user from the avatar cache.
+        Returns the default profile picture if the picture was not received yet.
+        :param username: str, the name of the user.
+        :return: str, the bytes of the picture.
+        """
+        return self.avatar_cache.get_picture_bytes(self.username_picture_digest_dict.get(username, ""))
+
+    def handle_pictures_message(self, pictures_message):
+        """
+        Saves the pictures that the server sent and shows them for every user whose current picture they are.
+        :param pictures_message: PicturesMessage, the message that contains the pictures.
+        """
+        received_digests = set()
+        for digest, encoded_picture_bytes in pictures_message.digest_encoded_picture_dict.iteritems():
+            if self.avatar_cache.save_picture(digest, base64.b64decode(encoded_picture_bytes)):
+                received_digests.add(digest)
+        for username, digest in self.username_picture_digest_dict.items():
+            if digest in received_digests:
+                self.show_user_picture(username)
+
+    def show_user_picture(self, username):
+        """
+        Shows the current profile picture of a user everywhere it appears in the GUI.
+        :param username: str, the name of the user - this client, a contact or a voice chat participant.
+        """
+        picture_bytes = self.get_user_picture_bytes(username)
+        if username == self.username:
+            wx.CallAfter(wx.GetApp().program_frame.secondary_panel.set_profile_picture, picture_bytes)
+        if username in self.username_contact_dict:
+            self.username_contact_dict[username].change_contact_picture(picture_bytes)
+        self.change_in_call_participant_picture(username, picture_bytes)
+
     def register_as_new_user(self, username, password):
         """
         Registers to the server as a new user.
@@ -427,6 +577,8 @@ class MainClient(object):
                     self.voice_chat.voice_chat_server.handle_pickled_voice_chat_messages(message)
                 elif isinstance(message, Common_Elements.UserInformationMessage):
                     wx.CallAfter(wx.GetApp().program_frame.main_panel.home_page_panel.display_user_information, message.username, message.does_exist, message.is_online, message.encoded_picture_bytes)
+                elif isinstance(message, Common_Elements.PicturesMessage):
+                    self.handle_pictures_message(message)
                 elif isinstance(message, Common_Elements.PopupMessage):
                     wx.CallAfter(wx.GetApp().pop_up_message, message.message)
             except socket.error:
@@ -477,7 +629,8 @@ class MainClient(object):
         elif isinstance(message, Common_Elements.ContactWentOfflineMessage):
             wx.CallAfter(wx.GetApp().program_frame.contact_name_chat_panel_dict[message.contact_name].contact_went_offline)
         elif isinstance(message, Common_Elements.ContactChangedPictureMessage):
-            self.username_contact_dict[message.contact_name].change_contact_picture(message.encoded_picture_bytes)
+            self.fetch_missing_pictures({message.contact_name: message.picture_digest})
+            self.show_user_picture(message.contact_name)
         elif isinstance(message, Common_Elements.DeleteContactMessage):
             self.delete_contact(message.contact_name)
 
@@ -495,8 +648,9 @@ class MainClient(object):
         Adds contacts to the clients contacts list and updates them in the GUI.
         :param contacts_info_list: [ContactInfo], a list of objects that contain information about the new contacts.
         """
+        self.fetch_missing_pictures(dict((contact_info.contact_name, contact_info.picture_digest) for contact_info in contacts_info_list))
         for contact_info in contacts_info_list:
-            contact_picture_bytes = base64.b64decode(contact_info.encoded_picture_bytes)
+            contact_picture_bytes = self.get_user_picture_bytes(contact_info.contact_name)
             self.username_contact_dict[contact_info.contact_name] = Contact(contact_info.contact_name, contact_info.is_connected, contact_picture_bytes)
             wx.CallAfter(wx.GetApp().program_frame.add_new_contact_chat, self.username_contact_dict[contact_info.contact_name])
             wx.CallAfter(wx.GetApp().program_frame.secondary_panel.delete_choice_from_pending_contact_listbox, contact_info.contact_name)
@@ -551,6 +705,10 @@ class MainClient(object):
             elif isinstance(message, Common_Elements.AddParticipantToCallMessage):
                 self.add_participant_to_voice_chat(message.voice_chat_peer, message.active_call_group_name)
                 self.update_called_user_information()
+            elif isinstance(message, Common_Elements.UseMediaRelayMessage):
+                self.use_media_relay(message.active_call_group_name, message.relay_port)
+            elif isinstance(message, Common_Elements.UseAudioMixerMessage):
+                self.use_audio_mixer(message.active_call_group_name, message.mixer_source_id)
             elif isinstance(message, Common_Elements.CallRejectedMessage):
                 wx.CallAfter(wx.GetApp().cancel_calling_dialog)
             elif isinstance(message, Common_Elements.CallingFailedMessage):
@@ -560,20 +718,21 @@ class MainClient(object):
             elif isinstance(message, Common_Elements.GroupMemberRequestedJoinMessage):
                 self.allow_group_member_to_join_voice_chat(message.call_name, message.requesting_username)
             elif isinstance(message, Common_Elements.ParticipantChangedPictureMessage):
-                self.change_in_call_participant_picture(message.participant_username, message.encoded_picture_bytes)
+                self.fetch_missing_pictures({message.participant_username: message.picture_digest})
+                self.show_user_picture(message.participant_username)
         except GroupCallDoesNotExistException:
             pass
         except UserIsNotInCallGroupException:
             pass
 
-    def change_in_call_participant_picture(self, participant_username, new_encoded_picture_bytes):
+    def change_in_call_participant_picture(self, participant_username, new_picture_bytes):
         """
         changes the picture of a voice chat participant in the GUI.
         :param participant_username: str, the name of the participant.
-        :param new_encoded_picture_bytes: str, the bytes of the picture encoded in base64.
+        :param new_picture_bytes: str, the bytes of the picture.
         """
         if self.is_in_call() and participant_username in self.voice_chat.voice_chat_client.get_participants_names_list():
-            wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.set_participant_picture, participant_username, new_encoded_picture_bytes)
+            wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.set_participant_picture, participant_username, new_picture_bytes)
 
     def start_new_voice_chat(self, start_call_message):
         """
@@ -671,13 +830,35 @@ class MainClient(object):
         """
         if self.voice_chat is not None and self.voice_chat.active_call_group_name == active_call_group_name:
             peer = voice_chat_peer
-            self.voice_chat.add_participant(peer.username, peer.ip, peer.voice_ports_pair, peer.screen_ports_pair, peer.camera_ports_pair)
-            participant_picture_bytes = base64.b64decode(peer.peer_encoded_picture_bytes)
+            self.voice_chat.add_participant(peer.username, peer.ip, peer.media_ports_pair, peer.peer_media_source_id, peer.peer_audio_codecs)
+            self.fetch_missing_pictures({peer.username: peer.peer_picture_digest})
+            participant_picture_bytes = self.get_user_picture_bytes(peer.username)
             wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.add_participant_panel, peer.username, participant_picture_bytes)
             if peer.username == self.calling_username:
                 wx.CallAfter(wx.GetApp().destroy_call_dialog)
             print "DEBUG - STARTED CALL WITH " + peer.username  # + " sending info to: " + str((peer.ip, peer.send_to_port)) + " receiving from port: " + str(peer.receive_port)
 
+    def use_media_relay(self, active_call_group_name, relay_port):
+        """
+        Sends the media of the current voice chat through the server's media relay, since the call is large.
+        :param active_call_group_name: str, the name of the voice chat's call group.
+        :param relay_port: int, the port of the media relay.
+        """
+        if self.voice_chat is not None and self.voice_chat.active_call_group_name == active_call_group_name:
+            self.voice_chat.communication_handler.relay_address = (SERVER_IP, relay_port)
+            print "DEBUG - SENDING MEDIA THROUGH THE MEDIA RELAY"
+
+    def use_audio_mixer(self, active_call_group_name, mixer_source_id):
+        """
+        Plays the voice of the current voice chat as a single stream that the server's media relay mixes,
+        since the call is very large.
+        :param active_call_group_name: str, the name of the voice chat's call group.
+        :param mixer_source_id: int, the source id of the mixed voice packets.
+        """
+        if self.voice_chat is not None and self.voice_chat.active_call_group_name == active_call_group_name:
+            self.voice_chat.use_audio_mixer(mixer_source_id)
+            print "DEBUG - PLAYING THE MIXED VOICE OF THE CALL"
+
     def close_client(self):
         """
         Fully closes the client by closing the connection with the main server
@@ -809,12 +990,12 @@ class Contact(ChatHostObject):
         self.is_connected = is_connected
         self.picture_bytes = picture_bytes
 
-    def change_contact_picture(self, new_encoded_picture_bytes):
+    def change_contact_picture(self, new_picture_bytes):
         """
         Changes the contact's picture.
-        :param new_encoded_picture_bytes: the bytes of the new picture encoded in base64.
+        :param new_picture_bytes: str, the bytes of the new picture.
         """
-        self.picture_bytes = base64.b64decode(new_encoded_picture_bytes)
+        self.picture_bytes = new_picture_bytes
         wx.CallAfter(wx.GetApp().program_frame.contact_name_chat_panel_dict[self.username].change_contact_picture, self.picture_bytes)
 
     def get_chat_name(self):
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 
-import pickle
+import os
+import socket
 import string
+import struct
 from Crypto.Cipher import AES
 from hashlib import md5
+from Message_Codec import MessageCodec, MessageCodecException, ListOf, DictOf, Optional, INT_FIELD, TEXT_FIELD, \
+    BOOL_FIELD
 
 #  ----------------CONSTANTS-----------------#
 LEN_OF_LENGTH = 10
+RECEIVE_BUFFER_SIZE = 65536
 USERNAME_MIN_LENGTH = 3
 USERNAME_MAX_LENGTH = 16
 USERNAME_ALLOWED_CHARACTERS = list(string.ascii_letters) + list(string.digits) + ["_"]
@@ -14,6 +19,24 @@ PASSWORD_MIN_LENGTH = 3
 PASSWORD_MAX_LENGTH = 16
 PASSWORD_ALLOWED_CHARACTERS = list(string.ascii_letters) + list(string.digits) + ["_"]
 
+# ---------------PROTOCOL---------------#
+PROTOCOL_VERSION = 7
+# versions 1 and 2 sent the full profile pictures instead of digests, version 3 did not announce audio codecs,
+# version 4 gave every peer three pairs of ports instead of a single port for all the media of a call,
+# version 5 had no media relay for large calls, version 6 did not mix the voice of very large calls.
+SUPPORTED_PROTOCOL_VERSIONS = [PROTOCOL_VERSION]
+MESSAGE_END_SIGN = "."  # ends every encoded message so the padding of the cipher is never confused with its last bytes
+
+# Framing modes. Every connection starts with ASCII framing, which is used for the protocol version negotiation,
+# and switches to the framing of the negotiated version right after it.
+ASCII_FRAMING = "ascii"  # zero-filled decimal length header, only the last bytes of the message are encrypted
+BINARY_FRAMING = "binary"  # 4 bytes length header, a nonce and then the whole message encrypted by AES-CTR
+# The framing of every supported version after the negotiation. Version 1 was the last one that kept ASCII framing.
+PROTOCOL_VERSION_FRAMING_DICT = dict((version, BINARY_FRAMING) for version in SUPPORTED_PROTOCOL_VERSIONS)
+BINARY_LENGTH_HEADER_STRUCT = struct.Struct(">I")
+CTR_NONCE_SIZE = 8
+MAX_FRAME_LENGTH = 32 * 1024 * 1024  # longer frames are refused before their bytes are buffered
+
 
 # ---------------ENCRYPTION---------------#
 ENC_KEY = md5("SOMEBODY ORDERED A BOMB?!?!").hexdigest()
@@ -66,6 +89,23 @@ class AESCipher(object):
         original_message = encrypted_message[:encrypted_message.find(START_ENCRYPTION_SIGN)] + decrypted_last_bytes
         return original_message
 
+    def decrypt_message_prefix(self, encrypted_message, prefix_length):
+        """
+        Decrypts only the first bytes of a message that was encrypted by encrypt_message, which is much cheaper than
+        decrypting all of it - the first bytes are either not encrypted, or are the first blocks of the encrypted
+        bytes, which are encrypted block by block.
+        :param encrypted_message: str, the encrypted message.
+        :param prefix_length: int, the number of bytes to decrypt, a multiple of the AES block size.
+        :return: str, the first bytes of the original message.
+        """
+        not_encrypted_length = encrypted_message.find(START_ENCRYPTION_SIGN)
+        if not_encrypted_length == 0:
+            encrypted_prefix = encrypted_message[len(START_ENCRYPTION_SIGN):len(START_ENCRYPTION_SIGN) + prefix_length]
+            return self.encryption_suite.decrypt(encrypted_prefix)
+        if not_encrypted_length >= prefix_length:
+            return encrypted_message[:prefix_length]
+        return self.decrypt_message(encrypted_message)[:prefix_length]
+
     def decrypt_string(self, encrypted_str):
         """
         Fully decrypts a string.
@@ -76,6 +116,102 @@ class AESCipher(object):
         decrypted_str = decrypted_str.rstrip(PADDING_CHAR)
         return decrypted_str
 
+    def encrypt_stream_into(self, original_message, output_buffer, nonce):
+        """
+        Fully encrypts a message using AES-CTR and writes the encrypted bytes straight into a given buffer.
+        CTR mode needs no padding, so the encrypted message has exactly the length of the original message.
+        :param original_message: str, the message that needs to be encrypted.
+        :param output_buffer: memoryview, a writable buffer with the length of the message.
+        :param nonce: str, CTR_NONCE_SIZE bytes that should never be used twice.
+        """
+        AES.new(ENC_KEY, AES.MODE_CTR, nonce=nonce).encrypt(original_message, output=output_buffer)
+
+    def decrypt_stream_in_place(self, encrypted_buffer, nonce):
+        """
+        Fully decrypts a message that was encrypted by encrypt_stream_into, without copying it.
+        :param encrypted_buffer: bytearray or memoryview, the encrypted bytes. They are replaced by the original bytes.
+        :param nonce: str, the nonce that the message was encrypted with.
+        """
+        AES.new(ENC_KEY, AES.MODE_CTR, nonce=nonce).decrypt(encrypted_buffer, output=encrypted_buffer)
+
+
+class InvalidFrameException(Exception):
+    pass
+
+
+class UnsupportedProtocolVersionException(Exception):
+    pass
+
+
+class FrameDecoder(object):
+    """
+    An incremental decoder of the frames of the BasicCommunicator protocol (a length header and then the message).
+    Every connection has its own decoder with its own receive buffer. The decoder consumes whatever bytes
+    are available and only returns frames that were fully received, so a partial frame never blocks the receiver.
+    """
+    def __init__(self):
+        """
+        receive_buffer - bytearray, the received bytes that are not a part of a complete frame yet.
+        framing - str, the framing mode of the connection, ASCII_FRAMING or BINARY_FRAMING.
+        """
+        self.receive_buffer = bytearray()
+        self.framing = ASCII_FRAMING
+
+    def feed(self, data):
+        """
+        Adds received bytes to the receive buffer.
+        :param data: str, bytes that were received from the connection.
+        """
+        self.receive_buffer.extend(data)
+
+    def get_complete_frames(self):
+        """
+        Takes all the complete frames out of the receive buffer.
+        Raises InvalidFrameException if the length header of a frame is not a valid length, or is longer than
+        MAX_FRAME_LENGTH.
+        :return: [str] in ASCII framing or [bytearray] in binary framing, the contents of the complete frames
+        (without their length headers).
+        """
+        if self.framing == BINARY_FRAMING:
+            return self.get_complete_binary_frames()
+        frames = []
+        frame_start = 0
+        while len(self.receive_buffer) - frame_start >= LEN_OF_LENGTH:
+            length_header = str(self.receive_buffer[frame_start:frame_start + LEN_OF_LENGTH])
+            if not length_header.isdigit() or int(length_header) > MAX_FRAME_LENGTH:
+                raise InvalidFrameException()
+            message_start = frame_start + LEN_OF_LENGTH
+            message_end = message_start + int(length_header)
+            if len(self.receive_buffer) < message_end:
+                break
+            frames.append(str(self.receive_buffer[message_start:message_end]))
+            frame_start = message_end
+        del self.receive_buffer[:frame_start]
+        return frames
+
+    def get_complete_binary_frames(self):
+        """
+        Takes all the complete binary frames out of the receive buffer.
+        Each frame is copied out of the buffer once, into a bytearray that can be decrypted in place.
+        Raises InvalidFrameException if the length header of a frame is shorter than a nonce or longer than
+        MAX_FRAME_LENGTH.
+        :return: [bytearray], the contents of the complete frames (the nonce and the encrypted message).
+        """
+        frames = []
+        frame_start = 0
+        while len(self.receive_buffer) - frame_start >= BINARY_LENGTH_HEADER_STRUCT.size:
+            message_length = BINARY_LENGTH_HEADER_STRUCT.unpack_from(self.receive_buffer, frame_start)[0]
+            if message_length < CTR_NONCE_SIZE or message_length > MAX_FRAME_LENGTH:
+                raise InvalidFrameException()
+            message_start = frame_start + BINARY_LENGTH_HEADER_STRUCT.size
+            message_end = message_start + message_length
+            if len(self.receive_buffer) < message_end:
+                break
+            frames.append(self.receive_buffer[message_start:message_end])
+            frame_start = message_end
+        del self.receive_buffer[:frame_start]
+        return frames
+
 
 class BasicCommunicator(object):
     """
@@ -83,13 +219,17 @@ class BasicCommunicator(object):
     using a more reliable protocol than a normal send/receive socket functions.
     The protocol makes sure that the whole message gets receives by the receiving side
     whenever a message is sent by first sending the message length and then the message itself.
-    It also allows non-string objects to be sent.
+    It also allows non-string objects to be sent - the messages are encoded by the MessageCodec, so only
+    basic values and the classes of MESSAGE_TYPES_REGISTRY can be sent.
     """
     def __init__(self):
         """
         Constructs a BasicCommunicator and starts its AES Cipher.
+        framing - str, the framing mode that is used by send_full_message and receive_full_message.
+        Starts as ASCII_FRAMING and is switched after the protocol version is negotiated.
         """
         self.cipher = AESCipher()
+        self.framing = ASCII_FRAMING
 
     def receive_message_by_length(self, client_socket, message_length):
         """
@@ -101,7 +241,10 @@ class BasicCommunicator(object):
         """
         message = ""
         while len(message) != message_length:
-            message += client_socket.recv(message_length - len(message))
+            data = client_socket.recv(message_length - len(message))
+            if not data:
+                raise socket.error("Connection closed by the other side")
+            message += data
         return message
 
     def receive_full_message(self, client_socket):
@@ -111,13 +254,76 @@ class BasicCommunicator(object):
 
         This function receives a full message without needing to know anything about it in advance
         using the protocol described in the class documentation.
+        Raises InvalidFrameException if the message is longer than MAX_FRAME_LENGTH.
+        """
+        if self.framing == BINARY_FRAMING:
+            length_header = self.receive_message_by_length(client_socket, BINARY_LENGTH_HEADER_STRUCT.size)
+            message_length = BINARY_LENGTH_HEADER_STRUCT.unpack(length_header)[0]
+            if message_length > MAX_FRAME_LENGTH:
+                raise InvalidFrameException()
+            message = self.receive_message_into_buffer(client_socket, message_length)
+        else:
+            message_length = int(self.receive_message_by_length(client_socket, LEN_OF_LENGTH))
+            if message_length > MAX_FRAME_LENGTH:
+                raise InvalidFrameException()
+            message = self.receive_message_by_length(client_socket, message_length)
+        return self.decode_message(message, self.framing)
+
+    def receive_message_into_buffer(self, client_socket, message_length):
+        """
+        :param client_socket: socket - the socket which connects two entities.
+        :param message_length: int - the length of the message that should be received.
+        :returns: bytearray - the full message with the given length.
+
+        This function fully receives a message with an already known length straight into a single buffer,
+        without joining the received parts together.
+        """
+        message = bytearray(message_length)
+        message_view = memoryview(message)
+        received_bytes_num = 0
+        while received_bytes_num != message_length:
+            data_length = client_socket.recv_into(message_view[received_bytes_num:])
+            if not data_length:
+                raise socket.error("Connection closed by the other side")
+            received_bytes_num += data_length
+        return message
+
+    def decode_message(self, encrypted_message, framing=ASCII_FRAMING):
         """
-        message_length = int(self.receive_message_by_length(client_socket, LEN_OF_LENGTH))
-        message = self.receive_message_by_length(client_socket, message_length)
-        message = self.cipher.decrypt_message(message)
-        message = pickle.loads(message)
+        :param encrypted_message: str (ASCII framing) or bytearray (binary framing) - the content of a single frame.
+        :param framing: str - the framing mode of the frame.
+        :returns: any object, the message that the frame contains.
+
+        This function decrypts the content of a frame and turns it back into the object that was sent.
+        Raises InvalidFrameException if the content of the frame cannot be decoded.
+        """
+        if framing == BINARY_FRAMING:
+            return self.decode_binary_message(encrypted_message)
+        try:
+            message = self.cipher.decrypt_message(encrypted_message)
+            if not message.endswith(MESSAGE_END_SIGN):
+                raise InvalidFrameException()
+            message = MESSAGE_CODEC.decode(message[:-len(MESSAGE_END_SIGN)])
+        except (ValueError, MessageCodecException):
+            raise InvalidFrameException()
         return message
 
+    def decode_binary_message(self, frame):
+        """
+        :param frame: bytearray - the content of a single binary frame, the nonce and then the encrypted message.
+        :returns: any object, the message that the frame contains.
+
+        This function decrypts the message in place and decodes it straight from the frame's buffer.
+        Raises InvalidFrameException if the content of the frame cannot be decoded.
+        """
+        nonce = str(frame[:CTR_NONCE_SIZE])
+        encrypted_message = memoryview(frame)[CTR_NONCE_SIZE:]
+        self.cipher.decrypt_stream_in_place(encrypted_message, nonce)
+        try:
+            return MESSAGE_CODEC.decode(frame, CTR_NONCE_SIZE)
+        except MessageCodecException:
+            raise InvalidFrameException()
+
     def send_full_message(self, client_socket, message):
         """
         :param client_socket: socket - the socket which connects two entities.
@@ -126,19 +332,48 @@ class BasicCommunicator(object):
         This function sends a full message to the other side using the protocol
         described in the class documentation.
         """
-        message = pickle.dumps(message)
+        client_socket.sendall(self.encode_frame(message, self.framing))
+
+    def encode_frame(self, message, framing=ASCII_FRAMING):
+        """
+        :param message: any object - the object that needs to be sent.
+        :param framing: str - the framing mode of the connection that the frame is sent through.
+        :returns: str (ASCII framing) or bytearray (binary framing) - the full frame of the message,
+        its length header followed by the encrypted message.
+
+        This function builds the frame that is sent by send_full_message. The length header and the message
+        are joined into a single buffer so a frame can be sent using a single send call.
+        """
+        if framing == BINARY_FRAMING:
+            return self.encode_binary_frame(message)
+        message = MESSAGE_CODEC.encode(message) + MESSAGE_END_SIGN
         encrypted_message = self.cipher.encrypt_message(message)
-        client_socket.send(str(len(encrypted_message)).zfill(LEN_OF_LENGTH))
-        client_socket.send(encrypted_message)
+        return str(len(encrypted_message)).zfill(LEN_OF_LENGTH) + encrypted_message
+
+    def encode_binary_frame(self, message):
+        """
+        :param message: any object - the object that needs to be sent.
+        :returns: bytearray - the full binary frame of the message.
+
+        The frame is allocated once and the encrypted message is written straight into it, so the encoded message
+        is never copied after it is encoded.
+        """
+        encoded_message = MESSAGE_CODEC.encode(message)
+        message_length = CTR_NONCE_SIZE + len(encoded_message)
+        nonce = os.urandom(CTR_NONCE_SIZE)
+        frame = bytearray(BINARY_LENGTH_HEADER_STRUCT.size + message_length)
+        BINARY_LENGTH_HEADER_STRUCT.pack_into(frame, 0, message_length)
+        message_start = BINARY_LENGTH_HEADER_STRUCT.size + CTR_NONCE_SIZE
+        frame[BINARY_LENGTH_HEADER_STRUCT.size:message_start] = nonce
+        self.cipher.encrypt_stream_into(encoded_message, memoryview(frame)[message_start:], nonce)
+        return frame
 
 
 class CommunicationPortsPair(object):
     """
     This call contains a pair of ports that allow p2p communication between two users.
-    Each pair of ports represents two ports that connect between two users and allows them to send
-    and receive a specific type of data. The send_to_port of the first user is the receive_port of
-    the second user and vice versa, and thus the users can transfer some kind of data through known
-    addresses.
+    The send_to_port is the port of the peer's call socket and the receive_port is the port of the user's own
+    call socket, which is the same for all the peers of a call.
     """
     def __init__(self, send_to_port, receive_port):
         self.send_to_port = send_to_port
@@ -150,31 +385,32 @@ class VoiceChatPeer(object):
     Represents a peer in a p2p connection. Contains all the necessary information for
     starting a p2p connection.
     """
-    def __init__(self, username, ip, voice_ports_pair, screen_ports_pair, camera_ports_pair, peer_encoded_picture_bytes):
+    def __init__(self, username, ip, media_ports_pair, peer_picture_digest, peer_audio_codecs, peer_media_source_id):
         """
         *username - the username of the peer
         *ip - the ip of the peer
-        *voice_ports_pair - PortsPair, a pair of ports to send and receive voice data.
-        *screen_ports_pair - PortsPair, a pair of ports to send and receive screen data.
-        *camera_ports_pair - PortsPair, a pair of ports to send and receive camera data.
-        *peer_encoded_picture_bytes - str, the bytes of the peer's profile picture encoded in base64.
+        *media_ports_pair - PortsPair, the ports of the call sockets that all the media of the call is sent between.
+        *peer_picture_digest - str, the digest of the peer's profile picture.
+        *peer_audio_codecs - [str], the names of the audio codecs that the peer can decode.
+        *peer_media_source_id - int, the source id in the media headers of the peer's packets.
         """
         self.username = username
         self.ip = ip
-        self.voice_ports_pair = voice_ports_pair
-        self.screen_ports_pair = screen_ports_pair
-        self.camera_ports_pair = camera_ports_pair
-        self.peer_encoded_picture_bytes = peer_encoded_picture_bytes
+        self.media_ports_pair = media_ports_pair
+        self.peer_picture_digest = peer_picture_digest
+        self.peer_audio_codecs = peer_audio_codecs
+        self.peer_media_source_id = peer_media_source_id
 
 
 class ContactInfo(object):
     """
     A data structure that contains information on a contact.
+    The contact's profile picture is identified by its digest, clients request the pictures that they don't have.
     """
-    def __init__(self, contact_name, is_connected, encoded_picture_bytes):
+    def __init__(self, contact_name, is_connected, picture_digest):
         self.contact_name = contact_name
         self.is_connected = is_connected
-        self.encoded_picture_bytes = encoded_picture_bytes
+        self.picture_digest = picture_digest
 
 
 class InputValidator(object):
@@ -395,13 +631,13 @@ class ContactChangedPictureMessage(ContactMessage):
     """
     Informs a client that his contact changed his profile picture.
     """
-    def __init__(self, contact_name, encoded_picture_bytes):
+    def __init__(self, contact_name, picture_digest):
         """
         :param contact_name: str, name of the contact.
-        :param encoded_picture_bytes: str, bytes of the new picture encoded in base64.
+        :param picture_digest: str, the digest of the new picture.
         """
         self.contact_name = contact_name
-        self.encoded_picture_bytes = encoded_picture_bytes
+        self.picture_digest = picture_digest
 
 
 # Call messages
@@ -551,6 +787,26 @@ class AddParticipantToCallMessage(CallMessage):
         self.active_call_group_name = active_call_group_name
 
 
+class UseMediaRelayMessage(CallMessage):
+    """
+    Tells a participant of a large call to send its media once, to the server's media relay, instead of
+    sending it to every other participant.
+    """
+    def __init__(self, active_call_group_name, relay_port):
+        self.active_call_group_name = active_call_group_name
+        self.relay_port = relay_port
+
+
+class UseAudioMixerMessage(CallMessage):
+    """
+    Tells a participant of a very large call that the media relay mixes the voice of the call, so the participant
+    gets a single voice stream, whose packets have the mixer's source id.
+    """
+    def __init__(self, active_call_group_name, mixer_source_id):
+        self.active_call_group_name = active_call_group_name
+        self.mixer_source_id = mixer_source_id
+
+
 class CallRejectedMessage(CallMessage):
     """
     Informs a user about a call reject.
@@ -586,9 +842,32 @@ class ParticipantChangedPictureMessage(CallMessage):
     """
     Informs a user that a participant in his voice chat changed his profile pictrue.
     """
-    def __init__(self, participant_username, encoded_picture_bytes):
+    def __init__(self, participant_username, picture_digest):
         self.participant_username = participant_username
-        self.encoded_picture_bytes = encoded_picture_bytes
+        self.picture_digest = picture_digest
+
+
+# Pictures Messages
+class RequestPicturesMessage(Message):
+    """
+    Asks the server for profile pictures that the client doesn't have yet.
+    """
+    def __init__(self, digest_owner_dict):
+        """
+        :param digest_owner_dict: {str:str}, the digests of the missing pictures and the names of their owners.
+        """
+        self.digest_owner_dict = digest_owner_dict
+
+
+class PicturesMessage(Message):
+    """
+    The answer to a RequestPicturesMessage. Pictures that are no longer the current pictures of their owners are left out.
+    """
+    def __init__(self, digest_encoded_picture_dict):
+        """
+        :param digest_encoded_picture_dict: {str:str}, the digests of the pictures and their bytes encoded in base64.
+        """
+        self.digest_encoded_picture_dict = digest_encoded_picture_dict
 
 
 # Group Messages
@@ -757,14 +1036,42 @@ class ChatPictureMessage(DisplayableChatMessage):
         self.encoded_picture_bytes = encoded_picture_bytes
 
 
+# Protocol Negotiation
+class RequestProtocolVersionMessage(Message):
+    """
+    The first message that a client sends. Offers the server the protocol versions that the client supports.
+    """
+    def __init__(self, supported_versions):
+        """
+        :param supported_versions: [int], the protocol versions that the client supports.
+        """
+        self.supported_versions = supported_versions
+
+
+class ProtocolVersionMessage(Message):
+    """
+    Informs the client about the protocol version that was chosen by the server.
+    """
+    def __init__(self, protocol_version):
+        """
+        :param protocol_version: int or None, the chosen version, or None if the server supports none of the
+        client's versions.
+        """
+        self.protocol_version = protocol_version
+
+
 # Login Process
 class LoginMessage(Message):
     """
     Attempts to login to the server as an existing user.
+    Also announces the audio codecs that the client can decode and the source id of its media packets,
+    they are passed to the peers of its voice chats.
     """
-    def __init__(self, username, password):
+    def __init__(self, username, password, audio_codecs, media_source_id):
         self.username = username
         self.password = password
+        self.audio_codecs = audio_codecs
+        self.media_source_id = media_source_id
 
 
 class RegisterMessage(Message):
@@ -795,10 +1102,10 @@ class SuccessfulLoginMessage(Message):
     """
     Inform a user about a successful login attempt.
     """
-    def __init__(self, contacts_info_list, pending_contacts_list, user_encoded_picture_byes):
+    def __init__(self, contacts_info_list, pending_contacts_list, user_picture_digest):
         self.contacts_info_list = contacts_info_list
         self.pending_contacts_list = pending_contacts_list
-        self.user_encoded_picture_bytes = user_encoded_picture_byes
+        self.user_picture_digest = user_picture_digest
 
 
 class LoginFailedMessage(Message):
@@ -931,3 +1238,97 @@ class ParticipantStoppedScreenShareMessage(ParticipantVoiceChatMessage):
         super(ParticipantStoppedScreenShareMessage, self).__init__(sending_user)
 
 
+#  ---------------------Message Types Registry----------------------#
+# (type id, class, ((field name, field type))) of every object that can be sent. The type ids and the order of the
+# fields are a part of the protocol - a change in them requires a new PROTOCOL_VERSION. The ids of the protocol
+# negotiation messages never change. A received field whose value does not have its field type makes the frame invalid.
+MESSAGE_TYPES_REGISTRY = [
+    (1, RequestProtocolVersionMessage, (("supported_versions", ListOf(INT_FIELD)),)),
+    (2, ProtocolVersionMessage, (("protocol_version", Optional(INT_FIELD)),)),
+    (3, CommunicationPortsPair, (("send_to_port", INT_FIELD), ("receive_port", INT_FIELD))),
+    (4, VoiceChatPeer, (("username", TEXT_FIELD), ("ip", TEXT_FIELD), ("media_ports_pair", CommunicationPortsPair),
+                        ("peer_picture_digest", TEXT_FIELD), ("peer_audio_codecs", ListOf(TEXT_FIELD)),
+                        ("peer_media_source_id", INT_FIELD))),
+    (5, ContactInfo, (("contact_name", TEXT_FIELD), ("is_connected", BOOL_FIELD), ("picture_digest", TEXT_FIELD))),
+    (6, NewOpenPortsMessage, (("new_open_ports", ListOf(INT_FIELD)),)),
+    (7, DisconnectMessage, ()),
+    (8, RequestUserInformationMessage, (("username", TEXT_FIELD),)),
+    (9, UserInformationMessage, (("username", TEXT_FIELD), ("does_exist", BOOL_FIELD),
+                                 ("is_online", Optional(BOOL_FIELD)), ("encoded_picture_bytes", Optional(TEXT_FIELD)))),
+    (10, PopupMessage, (("message", TEXT_FIELD),)),
+    (11, ChangePictureMessage, (("encoded_picture_bytes", TEXT_FIELD),
+                                ("in_call_participants", Optional(ListOf(TEXT_FIELD))))),
+    (12, RequestAddContactMessage, (("request_username", TEXT_FIELD),)),
+    (13, AskedToBeContactMessage, (("asked_by_username", TEXT_FIELD),)),
+    (14, AcceptContactMessage, (("requesting_username", TEXT_FIELD),)),
+    (15, RejectContactMessage, (("reject_username", TEXT_FIELD),)),
+    (16, AddContactsMessage, (("contacts_info_list", ListOf(ContactInfo)),)),
+    (17, ContactWentOfflineMessage, (("contact_name", TEXT_FIELD),)),
+    (18, ContactConnectedMessage, (("contact_name", TEXT_FIELD),)),
+    (19, DeleteContactMessage, (("contact_name", TEXT_FIELD),)),
+    (20, ContactChangedPictureMessage, (("contact_name", TEXT_FIELD), ("picture_digest", TEXT_FIELD))),
+    (21, RequestCallMessage, (("call_username", TEXT_FIELD), ("other_participants_names", ListOf(TEXT_FIELD)),
+                              ("call_group_name", TEXT_FIELD), ("host_name", TEXT_FIELD),
+                              ("not_in_call_members", ListOf(TEXT_FIELD)))),
+    (22, UpdateUserBeingCalledInformationMessage, (("called_username", TEXT_FIELD),
+                                                   ("new_other_participants_names", ListOf(TEXT_FIELD)),
+                                                   ("new_call_group_name", TEXT_FIELD),
+                                                   ("new_host_name", TEXT_FIELD),
+                                                   ("new_not_in_call_members", ListOf(TEXT_FIELD)))),
+    (23, RequestJoinCallMessage, (("call_name", TEXT_FIELD), ("host_name", TEXT_FIELD))),
+    (24, GroupMemberRequestedJoinMessage, (("call_name", TEXT_FIELD), ("requesting_username", TEXT_FIELD))),
+    (25, AllowCallJoinMessage, (("call_name", TEXT_FIELD), ("requesting_username", TEXT_FIELD),
+                                ("other_participants_names", ListOf(TEXT_FIELD)))),
+    (26, CalledByMessage, (("called_by_names", ListOf(TEXT_FIELD)), ("call_name", TEXT_FIELD))),
+    (27, InvitedToCallMessage, (("call_name", TEXT_FIELD), ("in_call_participants", ListOf(TEXT_FIELD)))),
+    (28, AcceptCallMessage, ()),
+    (29, RejectCallMessage, ()),
+    (30, StartNewCallMessage, (("voice_chat_peers_list", ListOf(VoiceChatPeer)),
+                               ("active_call_group_name", TEXT_FIELD))),
+    (31, AddParticipantToCallMessage, (("voice_chat_peer", VoiceChatPeer), ("active_call_group_name", TEXT_FIELD))),
+    (32, CallRejectedMessage, ()),
+    (33, StopCallingMessage, (("stop_calling_username", TEXT_FIELD),)),
+    (34, StopBeingCalledMessage, ()),
+    (35, CallingFailedMessage, (("error_message", TEXT_FIELD),)),
+    (36, ParticipantChangedPictureMessage, (("participant_username", TEXT_FIELD), ("picture_digest", TEXT_FIELD))),
+    (37, CreateNewCallGroupMessage, (("call_name", TEXT_FIELD), ("host_name", TEXT_FIELD))),
+    (38, AddCallGroupMembersMessage, (("call_name", TEXT_FIELD), ("members_names", ListOf(TEXT_FIELD)))),
+    (39, CommandMembersToCloseGroup, (("call_name", TEXT_FIELD), ("other_group_members_names", ListOf(TEXT_FIELD)))),
+    (40, DeleteCallGroupMessage, (("call_name", TEXT_FIELD),)),
+    (41, ChangeGroupHostMessage, (("call_name", TEXT_FIELD), ("new_host_name", TEXT_FIELD))),
+    (42, HostLeftVoiceChatMessage, (("call_name", TEXT_FIELD), ("other_participants_names", ListOf(TEXT_FIELD)),
+                                    ("other_group_members_names", ListOf(TEXT_FIELD)), ("host_name", TEXT_FIELD))),
+    (43, LeaveGroupMessage, (("call_name", TEXT_FIELD), ("other_group_members_names", ListOf(TEXT_FIELD)))),
+    (44, RemoveGroupMemberMessage, (("call_name", TEXT_FIELD), ("remove_username", TEXT_FIELD))),
+    (45, SendChatTextMessage, (("chat_name", TEXT_FIELD), ("chat_participants_list", ListOf(TEXT_FIELD)),
+                               ("send_time", TEXT_FIELD), ("message", TEXT_FIELD))),
+    (46, SendChatPictureMessage, (("chat_name", TEXT_FIELD), ("chat_participants_list", ListOf(TEXT_FIELD)),
+                                  ("send_time", TEXT_FIELD), ("encoded_picture_bytes", TEXT_FIELD))),
+    (47, ChatTextMessage, (("chat_name", TEXT_FIELD), ("sender_username", TEXT_FIELD), ("send_time", TEXT_FIELD),
+                           ("message", TEXT_FIELD))),
+    (48, ChatPictureMessage, (("chat_name", TEXT_FIELD), ("sender_username", TEXT_FIELD), ("send_time", TEXT_FIELD),
+                              ("encoded_picture_bytes", TEXT_FIELD))),
+    (49, LoginMessage, (("username", TEXT_FIELD), ("password", TEXT_FIELD), ("audio_codecs", ListOf(TEXT_FIELD)),
+                        ("media_source_id", INT_FIELD))),
+    (50, RegisterMessage, (("username", TEXT_FIELD), ("password", TEXT_FIELD))),
+    (51, RegisterFailedMessage, (("message", TEXT_FIELD),)),
+    (52, SuccessfulRegisterMessage, ()),
+    (53, SuccessfulLoginMessage, (("contacts_info_list", ListOf(ContactInfo)),
+                                  ("pending_contacts_list", ListOf(TEXT_FIELD)), ("user_picture_digest", TEXT_FIELD))),
+    (54, LoginFailedMessage, (("message", TEXT_FIELD),)),
+    (55, LeaveVoiceChatMessage, (("participants_names_list", ListOf(TEXT_FIELD)),)),
+    (56, StartedCameraShareMessage, (("participants_names_list", ListOf(TEXT_FIELD)),)),
+    (57, StoppedCameraShareMessage, (("participants_names_list", ListOf(TEXT_FIELD)),)),
+    (58, StartedScreenShareMessage, (("participants_names_list", ListOf(TEXT_FIELD)),)),
+    (59, StoppedScreenShareMessage, (("participants_names_list", ListOf(TEXT_FIELD)),)),
+    (60, ParticipantLeaveVoiceChatMessage, (("sending_user", TEXT_FIELD),)),
+    (61, ParticipantStartedCameraShareMessage, (("sending_user", TEXT_FIELD),)),
+    (62, ParticipantStoppedCameraShareMessage, (("sending_user", TEXT_FIELD),)),
+    (63, ParticipantStartedScreenShareMessage, (("sending_user", TEXT_FIELD),)),
+    (64, ParticipantStoppedScreenShareMessage, (("sending_user", TEXT_FIELD),)),
+    (65, RequestPicturesMessage, (("digest_owner_dict", DictOf(TEXT_FIELD, TEXT_FIELD)),)),
+    (66, PicturesMessage, (("digest_encoded_picture_dict", DictOf(TEXT_FIELD, TEXT_FIELD)),)),
+    (67, UseMediaRelayMessage, (("active_call_group_name", TEXT_FIELD), ("relay_port", INT_FIELD))),
+    (68, UseAudioMixerMessage, (("active_call_group_name", TEXT_FIELD), ("mixer_source_id", INT_FIELD))),
+]
+MESSAGE_CODEC = MessageCodec(MESSAGE_TYPES_REGISTRY)
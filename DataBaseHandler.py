@@ -4,6 +4,7 @@ from Common_Elements import CommunicationPortsPair, VoiceChatPeer, InputValidato
 import os.path
 import base64
 import hashlib
+from collections import OrderedDict
 
 # ---- FOR FULL DIRECTORY PATH IF NEEDED ------- #
 # package_dir = os.path.abspath(os.path.dirname(__file__))
@@ -15,14 +16,10 @@ P2P_PORTS_PACKAGE_SIZE = 20
 SMALLEST_P2P_PORT = 9000
 DEFAULT_P2P_PORTS = [x for x in range(SMALLEST_P2P_PORT, SMALLEST_P2P_PORT + P2P_PORTS_PACKAGE_SIZE)]  # example ports: 9000 -> 9019 (20 ports)
 ACTUAL_CALLING_USER_INDEX = -1
-PEER_PORT_PAIRS_NUMBER = 3
 
 USER_INFO_USERNAME_INDEX = 0
 USER_INFO_PASSWORD_INDEX = 1
-USER_INFO_CONTACTS_INDEX = 2
-USER_INFO_PENDING_CONTACTS_INDEX = 3
-USER_INFO_PICTURE_PATH_INDEX = 4
-CONTACTS_STRING_SEPARATOR = ' '
+USER_INFO_PICTURE_PATH_INDEX = 2
 
 INCORRECT_LOGIN_INFO_MESSAGE = "Incorrect username or password. Please try again."
 USER_ALREADY_EXISTS_MESSAGE = "The username you entered already exists. Please choose a different username."
@@ -34,20 +31,38 @@ DATABASE_NAME = "ServerDB.db"
 USERS_TABLE_NAME = "Users"
 USERNAME_TABLE_RAW = "Username"
 PASSWORD_TABLE_RAW = "Password"
-CONTACTS_TABLE_RAW = "Contacts"
-PENDING_CONTACTS_TABLE_RAW = "PendingContacts"
 PICTURE_PATH_TABLE_RAW = "PicturePath"
-CHECK_TABLE_EXISTS_QUERY = "SELECT name FROM sqlite_master WHERE type='table' AND name='{0}';".format(USERS_TABLE_NAME)
-CREATE_USERS_TABLE_QUERY = "CREATE TABLE {0} ({1} text, {2} password, {3} text, {4} text, {5})".format(USERS_TABLE_NAME, USERNAME_TABLE_RAW, PASSWORD_TABLE_RAW, CONTACTS_TABLE_RAW, PENDING_CONTACTS_TABLE_RAW, PICTURE_PATH_TABLE_RAW)
+OLD_CONTACTS_TABLE_RAW = "Contacts"  # the space separated contacts column of the old Users table
+OLD_PENDING_CONTACTS_TABLE_RAW = "PendingContacts"
+# Contacts is an edge table, every row is a contact (or a pending contact) of a single user.
+# A pending contact of a user is a user who asked to be his contact and is still waiting for an answer.
+CONTACT_STATE = 1
+PENDING_CONTACT_STATE = 0
+CREATE_USERS_TABLE_QUERY = "CREATE TABLE IF NOT EXISTS Users (Username TEXT PRIMARY KEY, Password TEXT, PicturePath TEXT)"
+CREATE_CONTACTS_TABLE_QUERY = "CREATE TABLE IF NOT EXISTS Contacts (User TEXT, Contact TEXT, State INTEGER, PRIMARY KEY (User, Contact))"
+CREATE_CONTACTS_STATE_INDEX_QUERY = "CREATE INDEX IF NOT EXISTS ContactsUserStateIndex ON Contacts (User, State)"
+GET_USERS_TABLE_COLUMNS_QUERY = "PRAGMA table_info(Users)"
+TABLE_COLUMN_NAME_INDEX = 1
+RENAME_OLD_USERS_TABLE_QUERY = "ALTER TABLE Users RENAME TO OldUsers"
+GET_OLD_USERS_CONTACTS_QUERY = "SELECT Username, Contacts, PendingContacts FROM OldUsers"
+COPY_OLD_USERS_QUERY = "INSERT OR IGNORE INTO Users SELECT Username, Password, PicturePath FROM OldUsers"
+DROP_OLD_USERS_TABLE_QUERY = "DROP TABLE OldUsers"
 VERIFY_USER_INFO_QUERY = "SELECT * FROM Users WHERE Username=? AND Password=?"
 FIND_USER_QUERY = "SELECT * FROM Users WHERE Username=?"
-ADD_USER_QUERY = "INSERT INTO Users VALUES (?, ?, ?, ?, ?)"
-UPDATE_PENDING_CONTACTS_QUERY = "UPDATE Users SET PendingContacts=? WHERE Username=?"
-UPDATE_CONTACTS_QUERY = "UPDATE Users SET Contacts=? WHERE Username=?"
+ADD_USER_QUERY = "INSERT INTO Users VALUES (?, ?, ?)"
+INSERT_CONTACT_QUERY = "INSERT OR IGNORE INTO Contacts VALUES (?, ?, ?)"
+ACCEPT_PENDING_CONTACT_QUERY = "UPDATE Contacts SET State=? WHERE User=? AND Contact=? AND State=?"
+DELETE_CONTACT_QUERY = "DELETE FROM Contacts WHERE User=? AND Contact=? AND State=?"
+GET_USER_CONTACTS_QUERY = "SELECT Contact FROM Contacts WHERE User=? AND State=?"
+# write ahead logging lets the database be read while a commit is written, and with synchronous NORMAL
+# a commit does not wait for the disk (only checkpoints do), which is still safe against corruption.
+ENABLE_WAL_QUERY = "PRAGMA journal_mode=WAL"
+SET_SYNCHRONOUS_QUERY = "PRAGMA synchronous=NORMAL"
 
 SERVER_IMAGES_FOLDER = "ServerImages"
 DEFAULT_USER_PICTURE_PATH = os.path.join(SERVER_IMAGES_FOLDER, "DefaultProfile.png")
 USER_PICTURE_PATH = os.path.join(SERVER_IMAGES_FOLDER, "{0}Profile.png")  # example path: "aaaProfile.png"
+PICTURE_CACHE_MAX_BYTES = 64 * 1024 * 1024
 
 
 class UserNotConnectedException(Exception):
@@ -90,6 +105,10 @@ class UserIsNotActualCallingUser(Exception):
     pass
 
 
+class InvalidPictureException(Exception):
+    pass
+
+
 class BeingCalledInformation(object):
     """
     Stores all the information that has to do with being called.
@@ -116,20 +135,31 @@ class User(object):
     """
     This class represents a connected user and contains all the relevant information about the user.
     """
-    def __init__(self, username, ip, port, client_socket):
+    def __init__(self, username, ip, port, client_socket, picture_digest, contact_names, audio_codecs, media_source_id):
         """
         Constructs a new User object.
         being_called_information - information about the user that currently call this user.
         open_p2p_ports - the open ports that the user can use for p2p connections.
+        call_port - int or None, the port of the user's call socket while the user is in a call.
         :param username: str, the user's username
         :param ip: str, the user's ip address
         :param port: int, the user's connection port
         :param client_socket: socket, the user's socket
+        :param picture_digest: str, the digest of the user's current profile picture.
+        :param contact_names: set(str), the names of the user's contacts. Loaded from the database on login and
+        kept up to date while the user is connected, so the server never waits for the database to find them.
+        :param audio_codecs: [str], the names of the audio codecs that the user's client can decode.
+        :param media_source_id: int, the source id in the media headers of the user's packets.
         """
         self.username = username
         self.ip = ip
         self.port = port
         self.client_socket = client_socket
+        self.picture_digest = picture_digest
+        self.contact_names = contact_names
+        self.audio_codecs = audio_codecs
+        self.media_source_id = media_source_id
+        self.call_port = None
         self.being_called_information = None
         self.open_p2p_ports = DEFAULT_P2P_PORTS  # [:]  # copying the open ports list
         # If you don't want to use the same computer for a few clients, add [:] to the above command for
@@ -170,11 +200,24 @@ class User(object):
             print "DEBUG - extended ports list, new biggest port: " + str(self.biggest_p2p_port)
         return open_port
 
+    def get_call_port(self):
+        """
+        Gets the port of the user's call socket, which receives all the media of the user's call from all the peers.
+        A port is taken from the open ports when the user joins a call, and kept until the client opens it again
+        after the call.
+        :return: int, the call port of the user.
+        """
+        if self.call_port is None:
+            self.call_port = self.get_open_p2p_port()
+        return self.call_port
+
     def add_new_open_p2p_ports(self, new_open_ports):
         """
         Adds a new port that can be used for p2p connections (after it has been opened again).
         :param new_open_ports: [int], a list of ports that the user can use for p2p connections.
         """
+        if self.call_port in new_open_ports:
+            self.call_port = None
         self.open_p2p_ports.extend(new_open_ports)
         print "DEBUG - opened ports " + str(new_open_ports) + " of user " + self.username + " new list: " + str(self.open_p2p_ports)
 
@@ -189,44 +232,160 @@ class User(object):
             raise UserIsNotBeingCalledException()
 
 
-class DataBaseHandler(object):
+class CachedPicture(object):
     """
-    This class is the available database of the server. It is the only class with
-    access to the real database. It also contains useful information regarding
-    connected users (so there won't be a need to access the database often).
+    A profile picture that is kept in the PictureCache.
     """
-    def __init__(self):
+    def __init__(self, encoded_picture_bytes, digest):
         """
-        pending_users - users that are connected to the server by socket but are yet to login.
-        connected_users - users that are fully connected to the server and can use it's services.
+        :param encoded_picture_bytes: str, the bytes of the picture encoded in base64.
+        :param digest: str, the sha1 hex digest of the picture's bytes. Identifies the content of the picture.
         """
-        self.pending_users = {}  # {socket:address}
-        self.connected_users = {}  # {socket:User}
-        self.conn = sqlite.connect(DATABASE_NAME)
+        self.encoded_picture_bytes = encoded_picture_bytes
+        self.digest = digest
+
+
+class PictureCache(object):
+    """
+    A least recently used cache of the users' profile pictures, limited by the total size of the encoded pictures.
+    Pictures are read from the disk and encoded in base64 only when they are missing from the cache, and must be
+    invalidated whenever they change.
+    """
+    def __init__(self, max_bytes=PICTURE_CACHE_MAX_BYTES):
+        """
+        username_picture_dict - OrderedDict {username:CachedPicture}, ordered from the least recently used picture.
+        cached_bytes_num - int, the total size of the cached encoded pictures.
+        :param max_bytes: int, the biggest total size of encoded pictures that can be cached.
+        """
+        self.max_bytes = max_bytes
+        self.username_picture_dict = OrderedDict()
+        self.cached_bytes_num = 0
+
+    def get(self, username):
+        """
+        :param username: str, the name of the user.
+        :return: CachedPicture or None, the cached picture of the user, or None if it is not cached.
+        """
+        cached_picture = self.username_picture_dict.pop(username, None)
+        if cached_picture is not None:
+            self.username_picture_dict[username] = cached_picture  # most recently used
+        return cached_picture
+
+    def put(self, username, picture_bytes):
+        """
+        Encodes a picture and caches it, evicting the least recently used pictures if the cache is too big.
+        :param username: str, the name of the user.
+        :param picture_bytes: str, the bytes of the picture.
+        :return: CachedPicture, the new cached picture.
+        """
+        self.invalidate(username)
+        cached_picture = CachedPicture(base64.b64encode(picture_bytes), hashlib.sha1(picture_bytes).hexdigest())
+        picture_size = len(cached_picture.encoded_picture_bytes)
+        if picture_size > self.max_bytes:
+            return cached_picture  # would evict everything else and still not fit
+        while self.cached_bytes_num + picture_size > self.max_bytes:
+            evicted_username, evicted_picture = self.username_picture_dict.popitem(last=False)
+            self.cached_bytes_num -= len(evicted_picture.encoded_picture_bytes)
+        self.username_picture_dict[username] = cached_picture
+        self.cached_bytes_num += picture_size
+        return cached_picture
+
+    def invalidate(self, username):
+        """
+        Removes the picture of a user from the cache. Should be called whenever the picture changes.
+        :param username: str, the name of the user.
+        """
+        cached_picture = self.username_picture_dict.pop(username, None)
+        if cached_picture is not None:
+            self.cached_bytes_num -= len(cached_picture.encoded_picture_bytes)
+
+
+class LoginInformation(object):
+    """
+    The information from the database that the server needs in order to connect a user.
+    """
+    def __init__(self, picture_digest, contact_name_digest_dict, pending_contacts_list):
+        """
+        :param picture_digest: str, the digest of the user's profile picture.
+        :param contact_name_digest_dict: {str:str}, the names of the user's contacts and the digests of their pictures.
+        :param pending_contacts_list: [str], the names of the user's pending contacts.
+        """
+        self.picture_digest = picture_digest
+        self.contact_name_digest_dict = contact_name_digest_dict
+        self.pending_contacts_list = pending_contacts_list
+
+
+class DataBaseStore(object):
+    """
+    This class is the only class with access to the real database and to the profile pictures of the users.
+    The server uses it only through the DataBaseWorker thread, so its methods never commit by themselves -
+    the worker commits every batch of requests at once.
+    """
+    def __init__(self, database_path=DATABASE_NAME):
+        """
+        Opens the database and creates its tables. The connection is in autocommit mode unless a transaction is
+        started explicitly, and it may be moved to the worker thread once it is created.
+        picture_cache - PictureCache, the recently used profile pictures.
+        :param database_path: str, the path of the database file.
+        """
+        self.picture_cache = PictureCache()
+        self.conn = sqlite.connect(database_path, isolation_level=None, check_same_thread=False)
         self.cursor = self.conn.cursor()
-        self.create_users_table_if_it_does_not_exist()
+        self.cursor.execute(ENABLE_WAL_QUERY)
+        self.cursor.execute(SET_SYNCHRONOUS_QUERY)
+        if self.is_old_schema():
+            self.migrate_old_schema()
+        self.create_tables_if_they_do_not_exist()
 
-    def create_users_table_if_it_does_not_exist(self):
+    def create_tables_if_they_do_not_exist(self):
         """
-        Checks if the database contains a Users table and creates
-        one if it doesn't.
+        Creates the Users and Contacts tables and the index of the Contacts table if they don't exist.
         """
-        self.cursor.execute(CHECK_TABLE_EXISTS_QUERY)
-        if self.cursor.fetchone() is None:
-            self.cursor.execute(CREATE_USERS_TABLE_QUERY)
-            self.conn.commit()
+        self.cursor.execute(CREATE_USERS_TABLE_QUERY)
+        self.cursor.execute(CREATE_CONTACTS_TABLE_QUERY)
+        self.cursor.execute(CREATE_CONTACTS_STATE_INDEX_QUERY)
 
-    def disconnect_user(self, client_socket):
+    def is_old_schema(self):
         """
-        Remove a user from the available database lists (wherever he is).
-        :param client_socket: socket, the user's socket.
+        Tells whether the database still uses the old schema, in which the contacts of every user were kept as
+        space separated strings in the Users table.
+        :return: Bool, True if the Users table has the old contacts columns, else False.
         """
-        if client_socket in self.connected_users:
-            del(self.connected_users[client_socket])
-        elif client_socket in self.pending_users:
-            del(self.pending_users[client_socket])
-        client_socket.close()
-        print "DEBUG - user disconnected"
+        self.cursor.execute(GET_USERS_TABLE_COLUMNS_QUERY)
+        columns_names = [column_info[TABLE_COLUMN_NAME_INDEX] for column_info in self.cursor.fetchall()]
+        return OLD_CONTACTS_TABLE_RAW in columns_names
+
+    def migrate_old_schema(self):
+        """
+        Moves the users and the contacts of the old schema to the Users and Contacts tables of the new schema.
+        The migration runs in a single transaction, so a failure leaves the old schema as it was.
+        """
+        print "DEBUG - migrating the database to the contacts table schema"
+        try:
+            self.cursor.execute("BEGIN")
+            self.cursor.execute(RENAME_OLD_USERS_TABLE_QUERY)
+            self.cursor.execute(CREATE_USERS_TABLE_QUERY)
+            self.cursor.execute(CREATE_CONTACTS_TABLE_QUERY)
+            self.cursor.execute(COPY_OLD_USERS_QUERY)
+            self.cursor.execute(GET_OLD_USERS_CONTACTS_QUERY)
+            contacts_rows = []
+            pending_contacts_rows = []
+            for username, contacts_string, pending_contacts_string in self.cursor.fetchall():
+                contacts_rows.extend((username, contact_name, CONTACT_STATE) for contact_name in (contacts_string or "").split())
+                pending_contacts_rows.extend((username, contact_name, PENDING_CONTACT_STATE) for contact_name in (pending_contacts_string or "").split())
+            self.cursor.executemany(INSERT_CONTACT_QUERY, contacts_rows)  # contacts first, they win over pending contacts
+            self.cursor.executemany(INSERT_CONTACT_QUERY, pending_contacts_rows)
+            self.cursor.execute(DROP_OLD_USERS_TABLE_QUERY)
+            self.cursor.execute("COMMIT")
+        except sqlite.Error:
+            self.cursor.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        """
+        Closes the connection to the database.
+        """
+        self.conn.close()
 
     def verify_user_login_info(self, username, password):
         """
@@ -243,36 +402,20 @@ class DataBaseHandler(object):
         if user_info is None:
             raise IncorrectLoginInformationException()
 
-    def connect_user_to_server(self, client_socket, login_message):
-        """
-        Attempts to connect a pending user to the server.
-        :param client_socket: socket, the user's socket
-        :param login_message: LoginMessage, the login message of the client.
-        :return:
+    def load_login_information(self, username, password):
         """
-        self.verify_user_login_info(login_message.username, login_message.password)
-        if self.is_user_connected(login_message.username):
-            raise UserAlreadyConnectedException()
-        net_address = self.pending_users[client_socket]
-        user = User(username=login_message.username, ip=net_address[ADDRESS_IP_INDEX], port=net_address[ADDRESS_PORT_INDEX], client_socket=client_socket)
-        self.connected_users[client_socket] = user
-        del(self.pending_users[client_socket])
-
-    def update_called_user_being_called_information(self, sending_client_socket, update_info_message):
-        """
-        Updates a user BeingCalledInformation object. This function should be called if there was a change
-        in the voice chat of the user of who calls another user, for example a new participant was added to the
-        voice chat while calling to another user, and thus he became another calling user for said called user.
-        :param sending_client_socket: socket, the socket of the actual calling user.
-        :param update_info_message: UpdateUserBeingCalledInformationMessage, a message that contains information about
-        the new voice chat that the user is being called to.
+        Verifies the user's login information and gathers everything that is needed to connect the user.
+        Will raise an exception if the information is incorrect.
+        :param username: str, the username that the user entered
+        :param password: str, the password that the user entered
+        :return: LoginInformation, the information about the user.
         """
-        calling_user = self.connected_users[sending_client_socket]
-        called_user = self.find_connected_user_through_username(update_info_message.called_username)
-        if calling_user.username != called_user.get_actual_calling_username():
-            raise UserIsNotActualCallingUser()
-        participant_names = update_info_message.new_other_participants_names + [calling_user.username]
-        called_user.start_being_called(participant_names, update_info_message.new_call_group_name, update_info_message.new_host_name, update_info_message.new_not_in_call_members)
+        self.verify_user_login_info(username, password)
+        contact_name_digest_dict = {}
+        for contact_name in self.get_user_contacts_names(username):
+            contact_name_digest_dict[contact_name] = self.get_user_picture_digest(contact_name)
+        pending_contacts_list = self.get_user_contacts_names(username, PENDING_CONTACT_STATE)
+        return LoginInformation(self.get_user_picture_digest(username), contact_name_digest_dict, pending_contacts_list)
 
     def add_new_user_to_database(self, username, password):
         """
@@ -284,9 +427,8 @@ class DataBaseHandler(object):
         hashed_password = hashlib.sha256(password).hexdigest()
         if self.does_user_exist(username):
             raise UserAlreadyExistsException()
-        register_info = (username, hashed_password, "", "", USER_PICTURE_PATH.format(username))
+        register_info = (username, hashed_password, USER_PICTURE_PATH.format(username))
         self.cursor.execute(ADD_USER_QUERY, register_info)
-        self.conn.commit()
         self.set_user_picture_as_default(username)
         print "DEBUG - user added successfully"
 
@@ -301,6 +443,26 @@ class DataBaseHandler(object):
         user_picture_file.write(default_picture_file.read())
         default_picture_file.close()
         user_picture_file.close()
+        self.picture_cache.invalidate(username)
+
+    def get_user_cached_picture(self, username):
+        """
+        Gets the profile picture of a user from the picture cache, reading it from the disk if it is not cached.
+        Raises UserDoesNotExistException if there is no user with the given name.
+        :param username: str, the name of the user.
+        :return: CachedPicture, the profile picture of the user.
+        """
+        cached_picture = self.picture_cache.get(username)
+        if cached_picture is None:
+            user_info = self.get_user_info_from_db(username)
+            if user_info is None:
+                raise UserDoesNotExistException()
+            picture_path = user_info[USER_INFO_PICTURE_PATH_INDEX]
+            picture_file = open(picture_path, "rb")
+            picture_bytes = picture_file.read()
+            picture_file.close()
+            cached_picture = self.picture_cache.put(username, picture_bytes)
+        return cached_picture
 
     def get_user_encoded_picture_bytes(self, username):
         """
@@ -308,13 +470,31 @@ class DataBaseHandler(object):
         :param username: str, the name of the user.
         :return: str, the bytes of the profile picture of a user encoded in base64.
         """
-        user_info = self.get_user_info_from_db(username)
-        picture_path = user_info[USER_INFO_PICTURE_PATH_INDEX]
-        picture_file = open(picture_path, "rb")
-        picture_bytes = picture_file.read()
-        picture_file.close()
-        encoded_picture_bytes = base64.b64encode(picture_bytes)
-        return encoded_picture_bytes
+        return self.get_user_cached_picture(username).encoded_picture_bytes
+
+    def get_user_picture_digest(self, username):
+        """
+        Gets the content hash of the profile picture of a user.
+        :param username: str, the name of the user.
+        :return: str, the sha1 hex digest of the bytes of the profile picture.
+        """
+        return self.get_user_cached_picture(username).digest
+
+    def get_current_pictures(self, digest_owner_dict):
+        """
+        Gets the pictures with the given digests, as long as they are still the current pictures of their owners.
+        :param digest_owner_dict: {str:str}, digests of pictures and the names of the users who own them.
+        :return: {str:str}, the digests of the current pictures and their bytes encoded in base64.
+        """
+        digest_encoded_picture_dict = {}
+        for digest, owner_username in digest_owner_dict.iteritems():
+            try:
+                cached_picture = self.get_user_cached_picture(owner_username)
+            except UserDoesNotExistException:
+                continue
+            if cached_picture.digest == digest:
+                digest_encoded_picture_dict[digest] = cached_picture.encoded_picture_bytes
+        return digest_encoded_picture_dict
 
     def validate_user_input(self, username, password):
         """
@@ -344,12 +524,19 @@ class DataBaseHandler(object):
         """
         Changes a user profile picture (by changing it in the server's file system).
         :param username: the name of the user.
+        Raises InvalidPictureException if the picture is not valid base64.
         :param encoded_picture_bytes: str, the bytes of the new picture encoded in base64.
+        :return: str, the digest of the new picture.
         """
+        try:
+            picture_bytes = base64.b64decode(encoded_picture_bytes)
+        except TypeError:  # not a string, or incorrect padding
+            raise InvalidPictureException()
         picture_path = USER_PICTURE_PATH.format(username)
         user_picture_file = open(picture_path, "wb")
-        user_picture_file.write(base64.b64decode(encoded_picture_bytes))
+        user_picture_file.write(picture_bytes)
         user_picture_file.close()
+        return self.picture_cache.put(username, picture_bytes).digest
 
     def add_user_pending_contact(self, username, new_pending_contact_name):
         """
@@ -358,16 +545,20 @@ class DataBaseHandler(object):
         :param new_pending_contact_name: str, the name of the new pending contact.
         :return: Bool, True if the pending contact was successfully added, else false.
         """
-        user_info = self.get_user_info_from_db(username)
-        user_pending_contacts = user_info[USER_INFO_PENDING_CONTACTS_INDEX]
-        user_contacts = user_info[USER_INFO_CONTACTS_INDEX]
-        if new_pending_contact_name not in user_pending_contacts and new_pending_contact_name not in user_contacts:
-            new_user_pending_contacts = user_pending_contacts + new_pending_contact_name + ' '
-            update_info = (new_user_pending_contacts, username)
-            self.cursor.execute(UPDATE_PENDING_CONTACTS_QUERY, update_info)
-            self.conn.commit()
-            return True  # added successfully
-        return False  # not added
+        # the primary key makes the insert fail if the users are already contacts or pending contacts.
+        self.cursor.execute(INSERT_CONTACT_QUERY, (username, new_pending_contact_name, PENDING_CONTACT_STATE))
+        return self.cursor.rowcount == 1
+
+    def add_pending_contact_to_existing_user(self, username, new_pending_contact_name):
+        """
+        Adds a pending contact to a given user, raises UserDoesNotExistException if the user does not exist.
+        :param username: str, the name of the user.
+        :param new_pending_contact_name: str, the name of the new pending contact.
+        :return: Bool, True if the pending contact was successfully added, else false.
+        """
+        if not self.does_user_exist(username):
+            raise UserDoesNotExistException()
+        return self.add_user_pending_contact(username, new_pending_contact_name)
 
     def add_user_contact(self, username, new_contact_name):
         """
@@ -376,14 +567,26 @@ class DataBaseHandler(object):
         :param new_contact_name: str, the name of the new contact.
         :return: Bool, True if the contact was successfully added, else false.
         """
-        user_contacts = self.get_user_info_from_db(username)[USER_INFO_CONTACTS_INDEX]
-        if new_contact_name not in user_contacts:
-            new_user_contacts = user_contacts + new_contact_name + ' '
-            update_info = (new_user_contacts, username)
-            self.cursor.execute(UPDATE_CONTACTS_QUERY, update_info)
-            self.conn.commit()
-            return True  # added successfully
-        return False  # not added
+        self.cursor.execute(ACCEPT_PENDING_CONTACT_QUERY, (CONTACT_STATE, username, new_contact_name, PENDING_CONTACT_STATE))
+        is_added = self.cursor.rowcount == 1
+        if not is_added:
+            self.cursor.execute(INSERT_CONTACT_QUERY, (username, new_contact_name, CONTACT_STATE))
+            is_added = self.cursor.rowcount == 1
+        return is_added
+
+    def make_users_contacts(self, accepting_username, requesting_username):
+        """
+        Makes two users contacts of each other and removes them from the pending contacts of each other.
+        :param accepting_username: str, the name of the user who accepted the contact request.
+        :param requesting_username: str, the name of the user who asked to be a contact.
+        :return: [0]: str, the digest of the accepting user's picture.
+        [1]: str, the digest of the requesting user's picture.
+        """
+        self.remove_user_pending_contact(accepting_username, requesting_username)
+        self.remove_user_pending_contact(requesting_username, accepting_username)
+        self.add_user_contact(accepting_username, requesting_username)
+        self.add_user_contact(requesting_username, accepting_username)
+        return self.get_user_picture_digest(accepting_username), self.get_user_picture_digest(requesting_username)
 
     def remove_user_pending_contact(self, username, pending_contact_name):
         """
@@ -392,17 +595,7 @@ class DataBaseHandler(object):
         :param pending_contact_name: str, the name of the pending contact.
         :return: Bool, True if the pending contact was successfully removed, else False.
         """
-        user_pending_contacts = self.get_user_info_from_db(username)[USER_INFO_PENDING_CONTACTS_INDEX]
-        if pending_contact_name in user_pending_contacts:
-            new_user_pending_contacts = user_pending_contacts.replace(pending_contact_name, '')
-            new_user_pending_contacts = new_user_pending_contacts.replace("  ", ' ')  # delete middle double space
-            if new_user_pending_contacts != "" and new_user_pending_contacts[0] == " ":
-                new_user_pending_contacts = new_user_pending_contacts[1:]
-            update_info = (new_user_pending_contacts, username)
-            self.cursor.execute(UPDATE_PENDING_CONTACTS_QUERY, update_info)
-            self.conn.commit()
-            return True  # removed successfully
-        return False  # not removed
+        return self.delete_user_contact_row(username, pending_contact_name, PENDING_CONTACT_STATE)
 
     def remove_user_contact(self, username, contact_name):
         """
@@ -411,17 +604,37 @@ class DataBaseHandler(object):
         :param contact_name: str, the name of the contact.
         :return: Bool, True if the contact was successfully removed, else False.
         """
-        user_contacts = self.get_user_info_from_db(username)[USER_INFO_CONTACTS_INDEX]
-        if contact_name in user_contacts:
-            new_user_contacts = user_contacts.replace(contact_name, '')
-            new_user_contacts = new_user_contacts.replace("  ", ' ')  # delete middle double space
-            if new_user_contacts[0] == " ":
-                new_user_contacts = new_user_contacts[1:]
-            update_info = (new_user_contacts, username)
-            self.cursor.execute(UPDATE_CONTACTS_QUERY, update_info)
-            self.conn.commit()
-            return True  # removed successfully
-        return False  # not removed
+        return self.delete_user_contact_row(username, contact_name, CONTACT_STATE)
+
+    def remove_users_contact(self, username, contact_name):
+        """
+        Removes two users from the contacts lists of each other.
+        :param username: str, the name of the user.
+        :param contact_name: str, the name of the contact.
+        """
+        self.remove_user_contact(username, contact_name)
+        self.remove_user_contact(contact_name, username)
+
+    def delete_user_contact_row(self, username, contact_name, state):
+        """
+        Deletes a single row of the Contacts table.
+        :param username: str, the name of the user.
+        :param contact_name: str, the name of the contact.
+        :param state: int, CONTACT_STATE or PENDING_CONTACT_STATE, the row is only deleted if it has this state.
+        :return: Bool, True if the row was deleted, else False.
+        """
+        self.cursor.execute(DELETE_CONTACT_QUERY, (username, contact_name, state))
+        return self.cursor.rowcount == 1
+
+    def get_user_contacts_names(self, username, state=CONTACT_STATE):
+        """
+        Gets the names of the contacts of a user.
+        :param username: str, the name of the user.
+        :param state: int, CONTACT_STATE for the contacts or PENDING_CONTACT_STATE for the pending contacts.
+        :return: [str], the names of the contacts.
+        """
+        self.cursor.execute(GET_USER_CONTACTS_QUERY, (username, state))
+        return [row[0] for row in self.cursor.fetchall()]
 
     def does_user_exist(self, username):
         """
@@ -432,16 +645,103 @@ class DataBaseHandler(object):
         user_info = self.get_user_info_from_db(username)
         return user_info is not None
 
+
+class DataBaseHandler(object):
+    """
+    This class is the available database of the server. It contains the information about the pending and
+    connected users, so handling their messages never waits for the real database (see DataBaseStore).
+    """
+    def __init__(self):
+        """
+        pending_users - users that are connected to the server by socket but are yet to login.
+        connected_users - users that are fully connected to the server and can use it's services.
+        username_user_dict - the connected users indexed by their usernames. Must always contain exactly the users of
+        connected_users, so it is only changed together with it (in connect_user_to_server and disconnect_user).
+        """
+        self.pending_users = {}  # {socket:address}
+        self.connected_users = {}  # {socket:User}
+        self.username_user_dict = {}  # {username:User}
+
+    def disconnect_user(self, client_socket):
+        """
+        Remove a user from the available database lists (wherever he is).
+        :param client_socket: socket, the user's socket.
+        """
+        if client_socket in self.connected_users:
+            del(self.username_user_dict[self.connected_users[client_socket].username])
+            del(self.connected_users[client_socket])
+        elif client_socket in self.pending_users:
+            del(self.pending_users[client_socket])
+        client_socket.close()
+        print "DEBUG - user disconnected"
+
+    def connect_user_to_server(self, client_socket, login_message, login_information):
+        """
+        Connects a pending user whose login information was already verified to the server.
+        :param client_socket: socket, the user's socket
+        :param login_message: LoginMessage, the login message of the client.
+        :param login_information: LoginInformation, the information about the user from the database.
+        :return: User, the connected user.
+        """
+        if self.is_user_connected(login_message.username):
+            raise UserAlreadyConnectedException()
+        net_address = self.pending_users[client_socket]
+        contact_names = set(login_information.contact_name_digest_dict)
+        user = User(username=login_message.username, ip=net_address[ADDRESS_IP_INDEX], port=net_address[ADDRESS_PORT_INDEX], client_socket=client_socket,
+                    picture_digest=login_information.picture_digest, contact_names=contact_names, audio_codecs=login_message.audio_codecs,
+                    media_source_id=login_message.media_source_id)
+        self.connected_users[client_socket] = user
+        self.username_user_dict[user.username] = user
+        del(self.pending_users[client_socket])
+        return user
+
+    def update_called_user_being_called_information(self, sending_client_socket, update_info_message):
+        """
+        Updates a user BeingCalledInformation object. This function should be called if there was a change
+        in the voice chat of the user of who calls another user, for example a new participant was added to the
+        voice chat while calling to another user, and thus he became another calling user for said called user.
+        :param sending_client_socket: socket, the socket of the actual calling user.
+        :param update_info_message: UpdateUserBeingCalledInformationMessage, a message that contains information about
+        the new voice chat that the user is being called to.
+        """
+        calling_user = self.connected_users[sending_client_socket]
+        called_user = self.find_connected_user_through_username(update_info_message.called_username)
+        if calling_user.username != called_user.get_actual_calling_username():
+            raise UserIsNotActualCallingUser()
+        participant_names = update_info_message.new_other_participants_names + [calling_user.username]
+        called_user.start_being_called(participant_names, update_info_message.new_call_group_name, update_info_message.new_host_name, update_info_message.new_not_in_call_members)
+
+    def add_contact_of_connected_users(self, first_username, second_username):
+        """
+        Updates the contacts of the connected users after two users became contacts in the database.
+        :param first_username: str, the name of one of the users.
+        :param second_username: str, the name of the other user.
+        """
+        if first_username in self.username_user_dict:
+            self.username_user_dict[first_username].contact_names.add(second_username)
+        if second_username in self.username_user_dict:
+            self.username_user_dict[second_username].contact_names.add(first_username)
+
+    def remove_contact_of_connected_users(self, first_username, second_username):
+        """
+        Updates the contacts of the connected users after two users stopped being contacts in the database.
+        :param first_username: str, the name of one of the users.
+        :param second_username: str, the name of the other user.
+        """
+        if first_username in self.username_user_dict:
+            self.username_user_dict[first_username].contact_names.discard(second_username)
+        if second_username in self.username_user_dict:
+            self.username_user_dict[second_username].contact_names.discard(first_username)
+
     def find_connected_user_through_username(self, username):
         """
         Finds a user with the given username.
         :param username: str, a username that needs to be found
         :return: User, the user with said username.
         """
-        for user in self.connected_users.values():
-            if user.username == username:
-                return user
-        raise UserNotConnectedException()
+        if username not in self.username_user_dict:
+            raise UserNotConnectedException()
+        return self.username_user_dict[username]
 
     def is_user_connected(self, username):
         """
@@ -449,10 +749,7 @@ class DataBaseHandler(object):
         :param username: str, the user which needs to be checked.
         :return: Bool, True if the user is connected right now, else False.
         """
-        for user in self.connected_users.values():
-            if user.username == username:
-                return True
-        return False
+        return username in self.username_user_dict
 
     def create_calling_users_list(self, called_user):
         """
@@ -494,74 +791,38 @@ class DataBaseHandler(object):
         """
         called_user_peers_list = []
         calling_users_peers_dict = {}
-        called_user_encoded_picture_bytes = self.get_user_encoded_picture_bytes(called_user.username)
         for calling_user in calling_users:
-            called_user_pairs, calling_user_pairs = self.create_port_pairs(called_user, calling_user)
-            called_user_peer_object = VoiceChatPeer(called_user.username, called_user.ip, called_user_pairs[0], called_user_pairs[1], called_user_pairs[2], called_user_encoded_picture_bytes)
+            called_user_port_pair = CommunicationPortsPair(called_user.get_call_port(), calling_user.get_call_port())
+            called_user_peer_object = VoiceChatPeer(called_user.username, called_user.ip, called_user_port_pair, called_user.picture_digest, called_user.audio_codecs, called_user.media_source_id)
             calling_users_peers_dict[calling_user] = called_user_peer_object
-            calling_user_encoded_picture_bytes = self.get_user_encoded_picture_bytes(calling_user.username)
-            calling_user_peer_object = VoiceChatPeer(calling_user.username, calling_user.ip, calling_user_pairs[0], calling_user_pairs[1], calling_user_pairs[2], calling_user_encoded_picture_bytes)
+            calling_user_port_pair = CommunicationPortsPair(calling_user.get_call_port(), called_user.get_call_port())
+            calling_user_peer_object = VoiceChatPeer(calling_user.username, calling_user.ip, calling_user_port_pair, calling_user.picture_digest, calling_user.audio_codecs, calling_user.media_source_id)
             called_user_peers_list.append(calling_user_peer_object)
         return called_user_peers_list, calling_users_peers_dict
 
-    def create_port_pairs(self, called_user, calling_user):
-        """
-        Creates lists of ports pairs between the called user and the given calling user.
-        Ports pair are a pair of ports to listen and receive a specific kind of data between two participants
-        in a voice chat. the port that one user sends data to is the port that the other user receives the data from.
-        a list of several Port Pairs is created between the called user and each calling user, one pair for each data type.
-        :param called_user: User, the called user.
-        :param calling_user: User, the calling user who is currently getting his port pairs.
-        :return:
-        """
-        called_user_port_pairs_list = []
-        calling_user_port_pairs_list = []
-        for i in range(PEER_PORT_PAIRS_NUMBER):
-            called_user_listen_port = called_user.get_open_p2p_port()
-            calling_user_listen_port = calling_user.get_open_p2p_port()
-            called_user_port_pair = CommunicationPortsPair(calling_user_listen_port, called_user_listen_port)
-            calling_user_port_pair = CommunicationPortsPair(called_user_listen_port, calling_user_listen_port)
-            called_user_port_pairs_list.append(called_user_port_pair)
-            calling_user_port_pairs_list.append(calling_user_port_pair)
-        return called_user_port_pairs_list, calling_user_port_pairs_list
-
-    def create_contacts_info_list(self, username):
+    def create_contacts_info_list(self, contact_name_digest_dict):
         """
         Creates a list of ContactInfo objects for all the contacts of user. These contain information about
         the contacts.
-        :param username: str, the name of the user.
+        :param contact_name_digest_dict: {str:str}, the names of the user's contacts and the digests of their pictures.
         :return: [ContactInfo], a list of objects that contain information about the user's contacts.
         """
-        user_info = self.get_user_info_from_db(username)
-        user_contacts_list = user_info[USER_INFO_CONTACTS_INDEX].split(CONTACTS_STRING_SEPARATOR)[0:-1]  # deleting last name which is an empty string
         user_contacts_info_list = []
-        for contact_name in user_contacts_list:
+        for contact_name, contact_picture_digest in contact_name_digest_dict.iteritems():
             contact_connected = self.is_user_connected(contact_name)
-            contact_encoded_picture_bytes = self.get_user_encoded_picture_bytes(contact_name)
-            contact_info = ContactInfo(contact_name, contact_connected, contact_encoded_picture_bytes)
+            contact_info = ContactInfo(contact_name, contact_connected, contact_picture_digest)
             user_contacts_info_list.append(contact_info)
         return user_contacts_info_list
 
-    def create_pending_contacts_list(self, username):
-        """
-        Creates a list of the names of the user's pending contacts.
-        :param username: str, the name of the user.
-        :return: [str], a list of the names of the user's pending contacts.
-        """
-        user_info = self.get_user_info_from_db(username)
-        user_pending_contacts_list = user_info[USER_INFO_PENDING_CONTACTS_INDEX].split(CONTACTS_STRING_SEPARATOR)[0:-1]  # deleting last name which is an empty string
-        return user_pending_contacts_list
-
     def create_user_objects_list_of_connected_contacts(self, username):
         """
-        Create a User objects list of the user's connected contacts.
+        Create a User objects list of the connected contacts of a connected user.
         :param username: str, the name of the user.
         :return: [User], a list of all the user's connected contacts.
         """
-        user_info = self.get_user_info_from_db(username)
-        contact_names_list = user_info[USER_INFO_CONTACTS_INDEX].split(CONTACTS_STRING_SEPARATOR)[0:-1]  # deleting last name which is an empty string
+        user = self.find_connected_user_through_username(username)
         contact_objects_list = []
-        for contact_name in contact_names_list:
+        for contact_name in user.contact_names:
             try:
                 contact_user_object = self.find_connected_user_through_username(contact_name)
                 contact_objects_list.append(contact_user_object)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+import Queue
+import socket
+import sqlite3 as sqlite
+from collections import deque
+from threading import Thread
+from DataBaseHandler import DataBaseStore, DATABASE_NAME
+
+MAX_BATCH_SIZE = 64  # the most requests that are committed together
+WAKEUP_DATA = "w"
+WAKEUP_RECEIVE_SIZE = 4096
+LOOPBACK_ADDRESS = ("127.0.0.1", 0)
+STOP_REQUEST = None
+
+
+class DataBaseFuture(object):
+    """
+    The result of a request that was sent to the DataBaseWorker.
+    A future is completed on the worker thread, but its callback is only run by the thread that
+    runs the completed callbacks (the server's event loop).
+    """
+    def __init__(self, callback):
+        """
+        :param callback: function or None, called with the future once the request is completed.
+        """
+        self.callback = callback
+        self.value = None
+        self.exception = None
+
+    def set_result(self, value):
+        """
+        Completes the future successfully.
+        :param value: the value that the request returned.
+        """
+        self.value = value
+        self.exception = None
+
+    def set_exception(self, exception):
+        """
+        Completes the future with an exception.
+        :param exception: Exception, the exception that the request raised.
+        """
+        self.exception = exception
+
+    def result(self):
+        """
+        Returns the value of the request, or raises the exception that the request raised.
+        :return: the value that the request returned.
+        """
+        if self.exception is not None:
+            raise self.exception
+        return self.value
+
+
+def create_wakeup_socket_pair():
+    """
+    Creates two connected sockets. socket.socketpair() is not available on Windows, so a loopback
+    connection is used instead when it is missing.
+    :return: [0]: socket, the socket that is written to.
+    [1]: socket, the socket that is read from.
+    """
+    if hasattr(socket, "socketpair"):
+        return socket.socketpair()
+    listen_socket = socket.socket()
+    listen_socket.bind(LOOPBACK_ADDRESS)
+    listen_socket.listen(1)
+    send_socket = socket.socket()
+    send_socket.connect(listen_socket.getsockname())
+    receive_socket, address = listen_socket.accept()
+    listen_socket.close()
+    return send_socket, receive_socket
+
+
+class DataBaseWorker(Thread):
+    """
+    A thread that runs all the requests to the database, so the server's event loop never waits for SQLite.
+    The event loop submits requests and moves on. The worker runs them in the order they were submitted,
+    in batches - every batch is a single transaction, so the requests that piled up while a commit was written
+    cost a single commit together.
+    Completed requests are handed back to the event loop, which is woken up through wakeup_socket - a socket
+    that should be registered in the server engine, and runs their callbacks by calling run_completed_callbacks.
+    """
+    def __init__(self, database_path=DATABASE_NAME):
+        """
+        Opens the database. The worker thread is not started yet.
+        store - DataBaseStore, the database. Only used by the worker thread once it starts.
+        requests_queue - Queue, the submitted requests, (function, args, DataBaseFuture).
+        completed_futures - deque, the futures that were completed and whose callbacks were not run yet.
+        wakeup_socket - socket, readable when there are completed futures.
+        :param database_path: str, the path of the database file.
+        """
+        super(DataBaseWorker, self).__init__()
+        self.daemon = True
+        self.store = DataBaseStore(database_path)
+        self.requests_queue = Queue.Queue()
+        self.completed_futures = deque()
+        self.wakeup_sender_socket, self.wakeup_socket = create_wakeup_socket_pair()
+        self.wakeup_socket.setblocking(False)
+
+    def submit(self, function, args=(), callback=None):
+        """
+        Sends a request to the worker.
+        :param function: function, an unbound method of DataBaseStore which is called with the store and the args.
+        :param args: tuple, the arguments of the function.
+        :param callback: function or None, called on the event loop with the DataBaseFuture of the request once
+        the request is committed.
+        :return: DataBaseFuture, the future of the request.
+        """
+        future = DataBaseFuture(callback)
+        self.requests_queue.put((function, args, future))
+        return future
+
+    def run(self):
+        """
+        Runs the requests until the worker is stopped.
+        """
+        while True:
+            requests = [self.requests_queue.get()]
+            while len(requests) < MAX_BATCH_SIZE:
+                try:
+                    requests.append(self.requests_queue.get_nowait())
+                except Queue.Empty:
+                    break
+            is_stopped = STOP_REQUEST in requests
+            if is_stopped:
+                requests = requests[:requests.index(STOP_REQUEST)]
+            if requests:
+                self.execute_batch(requests)
+                self.completed_futures.extend(future for function, args, future in requests)
+                self.wakeup_sender_socket.send(WAKEUP_DATA)
+            if is_stopped:
+                break
+        self.store.close()
+
+    def execute_batch(self, requests):
+        """
+        Runs a batch of requests in a single transaction and completes their futures.
+        Every request runs in a savepoint of its own, so a request that fails does not leave half of its changes
+        in the transaction. If the transaction itself fails - the commit, or an error that made SQLite roll back the
+        whole transaction, such as a full disk - every request of the batch fails with its error, and the connection
+        is left out of any transaction for the next batch.
+        :param requests: [(function, args, DataBaseFuture)], the requests of the batch.
+        """
+        cursor = self.store.cursor
+        try:
+            cursor.execute("BEGIN")
+            for function, args, future in requests:
+                cursor.execute("SAVEPOINT request")
+                try:
+                    future.set_result(function(self.store, *args))
+                except Exception as e:
+                    cursor.execute("ROLLBACK TO request")
+                    future.set_exception(e)
+                cursor.execute("RELEASE request")
+            cursor.execute("COMMIT")
+        except sqlite.Error as e:
+            try:
+                cursor.execute("ROLLBACK")
+            except sqlite.Error:
+                pass  # SQLite already rolled the transaction back
+            for function, args, future in requests:
+                future.set_exception(e)
+
+    def run_completed_callbacks(self):
+        """
+        Runs the callbacks of the completed requests, in the order that the requests were submitted.
+        A callback that raises is reported and skipped, so it neither stops the event loop nor the callbacks after it.
+        Should be called by the event loop whenever wakeup_socket is readable.
+        """
+        try:
+            self.wakeup_socket.recv(WAKEUP_RECEIVE_SIZE)
+        except socket.error:
+            pass  # the futures of an earlier wakeup were already handled
+        while self.completed_futures:
+            future = self.completed_futures.popleft()
+            if future.callback is not None:
+                try:
+                    future.callback(future)
+                except Exception as e:
+                    print "DEBUG - database request callback failed: " + repr(e)
+
+    def stop(self):
+        """
+        Stops the worker after the requests that were already submitted, and closes the database.
+        Callbacks of requests that were not handed to the event loop yet are not run.
+        """
+        self.requests_queue.put(STOP_REQUEST)
+        if self.is_alive():
+            self.join()
+        else:
+            self.store.close()
+        self.wakeup_sender_socket.close()
+        self.wakeup_socket.close()
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+
+import struct
+from Common_Elements import START_ENCRYPTION_SIGN
+from Media_Header import sequence_numbers_distance, MEDIA_HEADER_STRUCT, SEQUENCE_NUMBER_MODULO
+
+# frame id, fragment index, fragments count - 6 bytes after the media header of every camera and screen packet
+FRAGMENT_HEADER_STRUCT = struct.Struct(">HHH")
+MTU = 1500  # the largest IP packet on ethernet and most home networks
+UDP_IP_HEADERS_SIZE = 28
+ENCRYPTION_OVERHEAD = len(START_ENCRYPTION_SIGN) + 16  # the encryption sign and up to a block of AES padding
+# The data of a fragment, so a whole fragment datagram fits in a single IP packet and is never fragmented by IP.
+MAX_FRAGMENT_DATA_SIZE = MTU - UDP_IP_HEADERS_SIZE - ENCRYPTION_OVERHEAD - MEDIA_HEADER_STRUCT.size - \
+    FRAGMENT_HEADER_STRUCT.size
+MAX_FRAME_SIZE = 2 * 1024 * 1024  # bigger frames are not sent, and their fragments are not reassembled
+MAX_FRAME_FRAGMENTS = (MAX_FRAME_SIZE + MAX_FRAGMENT_DATA_SIZE - 1) / MAX_FRAGMENT_DATA_SIZE
+REASSEMBLY_TIMEOUT = 0.5  # seconds, a frame whose fragments did not all arrive by then was lost
+MAX_PENDING_FRAMES = 8  # frames that are reassembled at once, the oldest is given up on beyond it
+FRAME_ID_MODULO = SEQUENCE_NUMBER_MODULO  # frame ids are 16-bit and wrap around like sequence numbers
+
+
+class FrameFragmentException(Exception):
+    pass
+
+
+class FrameFragmenter(object):
+    """
+    Splits the frames of one of the user's camera or screen streams into fragments, each small enough for a single
+    datagram that IP does not fragment. The fragments of a frame share its frame id and are sent as media packets
+    of their own.
+    """
+    def __init__(self):
+        """
+        *frame_id - int, the id of the next frame, 16-bit.
+        """
+        self.frame_id = 0
+
+    def fragment(self, frame_bytes):
+        """
+        Raises FrameFragmentException if the frame is bigger than MAX_FRAME_SIZE.
+        :param frame_bytes: str, an encoded frame.
+        :return: [str], the fragments of the frame, every one starts with a fragment header.
+        """
+        if len(frame_bytes) > MAX_FRAME_SIZE:
+            raise FrameFragmentException("Frame of " + str(len(frame_bytes)) + " bytes is too big to send")
+        fragments_count = max(1, (len(frame_bytes) + MAX_FRAGMENT_DATA_SIZE - 1) / MAX_FRAGMENT_DATA_SIZE)
+        fragments = [FRAGMENT_HEADER_STRUCT.pack(self.frame_id, fragment_index, fragments_count) +
+                     frame_bytes[fragment_index * MAX_FRAGMENT_DATA_SIZE:(fragment_index + 1) * MAX_FRAGMENT_DATA_SIZE]
+                     for fragment_index in xrange(fragments_count)]
+        self.frame_id = (self.frame_id + 1) % FRAME_ID_MODULO
+        return fragments
+
+
+class PartialFrame(object):
+    """
+    A frame whose fragments are arriving.
+    """
+    def __init__(self, fragments_count, first_arrival_time):
+        """
+        *fragments - [str or None], the data of the fragments by their indexes, None for the fragments that did not
+        arrive yet.
+        :param fragments_count: int, the number of fragments in the frame.
+        :param first_arrival_time: float, the time that the first fragment of the frame arrived in.
+        """
+        self.fragments = [None] * fragments_count
+        self.missing_fragments = fragments_count
+        self.first_arrival_time = first_arrival_time
+
+    def add_fragment(self, fragment_index, fragment_data):
+        """
+        :param fragment_index: int, the index of the fragment in the frame.
+        :param fragment_data: str, the data of the fragment.
+        :return: Bool, True if the frame is complete.
+        """
+        if self.fragments[fragment_index] is None:
+            self.fragments[fragment_index] = fragment_data
+            self.missing_fragments -= 1
+        return not self.missing_fragments
+
+
+class FrameReassembler(object):
+    """
+    Reassembles the frames of a participant's camera or screen stream from their fragments, which may arrive out of
+    order. A frame that is not complete within REASSEMBLY_TIMEOUT, or is older than a frame that was completed, is
+    given up on, so lost fragments never hold frames in memory and an old frame is never shown over a newer one.
+    """
+    def __init__(self):
+        """
+        *frame_id_partial_frame_dict - {int:PartialFrame}, the frames that are being reassembled by their ids.
+        *last_frame_id - int or None, the id of the newest frame that was completed.
+        *completed_frames - int, the frames that were completed.
+        *lost_frames - int, the frames that were given up on.
+        *late_fragments - int, the fragments of frames that were already completed or given up on.
+        """
+        self.frame_id_partial_frame_dict = {}
+        self.last_frame_id = None
+        self.completed_frames = 0
+        self.lost_frames = 0
+        self.late_fragments = 0
+
+    def is_frame_late(self, frame_id):
+        """
+        :param frame_id: int, the id of a frame.
+        :return: Bool, True if the frame is not newer than the last frame that was completed.
+        """
+        return self.last_frame_id is not None and sequence_numbers_distance(self.last_frame_id, frame_id) <= 0
+
+    def drop_frames(self, should_drop):
+        """
+        Gives up on the frames that are being reassembled and should be dropped.
+        :param should_drop: function, gets a frame id and its PartialFrame and returns True if it should be dropped.
+        """
+        for frame_id, partial_frame in self.frame_id_partial_frame_dict.items():
+            if should_drop(frame_id, partial_frame):
+                del self.frame_id_partial_frame_dict[frame_id]
+                self.lost_frames += 1
+
+    def evict_frames(self, arrival_time):
+        """
+        Gives up on the frames that timed out, and on the oldest frames beyond MAX_PENDING_FRAMES.
+        :param arrival_time: float, the time that the current fragment arrived in.
+        """
+        self.drop_frames(lambda frame_id, partial_frame:
+                         arrival_time - partial_frame.first_arrival_time > REASSEMBLY_TIMEOUT)
+        while len(self.frame_id_partial_frame_dict) > MAX_PENDING_FRAMES:
+            oldest_frame_id = min(self.frame_id_partial_frame_dict,
+                                  key=lambda frame_id: self.frame_id_partial_frame_dict[frame_id].first_arrival_time)
+            del self.frame_id_partial_frame_dict[oldest_frame_id]
+            self.lost_frames += 1
+
+    def add_fragment(self, fragment, arrival_time):
+        """
+        Adds a fragment to its frame.
+        Raises FrameFragmentException if the fragment does not start with a valid fragment header.
+        :param fragment: str, the data of a camera or screen packet, starting with a fragment header.
+        :param arrival_time: float, the time that the fragment arrived in.
+        :return: str or None, the frame if this fragment completed it, else None.
+        """
+        if len(fragment) < FRAGMENT_HEADER_STRUCT.size:
+            raise FrameFragmentException("Frame fragment is too short")
+        frame_id, fragment_index, fragments_count = FRAGMENT_HEADER_STRUCT.unpack_from(fragment)
+        if not 0 < fragments_count <= MAX_FRAME_FRAGMENTS or fragment_index >= fragments_count:
+            raise FrameFragmentException("Invalid fragment " + str(fragment_index) + " of " + str(fragments_count))
+        self.evict_frames(arrival_time)
+        if self.is_frame_late(frame_id):
+            self.late_fragments += 1
+            return None
+        partial_frame = self.frame_id_partial_frame_dict.get(frame_id)
+        if partial_frame is None:
+            partial_frame = PartialFrame(fragments_count, arrival_time)
+            self.frame_id_partial_frame_dict[frame_id] = partial_frame
+        elif len(partial_frame.fragments) != fragments_count:
+            raise FrameFragmentException("Fragment count of frame " + str(frame_id) + " changed")
+        if not partial_frame.add_fragment(fragment_index, fragment[FRAGMENT_HEADER_STRUCT.size:]):
+            return None
+        del self.frame_id_partial_frame_dict[frame_id]
+        self.last_frame_id = frame_id
+        self.completed_frames += 1
+        self.drop_frames(lambda other_frame_id, other_partial_frame: self.is_frame_late(other_frame_id))
+        return "".join(partial_frame.fragments)
+
+    def __str__(self):
+        return "reassembly: {0} frames, {1} lost, {2} late fragments".format(self.completed_frames, self.lost_frames,
+                                                                           self.late_fragments)
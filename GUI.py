@@ -58,6 +58,7 @@ class VoiceChatApp(wx.App):
         self.program_frame.secondary_panel.enable_current_voice_chat_button()
         self.program_frame.secondary_panel.change_voice_chat_button_name(call_group_name)
         self.program_frame.main_panel.current_voice_chat_panel.change_voice_chat_name(call_group_name)
+        self.program_frame.main_panel.current_voice_chat_panel.participant_viewer.start_speaking_indicators()
         self.program_frame.secondary_panel.deselect_current_selections()
         self.program_frame.main_panel.switch_to_current_voice_chat()
 
@@ -66,6 +67,7 @@ class VoiceChatApp(wx.App):
             self.program_frame.main_panel.switch_to_home_page()
         self.program_frame.secondary_panel.disable_current_voice_chat_button()
         self.program_frame.secondary_panel.reset_voice_chat_button_name()
+        self.program_frame.main_panel.current_voice_chat_panel.participant_viewer.stop_speaking_indicators()
         self.program_frame.main_panel.current_voice_chat_panel.participant_viewer.remove_all_participant_panels()
         self.program_frame.main_panel.current_voice_chat_panel.close_own_camera_frame()
         self.program_frame.main_panel.current_voice_chat_panel.reset_buttons()
@@ -0,0 +1,277 @@
+# -*- coding: utf-8 -*-
+
+import audioop
+import math
+import threading
+from Media_Header import sequence_numbers_distance, SEQUENCE_NUMBER_MODULO
+
+MAX_DEPTH = 25  # the most chunks that are kept, half a second of 20 ms chunks
+MIN_TARGET_DEPTH = 2
+MAX_TARGET_DEPTH = 12
+INITIAL_TARGET_DEPTH = 3
+JITTER_DEPTH_FACTOR = 3.0  # the buffer covers this many times the measured jitter
+JITTER_SMOOTHING = 16.0  # the jitter estimate of RFC 3550
+DEPTH_SLACK = 2  # chunks above the target depth before chunks are dropped to reduce the delay
+LATE_PACKET_DEPTH_INCREASE = 1  # a late packet means that the buffer was too shallow
+LATE_INCREASE_INTERVAL_PACKETS = 50  # a burst of late packets increases the depth only once
+LATE_DEPTH_DECAY_PACKETS = 250  # played packets, about 5 seconds, before a depth increase of late packets is undone
+LOST_PACKET = ""  # returned by the jitter buffer in place of a packet that did not arrive in time
+MAX_CONCEALED_CHUNKS = 5  # after this many lost chunks in a row, silence is played instead of concealment
+CONCEALMENT_FADE = 0.6  # the volume of every concealed chunk relative to the chunk before it
+SAMPLE_WIDTH = 2
+
+
+class JitterBufferStatistics(object):
+    """
+    The state of a jitter buffer and what happened to the packets that it received.
+    """
+    def __init__(self, depth, target_depth, jitter, received_packets, played_packets, lost_packets, late_packets,
+                 duplicate_packets, discarded_packets, underruns):
+        """
+        *depth - int, the number of chunks that are currently buffered.
+        *target_depth - int, the number of chunks that the buffer currently aims to hold.
+        *jitter - float, the estimated jitter of the packets' arrival, in seconds.
+        *received_packets - int, the packets that were put in the buffer.
+        *played_packets - int, the packets that were taken out of the buffer to be played.
+        *lost_packets - int, the packets that were missing when it was their turn to be played.
+        *late_packets - int, the packets that arrived after their turn to be played, and were dropped.
+        *duplicate_packets - int, the packets that arrived more than once.
+        *discarded_packets - int, the packets that were dropped to reduce the delay.
+        *underruns - int, how many times the buffer ran empty while playing.
+        """
+        self.depth = depth
+        self.target_depth = target_depth
+        self.jitter = jitter
+        self.received_packets = received_packets
+        self.played_packets = played_packets
+        self.lost_packets = lost_packets
+        self.late_packets = late_packets
+        self.duplicate_packets = duplicate_packets
+        self.discarded_packets = discarded_packets
+        self.underruns = underruns
+
+    def get_loss_percentage(self):
+        """
+        :return: float, the percentage of the packets that were missing when it was their turn to be played.
+        """
+        expected_packets = self.played_packets + self.lost_packets
+        if not expected_packets:
+            return 0.0
+        return 100.0 * self.lost_packets / expected_packets
+
+    def __str__(self):
+        return "depth {0}/{1}, jitter {2:.1f} ms, loss {3:.1f}%, late {4}, discarded {5}, underruns {6}".format(
+            self.depth, self.target_depth, self.jitter * 1000, self.get_loss_percentage(), self.late_packets,
+            self.discarded_packets, self.underruns)
+
+
+class JitterBuffer(object):
+    """
+    Holds the voice packets of a participant until it is their turn to be played, in the order of their sequence
+    numbers, so packets that arrive in bursts, late or out of order are still played smoothly.
+    The buffer aims to hold a target depth of chunks that follows the measured jitter - deep enough to cover the
+    arrival variation, and not deeper, so the delay stays low. While the buffer holds more than it needs, one chunk
+    at a time is dropped, instead of throwing away the whole backlog.
+    Packets that are missing on their turn are reported as LOST_PACKET, so the player can conceal them.
+    Packets are put by the receiving thread and taken by the playing thread.
+    """
+    def __init__(self, rate, chunk_size):
+        """
+        condition - threading.Condition, guards the buffer and wakes up the playing thread.
+        packets - {int:str}, the buffered packets by their sequence numbers.
+        next_sequence_number - int or None, the sequence number of the next packet to be played.
+        is_playing - Bool, False while the buffer fills up to the target depth before playing.
+        last_transit - float or None, the transit time of the last packet, for the jitter estimate.
+        late_depth - int, chunks that are added to the target depth since packets arrived too late for it.
+        last_late_increase - int or None, the number of received packets when late_depth was last increased.
+        :param rate: int, the sample rate of the packets' timestamps.
+        :param chunk_size: int, the number of samples in a packet.
+        """
+        self.rate = rate
+        self.chunk_duration = float(chunk_size) / rate
+        self.condition = threading.Condition()
+        self.packets = {}
+        self.next_sequence_number = None
+        self.is_playing = False
+        self.is_closed = False
+        self.target_depth = INITIAL_TARGET_DEPTH
+        self.jitter = 0.0
+        self.last_transit = None
+        self.late_depth = 0
+        self.last_late_increase = None
+        self.received_packets = 0
+        self.played_packets = 0
+        self.lost_packets = 0
+        self.late_packets = 0
+        self.duplicate_packets = 0
+        self.discarded_packets = 0
+        self.underruns = 0
+
+    def put(self, sequence_number, timestamp, packet, arrival_time):
+        """
+        Adds a packet to the buffer. Packets that arrive after their turn was played are dropped.
+        :param sequence_number: int, the sequence number of the packet.
+        :param timestamp: int, the time that the packet was recorded in, in samples.
+        :param packet: str, the voice packet.
+        :param arrival_time: float, the time that the packet arrived in, in seconds.
+        """
+        with self.condition:
+            self.received_packets += 1
+            self.update_jitter(timestamp, arrival_time)
+            if self.next_sequence_number is None:
+                self.next_sequence_number = sequence_number
+            if sequence_numbers_distance(self.next_sequence_number, sequence_number) < 0:
+                self.late_packets += 1
+                self.increase_late_depth()
+                return
+            if sequence_number in self.packets:
+                self.duplicate_packets += 1
+                return
+            self.packets[sequence_number] = packet
+            while len(self.packets) > MAX_DEPTH:
+                oldest_sequence_number = self.get_oldest_sequence_number()
+                self.lost_packets += sequence_numbers_distance(self.next_sequence_number, oldest_sequence_number)
+                del self.packets[oldest_sequence_number]
+                self.next_sequence_number = oldest_sequence_number
+                self.advance()
+                self.discarded_packets += 1
+            self.condition.notify()
+
+    def update_jitter(self, timestamp, arrival_time):
+        """
+        Updates the jitter estimate with the arrival of a packet, like RFC 3550 does, and the target depth with it.
+        :param timestamp: int, the time that the packet was recorded in, in samples.
+        :param arrival_time: float, the time that the packet arrived in, in seconds.
+        """
+        transit = arrival_time - float(timestamp) / self.rate
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / JITTER_SMOOTHING
+        self.last_transit = transit
+        self.update_target_depth()
+
+    def increase_late_depth(self):
+        """
+        Deepens the buffer after a packet arrived too late to be played, once for a burst of late packets.
+        """
+        if self.last_late_increase is not None and \
+                self.received_packets - self.last_late_increase < LATE_INCREASE_INTERVAL_PACKETS:
+            return
+        self.last_late_increase = self.received_packets
+        self.late_depth = min(MAX_TARGET_DEPTH, self.late_depth + LATE_PACKET_DEPTH_INCREASE)
+        self.update_target_depth()
+
+    def update_target_depth(self):
+        """
+        Sets the target depth to cover the measured jitter, plus the depth that late packets added.
+        """
+        jitter_depth = int(math.ceil(JITTER_DEPTH_FACTOR * self.jitter / self.chunk_duration))
+        self.target_depth = max(MIN_TARGET_DEPTH, min(MAX_TARGET_DEPTH, jitter_depth + self.late_depth))
+
+    def get_oldest_sequence_number(self):
+        """
+        :return: int, the sequence number of the oldest buffered packet.
+        """
+        return min(self.packets, key=lambda sequence_number: sequence_numbers_distance(self.next_sequence_number,
+                                                                                       sequence_number))
+
+    def pop(self):
+        """
+        Takes the packet whose turn it is to be played, without waiting.
+        :return: str or None, the packet, LOST_PACKET if the packet is missing, or None if nothing should be played
+        right now - the buffer is still filling up.
+        """
+        with self.condition:
+            if not self.is_playing:
+                if len(self.packets) < self.target_depth:
+                    return None
+                oldest_sequence_number = self.get_oldest_sequence_number()
+                self.lost_packets += sequence_numbers_distance(self.next_sequence_number, oldest_sequence_number)
+                self.next_sequence_number = oldest_sequence_number
+                self.is_playing = True
+            if not self.packets:
+                self.is_playing = False
+                self.underruns += 1
+                return None
+            if len(self.packets) > self.target_depth + DEPTH_SLACK and self.next_sequence_number in self.packets:
+                del self.packets[self.next_sequence_number]
+                self.advance()
+                self.discarded_packets += 1
+            packet = self.packets.pop(self.next_sequence_number, LOST_PACKET)
+            self.advance()
+            if packet == LOST_PACKET:
+                self.lost_packets += 1
+            else:
+                self.played_packets += 1
+                if self.late_depth and self.played_packets % LATE_DEPTH_DECAY_PACKETS == 0:
+                    self.late_depth -= 1
+                    self.update_target_depth()
+            return packet
+
+    def advance(self):
+        """
+        Moves to the next sequence number.
+        """
+        self.next_sequence_number = (self.next_sequence_number + 1) % SEQUENCE_NUMBER_MODULO
+
+    def get(self, timeout):
+        """
+        Waits until there is something to play and takes it.
+        :param timeout: float, the most seconds to wait.
+        :return: str or None, the packet, LOST_PACKET if the packet is missing, or None if the timeout passed or
+        the buffer was closed.
+        """
+        with self.condition:
+            if not self.is_closed and not self.is_playing and len(self.packets) < self.target_depth:
+                self.condition.wait(timeout)
+            if self.is_closed:
+                return None
+            return self.pop()
+
+    def close(self):
+        """
+        Wakes up the playing thread for good.
+        """
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+
+    def get_statistics(self):
+        """
+        :return: JitterBufferStatistics, the current state of the buffer.
+        """
+        with self.condition:
+            return JitterBufferStatistics(len(self.packets), self.target_depth, self.jitter, self.received_packets,
+                                          self.played_packets, self.lost_packets, self.late_packets,
+                                          self.duplicate_packets, self.discarded_packets, self.underruns)
+
+
+class PacketLossConcealer(object):
+    """
+    Fills the place of lost voice chunks - the last chunk that was played is repeated and faded out, which sounds much
+    smoother than a gap. Longer losses fade into silence.
+    """
+    def __init__(self):
+        """
+        last_chunk - str, the last chunk that was played, 16-bit PCM.
+        concealed_chunks - int, the number of chunks that were concealed in a row.
+        """
+        self.last_chunk = ""
+        self.concealed_chunks = 0
+
+    def update(self, chunk):
+        """
+        Remembers a chunk that was played.
+        :param chunk: str, a decoded chunk, 16-bit PCM.
+        """
+        self.last_chunk = chunk
+        self.concealed_chunks = 0
+
+    def conceal(self):
+        """
+        :return: str, a chunk to play in place of a lost chunk, 16-bit PCM.
+        """
+        self.concealed_chunks += 1
+        if self.concealed_chunks > MAX_CONCEALED_CHUNKS:
+            return "\0" * len(self.last_chunk)
+        self.last_chunk = audioop.mul(self.last_chunk, SAMPLE_WIDTH, CONCEALMENT_FADE)
+        return self.last_chunk
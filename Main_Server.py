@@ -1,12 +1,23 @@
 # -*- coding: utf-8 -*-
 
+import errno
 import socket
-from select import select
+import sqlite3 as sqlite
+import sys
+from functools import partial
 import Common_Elements
 from DataBaseHandler import *
+from DataBase_Worker import DataBaseWorker
+from Media_Relay import MediaRelay, RELAY_PARTICIPANTS_THRESHOLD
+from Audio_Mixer import MIXING_PARTICIPANTS_THRESHOLD
+from Server_Engines import create_server_engine, DEFAULT_SERVER_ENGINE, UnknownServerEngineException, SERVER_ENGINE_TYPES
 
 IP = "0.0.0.0"
 PORT = 9999
+LISTEN_BACKLOG = 128
+MAX_OUTGOING_BUFFER_BYTES = 32 * 1024 * 1024  # a client that falls this far behind is disconnected
+DATABASE_ERRORS = (sqlite.Error, IOError)  # a request failed to use the database or a picture file
+SERVER_ENGINE_ARGUMENT_INDEX = 1
 
 NEW_HOST_NAME_INDEX = 0
 
@@ -17,6 +28,7 @@ CANNOT_CALL_EXISTING_PARTICIPANT_CALLING_ERROR = "Calling Error - Cannot call a
 
 SENT_ADD_CONTACT_REQUEST_MESSAGE = "Successfully sent add contact request."
 ALREADY_SENT_CONTACT_REQUEST_MESSAGE = "This user was already asked to be a contact or is already a contact."
+DATABASE_ERROR_MESSAGE = "The server could not reach its database. Please try again later."
 
 #  -----------------------EXCEPTIONS--------------------#
 
@@ -29,19 +41,174 @@ class UserIsNotCallHostException(Exception):
     pass
 
 
+class ClientConnection(object):
+    """
+    Contains the buffers and the protocol state of a single client connection.
+    The server's sockets are non-blocking, so received bytes wait in the frame decoder until a whole frame
+    arrives and outgoing frames wait in the outgoing buffer until the socket is writable.
+    """
+    def __init__(self):
+        """
+        frame_decoder - FrameDecoder, decodes the frames that the client sends.
+        outgoing_buffer - bytearray, the bytes that are waiting to be sent to the client.
+        protocol_version - int or None, the protocol version that was negotiated with the client.
+        Is None until the client sends a RequestProtocolVersionMessage.
+        framing - str, the framing mode of the frames that are sent to the client.
+        """
+        self.frame_decoder = Common_Elements.FrameDecoder()
+        self.outgoing_buffer = bytearray()
+        self.protocol_version = None
+        self.framing = Common_Elements.ASCII_FRAMING
+
+    def set_framing(self, framing):
+        """
+        Switches both directions of the connection to a new framing mode.
+        :param framing: str, the new framing mode.
+        """
+        self.framing = framing
+        self.frame_decoder.framing = framing
+
+
 class CommunicationHandler(Common_Elements.BasicCommunicator):
     """
     This class is responsible for communication between server and clients.
     Contains functions that require sending and receiving information.
     """
-    def __init__(self):
+    def __init__(self, engine):
         """
         Constructs a CommunicationHandler object and its AESCipher object which
         allows it to encrypt and decrypt messages.
+        :param engine: the server engine, used to wait for sockets that have data to send.
+        """
+        super(CommunicationHandler, self).__init__()
+        self.engine = engine
+        self.socket_connection_dict = {}  # {socket:ClientConnection}
+        self.failed_sockets = set()  # sockets that failed or fell too far behind and need to be disconnected
+
+    def add_connection(self, client_socket):
+        """
+        Starts tracking a newly accepted connection and makes its socket non-blocking.
+        :param client_socket: socket, the socket of the new connection.
+        """
+        client_socket.setblocking(0)
+        self.socket_connection_dict[client_socket] = ClientConnection()
+
+    def remove_connection(self, client_socket):
+        """
+        Stops tracking a connection and drops its buffers.
+        :param client_socket: socket, the socket of the closed connection.
+        """
+        if client_socket in self.socket_connection_dict:
+            del(self.socket_connection_dict[client_socket])
+        self.failed_sockets.discard(client_socket)
+
+    def receive_available_messages(self, client_socket):
+        """
+        Receives the bytes that are available on a readable socket and returns the messages that were completed by them.
+        Only a single recv call is made, which never blocks on a readable socket, so a client that sent only a part of
+        a frame cannot stall the server. The rest of the frame is kept in the connection's frame decoder.
+        :param client_socket: socket, a readable socket.
+        :return: [Message], the messages that were fully received (might be empty).
+        """
+        try:
+            data = client_socket.recv(Common_Elements.RECEIVE_BUFFER_SIZE)
+        except socket.error as e:
+            if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+        if not data:
+            raise socket.error("Connection closed by the client")
+        frame_decoder = self.socket_connection_dict[client_socket].frame_decoder
+        frame_decoder.feed(data)
+        return [self.decode_message(frame, frame_decoder.framing) for frame in frame_decoder.get_complete_frames()]
+
+    def get_protocol_version(self, client_socket):
+        """
+        :param client_socket: socket, the socket of a client.
+        :return: int or None, the protocol version that was negotiated with the client, or None if there is none yet.
+        """
+        connection = self.socket_connection_dict.get(client_socket)
+        if connection is None:
+            return None
+        return connection.protocol_version
+
+    def negotiate_protocol_version(self, client_socket, request_protocol_version_message):
+        """
+        Chooses the newest protocol version that both the server and the client support and informs the client about it.
+        The answer is still sent with ASCII framing, every frame after it uses the framing of the chosen version.
+        The client waits for the answer before sending anything else, so no frame is received with the wrong framing.
+        :param client_socket: socket, the socket of the client.
+        :param request_protocol_version_message: RequestProtocolVersionMessage, the versions that the client supports.
+        :return: int or None, the chosen version, or None if there is no common version.
+        """
+        common_versions = [version for version in request_protocol_version_message.supported_versions
+                           if version in Common_Elements.SUPPORTED_PROTOCOL_VERSIONS]
+        protocol_version = max(common_versions) if common_versions else None
+        connection = self.socket_connection_dict[client_socket]
+        connection.protocol_version = protocol_version
+        self.send_full_message(client_socket, Common_Elements.ProtocolVersionMessage(protocol_version))
+        if protocol_version is not None:
+            connection.set_framing(Common_Elements.PROTOCOL_VERSION_FRAMING_DICT[protocol_version])
+        return protocol_version
+
+    def send_full_message(self, client_socket, message):
+        """
+        Queues a message to be sent to a client.
+        :param client_socket: socket, the socket of the client.
+        :param message: Message, the message that needs to be sent.
         """
-        super(Common_Elements.BasicCommunicator, self).__init__()
-        self.cipher = Common_Elements.AESCipher()  # prevent crash
+        connection = self.socket_connection_dict.get(client_socket)
+        if connection is None:
+            return
+        self.queue_frame(client_socket, self.encode_frame(message, connection.framing))
+
+    def queue_frame(self, client_socket, frame):
+        """
+        Adds an encoded frame to the outgoing buffer of a client and tries to send it right away.
+        Whatever cannot be sent right now is sent when the socket becomes writable, so a slow client never blocks the
+        server. Clients that cannot be sent to, or whose outgoing buffer grows over the backpressure limit, are marked
+        as failed and are disconnected by the server after the current event is handled.
+        :param client_socket: socket, the socket of the client.
+        :param frame: str or bytearray, a full frame (length header and message).
+        """
+        connection = self.socket_connection_dict.get(client_socket)
+        if connection is None or client_socket in self.failed_sockets:
+            return
+        was_buffer_empty = len(connection.outgoing_buffer) == 0
+        connection.outgoing_buffer.extend(frame)
+        if was_buffer_empty:
+            self.flush_outgoing_buffer(client_socket)
+        if len(connection.outgoing_buffer) > MAX_OUTGOING_BUFFER_BYTES:
+            print "DEBUG - outgoing buffer limit exceeded, dropping slow client"
+            self.failed_sockets.add(client_socket)
+
+    def flush_outgoing_buffer(self, client_socket):
+        """
+        Sends as much of the outgoing buffer of a client as the socket accepts without blocking.
+        All the frames that are waiting in the buffer are sent together, so queued messages share send calls.
+        :param client_socket: socket, the socket of the client.
+        """
+        connection = self.socket_connection_dict.get(client_socket)
+        if connection is None:
+            return
+        try:
+            while connection.outgoing_buffer:
+                sent_bytes_num = client_socket.send(memoryview(connection.outgoing_buffer))
+                del connection.outgoing_buffer[:sent_bytes_num]
+        except socket.error as e:
+            if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                self.failed_sockets.add(client_socket)
+                return
+        self.engine.set_write_interest(client_socket, len(connection.outgoing_buffer) > 0)
 
+    def pop_failed_sockets(self):
+        """
+        Returns the sockets that need to be disconnected and forgets them.
+        :return: [socket], the sockets of the clients that failed.
+        """
+        failed_sockets = list(self.failed_sockets)
+        self.failed_sockets.clear()
+        return failed_sockets
 
     def relay_request_call_message(self, called_user, participant_names, call_group_name, host_name, not_in_call_members):
         """
@@ -174,6 +341,26 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
                 calling_user_add_participant_message = Common_Elements.AddParticipantToCallMessage(calling_users_peers_dict[calling_user], call_name)
                 self.send_full_message(calling_user.client_socket, calling_user_add_participant_message)
 
+    def send_use_media_relay_message(self, users_list, call_name, relay_port):
+        """
+        Tells participants of a call to send their media through the media relay.
+        :param users_list: [User], the participants whose media now goes through the relay.
+        :param call_name: str, the name of the call group.
+        :param relay_port: int, the port of the media relay.
+        """
+        use_media_relay_message = Common_Elements.UseMediaRelayMessage(call_name, relay_port)
+        self.broadcast_message_to_users_list(users_list, use_media_relay_message)
+
+    def send_use_audio_mixer_message(self, users_list, call_name, mixer_source_id):
+        """
+        Tells participants of a call that the media relay mixes the voice of the call.
+        :param users_list: [User], the participants who now get the mixed voice.
+        :param call_name: str, the name of the call group.
+        :param mixer_source_id: int, the source id of the mixed voice packets.
+        """
+        use_audio_mixer_message = Common_Elements.UseAudioMixerMessage(call_name, mixer_source_id)
+        self.broadcast_message_to_users_list(users_list, use_audio_mixer_message)
+
     def send_change_host_message(self, call_name, new_host_name, all_group_members):
         """
         Sends a message to all group members that tells them to change the host of the group
@@ -196,15 +383,15 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         remove_group_member_message = Common_Elements.RemoveGroupMemberMessage(call_name, remove_username)
         self.broadcast_message_to_users_list(other_group_members_list, remove_group_member_message)
 
-    def send_successful_login_message(self, client_socket, user_contacts_info_list, user_pending_contacts_list, user_encoded_picture_bytes):
+    def send_successful_login_message(self, client_socket, user_contacts_info_list, user_pending_contacts_list, user_picture_digest):
         """
         Informs a client about a successful login.
         :param client_socket: socket, the socket of the client who tried to log in
         :param user_contacts_info_list: [ContactInfo], a list of information objects about the user's contacts.
         :param user_pending_contacts_list: [str], a list of the user's pending users' names.
-        :param user_encoded_picture_bytes: str, the user's profile picture encoded in base64.
+        :param user_picture_digest: str, the digest of the user's profile picture.
         """
-        successful_login_message = Common_Elements.SuccessfulLoginMessage(user_contacts_info_list, user_pending_contacts_list, user_encoded_picture_bytes)
+        successful_login_message = Common_Elements.SuccessfulLoginMessage(user_contacts_info_list, user_pending_contacts_list, user_picture_digest)
         self.send_full_message(client_socket, successful_login_message)
 
     def send_login_failed_message(self, client_socket, message):
@@ -306,8 +493,14 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         :param users_list: [User], list of users.
         :param message: Message, the message that needs to be sent.
         """
+        framing_frame_dict = {}  # {framing:frame}, the message is encoded once for all the users of each framing
         for user in users_list:
-            self.send_full_message(user.client_socket, message)
+            connection = self.socket_connection_dict.get(user.client_socket)
+            if connection is None:
+                continue
+            if connection.framing not in framing_frame_dict:
+                framing_frame_dict[connection.framing] = self.encode_frame(message, connection.framing)
+            self.queue_frame(user.client_socket, framing_frame_dict[connection.framing])
 
     def send_delete_contact_message(self, client_socket, contact_name):
         """
@@ -318,26 +511,35 @@ class CommunicationHandler(Common_Elements.BasicCommunicator):
         delete_contact_message = Common_Elements.DeleteContactMessage(contact_name)
         self.send_full_message(client_socket, delete_contact_message)
 
-    def send_contact_changed_picture_message_to_all_contacts(self, connected_contacts_list, username, encoded_picture_bytes):
+    def send_contact_changed_picture_message_to_all_contacts(self, connected_contacts_list, username, picture_digest):
         """
         Informs all contacts of a user that the user changed his profile picture.
         :param connected_contacts_list: [User], a list of the user's contacts.
         :param username: str, the name of the user.
-        :param encoded_picture_bytes: str, the bytes of the new picture encoded in base64.
+        :param picture_digest: str, the digest of the new picture.
         """
-        contact_changed_picture_message = Common_Elements.ContactChangedPictureMessage(username, encoded_picture_bytes)
+        contact_changed_picture_message = Common_Elements.ContactChangedPictureMessage(username, picture_digest)
         self.broadcast_message_to_users_list(connected_contacts_list, contact_changed_picture_message)
 
-    def broadcast_participant_changed_picture_message(self, participants_list, username, encoded_picture_bytes):
+    def broadcast_participant_changed_picture_message(self, participants_list, username, picture_digest):
         """
         Informs all participants of a user's voice chat that the user changed his profile picture.
         :param participants_list: [User], a list of the users who are in a voice chat with said user.
         :param username: str, the name of the user.
-        :param encoded_picture_bytes: str, the bytes of the new picture encoded in base64.
+        :param picture_digest: str, the digest of the new picture.
         """
-        participant_changed_picture_message = Common_Elements.ParticipantChangedPictureMessage(username, encoded_picture_bytes)
+        participant_changed_picture_message = Common_Elements.ParticipantChangedPictureMessage(username, picture_digest)
         self.broadcast_message_to_users_list(participants_list, participant_changed_picture_message)
 
+    def send_pictures_message(self, client_socket, digest_encoded_picture_dict):
+        """
+        Sends profile pictures that a client asked for.
+        :param client_socket: socket, the socket of the client.
+        :param digest_encoded_picture_dict: {str:str}, the digests of the pictures and their bytes encoded in base64.
+        """
+        pictures_message = Common_Elements.PicturesMessage(digest_encoded_picture_dict)
+        self.send_full_message(client_socket, pictures_message)
+
     def relay_chat_text_message(self, chat_name, sender_username, send_time, message, receiving_users_list):
         """
         Relays a text chat message to all chat participants (aside from the sender).
@@ -371,22 +573,37 @@ class Server(object):
     This specific class is responsible for interpreting and handling client requests and relaying them
     to the other Server components.
     """
-    def __init__(self):
+    def __init__(self, engine_type=DEFAULT_SERVER_ENGINE):
         """
         db - DataBaseHandler, the available database of the server.
+        db_worker - DataBaseWorker, the thread that runs all the requests to the real database.
+        logging_in_sockets - {socket:[Message]}, the pending users whose login is being verified by the database worker
+        and the messages that they sent in the meantime, which are handled once the login is over.
         server_socket - socket, the server socket which accepts new clients.
         communication_handler - CommunicationHandler, the communication handler of the server.
+        engine - the server engine which waits for socket events (select or epoll).
+        media_relay - MediaRelay, the thread that forwards the media of large calls.
+        :param engine_type: str, the type of the server engine, one of SERVER_ENGINE_TYPES.
         """
         self.db = DataBaseHandler()
+        self.db_worker = DataBaseWorker()
+        self.logging_in_sockets = {}  # {socket:[Message]}
         self.server_socket = socket.socket()
-        self.communication_handler = CommunicationHandler()
+        self.engine = create_server_engine(engine_type)
+        self.communication_handler = CommunicationHandler(self.engine)
+        self.media_relay = MediaRelay()
 
     def open_server(self):
         """
         Binds the server to the constant address and opens it.
         """
         self.server_socket.bind((IP, PORT))
-        self.server_socket.listen(1)
+        self.server_socket.listen(LISTEN_BACKLOG)
+        self.engine.register_socket(self.server_socket)
+        self.engine.register_socket(self.db_worker.wakeup_socket)
+        self.db_worker.start()
+        self.media_relay.open()
+        self.media_relay.start()
 
     def accept_pending_user(self):
         """
@@ -397,6 +614,8 @@ class Server(object):
         if client_address[ADDRESS_IP_INDEX] == "127.0.0.1":
             client_address = (THIS_COMPUTER_IP, client_address[ADDRESS_PORT_INDEX])
         self.db.pending_users[client_socket] = client_address
+        self.communication_handler.add_connection(client_socket)
+        self.engine.register_socket(client_socket)
         print "DEBUG - new client accepted " + str(client_address)
 
     def disconnect_user(self, client_socket):
@@ -406,65 +625,144 @@ class Server(object):
         """
         try:
             disconnecting_user = self.db.connected_users[client_socket]
+            self.media_relay.remove_participant(disconnecting_user.media_source_id)
             connected_contacts_list = self.db.create_user_objects_list_of_connected_contacts(disconnecting_user.username)
             self.communication_handler.send_user_went_offline_message_to_all_contacts(connected_contacts_list, disconnecting_user.username)
         except (UserNotConnectedException, KeyError, socket.error) as e:
             print "ERROR IN USER DISCONNECT - " + str(type(e))
+        self.engine.unregister_socket(client_socket)
+        self.communication_handler.remove_connection(client_socket)
+        self.logging_in_sockets.pop(client_socket, None)
         self.db.disconnect_user(client_socket)
 
+    def disconnect_failed_users(self):
+        """
+        Disconnects the users that could not be sent to or that fell too far behind in receiving their messages.
+        Disconnecting a user informs his contacts, which might cause more failures, so this repeats until
+        there are no failed users left.
+        """
+        failed_sockets = self.communication_handler.pop_failed_sockets()
+        while failed_sockets:
+            for failed_socket in failed_sockets:
+                if failed_socket in self.db.connected_users or failed_socket in self.db.pending_users:
+                    self.disconnect_user(failed_socket)
+            failed_sockets = self.communication_handler.pop_failed_sockets()
+
     def connect_user_to_server(self, client_socket, login_message):
         """
-        Attempts to connect the user to the server and informs him about the result.
+        Asks the database worker to verify the login information of a user. The user is connected and informed
+        about the result once the worker is done (see finish_user_login).
+        :param client_socket: socket, the socket of the pending user that sent a login message.
+        :param login_message: LoginMessage, the message that contains the user's login information
+        """
+        self.logging_in_sockets[client_socket] = []
+        self.db_worker.submit(DataBaseStore.load_login_information, (login_message.username, login_message.password),
+                              partial(self.finish_user_login, client_socket, login_message))
+
+    def finish_user_login(self, client_socket, login_message, login_future):
+        """
+        Connects the user to the server if his login information was verified and informs him about the result.
+        Then handles the messages that the user sent while his login was verified.
         :param client_socket: socket, the socket of the pending user that sent a login message.
         :param login_message: LoginMessage, the message that contains the user's login information
+        :param login_future: DataBaseFuture, the future of the login information of the user.
         """
+        if client_socket not in self.logging_in_sockets:
+            return  # disconnected while the login was verified
+        deferred_messages = self.logging_in_sockets.pop(client_socket)
         try:
-            self.db.connect_user_to_server(client_socket, login_message)
-            user_contacts_info_list = self.db.create_contacts_info_list(login_message.username)
-            user_pending_contacts_list = self.db.create_pending_contacts_list(login_message.username)
-            user_encoded_picture_bytes = self.db.get_user_encoded_picture_bytes(login_message.username)
-            self.communication_handler.send_successful_login_message(client_socket, user_contacts_info_list, user_pending_contacts_list, user_encoded_picture_bytes)
-            connected_contacts_list = self.db.create_user_objects_list_of_connected_contacts(login_message.username)
-            self.communication_handler.send_user_connected_message_to_all_contacts(connected_contacts_list, login_message.username)
+            login_information = login_future.result()
+            user = self.db.connect_user_to_server(client_socket, login_message, login_information)
+            user_contacts_info_list = self.db.create_contacts_info_list(login_information.contact_name_digest_dict)
+            self.communication_handler.send_successful_login_message(client_socket, user_contacts_info_list, login_information.pending_contacts_list, user.picture_digest)
+            connected_contacts_list = self.db.create_user_objects_list_of_connected_contacts(user.username)
+            self.communication_handler.send_user_connected_message_to_all_contacts(connected_contacts_list, user.username)
         except (IncorrectLoginInformationException, InvalidUserInformationException, UserAlreadyConnectedException) as e:
             self.communication_handler.send_login_failed_message(client_socket, e.get_message())
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not load login information: " + repr(e)
+            self.communication_handler.send_login_failed_message(client_socket, DATABASE_ERROR_MESSAGE)
+        try:
+            self.handle_client_messages(client_socket, deferred_messages)
+        except (socket.error, InvalidConnectionMessageException):
+            self.disconnect_user(client_socket)
 
     def add_new_user_to_database(self, client_socket, register_message):
         """
-        Adds a new user to the database when a client requests to register.
-        Handles both outcomes of either a successful or a failed register.
-        :param client_socket:
-        :param register_message:
-        :return:
+        Asks the database worker to add a new user when a client requests to register.
+        The client is informed about the result once the worker is done.
+        :param client_socket: socket, the socket of the pending user that sent a register message.
+        :param register_message: RegisterMessage, the message that contains the new user's information.
+        """
+        self.db_worker.submit(DataBaseStore.add_new_user_to_database, (register_message.username, register_message.password),
+                              partial(self.finish_user_register, client_socket))
+
+    def finish_user_register(self, client_socket, register_future):
+        """
+        Informs a client about the result of his register request.
+        :param client_socket: socket, the socket of the client who asked to register.
+        :param register_future: DataBaseFuture, the future of the register request.
         """
         try:
-            self.db.add_new_user_to_database(register_message.username, register_message.password)
+            register_future.result()
             self.communication_handler.send_successful_register_message(client_socket)
-        except UserAlreadyExistsException as e:
-            self.communication_handler.send_failed_register_message(client_socket, e.get_message())
-        except InvalidUserInformationException as e:
+        except (UserAlreadyExistsException, InvalidUserInformationException) as e:
             self.communication_handler.send_failed_register_message(client_socket, e.get_message())
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not add new user: " + repr(e)
+            self.communication_handler.send_failed_register_message(client_socket, DATABASE_ERROR_MESSAGE)
 
-    def handle_pending_user(self, client_socket):
+    def handle_ready_client(self, client_socket):
         """
-        Gets the message that a pending user sent and handles it (relays it to suitable functions).
-        :param client_socket: socket, the socket of the pending user who sent data.
+        Receives the available data of a readable client socket and handles every message that was completed by it.
+        :param client_socket: socket, the socket of the client who sent data.
+        """
+        self.handle_client_messages(client_socket, self.communication_handler.receive_available_messages(client_socket))
+
+    def handle_client_messages(self, client_socket, messages):
+        """
+        Handles messages of a client according to the current state of the client, so messages that arrive right
+        after a login message are handled as messages of a connected user. Messages that arrive while the login
+        is being verified wait until the login is over.
+        :param client_socket: socket, the socket of the client.
+        :param messages: [Message], the messages that the client sent, in the order they were sent.
+        """
+        for message_index, message in enumerate(messages):
+            if client_socket in self.logging_in_sockets:
+                self.logging_in_sockets[client_socket].extend(messages[message_index:])
+                return
+            if client_socket in self.db.pending_users:
+                self.handle_pending_user(client_socket, message)
+            elif client_socket in self.db.connected_users:
+                self.handle_connected_user(client_socket, message)
+
+    def handle_pending_user(self, client_socket, message):
         """
-        message = self.communication_handler.receive_full_message(client_socket)
-        if isinstance(message, Common_Elements.LoginMessage):
+        Handles a message that a pending user sent (relays it to suitable functions).
+        :param client_socket: socket, the socket of the pending user who sent data.
+        :param message: Message, the message that the pending user sent.
+        """
+        if self.communication_handler.get_protocol_version(client_socket) is None:
+            # the first message of every client must negotiate the protocol version.
+            if not isinstance(message, Common_Elements.RequestProtocolVersionMessage) or \
+                    not isinstance(message.supported_versions, list):
+                raise InvalidConnectionMessageException()
+            if self.communication_handler.negotiate_protocol_version(client_socket, message) is None:
+                print "DEBUG - client does not support any of the server's protocol versions"
+                raise InvalidConnectionMessageException()
+        elif isinstance(message, Common_Elements.LoginMessage):
             self.connect_user_to_server(client_socket, message)
         elif isinstance(message, Common_Elements.RegisterMessage):
             self.add_new_user_to_database(client_socket, message)
         else:
             raise InvalidConnectionMessageException()
 
-    def handle_connected_user(self, client_socket):
+    def handle_connected_user(self, client_socket, message):
         """
-        Gets the message that a connected user sent and handles it (relays it to suitable functions).
+        Handles a message that a connected user sent (relays it to suitable functions).
         :param client_socket: socket, the socket of the connected user who sent data.
-        :return:
+        :param message: Message, the message that the connected user sent.
         """
-        message = self.communication_handler.receive_full_message(client_socket)
         print "DEBUG - " + str(message)
         try:
             if isinstance(message, Common_Elements.CallMessage):
@@ -483,6 +781,8 @@ class Server(object):
                 self.provide_user_information(client_socket, message)
             elif isinstance(message, Common_Elements.ChangePictureMessage):
                 self.change_user_picture(client_socket, message.encoded_picture_bytes, message.in_call_participants)
+            elif isinstance(message, Common_Elements.RequestPicturesMessage):
+                self.provide_pictures(client_socket, message)
             elif isinstance(message, Common_Elements.DisconnectMessage):
                 self.disconnect_user(client_socket)
         except UserNotConnectedException:
@@ -501,6 +801,7 @@ class Server(object):
         ready_message = None
         if isinstance(message, Common_Elements.LeaveVoiceChatMessage):
             ready_message = Common_Elements.ParticipantLeaveVoiceChatMessage(sending_username)
+            self.media_relay.remove_participant(self.db.connected_users[client_socket].media_source_id)
         elif isinstance(message, Common_Elements.StartedCameraShareMessage):
             ready_message = Common_Elements.ParticipantStartedCameraShareMessage(sending_username)
         elif isinstance(message, Common_Elements.StoppedCameraShareMessage):
@@ -572,7 +873,7 @@ class Server(object):
             elif isinstance(message, Common_Elements.AcceptContactMessage):
                 self.allow_users_to_be_contacts(client_socket, message)
             elif isinstance(message, Common_Elements.RejectContactMessage):
-                self.db.remove_user_pending_contact(self.db.connected_users[client_socket].username, message.reject_username)
+                self.db_worker.submit(DataBaseStore.remove_user_pending_contact, (self.db.connected_users[client_socket].username, message.reject_username))
             elif isinstance(message, Common_Elements.DeleteContactMessage):
                 self.delete_user_contact(client_socket, message)
         except UserDoesNotExistException:
@@ -593,25 +894,40 @@ class Server(object):
 
     def allow_users_to_be_contacts(self, accepting_client_socket, accept_contact_message):
         """
-        Adds two users as contacts of each other after the contact adding process is over.
-        Also removes them from the pending contacts list of each other.
+        Asks the database worker to add two users as contacts of each other after the contact adding process is over,
+        and to remove them from the pending contacts list of each other.
         :param accepting_client_socket: socket, the socket of the client who accepted the friendship.
         :param accept_contact_message: AcceptContactMessage, the message that the accepting client sent.
         """
         accepting_user = self.db.connected_users[accepting_client_socket]
-        self.db.remove_user_pending_contact(accepting_user.username, accept_contact_message.requesting_username)
-        self.db.remove_user_pending_contact(accept_contact_message.requesting_username, accepting_user.username)
-        self.db.add_user_contact(accepting_user.username, accept_contact_message.requesting_username)
-        self.db.add_user_contact(accept_contact_message.requesting_username, accepting_user.username)
-        is_requesting_user_connected = self.db.is_user_connected(accept_contact_message.requesting_username)
+        self.db_worker.submit(DataBaseStore.make_users_contacts, (accepting_user.username, accept_contact_message.requesting_username),
+                              partial(self.inform_users_about_new_contact, accepting_user.username, accept_contact_message.requesting_username))
+
+    def inform_users_about_new_contact(self, accepting_username, requesting_username, contacts_future):
+        """
+        Informs two users that they became contacts of each other (if they are still connected).
+        :param accepting_username: str, the name of the user who accepted the friendship.
+        :param requesting_username: str, the name of the user who asked to be a contact.
+        :param contacts_future: DataBaseFuture, the future of the digests of the users' pictures.
+        """
+        try:
+            accepting_user_picture_digest, requesting_user_picture_digest = contacts_future.result()
+        except UserDoesNotExistException:
+            return
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not make users contacts: " + repr(e)
+            return
+        self.db.add_contact_of_connected_users(accepting_username, requesting_username)
+        is_accepting_user_connected = self.db.is_user_connected(accepting_username)
+        is_requesting_user_connected = self.db.is_user_connected(requesting_username)
         if is_requesting_user_connected:
-            requesting_user = self.db.find_connected_user_through_username(accept_contact_message.requesting_username)
-            accepting_user_picture = self.db.get_user_encoded_picture_bytes(accepting_user.username)
-            accepting_user_contact_info = [Common_Elements.ContactInfo(accepting_user.username, True, accepting_user_picture)]
+            requesting_user = self.db.find_connected_user_through_username(requesting_username)
+            accepting_user_contact_info = [Common_Elements.ContactInfo(accepting_username, is_accepting_user_connected, accepting_user_picture_digest)]
             self.communication_handler.send_add_contacts_message(requesting_user.client_socket, accepting_user_contact_info)
-        requesting_user_picture = self.db.get_user_encoded_picture_bytes(accept_contact_message.requesting_username)
-        requesting_user_contact_info = [Common_Elements.ContactInfo(accept_contact_message.requesting_username, is_requesting_user_connected, requesting_user_picture)]
-        self.communication_handler.send_add_contacts_message(accepting_user.client_socket, requesting_user_contact_info)
+        if is_accepting_user_connected:
+            accepting_user = self.db.find_connected_user_through_username(accepting_username)
+            requesting_user_contact_info = [Common_Elements.ContactInfo(requesting_username, is_requesting_user_connected, requesting_user_picture_digest)]
+            self.communication_handler.send_add_contacts_message(accepting_user.client_socket, requesting_user_contact_info)
 
     def delete_user_contact(self, deleting_client_socket, delete_contact_message):
         """
@@ -621,11 +937,26 @@ class Server(object):
         :param delete_contact_message: DeleteContactMessage, the message that the client sent.
         """
         deleting_user = self.db.connected_users[deleting_client_socket]
-        self.db.remove_user_contact(deleting_user.username, delete_contact_message.contact_name)
-        self.db.remove_user_contact(delete_contact_message.contact_name, deleting_user.username)
+        self.db_worker.submit(DataBaseStore.remove_users_contact, (deleting_user.username, delete_contact_message.contact_name),
+                              partial(self.inform_user_about_deleted_contact, deleting_user.username, delete_contact_message.contact_name))
+
+    def inform_user_about_deleted_contact(self, deleting_username, deleted_username, delete_future):
+        """
+        Removes two users from the contacts of each other once they were removed from the database, and informs
+        the deleted user if he is online.
+        :param deleting_username: str, the name of the user who deleted the contact.
+        :param deleted_username: str, the name of the deleted contact.
+        :param delete_future: DataBaseFuture, the future of the delete request.
+        """
+        try:
+            delete_future.result()
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not delete contact: " + repr(e)
+            return
+        self.db.remove_contact_of_connected_users(deleting_username, deleted_username)
         try:
-            deleted_user = self.db.find_connected_user_through_username(delete_contact_message.contact_name)
-            self.communication_handler.send_delete_contact_message(deleted_user.client_socket, deleting_user.username)
+            deleted_user = self.db.find_connected_user_through_username(deleted_username)
+            self.communication_handler.send_delete_contact_message(deleted_user.client_socket, deleting_username)
         except UserNotConnectedException:
             pass
 
@@ -633,25 +964,40 @@ class Server(object):
         """
         Relays a request to add another user as a contact if the request is valid.
         The users must not already be contacts with each other, be pending contacts of each other, and the
-        user can't send this request to himself.
+        user can't send this request to himself. The request is validated and saved by the database worker.
         :param client_socket: socket, the socket of the requesting user.
         :param request_add_contact_message: RequestAddContactMessage, the message of the requesting user which
         contains the needed info.
         """
         requesting_user = self.db.connected_users[client_socket]
         if requesting_user.username != request_add_contact_message.request_username:  # you can't add yourself as a contact
-            if not self.db.does_user_exist(request_add_contact_message.request_username):
-                raise UserDoesNotExistException
-            is_added = self.db.add_user_pending_contact(request_add_contact_message.request_username, requesting_user.username)
-            if is_added:
-                self.communication_handler.send_popup_message(client_socket, SENT_ADD_CONTACT_REQUEST_MESSAGE)
-                try:
-                    requested_user = self.db.find_connected_user_through_username(request_add_contact_message.request_username)
-                    self.communication_handler.send_asked_to_be_contact_message(requested_user.client_socket, requesting_user.username)
-                except UserNotConnectedException:
-                    pass
-            else:
-                self.communication_handler.send_popup_message(client_socket, ALREADY_SENT_CONTACT_REQUEST_MESSAGE)
+            self.db_worker.submit(DataBaseStore.add_pending_contact_to_existing_user, (request_add_contact_message.request_username, requesting_user.username),
+                                  partial(self.finish_request_add_contact, requesting_user, request_add_contact_message.request_username))
+
+    def finish_request_add_contact(self, requesting_user, requested_username, pending_contact_future):
+        """
+        Informs a user about the result of his request to add a contact, and relays the request to the requested
+        user if the request is valid.
+        :param requesting_user: User, the user who asked to add a contact.
+        :param requested_username: str, the name of the user who was asked to be a contact.
+        :param pending_contact_future: DataBaseFuture, the future of the pending contact request.
+        """
+        try:
+            is_added = pending_contact_future.result()
+        except UserDoesNotExistException:
+            return
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not add pending contact: " + repr(e)
+            return
+        if is_added:
+            self.communication_handler.send_popup_message(requesting_user.client_socket, SENT_ADD_CONTACT_REQUEST_MESSAGE)
+            try:
+                requested_user = self.db.find_connected_user_through_username(requested_username)
+                self.communication_handler.send_asked_to_be_contact_message(requested_user.client_socket, requesting_user.username)
+            except UserNotConnectedException:
+                pass
+        else:
+            self.communication_handler.send_popup_message(requesting_user.client_socket, ALREADY_SENT_CONTACT_REQUEST_MESSAGE)
 
     def provide_user_information(self, client_socket, request_user_info_message):
         """
@@ -659,16 +1005,28 @@ class Server(object):
         :param client_socket: socket, the socket of the requesting user.
         :param request_user_info_message: RequestUserInformationMessage, the message that the
         requesting user sent.
-        :return:
         """
         requesting_user = self.db.connected_users[client_socket]
-        questioned_user_info = self.db.get_user_info_from_db(request_user_info_message.username)
-        if questioned_user_info is None:
-            self.communication_handler.send_user_information_message(requesting_user, request_user_info_message.username, False, None, None)
-        else:
-            is_online = self.db.is_user_connected(request_user_info_message.username)
-            user_encoded_picture_bytes = self.db.get_user_encoded_picture_bytes(request_user_info_message.username)
-            self.communication_handler.send_user_information_message(requesting_user, request_user_info_message.username, True, is_online, user_encoded_picture_bytes)
+        self.db_worker.submit(DataBaseStore.get_user_encoded_picture_bytes, (request_user_info_message.username,),
+                              partial(self.finish_provide_user_information, requesting_user, request_user_info_message.username))
+
+    def finish_provide_user_information(self, requesting_user, username, picture_future):
+        """
+        Sends the information about a user once his picture was read by the database worker.
+        :param requesting_user: User, the user who asked for the information.
+        :param username: str, the name of the user that the information is about.
+        :param picture_future: DataBaseFuture, the future of the user's picture.
+        """
+        try:
+            user_encoded_picture_bytes = picture_future.result()
+        except UserDoesNotExistException:
+            self.communication_handler.send_user_information_message(requesting_user, username, False, None, None)
+            return
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not read user picture: " + repr(e)
+            return
+        is_online = self.db.is_user_connected(username)
+        self.communication_handler.send_user_information_message(requesting_user, username, True, is_online, user_encoded_picture_bytes)
 
     def change_user_picture(self, client_socket, new_encoded_picture_bytes, in_call_participants):
         """
@@ -678,12 +1036,59 @@ class Server(object):
         :param in_call_participants: [str], the names of the participants who are in call with the user.
         """
         user = self.db.connected_users[client_socket]
-        self.db.update_user_profile_picture(user.username, new_encoded_picture_bytes)
+        self.db_worker.submit(DataBaseStore.update_user_profile_picture, (user.username, new_encoded_picture_bytes),
+                              partial(self.inform_users_about_picture_change, user, in_call_participants))
+
+    def inform_users_about_picture_change(self, user, in_call_participants, picture_future):
+        """
+        Updates the picture of a user for all his online contacts and the users he is in call with,
+        once the new picture was saved.
+        :param user: User, the user who changed his picture.
+        :param in_call_participants: [str] or None, the names of the participants who are in call with the user.
+        :param picture_future: DataBaseFuture, the future of the digest of the new picture.
+        """
+        try:
+            user.picture_digest = picture_future.result()
+        except InvalidPictureException:
+            print "DEBUG - INVALID PICTURE EXCEPTION"
+            return
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not save user picture: " + repr(e)
+            return
+        if user.client_socket not in self.db.connected_users:
+            return
         connected_contacts_list = self.db.create_user_objects_list_of_connected_contacts(user.username)
-        self.communication_handler.send_contact_changed_picture_message_to_all_contacts(connected_contacts_list, user.username, new_encoded_picture_bytes)
+        self.communication_handler.send_contact_changed_picture_message_to_all_contacts(connected_contacts_list, user.username, user.picture_digest)
         if in_call_participants is not None:
-            participants_list = self.db.create_users_list_through_names(in_call_participants)
-            self.communication_handler.broadcast_participant_changed_picture_message(participants_list, user.username, new_encoded_picture_bytes)
+            try:
+                participants_list = self.db.create_users_list_through_names(in_call_participants)
+                self.communication_handler.broadcast_participant_changed_picture_message(participants_list, user.username, user.picture_digest)
+            except UserNotConnectedException:
+                print "DEBUG - USER NOT CONNECTED EXCEPTION"
+
+    def provide_pictures(self, client_socket, request_pictures_message):
+        """
+        Sends a client the profile pictures that it asked for.
+        A requested picture is only sent if it is still the current picture of its owner, otherwise the client
+        is informed about the newer picture by a picture changed message anyway.
+        :param client_socket: socket, the socket of the client.
+        :param request_pictures_message: RequestPicturesMessage, the message that contains the requested digests.
+        """
+        self.db_worker.submit(DataBaseStore.get_current_pictures, (request_pictures_message.digest_owner_dict,),
+                              partial(self.finish_provide_pictures, client_socket))
+
+    def finish_provide_pictures(self, client_socket, pictures_future):
+        """
+        Sends a client the pictures that were read by the database worker.
+        :param client_socket: socket, the socket of the client.
+        :param pictures_future: DataBaseFuture, the future of the pictures, {digest:encoded picture bytes}.
+        """
+        try:
+            digest_encoded_picture_dict = pictures_future.result()
+        except DATABASE_ERRORS as e:
+            print "DEBUG - could not read pictures: " + repr(e)
+            digest_encoded_picture_dict = {}
+        self.communication_handler.send_pictures_message(client_socket, digest_encoded_picture_dict)
 
     def change_call_host(self, host_client_socket, host_left_message):
         """
@@ -719,6 +1124,7 @@ class Server(object):
         all_call_participants = other_in_call_participants + [host_user]
         # represent the requesting user as the called user and the in call members as the calling users
         self.communication_handler.send_call_messages_for_call_start(requesting_user, all_call_participants, allow_call_join_message.call_name, self.db)
+        self.relay_large_call_media(allow_call_join_message.call_name, all_call_participants + [requesting_user])
 
     def relay_call_join_request(self, requesting_client_socket, request_join_call_message):
         """
@@ -754,7 +1160,33 @@ class Server(object):
             raise UserIsNotBeingCalledException()
         calling_users = self.db.create_calling_users_list(called_user)
         not_in_call_members_users = self.db.create_not_in_call_members_users_list(called_user)
+        call_name = called_user.being_called_information.call_name
         self.communication_handler.start_call_between_users(called_user, calling_users, not_in_call_members_users, self.db)
+        self.relay_large_call_media(call_name, calling_users + [called_user])
+
+    def relay_large_call_media(self, call_name, call_users):
+        """
+        Moves the media of a call to the media relay once the call has more than RELAY_PARTICIPANTS_THRESHOLD
+        participants, and moves the participants who join a relayed call to the relay too. Once the call has more
+        than MIXING_PARTICIPANTS_THRESHOLD participants, the relay mixes its voice as well.
+        Should be called after the participants were told about their peers, so they already have a call port.
+        A call that was moved to the relay stays on it until it ends, even if participants leave.
+        :param call_name: str, the name of the call group.
+        :param call_users: [User], all the participants of the call.
+        """
+        if len(call_users) <= RELAY_PARTICIPANTS_THRESHOLD and not self.media_relay.has_call(call_name):
+            return
+        new_relayed_users = [user for user in call_users if not self.media_relay.has_participant(user.media_source_id)]
+        for user in new_relayed_users:
+            self.media_relay.add_participant(call_name, user.media_source_id, (user.ip, user.get_call_port()), user.audio_codecs)
+        self.communication_handler.send_use_media_relay_message(new_relayed_users, call_name, self.media_relay.get_port())
+        new_mixed_users = new_relayed_users
+        if len(call_users) > MIXING_PARTICIPANTS_THRESHOLD and not self.media_relay.is_call_mixed(call_name):
+            self.media_relay.mix_call(call_name)
+            new_mixed_users = call_users
+        if self.media_relay.is_call_mixed(call_name) and new_mixed_users:
+            self.communication_handler.send_use_audio_mixer_message(new_mixed_users, call_name, self.media_relay.get_mixer_source_id(call_name))
+        print "DEBUG - relaying the media of call " + call_name + " with " + str(len(call_users)) + " participants"
 
     def inform_user_about_call_reject(self, called_user_client_socket):
         """
@@ -793,30 +1225,44 @@ class Server(object):
         """
         try:
             while True:
-                rlist, wlist, xlist = select(self.db.pending_users.keys() + self.db.connected_users.keys() + [self.server_socket], [], [])
-                for ready_socket in rlist:
+                readable_sockets, writable_sockets = self.engine.wait_for_socket_events()
+                for ready_socket in writable_sockets:
+                    self.communication_handler.flush_outgoing_buffer(ready_socket)
+                for ready_socket in readable_sockets:
                     try:
                         if ready_socket is self.server_socket:
                             self.accept_pending_user()
-                        elif ready_socket in self.db.pending_users:
-                            self.handle_pending_user(ready_socket)
-                        else:  # a connected user
-                            self.handle_connected_user(ready_socket)
+                        elif ready_socket is self.db_worker.wakeup_socket:
+                            self.db_worker.run_completed_callbacks()
+                        else:  # a pending or a connected user
+                            self.handle_ready_client(ready_socket)
                     except socket.error:
                         self.disconnect_user(ready_socket)
-                    except InvalidConnectionMessageException:
+                    except (InvalidConnectionMessageException, Common_Elements.InvalidFrameException):
                         self.disconnect_user(ready_socket)
+                    self.disconnect_failed_users()
+                self.disconnect_failed_users()
         finally:
+            self.engine.close()
             self.server_socket.close()
-            self.db.conn.close()
+            self.db_worker.stop()
+            self.media_relay.stop()
 
 
 def main():
     """
     Main fucntion. Runs the server to the end of times.
     Rest In Spaghetti CPU never forggeti :^(
+    The server engine can be chosen by the first command line argument (select / epoll).
     """
-    server = Server()
+    engine_type = DEFAULT_SERVER_ENGINE
+    if len(sys.argv) > SERVER_ENGINE_ARGUMENT_INDEX:
+        engine_type = sys.argv[SERVER_ENGINE_ARGUMENT_INDEX]
+    try:
+        server = Server(engine_type)
+    except UnknownServerEngineException:
+        print "Unknown server engine - " + engine_type + ", available engines: " + str(SERVER_ENGINE_TYPES)
+        return
     server.open_server()
     server.run_server()
 
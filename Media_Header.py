@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+import random
+import struct
+import time
+
+MEDIA_HEADER_VERSION = 2  # version 1 had no source id, every participant sent to sockets of its own
+# version, stream id, sequence number, media timestamp, send time in milliseconds, source id - 16 bytes,
+# like an RTP header.
+MEDIA_HEADER_STRUCT = struct.Struct(">BBHIII")
+MEDIA_SOURCE_ID_BITS = 32
+
+# Stream ids, one for every type of data that a participant sends.
+VOICE_STREAM_ID = 0
+CAMERA_STREAM_ID = 1
+SCREEN_STREAM_ID = 2
+FEEDBACK_STREAM_ID = 3  # the reports of a receiver about the streams that it gets, for the senders' rate control
+CAMERA_LOW_STREAM_ID = 4  # the low resolution layer of the camera, for small camera windows
+SUBSCRIPTION_STREAM_ID = 5  # the camera layer that a receiver wants of a sender, see Simulcast
+STREAM_IDS = [VOICE_STREAM_ID, CAMERA_STREAM_ID, SCREEN_STREAM_ID, FEEDBACK_STREAM_ID, CAMERA_LOW_STREAM_ID,
+              SUBSCRIPTION_STREAM_ID]
+STREAM_ID_NAME_DICT = {VOICE_STREAM_ID: "voice", CAMERA_STREAM_ID: "camera", SCREEN_STREAM_ID: "screen",
+                       FEEDBACK_STREAM_ID: "feedback", CAMERA_LOW_STREAM_ID: "camera low",
+                       SUBSCRIPTION_STREAM_ID: "subscription"}
+
+VIDEO_CLOCK_RATE = 90000  # the timestamps of camera and screen frames, like RTP video
+SEQUENCE_NUMBER_MODULO = 2 ** 16  # sequence numbers are sent as 16-bit numbers and wrap around
+HALF_SEQUENCE_NUMBER_MODULO = SEQUENCE_NUMBER_MODULO / 2
+TIMESTAMP_MODULO = 2 ** 32
+MILLISECONDS_IN_SECOND = 1000
+
+
+class MediaHeaderException(Exception):
+    pass
+
+
+def sequence_numbers_distance(from_sequence_number, to_sequence_number):
+    """
+    Gets the distance between two sequence numbers, taking wrap around into account.
+    :param from_sequence_number: int, the first sequence number.
+    :param to_sequence_number: int, the second sequence number.
+    :return: int, how many packets to_sequence_number comes after from_sequence_number, negative if it comes before it.
+    """
+    distance = (to_sequence_number - from_sequence_number) % SEQUENCE_NUMBER_MODULO
+    if distance >= HALF_SEQUENCE_NUMBER_MODULO:
+        distance -= SEQUENCE_NUMBER_MODULO
+    return distance
+
+
+def create_media_source_id():
+    """
+    Creates the source id of a client's media packets. The ids are random, like RTP's SSRC, so clients do not need
+    to coordinate them.
+    :return: int, a random 32-bit source id.
+    """
+    return random.getrandbits(MEDIA_SOURCE_ID_BITS)
+
+
+def get_send_time(current_time=None):
+    """
+    Gets the send time of a packet - the wall clock in milliseconds, wrapped to 32 bits.
+    :param current_time: float or None, the time in seconds, or None for now.
+    :return: int, the send time.
+    """
+    if current_time is None:
+        current_time = time.time()
+    return int(current_time * MILLISECONDS_IN_SECOND) % TIMESTAMP_MODULO
+
+
+def get_video_timestamp(current_time=None):
+    """
+    Gets the media timestamp of a camera or screen frame that is captured now.
+    :param current_time: float or None, the capture time in seconds, or None for now.
+    :return: int, the timestamp in VIDEO_CLOCK_RATE units, wrapped to 32 bits.
+    """
+    if current_time is None:
+        current_time = time.time()
+    return int(current_time * VIDEO_CLOCK_RATE) % TIMESTAMP_MODULO
+
+
+class MediaHeader(object):
+    """
+    The header at the start of every media datagram.
+    """
+    def __init__(self, source_id, stream_id, sequence_number, timestamp, send_time):
+        """
+        *source_id - int, identifies the participant that sent the packet, 32-bit.
+        *stream_id - int, the type of the data, one of STREAM_IDS.
+        *sequence_number - int, counts the packets of the stream, 16-bit.
+        *timestamp - int, the time that the data was captured in, in the clock rate of the stream, 32-bit.
+        *send_time - int, the wall clock of the sender when the packet was sent, in milliseconds, 32-bit.
+        """
+        self.source_id = source_id
+        self.stream_id = stream_id
+        self.sequence_number = sequence_number
+        self.timestamp = timestamp
+        self.send_time = send_time
+
+    def pack(self):
+        """
+        :return: str, the header bytes.
+        """
+        return MEDIA_HEADER_STRUCT.pack(MEDIA_HEADER_VERSION, self.stream_id, self.sequence_number, self.timestamp,
+                                        self.send_time, self.source_id)
+
+
+def parse_media_packet(packet):
+    """
+    Splits a media datagram to its header and its data.
+    Raises MediaHeaderException if the datagram does not start with a valid header.
+    :param packet: str, the datagram.
+    :return: [0]: MediaHeader, the header of the datagram.
+    [1]: str, the data of the datagram.
+    """
+    if len(packet) < MEDIA_HEADER_STRUCT.size:
+        raise MediaHeaderException("Media packet is too short")
+    version, stream_id, sequence_number, timestamp, send_time, source_id = MEDIA_HEADER_STRUCT.unpack_from(packet)
+    if version != MEDIA_HEADER_VERSION:
+        raise MediaHeaderException("Unsupported media header version " + str(version))
+    if stream_id not in STREAM_ID_NAME_DICT:
+        raise MediaHeaderException("Unknown media stream " + str(stream_id))
+    return MediaHeader(source_id, stream_id, sequence_number, timestamp, send_time), packet[MEDIA_HEADER_STRUCT.size:]
+
+
+class MediaStreamSender(object):
+    """
+    Adds the media header to the packets of one of the user's streams, and counts what was sent.
+    """
+    def __init__(self, source_id, stream_id):
+        """
+        *sequence_number - int, the sequence number of the next packet.
+        *sent_packets - int, the number of packets that were created.
+        *sent_bytes - int, the number of data bytes in the packets that were created, without headers.
+        :param source_id: int, the source id of the user's packets.
+        :param stream_id: int, the stream, one of STREAM_IDS.
+        """
+        self.source_id = source_id
+        self.stream_id = stream_id
+        self.sequence_number = 0
+        self.sent_packets = 0
+        self.sent_bytes = 0
+
+    def create_packet(self, data, timestamp):
+        """
+        Adds the header to the data of a packet.
+        :param data: str, the data of the packet.
+        :param timestamp: int, the time that the data was captured in, in the clock rate of the stream.
+        :return: str, the packet.
+        """
+        header = MediaHeader(self.source_id, self.stream_id, self.sequence_number, timestamp % TIMESTAMP_MODULO,
+                             get_send_time())
+        self.sequence_number = (self.sequence_number + 1) % SEQUENCE_NUMBER_MODULO
+        self.sent_packets += 1
+        self.sent_bytes += len(data)
+        return header.pack() + data
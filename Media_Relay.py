@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+
+import socket
+import time
+from threading import Thread
+from Common_Elements import AESCipher
+from Media_Header import parse_media_packet, create_media_source_id, MediaHeaderException, MEDIA_HEADER_STRUCT, \
+    VOICE_STREAM_ID, SUBSCRIPTION_STREAM_ID
+from Audio_Mixer import AudioMixer, MIXING_RATE, MIXING_CHUNK
+from Simulcast import LayerSubscriptions, parse_subscription, SubscriptionException, CAMERA_LAYER_STREAM_IDS
+
+RELAY_IP = "0.0.0.0"
+RELAY_PORT = 9998
+RELAY_PARTICIPANTS_THRESHOLD = 4  # calls with more participants than this send their media through the relay
+MAX_DATAGRAM_SIZE = 65536
+RELAY_RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024  # room for the bursts of camera frames of many calls
+MIXING_PERIOD = float(MIXING_CHUNK) / MIXING_RATE  # a mixed chunk is sent every chunk duration
+
+
+class RelayedCall(object):
+    """
+    A call whose media goes through the relay.
+    """
+    def __init__(self, call_name):
+        """
+        *source_id_address_dict - {int:(IP, PORT)}, the address of the call socket of every participant by its
+        source id. The dictionary is never changed in place, it is replaced by a changed copy, so the relay thread
+        can go over it while the server's thread changes the participants.
+        *source_id_audio_codecs_dict - {int:[str]}, the audio codecs that every participant can decode.
+        *audio_mixer - AudioMixer or None, mixes the voice of the call if the call is mixed, else the voice is
+        forwarded like the rest of the media.
+        *source_id_subscriptions_dict - {int:LayerSubscriptions}, the subscriptions to the camera layers of every
+        participant by its source id. Replaced by a changed copy, like source_id_address_dict.
+        :param call_name: str, the name of the call group of the call.
+        """
+        self.call_name = call_name
+        self.source_id_address_dict = {}
+        self.source_id_audio_codecs_dict = {}
+        self.source_id_subscriptions_dict = {}
+        self.audio_mixer = None
+
+    def add_participant(self, source_id, address, audio_codecs):
+        """
+        :param source_id: int, the source id of the participant's media packets.
+        :param address: (IP, PORT), the address of the participant's call socket.
+        :param audio_codecs: [str], the names of the audio codecs that the participant can decode.
+        """
+        source_id_address_dict = dict(self.source_id_address_dict)
+        source_id_address_dict[source_id] = address
+        self.source_id_address_dict = source_id_address_dict
+        self.source_id_audio_codecs_dict[source_id] = audio_codecs
+        if self.audio_mixer is not None:
+            self.audio_mixer.add_participant(source_id, address, audio_codecs)
+
+    def remove_participant(self, source_id):
+        """
+        :param source_id: int, the source id of the participant's media packets.
+        """
+        source_id_address_dict = dict(self.source_id_address_dict)
+        source_id_address_dict.pop(source_id, None)
+        self.source_id_address_dict = source_id_address_dict
+        self.source_id_audio_codecs_dict.pop(source_id, None)
+        source_id_subscriptions_dict = dict(self.source_id_subscriptions_dict)
+        source_id_subscriptions_dict.pop(source_id, None)
+        self.source_id_subscriptions_dict = source_id_subscriptions_dict
+        for subscriptions in source_id_subscriptions_dict.itervalues():
+            subscriptions.remove_receiver(source_id)
+        if self.audio_mixer is not None:
+            self.audio_mixer.remove_participant(source_id)
+
+    def subscribe(self, receiver_source_id, sender_source_id, stream_id):
+        """
+        :param receiver_source_id: int, the source id of the participant that subscribed.
+        :param sender_source_id: int, the source id of the participant whose camera the subscription is for.
+        :param stream_id: int, the stream id of the camera layer, or NO_LAYER.
+        """
+        if sender_source_id not in self.source_id_address_dict:
+            return
+        subscriptions = self.source_id_subscriptions_dict.get(sender_source_id)
+        if subscriptions is None:
+            subscriptions = LayerSubscriptions()
+            source_id_subscriptions_dict = dict(self.source_id_subscriptions_dict)
+            source_id_subscriptions_dict[sender_source_id] = subscriptions
+            self.source_id_subscriptions_dict = source_id_subscriptions_dict
+        subscriptions.subscribe(receiver_source_id, stream_id)
+
+    def get_receiver_addresses(self, header):
+        """
+        :param header: MediaHeader, the header of a forwarded packet.
+        :return: [(IP, PORT)], the addresses of the participants that the packet is forwarded to - the camera layers
+        only to the participants that subscribed to them, the rest of the media to all the other participants.
+        """
+        if header.stream_id in CAMERA_LAYER_STREAM_IDS:
+            subscriptions = self.source_id_subscriptions_dict.get(header.source_id)
+            if subscriptions is None:
+                return []
+            source_id_address_dict = self.source_id_address_dict
+            return [source_id_address_dict[source_id] for source_id in subscriptions.get_subscribers(header.stream_id)
+                    if source_id in source_id_address_dict]
+        return [address for source_id, address in self.source_id_address_dict.iteritems()
+                if source_id != header.source_id]
+
+    def start_mixing(self):
+        """
+        Starts mixing the voice of the call instead of forwarding it.
+        """
+        audio_mixer = AudioMixer(create_media_source_id())
+        for source_id, address in self.source_id_address_dict.iteritems():
+            audio_mixer.add_participant(source_id, address, self.source_id_audio_codecs_dict[source_id])
+        self.audio_mixer = audio_mixer
+
+
+class MediaRelay(Thread):
+    """
+    A Selective Forwarding Unit that runs alongside the main server. In large calls every participant sends its media
+    once, to the relay, and the relay forwards every packet to the other participants of the call, instead of every
+    participant sending every packet to every other participant.
+    Only the media header is read from a packet - at most a single AES block is decrypted - and the packet is
+    forwarded as it arrived, so the relay does not decrypt, decode or re-encrypt the media.
+    The layers of a participant's camera are only forwarded to the participants that subscribed to them. The relay
+    reads the small subscription packets on their way to the senders, so it knows the subscriptions too.
+    The voice of very large calls is mixed instead (see AudioMixer) by the mixing thread, and only the camera and
+    screen data is forwarded.
+    The calls are changed by the server's thread and the packets are forwarded by the relay thread.
+    """
+    def __init__(self, port=RELAY_PORT):
+        """
+        Opens the relay socket. The relay thread is not started yet.
+        source_id_call_dict - {int:RelayedCall}, the call of every relayed participant by its source id.
+        call_name_call_dict - {str:RelayedCall}, the relayed calls by their names.
+        mixing_thread - Thread, sends the mixed voice of the mixed calls, started with the relay thread.
+        :param port: int, the port that the relay receives on.
+        """
+        super(MediaRelay, self).__init__()
+        self.daemon = True
+        self.port = port
+        self.cipher = AESCipher()
+        self.mixing_cipher = AESCipher()  # the mixing thread encrypts with a cipher of its own
+        self.mixing_thread = Thread(target=self.mixing_loop)
+        self.mixing_thread.daemon = True
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RELAY_RECEIVE_BUFFER_BYTES)
+        self.source_id_call_dict = {}
+        self.call_name_call_dict = {}
+        self.is_open = False
+        self.received_packets = 0
+        self.forwarded_packets = 0
+        self.dropped_packets = 0
+
+    def open(self):
+        """
+        Binds the relay socket.
+        """
+        self.sock.bind((RELAY_IP, self.port))
+        self.is_open = True
+
+    def get_port(self):
+        """
+        :return: int, the port that the relay receives on.
+        """
+        return self.sock.getsockname()[1]
+
+    def has_call(self, call_name):
+        """
+        :param call_name: str, the name of a call group.
+        :return: Bool, True if the media of the call goes through the relay.
+        """
+        return call_name in self.call_name_call_dict
+
+    def has_participant(self, source_id):
+        """
+        :param source_id: int, the source id of a user's media packets.
+        :return: Bool, True if the user's media goes through the relay.
+        """
+        return source_id in self.source_id_call_dict
+
+    def is_call_mixed(self, call_name):
+        """
+        :param call_name: str, the name of a call group.
+        :return: Bool, True if the voice of the call is mixed by the relay.
+        """
+        return self.has_call(call_name) and self.call_name_call_dict[call_name].audio_mixer is not None
+
+    def get_mixer_source_id(self, call_name):
+        """
+        :param call_name: str, the name of a mixed call group.
+        :return: int, the source id of the mixed voice packets of the call.
+        """
+        return self.call_name_call_dict[call_name].audio_mixer.mixer_source_id
+
+    def mix_call(self, call_name):
+        """
+        Starts mixing the voice of a relayed call, so every participant gets a single voice stream.
+        :param call_name: str, the name of a relayed call group.
+        """
+        self.call_name_call_dict[call_name].start_mixing()
+
+    def add_participant(self, call_name, source_id, address, audio_codecs):
+        """
+        Starts relaying the media of a participant to the other participants of its call, and the media of the other
+        participants to it.
+        :param call_name: str, the name of the call group of the call.
+        :param source_id: int, the source id of the participant's media packets.
+        :param address: (IP, PORT), the address of the participant's call socket.
+        :param audio_codecs: [str], the names of the audio codecs that the participant can decode.
+        """
+        self.remove_participant(source_id)
+        relayed_call = self.call_name_call_dict.get(call_name)
+        if relayed_call is None:
+            relayed_call = RelayedCall(call_name)
+            self.call_name_call_dict[call_name] = relayed_call
+        relayed_call.add_participant(source_id, address, audio_codecs)
+        self.source_id_call_dict[source_id] = relayed_call
+
+    def remove_participant(self, source_id):
+        """
+        Stops relaying the media of a participant. A call is forgotten once its last participant is removed.
+        :param source_id: int, the source id of the participant's media packets.
+        """
+        relayed_call = self.source_id_call_dict.pop(source_id, None)
+        if relayed_call is None:
+            return
+        relayed_call.remove_participant(source_id)
+        if not relayed_call.source_id_address_dict:
+            del self.call_name_call_dict[relayed_call.call_name]
+
+    def read_media_header(self, encrypted_packet):
+        """
+        Reads the media header of a packet without decrypting the rest of it.
+        Raises MediaHeaderException if the packet does not start with a valid header.
+        :param encrypted_packet: str, the packet as it was sent.
+        :return: MediaHeader, the header of the packet.
+        """
+        header_bytes = self.cipher.decrypt_message_prefix(encrypted_packet, MEDIA_HEADER_STRUCT.size)
+        return parse_media_packet(header_bytes)[0]
+
+    def forward_packet(self):
+        """
+        Receives a single packet and forwards it to the other participants of its sender's call.
+        The source id of a packet is known to every participant of the call, so a packet is only accepted from the
+        address that its source id was added with - anyone else could inject media into the call through the relay.
+        """
+        encrypted_packet, address = self.sock.recvfrom(MAX_DATAGRAM_SIZE)
+        self.received_packets += 1
+        try:
+            header = self.read_media_header(encrypted_packet)
+        except (MediaHeaderException, ValueError):
+            self.dropped_packets += 1
+            return
+        relayed_call = self.source_id_call_dict.get(header.source_id)
+        if relayed_call is None or relayed_call.source_id_address_dict.get(header.source_id) != address:
+            self.dropped_packets += 1
+            return
+        audio_mixer = relayed_call.audio_mixer
+        if audio_mixer is not None and header.stream_id == VOICE_STREAM_ID:
+            self.mix_voice_packet(audio_mixer, encrypted_packet)
+            return
+        if header.stream_id == SUBSCRIPTION_STREAM_ID:
+            self.read_subscription_packet(relayed_call, encrypted_packet)
+        for address in relayed_call.get_receiver_addresses(header):
+            self.sock.sendto(encrypted_packet, address)
+            self.forwarded_packets += 1
+
+    def read_subscription_packet(self, relayed_call, encrypted_packet):
+        """
+        Reads the subscription of a participant to a camera layer, before it is forwarded.
+        :param relayed_call: RelayedCall, the call of the participant that subscribed.
+        :param encrypted_packet: str, the subscription packet as it was sent.
+        """
+        try:
+            header, data = parse_media_packet(self.cipher.decrypt_message(encrypted_packet))
+            sender_source_id, stream_id = parse_subscription(data)
+        except (MediaHeaderException, SubscriptionException, ValueError):
+            self.dropped_packets += 1
+            return
+        relayed_call.subscribe(header.source_id, sender_source_id, stream_id)
+
+    def mix_voice_packet(self, audio_mixer, encrypted_packet):
+        """
+        Hands a voice packet of a mixed call to the call's mixer.
+        :param audio_mixer: AudioMixer, the mixer of the call.
+        :param encrypted_packet: str, the voice packet as it was sent.
+        """
+        arrival_time = time.time()
+        try:
+            header, voice_packet = parse_media_packet(self.cipher.decrypt_message(encrypted_packet))
+        except (MediaHeaderException, ValueError):
+            self.dropped_packets += 1
+            return
+        audio_mixer.put(header, voice_packet, arrival_time)
+
+    def mixing_loop(self):
+        """
+        Mixes the voice of the mixed calls and sends it, once every chunk duration, until the relay is stopped.
+        """
+        next_mixing_time = time.time()
+        while self.is_open:
+            for relayed_call in self.call_name_call_dict.values():
+                audio_mixer = relayed_call.audio_mixer
+                if audio_mixer is None:
+                    continue
+                for address, packet in audio_mixer.mix():
+                    try:
+                        self.sock.sendto(self.mixing_cipher.encrypt_message(packet), address)
+                    except socket.error as e:
+                        if self.is_open:
+                            print "MEDIA RELAY MIXING ERROR " + str(e)
+            next_mixing_time += MIXING_PERIOD
+            wait_time = next_mixing_time - time.time()
+            if wait_time > 0:
+                time.sleep(wait_time)
+            else:  # the mixing fell behind, skip the missed periods instead of mixing them in a burst
+                next_mixing_time = time.time()
+
+    def start(self):
+        """
+        Starts the relay thread and the mixing thread.
+        """
+        super(MediaRelay, self).start()
+        self.mixing_thread.start()
+
+    def run(self):
+        """
+        Forwards packets until the relay is stopped.
+        """
+        while self.is_open:
+            try:
+                self.forward_packet()
+            except socket.error as e:
+                if self.is_open:
+                    print "MEDIA RELAY ERROR " + str(e)  # a participant's port is closed, keep relaying the others
+
+    def stop(self):
+        """
+        Closes the relay socket, which also ends the relay thread.
+        """
+        self.is_open = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)  # wakes up the relay thread
+        except socket.error:
+            pass
+        self.sock.close()
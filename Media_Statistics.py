@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+
+from Media_Header import sequence_numbers_distance, SEQUENCE_NUMBER_MODULO, TIMESTAMP_MODULO, MILLISECONDS_IN_SECOND, \
+    STREAM_ID_NAME_DICT
+
+JITTER_SMOOTHING = 16.0  # the jitter estimate of RFC 3550
+DELAY_SMOOTHING = 16.0
+HALF_TIMESTAMP_MODULO = TIMESTAMP_MODULO / 2
+
+
+def wrapped_difference(first_value, second_value):
+    """
+    Subtracts two 32-bit wrapping values.
+    :param first_value: int, the value to subtract from.
+    :param second_value: int, the value to subtract.
+    :return: int, first_value - second_value, taking wrap around into account.
+    """
+    difference = (first_value - second_value) % TIMESTAMP_MODULO
+    if difference >= HALF_TIMESTAMP_MODULO:
+        difference -= TIMESTAMP_MODULO
+    return difference
+
+
+class MediaStreamStatistics(object):
+    """
+    Receiver side statistics of a participant's media stream, measured from the media headers of its packets:
+    the packets that were lost or arrived out of order, the jitter, and an estimate of the one-way delay.
+    The delay is measured with the sender's wall clock, so it is only as accurate as the clocks of the two computers
+    are synchronized. The queuing delay - how much the delay grew above the lowest delay that was seen - does not
+    depend on the clocks, and shows congestion.
+    """
+    def __init__(self, stream_id, clock_rate):
+        """
+        *base_sequence_number - int or None, the sequence number of the first packet.
+        *highest_sequence_number - int, the highest sequence number that arrived, extended beyond 16 bits,
+        so it keeps growing when the sequence numbers wrap around.
+        :param stream_id: int, the stream, one of Media_Header.STREAM_IDS.
+        :param clock_rate: int, the clock rate of the stream's timestamps.
+        """
+        self.stream_id = stream_id
+        self.clock_rate = clock_rate
+        self.base_sequence_number = None
+        self.highest_sequence_number = 0
+        self.received_packets = 0
+        self.received_bytes = 0
+        self.reordered_packets = 0
+        self.duplicate_packets = 0
+        self.jitter = 0.0
+        self.last_transit = None
+        self.one_way_delay = None
+        self.min_one_way_delay = None
+        self.last_report_time = None
+        self.last_report_expected_packets = 0
+        self.last_report_received_packets = 0
+        self.last_report_received_bytes = 0
+
+    def update(self, header, data_size, arrival_time):
+        """
+        Updates the statistics with a packet that arrived.
+        :param header: MediaHeader, the header of the packet.
+        :param data_size: int, the number of data bytes in the packet.
+        :param arrival_time: float, the time that the packet arrived in, in seconds.
+        :return: Bool, True if the packet is newer than every packet that arrived before it, False if it arrived
+        out of order.
+        """
+        self.received_packets += 1
+        self.received_bytes += data_size
+        self.update_delays(header, arrival_time)
+        if self.base_sequence_number is None:
+            self.base_sequence_number = header.sequence_number
+            self.last_report_time = arrival_time
+            self.highest_sequence_number = header.sequence_number
+            return True
+        distance = sequence_numbers_distance(self.highest_sequence_number % SEQUENCE_NUMBER_MODULO,
+                                             header.sequence_number)
+        if distance > 0:
+            self.highest_sequence_number += distance
+            return True
+        if distance == 0:
+            self.duplicate_packets += 1
+        else:
+            self.reordered_packets += 1
+        return False
+
+    def update_delays(self, header, arrival_time):
+        """
+        Updates the jitter, like RFC 3550 does, and the one-way delay estimate with the arrival of a packet.
+        :param header: MediaHeader, the header of the packet.
+        :param arrival_time: float, the time that the packet arrived in, in seconds.
+        """
+        transit = arrival_time - float(header.timestamp) / self.clock_rate
+        if self.last_transit is not None:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / JITTER_SMOOTHING
+        self.last_transit = transit
+        arrival_milliseconds = int(arrival_time * MILLISECONDS_IN_SECOND) % TIMESTAMP_MODULO
+        delay = float(wrapped_difference(arrival_milliseconds, header.send_time)) / MILLISECONDS_IN_SECOND
+        if self.one_way_delay is None:
+            self.one_way_delay = delay
+            self.min_one_way_delay = delay
+        else:
+            self.one_way_delay += (delay - self.one_way_delay) / DELAY_SMOOTHING
+            self.min_one_way_delay = min(self.min_one_way_delay, delay)
+
+    def get_expected_packets(self):
+        """
+        :return: int, the number of packets that the sender sent, by the sequence numbers that arrived.
+        """
+        if self.base_sequence_number is None:
+            return 0
+        return self.highest_sequence_number - self.base_sequence_number + 1
+
+    def get_lost_packets(self):
+        """
+        :return: int, the number of packets that were sent and did not arrive.
+        """
+        return max(0, self.get_expected_packets() - (self.received_packets - self.duplicate_packets))
+
+    def get_loss_percentage(self):
+        """
+        :return: float, the percentage of the sent packets that did not arrive.
+        """
+        expected_packets = self.get_expected_packets()
+        if not expected_packets:
+            return 0.0
+        return 100.0 * self.get_lost_packets() / expected_packets
+
+    def get_queuing_delay(self):
+        """
+        :return: float, how much the one-way delay is above the lowest delay that was seen, in seconds.
+        """
+        if self.one_way_delay is None:
+            return 0.0
+        return max(0.0, self.one_way_delay - self.min_one_way_delay)
+
+    def has_interval_packets(self):
+        """
+        :return: Bool, True if packets arrived since the last interval report, False if the stream stopped.
+        """
+        return self.received_packets - self.duplicate_packets > self.last_report_received_packets
+
+    def get_interval_report(self, current_time):
+        """
+        Measures the stream since the last time that this was called, for a report to the sender. The first interval
+        starts with the first packet.
+        Called only after a packet arrived.
+        :param current_time: float, the time now, in seconds.
+        :return: [0]: float, the part of the packets of the interval that did not arrive, 0 to 1.
+        [1]: float, the bytes of the stream that arrived every second in the interval.
+        """
+        expected_packets = self.get_expected_packets() - self.last_report_expected_packets
+        received_packets = (self.received_packets - self.duplicate_packets) - self.last_report_received_packets
+        received_bytes = self.received_bytes - self.last_report_received_bytes
+        fraction_lost = max(0.0, float(expected_packets - received_packets) / expected_packets) if expected_packets \
+            else 0.0
+        if current_time > self.last_report_time:
+            receive_rate = received_bytes / (current_time - self.last_report_time)
+        else:
+            receive_rate = 0.0
+        self.last_report_time = current_time
+        self.last_report_expected_packets += expected_packets
+        self.last_report_received_packets += received_packets
+        self.last_report_received_bytes += received_bytes
+        return fraction_lost, receive_rate
+
+    def __str__(self):
+        return "{0}: {1} packets, loss {2:.1f}%, reordered {3}, jitter {4:.1f} ms, delay {5:.1f} ms " \
+               "(queuing {6:.1f} ms)".format(STREAM_ID_NAME_DICT[self.stream_id], self.received_packets,
+                                             self.get_loss_percentage(), self.reordered_packets, self.jitter * 1000,
+                                             (self.one_way_delay or 0.0) * 1000, self.get_queuing_delay() * 1000)
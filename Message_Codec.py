@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+
+import struct
+
+# Value tags - every encoded value starts with one of these bytes.
+NONE_TAG = 0
+FALSE_TAG = 1
+TRUE_TAG = 2
+INT8_TAG = 3
+INT32_TAG = 4
+INT64_TAG = 5
+FLOAT_TAG = 6
+SHORT_BYTES_TAG = 7  # byte strings shorter than 256 bytes, the length takes a single byte
+BYTES_TAG = 8
+SHORT_TEXT_TAG = 9
+TEXT_TAG = 10
+LIST_TAG = 11
+TUPLE_TAG = 12
+DICT_TAG = 13
+OBJECT_TAG = 14
+
+TAG_STRUCT = struct.Struct(">B")
+INT8_STRUCT = struct.Struct(">b")
+INT32_STRUCT = struct.Struct(">i")
+INT64_STRUCT = struct.Struct(">q")
+FLOAT_STRUCT = struct.Struct(">d")
+SHORT_LENGTH_STRUCT = struct.Struct(">B")
+LENGTH_STRUCT = struct.Struct(">I")
+TYPE_ID_STRUCT = struct.Struct(">H")
+
+MAX_SHORT_LENGTH = 255
+INT8_RANGE = (-2 ** 7, 2 ** 7 - 1)
+INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+INT64_RANGE = (-2 ** 63, 2 ** 63 - 1)
+
+# Field types of the schemas. A field type is a type, a tuple of the types that are allowed, a registered class, or a
+# ListOf, DictOf or Optional of other field types.
+INT_FIELD = (int, long)
+TEXT_FIELD = (str, unicode)
+BOOL_FIELD = bool
+
+
+class MessageCodecException(Exception):
+    pass
+
+
+class ListOf(object):
+    """
+    The field type of a list whose items all have the same field type.
+    """
+    def __init__(self, item_type):
+        """
+        :param item_type: the field type of the items.
+        """
+        self.item_type = item_type
+
+    def is_valid(self, value):
+        """
+        :param value: a decoded value.
+        :return: Bool, True if the value is a list of valid items.
+        """
+        return type(value) is list and all(is_valid_field_value(item, self.item_type) for item in value)
+
+
+class DictOf(object):
+    """
+    The field type of a dictionary whose keys and values all have the same field types.
+    """
+    def __init__(self, key_type, value_type):
+        """
+        :param key_type: the field type of the keys.
+        :param value_type: the field type of the values.
+        """
+        self.key_type = key_type
+        self.value_type = value_type
+
+    def is_valid(self, value):
+        """
+        :param value: a decoded value.
+        :return: Bool, True if the value is a dictionary of valid keys and values.
+        """
+        return type(value) is dict and all(is_valid_field_value(key, self.key_type) and
+                                           is_valid_field_value(item, self.value_type)
+                                           for key, item in value.iteritems())
+
+
+class Optional(object):
+    """
+    The field type of a field that is either None or of another field type.
+    """
+    def __init__(self, field_type):
+        """
+        :param field_type: the field type of the field when it is not None.
+        """
+        self.field_type = field_type
+
+    def is_valid(self, value):
+        """
+        :param value: a decoded value.
+        :return: Bool, True if the value is None or valid.
+        """
+        return value is None or is_valid_field_value(value, self.field_type)
+
+
+def is_valid_field_value(value, field_type):
+    """
+    :param value: a decoded value.
+    :param field_type: a field type of a schema.
+    :return: Bool, True if the value has the field type. Types are matched exactly, so a bool is not an int.
+    """
+    if isinstance(field_type, (ListOf, DictOf, Optional)):
+        return field_type.is_valid(value)
+    if type(field_type) is tuple:
+        return type(value) in field_type
+    return type(value) is field_type
+
+
+class MessageCodec(object):
+    """
+    A compact binary codec for the objects that are sent between the server and the clients.
+    Unlike pickle, the codec only knows how to build the basic data types and the classes that were registered in it,
+    so a decoded message can never execute code on the receiving side.
+    Every registered class has a constant type id and a schema - the ordered names and types of the fields that are
+    sent. Only the field values are written, one after the other, so the field names do not take space on the wire.
+    A decoded field whose value does not have the type of its field is refused, so the receiving side can trust the
+    types of the fields of every decoded object.
+    """
+    def __init__(self, registry):
+        """
+        Constructs the codec.
+        :param registry: [(int, class, ((str, field type)))], a list of type ids, the classes that they represent and
+        the names and the types of the fields of each class.
+        """
+        self.type_id_schema_dict = {}  # {type id:(class, fields)}
+        self.class_schema_dict = {}  # {class:(type id, fields)}
+        for type_id, registered_class, fields in registry:
+            if type_id in self.type_id_schema_dict or registered_class in self.class_schema_dict:
+                raise MessageCodecException("Duplicate registration of type id " + str(type_id))
+            self.type_id_schema_dict[type_id] = (registered_class, fields)
+            self.class_schema_dict[registered_class] = (type_id, fields)
+
+    def encode(self, value):
+        """
+        Encodes a value into bytes.
+        :param value: any basic value (None, bool, int, float, str, unicode, list, tuple, dict) or a registered object.
+        :return: str, the encoded bytes.
+        """
+        parts = []
+        self.encode_value(value, parts)
+        return "".join(parts)
+
+    def encode_value(self, value, parts):
+        """
+        Encodes a single value and appends the encoded parts to a list.
+        :param value: the value that needs to be encoded.
+        :param parts: [str], the encoded parts of the whole message.
+        """
+        value_type = type(value)
+        if value is None:
+            parts.append(TAG_STRUCT.pack(NONE_TAG))
+        elif value_type is bool:
+            parts.append(TAG_STRUCT.pack(TRUE_TAG if value else FALSE_TAG))
+        elif value_type is str:
+            self.encode_length_prefixed(value, SHORT_BYTES_TAG, BYTES_TAG, parts)
+        elif value_type is unicode:
+            self.encode_length_prefixed(value.encode("utf-8"), SHORT_TEXT_TAG, TEXT_TAG, parts)
+        elif value_type is int or value_type is long:
+            self.encode_integer(value, parts)
+        elif value_type is float:
+            parts.append(TAG_STRUCT.pack(FLOAT_TAG) + FLOAT_STRUCT.pack(value))
+        elif value_type is list or value_type is tuple:
+            parts.append(TAG_STRUCT.pack(LIST_TAG if value_type is list else TUPLE_TAG) + LENGTH_STRUCT.pack(len(value)))
+            for item in value:
+                self.encode_value(item, parts)
+        elif value_type is dict:
+            parts.append(TAG_STRUCT.pack(DICT_TAG) + LENGTH_STRUCT.pack(len(value)))
+            for key, item in value.iteritems():
+                self.encode_value(key, parts)
+                self.encode_value(item, parts)
+        elif value_type in self.class_schema_dict:
+            type_id, fields = self.class_schema_dict[value_type]
+            parts.append(TAG_STRUCT.pack(OBJECT_TAG) + TYPE_ID_STRUCT.pack(type_id))
+            for field, field_type in fields:
+                self.encode_value(getattr(value, field), parts)
+        else:
+            raise MessageCodecException("Cannot encode a value of type " + value_type.__name__)
+
+    def encode_length_prefixed(self, data, short_tag, long_tag, parts):
+        """
+        Encodes a byte string with its length in front of it.
+        :param data: str, the bytes.
+        :param short_tag: int, the tag to use if the bytes are short enough for a one byte length.
+        :param long_tag: int, the tag to use otherwise.
+        :param parts: [str], the encoded parts of the whole message.
+        """
+        if len(data) <= MAX_SHORT_LENGTH:
+            parts.append(TAG_STRUCT.pack(short_tag) + SHORT_LENGTH_STRUCT.pack(len(data)))
+        else:
+            parts.append(TAG_STRUCT.pack(long_tag) + LENGTH_STRUCT.pack(len(data)))
+        parts.append(data)
+
+    def encode_integer(self, value, parts):
+        """
+        Encodes an integer using the smallest fitting size.
+        :param value: int or long, the integer.
+        :param parts: [str], the encoded parts of the whole message.
+        """
+        if INT8_RANGE[0] <= value <= INT8_RANGE[1]:
+            parts.append(TAG_STRUCT.pack(INT8_TAG) + INT8_STRUCT.pack(value))
+        elif INT32_RANGE[0] <= value <= INT32_RANGE[1]:
+            parts.append(TAG_STRUCT.pack(INT32_TAG) + INT32_STRUCT.pack(value))
+        elif INT64_RANGE[0] <= value <= INT64_RANGE[1]:
+            parts.append(TAG_STRUCT.pack(INT64_TAG) + INT64_STRUCT.pack(value))
+        else:
+            raise MessageCodecException("Integer is too big to encode")
+
+    def decode(self, data, start_position=0):
+        """
+        Decodes bytes that were encoded by the codec.
+        Raises MessageCodecException if the bytes are not a single valid encoded value, or if a field of a decoded
+        object does not have the type of its field.
+        :param data: str or bytearray, the encoded bytes. A bytearray is read in place, only the decoded
+        strings are copied out of it.
+        :param start_position: int, the position of the encoded value in the data, the bytes before it are ignored.
+        :return: the decoded value.
+        """
+        try:
+            value, position = self.decode_value(data, start_position)
+        # RuntimeError - nested too deep, TypeError - a dictionary key that cannot be hashed
+        except (struct.error, UnicodeDecodeError, RuntimeError, TypeError):
+            raise MessageCodecException("Invalid encoded data")
+        if position != len(data):
+            raise MessageCodecException("Unexpected data after the encoded value")
+        return value
+
+    def decode_value(self, data, position):
+        """
+        Decodes a single value from a given position.
+        :param data: str or bytearray, the encoded bytes.
+        :param position: int, the position of the value's tag.
+        :return: [0]: the decoded value.
+        [1]: int, the position right after the decoded value.
+        """
+        tag = TAG_STRUCT.unpack_from(data, position)[0]
+        position += TAG_STRUCT.size
+        if tag == NONE_TAG:
+            return None, position
+        elif tag == FALSE_TAG:
+            return False, position
+        elif tag == TRUE_TAG:
+            return True, position
+        elif tag == SHORT_BYTES_TAG or tag == SHORT_TEXT_TAG:
+            length = SHORT_LENGTH_STRUCT.unpack_from(data, position)[0]
+            return self.decode_length_prefixed(data, position + SHORT_LENGTH_STRUCT.size, length, tag == SHORT_TEXT_TAG)
+        elif tag == BYTES_TAG or tag == TEXT_TAG:
+            length = LENGTH_STRUCT.unpack_from(data, position)[0]
+            return self.decode_length_prefixed(data, position + LENGTH_STRUCT.size, length, tag == TEXT_TAG)
+        elif tag == INT8_TAG:
+            return INT8_STRUCT.unpack_from(data, position)[0], position + INT8_STRUCT.size
+        elif tag == INT32_TAG:
+            return INT32_STRUCT.unpack_from(data, position)[0], position + INT32_STRUCT.size
+        elif tag == INT64_TAG:
+            return INT64_STRUCT.unpack_from(data, position)[0], position + INT64_STRUCT.size
+        elif tag == FLOAT_TAG:
+            return FLOAT_STRUCT.unpack_from(data, position)[0], position + FLOAT_STRUCT.size
+        elif tag == LIST_TAG or tag == TUPLE_TAG:
+            items_num = LENGTH_STRUCT.unpack_from(data, position)[0]
+            position += LENGTH_STRUCT.size
+            items = []
+            for i in xrange(items_num):
+                item, position = self.decode_value(data, position)
+                items.append(item)
+            if tag == TUPLE_TAG:
+                return tuple(items), position
+            return items, position
+        elif tag == DICT_TAG:
+            items_num = LENGTH_STRUCT.unpack_from(data, position)[0]
+            position += LENGTH_STRUCT.size
+            items = {}
+            for i in xrange(items_num):
+                key, position = self.decode_value(data, position)
+                item, position = self.decode_value(data, position)
+                items[key] = item
+            return items, position
+        elif tag == OBJECT_TAG:
+            type_id = TYPE_ID_STRUCT.unpack_from(data, position)[0]
+            position += TYPE_ID_STRUCT.size
+            if type_id not in self.type_id_schema_dict:
+                raise MessageCodecException("Unknown type id " + str(type_id))
+            registered_class, fields = self.type_id_schema_dict[type_id]
+            decoded_object = registered_class.__new__(registered_class)  # the fields are set directly, __init__ is not called
+            for field, field_type in fields:
+                field_value, position = self.decode_value(data, position)
+                if not is_valid_field_value(field_value, field_type):
+                    raise MessageCodecException("Invalid type of field " + field + " of type id " + str(type_id))
+                setattr(decoded_object, field, field_value)
+            return decoded_object, position
+        raise MessageCodecException("Unknown value tag " + str(tag))
+
+    def decode_length_prefixed(self, data, position, length, is_text):
+        """
+        Decodes bytes or text that come after their length.
+        :param data: str or bytearray, the encoded bytes.
+        :param position: int, the position of the first byte after the length.
+        :param length: int, the number of bytes.
+        :param is_text: Bool, True if the bytes are utf-8 encoded text, else False.
+        :return: [0]: str or unicode, the decoded value.
+        [1]: int, the position right after the decoded value.
+        """
+        end_position = position + length
+        if end_position > len(data):
+            raise MessageCodecException("Encoded value is longer than the data")
+        value = str(buffer(data, position, length))  # a single copy for both str and bytearray
+        if is_text:
+            value = value.decode("utf-8")
+        return value, end_position
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import numpy as np
+from Audio_Codecs import AudioCodecException, is_comfort_noise_packet
+from Audio_Mixer import fit_chunk, SAMPLE_MIN_VALUE, SAMPLE_MAX_VALUE
+from Jitter_Buffer import LOST_PACKET
+
+DEFAULT_VOICE_GAIN = 1.0
+MIN_VOICE_GAIN = 0.0
+MAX_VOICE_GAIN = 4.0  # a quiet participant can be made up to four times louder
+# Samples of the mix that are louder than this are compressed smoothly towards the largest sample instead of being cut
+# off at it, so a loud mix is a little quieter at its peaks instead of distorted.
+LIMITER_THRESHOLD = 0.75 * SAMPLE_MAX_VALUE
+LIMITER_RANGE = SAMPLE_MAX_VALUE - LIMITER_THRESHOLD
+
+
+def clip_voice_gain(gain):
+    """
+    :param gain: float, a gain that the user chose for a participant.
+    :return: float, the gain within the allowed range.
+    """
+    return max(MIN_VOICE_GAIN, min(MAX_VOICE_GAIN, gain))
+
+
+def soft_limit(mix):
+    """
+    Compresses the samples that are louder than LIMITER_THRESHOLD with a tanh curve, which reaches the largest sample
+    only at infinity, so no sample of the mix has to be clipped. Quieter samples are not changed.
+    :param mix: numpy.ndarray, float samples of a mix, which can be louder than 16-bit samples.
+    :return: [0]: numpy.ndarray, the limited samples, within the range of 16-bit samples.
+    [1]: int, the number of samples that were compressed.
+    """
+    magnitudes = np.abs(mix)
+    loud_samples = magnitudes > LIMITER_THRESHOLD
+    loud_samples_num = int(np.count_nonzero(loud_samples))
+    if not loud_samples_num:
+        return mix, 0
+    limited_magnitudes = LIMITER_THRESHOLD + LIMITER_RANGE * np.tanh(
+        (magnitudes[loud_samples] - LIMITER_THRESHOLD) / LIMITER_RANGE)
+    limited_mix = mix.copy()
+    limited_mix[loud_samples] = np.copysign(limited_magnitudes, mix[loud_samples])
+    return limited_mix, loud_samples_num
+
+
+class PlaybackMixer(object):
+    """
+    Mixes the voice of all the participants of a call into the single output stream of the user.
+    The output stream calls the mixer whenever the device needs more frames, and on every call the mixer takes the
+    current chunk out of the jitter buffer of every participant, decodes it, and sums all the chunks at once, with the
+    gain of every participant and through a soft limiter - instead of an output stream and a playing thread for
+    every participant, with the operating system's mixer summing them and every stream buffering on its own.
+    A source whose last packet was comfort noise keeps playing noise as loud, until its speech is played again.
+    Sources are added and removed by the client's threads and mixed by the playback thread.
+    """
+    def __init__(self, chunk_size):
+        """
+        sources - [Participant or MixedVoice], the voices that are played. Never changed in place, it is replaced by
+        a changed copy, so the callback can go over it while the participants change.
+        pending_samples - numpy.ndarray, mixed samples that were not played yet, when the device asks for a number of
+        frames that is not a whole number of chunks.
+        source_comfort_noise_dict - {Participant or MixedVoice:str}, the last comfort noise packet of every source that
+        is silent.
+        :param chunk_size: int, the number of samples in a voice packet.
+        """
+        self.chunk_size = chunk_size
+        self.sources = []
+        self.sources_lock = threading.Lock()
+        self.pending_samples = np.zeros(0, dtype=np.int16)
+        self.source_comfort_noise_dict = {}
+        self.mixed_chunks = 0
+        self.limited_samples = 0
+        self.clipped_samples = 0
+
+    def add_source(self, source):
+        """
+        :param source: Participant or MixedVoice, a voice to play.
+        """
+        with self.sources_lock:
+            self.sources = self.sources + [source]
+
+    def remove_source(self, source):
+        """
+        :param source: Participant or MixedVoice, a voice to stop playing.
+        """
+        with self.sources_lock:
+            self.sources = [other_source for other_source in self.sources if other_source is not source]
+        self.source_comfort_noise_dict.pop(source, None)
+
+    def get_source_chunk(self, source):
+        """
+        Takes the current chunk of a source out of its jitter buffer. Packets that were lost or could not be decoded
+        are concealed, and a silent source plays its comfort noise.
+        :param source: Participant or MixedVoice, a voice that is played.
+        :return: str or None, the decoded chunk, 16-bit PCM, or None if the source has nothing to play right now.
+        """
+        voice_data = source.jitter_buffer.pop()
+        if voice_data is None:
+            voice_data = self.source_comfort_noise_dict.get(source)
+            if voice_data is None:
+                return None
+        elif voice_data == LOST_PACKET:
+            return source.loss_concealer.conceal()
+        elif is_comfort_noise_packet(voice_data):
+            self.source_comfort_noise_dict[source] = voice_data
+        else:
+            self.source_comfort_noise_dict.pop(source, None)
+        try:
+            voice_chunk = source.audio_decoder.decode(voice_data)
+            source.loss_concealer.update(voice_chunk)
+            return voice_chunk
+        except AudioCodecException as e:
+            print "DEBUG - invalid voice packet: " + str(e)
+            return source.loss_concealer.conceal()
+
+    def mix_chunk(self):
+        """
+        Mixes the current chunk of all the sources.
+        :return: numpy.ndarray, chunk_size 16-bit samples, silence if no source has anything to play.
+        """
+        chunks = []
+        gains = []
+        for source in self.sources:
+            voice_chunk = self.get_source_chunk(source)
+            if voice_chunk:
+                chunks.append(fit_chunk(np.frombuffer(voice_chunk, dtype=np.int16), self.chunk_size))
+                gains.append(source.voice_gain)
+        if not chunks:
+            return np.zeros(self.chunk_size, dtype=np.int16)
+        self.mixed_chunks += 1
+        mix = np.dot(np.array(gains, dtype=np.float32), np.array(chunks, dtype=np.float32))
+        mix, limited_samples = soft_limit(mix)
+        self.limited_samples += limited_samples
+        clipped_mix = np.clip(mix, SAMPLE_MIN_VALUE, SAMPLE_MAX_VALUE)
+        self.clipped_samples += int(np.count_nonzero(clipped_mix != mix))
+        return clipped_mix.astype(np.int16)
+
+    def get_frames(self, frames_count):
+        """
+        Mixes the frames that the output stream asks for. Called by the callback of the output stream.
+        :param frames_count: int, the number of frames that the device needs.
+        :return: str, frames_count mixed frames, 16-bit PCM.
+        """
+        samples = [self.pending_samples]
+        samples_count = len(self.pending_samples)
+        while samples_count < frames_count:
+            chunk = self.mix_chunk()
+            samples.append(chunk)
+            samples_count += len(chunk)
+        all_samples = np.concatenate(samples)
+        self.pending_samples = all_samples[frames_count:]
+        return all_samples[:frames_count].tostring()
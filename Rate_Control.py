@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import threading
+from Media_Header import CAMERA_STREAM_ID, SCREEN_STREAM_ID
+
+# Receiver reports
+RECEIVER_REPORT_INTERVAL = 1.0  # seconds between the reports that a receiver sends about every participant
+# reported source id, stream id, fraction lost out of 255, jitter in milliseconds, queuing delay in milliseconds,
+# receive rate in bytes per second - 14 bytes for every stream, like an RTCP report block.
+RECEIVER_REPORT_STRUCT = struct.Struct(">IBBHHI")
+MAX_FRACTION_LOST = 255
+MAX_REPORTED_MILLISECONDS = 2 ** 16 - 1
+
+# Bandwidth estimation
+START_VIDEO_BITRATE = 1500000  # bits per second, until the receivers report
+MIN_VIDEO_BITRATE = 100000
+MAX_VIDEO_BITRATE = 8000000
+HIGH_LOSS_FRACTION = 0.1  # more loss than this means the network is overloaded
+LOW_LOSS_FRACTION = 0.02  # less loss than this means there may be room for more
+QUEUING_DELAY_THRESHOLD = 0.1  # seconds, a growing queue in the network means it is overloaded before it loses
+BITRATE_INCREASE_FACTOR = 1.08  # for every report with little loss and no queue, like the loss-based part of GCC
+# For every report with some loss but no queue. Random loss that does not grow with the bitrate, like on wireless
+# networks, would hold the estimate forever, so it is still probed upwards, only slowly.
+LOSSY_INCREASE_FACTOR = 1.02
+STARTUP_INCREASE_FACTOR = 1.25  # the faster increase until the network is overloaded for the first time
+# The estimate grows fast again once it is this much above the rate that the network was last overloaded at, since
+# the network got better, so it does not climb back slowly from a short drop.
+RECOVERY_FACTOR = 1.2
+QUEUING_DECREASE_FACTOR = 0.85  # of the rate that the receiver got, when the queue grows
+REPORT_TIMEOUT = 3.0  # seconds without reports from a receiver, while sending to it, that halve its estimate
+
+# Sharing the bandwidth between the streams
+CONTROL_INTERVAL = 1.0  # seconds between the decisions of the video settings
+ACTIVE_STREAM_TIME = 1.0  # seconds that a stream is considered sent after it last asked for its settings
+SCREEN_BITRATE_SHARE = 0.6  # the part of the video bandwidth that the screen gets while the camera is sent too
+UP_SWITCH_FRACTION = 0.85  # a better level is only tried while the stream uses less than this part of its bandwidth
+UP_SWITCH_HOLD_TIME = 2.0  # seconds that a stream stays on a level before trying a better one, so it does not flap
+
+# The relative size of a JPEG picture by its quality, about the same for most pictures.
+JPEG_QUALITY_COSTS = [(40, 0.5), (50, 0.6), (60, 0.72), (70, 0.87), (75, 1.0), (80, 1.15), (90, 1.7), (100, 3.5)]
+
+
+def get_jpeg_quality_cost(quality):
+    """
+    :param quality: int, a JPEG quality.
+    :return: float, the size of a JPEG picture with that quality relative to quality 75.
+    """
+    if quality <= JPEG_QUALITY_COSTS[0][0]:
+        return JPEG_QUALITY_COSTS[0][1]
+    for (lower_quality, lower_cost), (higher_quality, higher_cost) in zip(JPEG_QUALITY_COSTS, JPEG_QUALITY_COSTS[1:]):
+        if quality <= higher_quality:
+            return lower_cost + \
+                (higher_cost - lower_cost) * (quality - lower_quality) / float(higher_quality - lower_quality)
+    return JPEG_QUALITY_COSTS[-1][1]
+
+
+class ReceiverReport(object):
+    """
+    What a receiver measured about one of the streams that a participant sends it, over the last report interval.
+    """
+    def __init__(self, source_id, stream_id, fraction_lost, jitter, queuing_delay, receive_rate):
+        """
+        *source_id - int, the source id of the participant that sent the stream.
+        *stream_id - int, the stream, one of Media_Header.STREAM_IDS.
+        *fraction_lost - float, the part of the packets of the interval that did not arrive, 0 to 1.
+        *jitter - float, the jitter of the stream in seconds.
+        *queuing_delay - float, how much the delay is above the lowest delay that was seen, in seconds.
+        *receive_rate - int, the bytes of the stream that arrived every second.
+        """
+        self.source_id = source_id
+        self.stream_id = stream_id
+        self.fraction_lost = fraction_lost
+        self.jitter = jitter
+        self.queuing_delay = queuing_delay
+        self.receive_rate = receive_rate
+
+    def pack(self):
+        """
+        :return: str, the report bytes.
+        """
+        return RECEIVER_REPORT_STRUCT.pack(
+            self.source_id, self.stream_id, int(round(min(1.0, self.fraction_lost) * MAX_FRACTION_LOST)),
+            min(MAX_REPORTED_MILLISECONDS, int(self.jitter * 1000)),
+            min(MAX_REPORTED_MILLISECONDS, int(self.queuing_delay * 1000)), int(self.receive_rate))
+
+
+def parse_receiver_reports(data):
+    """
+    :param data: str, the data of a feedback packet, a number of packed reports.
+    :return: [ReceiverReport], the reports, without the bytes of a report that was cut.
+    """
+    reports = []
+    for offset in xrange(0, len(data) - RECEIVER_REPORT_STRUCT.size + 1, RECEIVER_REPORT_STRUCT.size):
+        source_id, stream_id, fraction_lost, jitter, queuing_delay, receive_rate = \
+            RECEIVER_REPORT_STRUCT.unpack_from(data, offset)
+        reports.append(ReceiverReport(source_id, stream_id, float(fraction_lost) / MAX_FRACTION_LOST, jitter / 1000.0,
+                                      queuing_delay / 1000.0, receive_rate))
+    return reports
+
+
+class VideoSettings(object):
+    """
+    The resolution, frame rate and quality that a camera or screen stream is sent with.
+    """
+    def __init__(self, picture_size, fps, quality):
+        """
+        :param picture_size: (int, int), the width and the height of the pictures.
+        :param fps: int, the frame rate.
+        :param quality: int, the JPEG quality.
+        """
+        self.picture_size = picture_size
+        self.fps = fps
+        self.quality = quality
+
+    def get_cost(self):
+        """
+        :return: float, a number proportional to the bitrate that the settings need, for the same content.
+        """
+        return self.picture_size[0] * self.picture_size[1] * self.fps * get_jpeg_quality_cost(self.quality)
+
+    def __str__(self):
+        return "{0}x{1} {2} fps quality {3}".format(self.picture_size[0], self.picture_size[1], self.fps, self.quality)
+
+
+# The levels of every stream, from the cheapest to the best. The camera gives up sharpness before it gives up
+# movement, and the screen gives up movement before it gives up sharpness, so text stays readable.
+CAMERA_SETTINGS_LADDER = [VideoSettings((424, 240), 10, 45), VideoSettings((424, 240), 15, 55),
+                          VideoSettings((640, 360), 15, 60), VideoSettings((640, 360), 24, 65),
+                          VideoSettings((848, 480), 24, 70), VideoSettings((848, 480), 24, 80)]
+SCREEN_SETTINGS_LADDER = [VideoSettings((400, 300), 5, 50), VideoSettings((600, 450), 5, 55),
+                          VideoSettings((800, 600), 5, 60), VideoSettings((800, 600), 10, 65),
+                          VideoSettings((800, 600), 15, 70), VideoSettings((800, 600), 24, 76),
+                          VideoSettings((800, 600), 24, 85)]
+STREAM_ID_SETTINGS_LADDER_DICT = {CAMERA_STREAM_ID: CAMERA_SETTINGS_LADDER, SCREEN_STREAM_ID: SCREEN_SETTINGS_LADDER}
+
+
+class VideoSettingsController(object):
+    """
+    Picks the level of a stream's settings ladder that fits the bitrate that the stream gets.
+    The bitrate of another level is predicted from the bitrate that the current level really uses, scaled by the
+    costs of the levels, so the prediction follows the content - a still screen costs little at any level.
+    Going down happens at once, as far as needed. Going up happens one level at a time, after the stream stayed on its
+    level for a while and only while it uses clearly less than it gets, so the level does not flap.
+    """
+    def __init__(self, settings_ladder):
+        """
+        *level - int, the index of the current settings in the ladder, starts at the cheapest and goes up as the
+        bandwidth allows.
+        *level_start_time - float or None, the time that the stream moved to its level in.
+        :param settings_ladder: [VideoSettings], the levels, from the cheapest to the best.
+        """
+        self.settings_ladder = settings_ladder
+        self.level = 0
+        self.level_start_time = None
+        self.level_changes = 0
+
+    def get_settings(self):
+        """
+        :return: VideoSettings, the current settings of the stream.
+        """
+        return self.settings_ladder[self.level]
+
+    def predict_bitrate(self, level, measured_bitrate):
+        """
+        :param level: int, a level of the ladder.
+        :param measured_bitrate: float, the bitrate that the current level uses, in bits per second.
+        :return: float, the bitrate that the level would use.
+        """
+        return measured_bitrate * self.settings_ladder[level].get_cost() / self.get_settings().get_cost()
+
+    def update(self, target_bitrate, measured_bitrate, current_time):
+        """
+        Moves the stream to the level that fits its bitrate.
+        :param target_bitrate: float, the bits per second that the stream may use.
+        :param measured_bitrate: float, the bits per second that the stream used since the last update.
+        :param current_time: float, the time now.
+        :return: Bool, True if the level changed.
+        """
+        if self.level_start_time is None:
+            self.level_start_time = current_time
+        new_level = self.level
+        if measured_bitrate > target_bitrate:
+            new_level = max(0, self.level - 1)
+            while new_level > 0 and self.predict_bitrate(new_level, measured_bitrate) > target_bitrate:
+                new_level -= 1
+        elif self.level < len(self.settings_ladder) - 1 and \
+                current_time - self.level_start_time >= UP_SWITCH_HOLD_TIME and \
+                measured_bitrate < UP_SWITCH_FRACTION * target_bitrate and \
+                self.predict_bitrate(self.level + 1, measured_bitrate) <= target_bitrate:
+            new_level = self.level + 1
+        if new_level == self.level:
+            return False
+        self.level = new_level
+        self.level_start_time = current_time
+        self.level_changes += 1
+        return True
+
+
+class ReceiverBandwidthEstimate(object):
+    """
+    The video bitrate that a single receiver can take, estimated from its reports.
+    """
+    def __init__(self, report_time):
+        """
+        *overload_bitrate - float or None, the bits per second that the receiver got when the network was last
+        overloaded, None until it is overloaded for the first time, while the estimate grows fast.
+        :param report_time: float, the time that the first report of the receiver arrived in.
+        """
+        self.bitrate = START_VIDEO_BITRATE
+        self.overload_bitrate = None
+        self.last_report_time = report_time
+
+    def update(self, reports, report_time):
+        """
+        Updates the estimate with the reports of the video streams that the receiver got - lowers it when the
+        receiver lost many packets or the queue in the network grows, raises it while neither happens - fast until the
+        network is overloaded for the first time and once it is well above the rate of the last overload, slowly near
+        that rate, and even slower while some packets are lost.
+        The loss of the streams is weighted by their rates, since one lost packet of a small stream is a big fraction.
+        :param reports: [ReceiverReport], the reports of the receiver about the user's video streams.
+        :param report_time: float, the time that the reports arrived in.
+        """
+        self.last_report_time = report_time
+        if not reports:
+            return
+        receive_rate = sum(report.receive_rate for report in reports)
+        if receive_rate:
+            fraction_lost = sum(report.fraction_lost * report.receive_rate for report in reports) / receive_rate
+        else:
+            fraction_lost = max(report.fraction_lost for report in reports)
+        queuing_delay = max(report.queuing_delay for report in reports)
+        receive_bitrate = 8 * receive_rate
+        if fraction_lost > HIGH_LOSS_FRACTION:
+            self.bitrate = min(self.bitrate, receive_bitrate) * (1 - fraction_lost / 2)
+            self.overload_bitrate = receive_bitrate
+        elif queuing_delay > QUEUING_DELAY_THRESHOLD:
+            self.bitrate = min(self.bitrate, QUEUING_DECREASE_FACTOR * receive_bitrate)
+            self.overload_bitrate = receive_bitrate
+        elif fraction_lost >= LOW_LOSS_FRACTION:
+            self.bitrate *= LOSSY_INCREASE_FACTOR
+        elif self.overload_bitrate is None or self.bitrate > RECOVERY_FACTOR * self.overload_bitrate:
+            self.bitrate *= STARTUP_INCREASE_FACTOR
+        else:
+            self.bitrate *= BITRATE_INCREASE_FACTOR
+        self.bitrate = max(MIN_VIDEO_BITRATE, min(MAX_VIDEO_BITRATE, self.bitrate))
+
+    def check_timeout(self, current_time):
+        """
+        Halves the estimate if the receiver stopped reporting, since its reports may be lost in an overloaded network.
+        :param current_time: float, the time now.
+        """
+        if current_time - self.last_report_time >= REPORT_TIMEOUT:
+            self.bitrate = max(MIN_VIDEO_BITRATE, self.bitrate / 2)
+            self.last_report_time = current_time
+
+
+class RateController(object):
+    """
+    Decides how the user's camera and screen streams are sent, by the bandwidth of the call.
+    Every receiver reports the loss, the queuing delay and the receive rate of the user's streams, and the controller
+    keeps a bandwidth estimate for every receiver. The same pictures are sent to everyone, so the call gets the lowest
+    estimate, which is shared between the streams that are sent, and every stream picks the resolution, frame rate
+    and quality that fit its share.
+    The reports are handled by the receiving thread and the settings are asked for by the sending threads.
+    """
+    def __init__(self, stream_senders):
+        """
+        *source_id_estimate_dict - {int:ReceiverBandwidthEstimate}, the estimate of every receiver by its source id.
+        *stream_id_controller_dict - {int:VideoSettingsController}, the settings of every video stream.
+        *stream_id_request_time_dict - {int:float}, the time that every stream last asked for its settings in.
+        *stream_id_sent_bytes_dict - {int:int}, the bytes that every stream sent by the last control.
+        :param stream_senders: [MediaStreamSender], the senders of the video streams, which count the sent bytes.
+        """
+        self.stream_id_sender_dict = dict((sender.stream_id, sender) for sender in stream_senders)
+        self.source_id_estimate_dict = {}
+        self.stream_id_controller_dict = dict((sender.stream_id,
+                                               VideoSettingsController(STREAM_ID_SETTINGS_LADDER_DICT[sender.stream_id]))
+                                              for sender in stream_senders)
+        self.stream_id_request_time_dict = {}
+        self.stream_id_sent_bytes_dict = dict((sender.stream_id, sender.sent_bytes) for sender in stream_senders)
+        self.last_control_time = None
+        self.lock = threading.Lock()
+
+    def handle_receiver_reports(self, receiver_source_id, reports, report_time):
+        """
+        :param receiver_source_id: int, the source id of the participant that sent the reports.
+        :param reports: [ReceiverReport], the reports about the user's streams.
+        :param report_time: float, the time that the reports arrived in.
+        """
+        reports = [report for report in reports if report.stream_id in self.stream_id_controller_dict]
+        with self.lock:
+            if not reports:  # the receiver gets none of the controlled streams, so it does not limit them
+                self.source_id_estimate_dict.pop(receiver_source_id, None)
+                return
+            estimate = self.source_id_estimate_dict.get(receiver_source_id)
+            if estimate is None:
+                estimate = ReceiverBandwidthEstimate(report_time)
+                self.source_id_estimate_dict[receiver_source_id] = estimate
+            estimate.update(reports, report_time)
+
+    def remove_receiver(self, receiver_source_id):
+        """
+        :param receiver_source_id: int, the source id of a participant that left the call.
+        """
+        with self.lock:
+            self.source_id_estimate_dict.pop(receiver_source_id, None)
+
+    def get_video_bitrate(self):
+        """
+        :return: float, the bits per second that the video of the call may use - the lowest estimate of the receivers.
+        """
+        if not self.source_id_estimate_dict:
+            return START_VIDEO_BITRATE
+        return min(estimate.bitrate for estimate in self.source_id_estimate_dict.itervalues())
+
+    def get_active_stream_ids(self, current_time):
+        """
+        :param current_time: float, the time now.
+        :return: [int], the video streams that are being sent.
+        """
+        return [stream_id for stream_id, request_time in self.stream_id_request_time_dict.iteritems()
+                if current_time - request_time < ACTIVE_STREAM_TIME]
+
+    def get_stream_bitrate(self, stream_id, active_stream_ids):
+        """
+        :param stream_id: int, a video stream that is being sent.
+        :param active_stream_ids: [int], all the video streams that are being sent.
+        :return: float, the bits per second that the stream may use.
+        """
+        video_bitrate = self.get_video_bitrate()
+        if len(active_stream_ids) < 2:
+            return video_bitrate
+        if stream_id == SCREEN_STREAM_ID:
+            return SCREEN_BITRATE_SHARE * video_bitrate
+        return (1 - SCREEN_BITRATE_SHARE) * video_bitrate
+
+    def control(self, current_time):
+        """
+        Moves every stream that is being sent to the settings that fit its share of the bandwidth, by the bitrate
+        that it really used since the last control.
+        :param current_time: float, the time now.
+        """
+        elapsed_time = current_time - self.last_control_time
+        active_stream_ids = self.get_active_stream_ids(current_time)
+        if active_stream_ids:
+            for estimate in self.source_id_estimate_dict.itervalues():
+                estimate.check_timeout(current_time)
+        for stream_id, controller in self.stream_id_controller_dict.iteritems():
+            sent_bytes = self.stream_id_sender_dict[stream_id].sent_bytes
+            measured_bitrate = 8 * (sent_bytes - self.stream_id_sent_bytes_dict[stream_id]) / elapsed_time
+            self.stream_id_sent_bytes_dict[stream_id] = sent_bytes
+            if stream_id in active_stream_ids:
+                controller.update(self.get_stream_bitrate(stream_id, active_stream_ids), measured_bitrate,
+                                  current_time)
+
+    def get_current_settings(self, stream_id):
+        """
+        Gets the settings of a video stream without counting the stream as sent, for pictures that are only shown to
+        the user.
+        :param stream_id: int, CAMERA_STREAM_ID or SCREEN_STREAM_ID.
+        :return: VideoSettings, the settings of the stream.
+        """
+        return self.stream_id_controller_dict[stream_id].get_settings()
+
+    def get_settings(self, stream_id, current_time):
+        """
+        Gets the settings that a video stream should be sent with now. Called by the sending thread of the stream
+        before every picture.
+        :param stream_id: int, CAMERA_STREAM_ID or SCREEN_STREAM_ID.
+        :param current_time: float, the time now.
+        :return: VideoSettings, the settings of the stream.
+        """
+        with self.lock:
+            self.stream_id_request_time_dict[stream_id] = current_time
+            if self.last_control_time is None:
+                self.last_control_time = current_time
+            elif current_time - self.last_control_time >= CONTROL_INTERVAL:
+                self.control(current_time)
+                self.last_control_time = current_time
+            return self.stream_id_controller_dict[stream_id].get_settings()
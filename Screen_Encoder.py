@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+
+import struct
+import time
+import numpy as np
+
+TILE_SIZE = 64  # pixels, the screen is compared and sent in squares of this size
+KEYFRAME_INTERVAL = 2.0  # seconds, a whole screenshot is sent at least this often, so lost updates are repaired
+# When this part of the tiles changed, a whole screenshot is sent instead - it is smaller than that many tiles.
+KEYFRAME_DIRTY_FRACTION = 0.5
+KEYFRAME_UPDATE = 0
+DELTA_UPDATE = 1
+UPDATE_TYPES = [KEYFRAME_UPDATE, DELTA_UPDATE]
+# update type, update id, screen width, screen height, number of pictures - 9 bytes at the start of every update.
+SCREEN_UPDATE_HEADER_STRUCT = struct.Struct(">BHHHH")
+# x, y, length of the picture - 8 bytes before every picture of an update.
+SCREEN_PICTURE_HEADER_STRUCT = struct.Struct(">HHI")
+UPDATE_ID_MODULO = 2 ** 16
+
+
+class ScreenUpdateException(Exception):
+    pass
+
+
+def get_dirty_tiles(picture, previous_picture, tile_size):
+    """
+    Compares two screenshots of the same size tile by tile.
+    :param picture: numpy.ndarray, the current screenshot, height x width x channels.
+    :param previous_picture: numpy.ndarray, the previous screenshot.
+    :param tile_size: int, the size of a tile in pixels.
+    :return: numpy.ndarray, a Bool for every tile, rows x columns, True for the tiles that changed.
+    """
+    height, width = picture.shape[:2]
+    rows = (height + tile_size - 1) / tile_size
+    columns = (width + tile_size - 1) / tile_size
+    changed_pixels = np.zeros((rows * tile_size, columns * tile_size), dtype=bool)
+    changed_pixels[:height, :width] = (picture != previous_picture).any(axis=2)
+    return changed_pixels.reshape(rows, tile_size, columns, tile_size).any(axis=3).any(axis=1)
+
+
+def pack_screen_update(update_type, update_id, width, height, positioned_pictures):
+    """
+    :param update_type: int, one of UPDATE_TYPES.
+    :param update_id: int, the id of the update, 16-bit.
+    :param width: int, the width of the screen in pixels.
+    :param height: int, the height of the screen in pixels.
+    :param positioned_pictures: [(int, int, str)], the x, y and encoded picture of every part of the screen that is
+    sent.
+    :return: str, the update.
+    """
+    parts = [SCREEN_UPDATE_HEADER_STRUCT.pack(update_type, update_id, width, height, len(positioned_pictures))]
+    for x, y, picture_bytes in positioned_pictures:
+        parts.append(SCREEN_PICTURE_HEADER_STRUCT.pack(x, y, len(picture_bytes)))
+        parts.append(picture_bytes)
+    return "".join(parts)
+
+
+def parse_screen_update(update_bytes):
+    """
+    Raises ScreenUpdateException if the update is not valid.
+    :param update_bytes: str, an update that was created by pack_screen_update.
+    :return: [0]: int, the update type, one of UPDATE_TYPES.
+    [1]: int, the update id.
+    [2]: (int, int), the width and the height of the screen.
+    [3]: [(int, int, str)], the x, y and encoded picture of every part of the screen in the update.
+    """
+    if len(update_bytes) < SCREEN_UPDATE_HEADER_STRUCT.size:
+        raise ScreenUpdateException("Screen update is too short")
+    update_type, update_id, width, height, pictures_count = SCREEN_UPDATE_HEADER_STRUCT.unpack_from(update_bytes)
+    if update_type not in UPDATE_TYPES:
+        raise ScreenUpdateException("Unknown screen update type " + str(update_type))
+    positioned_pictures = []
+    offset = SCREEN_UPDATE_HEADER_STRUCT.size
+    for picture_index in xrange(pictures_count):
+        if len(update_bytes) < offset + SCREEN_PICTURE_HEADER_STRUCT.size:
+            raise ScreenUpdateException("Screen update is cut in picture " + str(picture_index))
+        x, y, picture_length = SCREEN_PICTURE_HEADER_STRUCT.unpack_from(update_bytes, offset)
+        offset += SCREEN_PICTURE_HEADER_STRUCT.size
+        if len(update_bytes) < offset + picture_length:
+            raise ScreenUpdateException("Screen update is cut in picture " + str(picture_index))
+        positioned_pictures.append((x, y, update_bytes[offset:offset + picture_length]))
+        offset += picture_length
+    return update_type, update_id, (width, height), positioned_pictures
+
+
+class ScreenEncoder(object):
+    """
+    Encodes the user's screenshots as updates of the screen that the receivers show.
+    Every screenshot is compared with the previous one in tiles, and only the tiles that changed are encoded and sent,
+    so nothing is sent while the screen does not change. A keyframe - the whole screenshot - is sent when most of the
+    screen changed, when a participant joins, and every KEYFRAME_INTERVAL, so a receiver that lost an update or
+    started watching late shows the right screen soon.
+    """
+    def __init__(self, encode_picture, tile_size=TILE_SIZE):
+        """
+        *previous_picture - numpy.ndarray or None, the last screenshot, None before the first one.
+        *last_keyframe_time - float, the time that the last keyframe was sent in.
+        *update_id - int, the id of the next update, 16-bit.
+        :param encode_picture: function, gets a part of a screenshot as a numpy.ndarray and returns it encoded.
+        :param tile_size: int, the size of a tile in pixels.
+        """
+        self.encode_picture = encode_picture
+        self.tile_size = tile_size
+        self.previous_picture = None
+        self.last_keyframe_time = 0
+        self.update_id = 0
+        self.keyframes = 0
+        self.delta_updates = 0
+        self.sent_tiles = 0
+
+    def request_keyframe(self):
+        """
+        Makes the next update a keyframe, for a participant that just joined.
+        """
+        self.previous_picture = None
+
+    def should_send_keyframe(self, picture, current_time):
+        """
+        :param picture: numpy.ndarray, the current screenshot.
+        :param current_time: float, the time that the screenshot was taken in.
+        :return: Bool, True if the whole screenshot should be sent regardless of what changed.
+        """
+        return self.previous_picture is None or self.previous_picture.shape != picture.shape or \
+            current_time - self.last_keyframe_time >= KEYFRAME_INTERVAL
+
+    def encode(self, picture, current_time=None):
+        """
+        Encodes a screenshot as an update of the previous one.
+        :param picture: numpy.ndarray, the screenshot, height x width x channels, 8-bit.
+        :param current_time: float or None, the time that the screenshot was taken in, None for now.
+        :return: [0]: str or None, the update, None if nothing changed.
+        [1]: Bool, True if the update is a keyframe.
+        """
+        if current_time is None:
+            current_time = time.time()
+        height, width = picture.shape[:2]
+        is_keyframe = self.should_send_keyframe(picture, current_time)
+        if not is_keyframe:
+            dirty_tiles = get_dirty_tiles(picture, self.previous_picture, self.tile_size)
+            if not dirty_tiles.any():
+                return None, False
+            is_keyframe = dirty_tiles.mean() >= KEYFRAME_DIRTY_FRACTION
+        if is_keyframe:
+            positioned_pictures = [(0, 0, self.encode_picture(picture))]
+            self.last_keyframe_time = current_time
+            self.keyframes += 1
+        else:
+            positioned_pictures = []
+            for row, column in zip(*np.nonzero(dirty_tiles)):
+                y = int(row) * self.tile_size
+                x = int(column) * self.tile_size
+                tile = picture[y:y + self.tile_size, x:x + self.tile_size]
+                positioned_pictures.append((x, y, self.encode_picture(tile)))
+            self.delta_updates += 1
+            self.sent_tiles += len(positioned_pictures)
+        self.previous_picture = picture
+        update_bytes = pack_screen_update(KEYFRAME_UPDATE if is_keyframe else DELTA_UPDATE, self.update_id, width,
+                                          height, positioned_pictures)
+        self.update_id = (self.update_id + 1) % UPDATE_ID_MODULO
+        return update_bytes, is_keyframe
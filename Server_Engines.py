@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import select
+
+SELECT_SERVER_ENGINE = "select"
+EPOLL_SERVER_ENGINE = "epoll"
+DEFAULT_SERVER_ENGINE = EPOLL_SERVER_ENGINE
+SERVER_ENGINE_TYPES = [SELECT_SERVER_ENGINE, EPOLL_SERVER_ENGINE]
+
+IS_EPOLL_AVAILABLE = hasattr(select, "epoll")
+if IS_EPOLL_AVAILABLE:
+    # hang ups and errors are reported as readable so the next recv() reveals the disconnect.
+    EPOLL_READ_EVENTS = select.EPOLLIN | select.EPOLLPRI | select.EPOLLHUP | select.EPOLLERR
+    EPOLL_READ_WRITE_EVENTS = EPOLL_READ_EVENTS | select.EPOLLOUT
+
+
+class UnknownServerEngineException(Exception):
+    pass
+
+
+class SelectServerEngine(object):
+    """
+    A server engine that waits for socket events using select().
+    This is the original engine of the server. It is available on every platform but
+    it is limited to about 1024 sockets and every wakeup costs O(n) in the number of sockets.
+    """
+    def __init__(self):
+        """
+        registered_sockets - [socket], all the sockets that the engine listens to.
+        write_interest_sockets - [socket], the registered sockets that wait to become writable.
+        """
+        self.registered_sockets = []
+        self.write_interest_sockets = []
+
+    def register_socket(self, sock):
+        """
+        Starts listening to events of a socket.
+        :param sock: socket, the socket that needs to be listened to.
+        """
+        self.registered_sockets.append(sock)
+
+    def unregister_socket(self, sock):
+        """
+        Stops listening to events of a socket. Should be called before the socket is closed.
+        :param sock: socket, the socket that should not be listened to anymore.
+        """
+        if sock in self.registered_sockets:
+            self.registered_sockets.remove(sock)
+        self.set_write_interest(sock, False)
+
+    def set_write_interest(self, sock, is_interested):
+        """
+        Sets whether the engine should report when a registered socket becomes writable.
+        :param sock: socket, a registered socket.
+        :param is_interested: Bool, True if the socket has data waiting to be sent, else False.
+        """
+        if is_interested and sock not in self.write_interest_sockets:
+            self.write_interest_sockets.append(sock)
+        elif not is_interested and sock in self.write_interest_sockets:
+            self.write_interest_sockets.remove(sock)
+
+    def wait_for_socket_events(self):
+        """
+        Blocks until at least one of the registered sockets is readable, or writable while having data to send.
+        :return: [0]: [socket], a list of the readable sockets.
+        [1]: [socket], a list of the writable sockets.
+        """
+        rlist, wlist, xlist = select.select(self.registered_sockets, self.write_interest_sockets, [])
+        return rlist, wlist
+
+    def close(self):
+        """
+        Closes the engine.
+        """
+        self.registered_sockets = []
+        self.write_interest_sockets = []
+
+
+class EpollServerEngine(object):
+    """
+    A server engine that waits for socket events using epoll (Linux only).
+    Sockets are registered once when they are accepted and unregistered once when they are disconnected,
+    so waiting for events costs the same no matter how many users are connected to the server.
+    """
+    def __init__(self):
+        """
+        epoll - the epoll object which holds the persistent registrations.
+        fd_socket_dict - {fd:socket}, used to find the socket of every event.
+        socket_fd_dict - {socket:fd}, used to unregister sockets whose file descriptor is no longer known.
+        write_interest_sockets - set(socket), the registered sockets that wait to become writable.
+        """
+        self.epoll = select.epoll()
+        self.fd_socket_dict = {}
+        self.socket_fd_dict = {}
+        self.write_interest_sockets = set()
+
+    def register_socket(self, sock):
+        """
+        Starts listening to events of a socket.
+        :param sock: socket, the socket that needs to be listened to.
+        """
+        fd = sock.fileno()
+        self.epoll.register(fd, EPOLL_READ_EVENTS)
+        self.fd_socket_dict[fd] = sock
+        self.socket_fd_dict[sock] = fd
+
+    def unregister_socket(self, sock):
+        """
+        Stops listening to events of a socket. Should be called before the socket is closed.
+        :param sock: socket, the socket that should not be listened to anymore.
+        """
+        self.write_interest_sockets.discard(sock)
+        fd = self.socket_fd_dict.pop(sock, None)
+        if fd is not None:
+            del(self.fd_socket_dict[fd])
+            try:
+                self.epoll.unregister(fd)
+            except (IOError, OSError, ValueError):
+                pass  # the socket was already closed and the kernel dropped its registration.
+
+    def set_write_interest(self, sock, is_interested):
+        """
+        Sets whether the engine should report when a registered socket becomes writable.
+        :param sock: socket, a registered socket.
+        :param is_interested: Bool, True if the socket has data waiting to be sent, else False.
+        """
+        if sock not in self.socket_fd_dict or is_interested == (sock in self.write_interest_sockets):
+            return
+        if is_interested:
+            self.write_interest_sockets.add(sock)
+            self.epoll.modify(self.socket_fd_dict[sock], EPOLL_READ_WRITE_EVENTS)
+        else:
+            self.write_interest_sockets.discard(sock)
+            self.epoll.modify(self.socket_fd_dict[sock], EPOLL_READ_EVENTS)
+
+    def wait_for_socket_events(self):
+        """
+        Blocks until at least one of the registered sockets is readable, or writable while having data to send.
+        :return: [0]: [socket], a list of the readable sockets.
+        [1]: [socket], a list of the writable sockets.
+        """
+        while True:
+            try:
+                events = self.epoll.poll()
+                break
+            except IOError:  # interrupted by a signal
+                pass
+        readable_sockets = []
+        writable_sockets = []
+        for fd, event in events:
+            if fd in self.fd_socket_dict:
+                if event & EPOLL_READ_EVENTS:
+                    readable_sockets.append(self.fd_socket_dict[fd])
+                if event & select.EPOLLOUT:
+                    writable_sockets.append(self.fd_socket_dict[fd])
+        return readable_sockets, writable_sockets
+
+    def close(self):
+        """
+        Closes the engine and its epoll object.
+        """
+        self.epoll.close()
+        self.fd_socket_dict = {}
+        self.socket_fd_dict = {}
+        self.write_interest_sockets = set()
+
+
+def create_server_engine(engine_type):
+    """
+    Creates a server engine of the given type.
+    Falls back to the select engine if epoll is not supported by this platform (for example on Windows).
+    :param engine_type: str, one of SERVER_ENGINE_TYPES.
+    :return: SelectServerEngine or EpollServerEngine, the new engine.
+    """
+    if engine_type not in SERVER_ENGINE_TYPES:
+        raise UnknownServerEngineException(engine_type)
+    if engine_type == EPOLL_SERVER_ENGINE:
+        if IS_EPOLL_AVAILABLE:
+            return EpollServerEngine()
+        print "DEBUG - epoll is not available on this platform, using select engine instead"
+    return SelectServerEngine()
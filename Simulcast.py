@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+import struct
+from Media_Header import CAMERA_STREAM_ID, CAMERA_LOW_STREAM_ID
+
+CAMERA_LOW_LAYER_PICTURE_SIZE = (320, 180)
+CAMERA_LOW_LAYER_QUALITY = 60
+CAMERA_HIGH_LAYER_PICTURE_SIZE = (848, 480)  # the high layer is sent with the settings of the rate controller, up to it
+# The layers of the camera by their stream ids, from the cheapest to the best, with the size of their pictures.
+# Every layer is a media stream of its own.
+CAMERA_LAYERS = [(CAMERA_LOW_STREAM_ID, CAMERA_LOW_LAYER_PICTURE_SIZE),
+                 (CAMERA_STREAM_ID, CAMERA_HIGH_LAYER_PICTURE_SIZE)]
+CAMERA_LAYER_STREAM_IDS = [stream_id for stream_id, picture_size in CAMERA_LAYERS]
+NO_LAYER = 255  # a subscription to none of the layers, while the camera window is closed
+MAX_LAYER_UPSCALE = 1.25  # a layer is shown in windows up to this much bigger than its pictures
+# source id of the sender, stream id of the layer or NO_LAYER - 5 bytes, the data of a subscription packet
+SUBSCRIPTION_STRUCT = struct.Struct(">IB")
+
+
+class SubscriptionException(Exception):
+    pass
+
+
+def choose_camera_layer(window_size):
+    """
+    :param window_size: (int, int) or None, the width and the height of the window that shows a participant's camera,
+    None if the window is closed.
+    :return: int, the stream id of the cheapest layer that fills the window, NO_LAYER if the window is closed.
+    """
+    if window_size is None:
+        return NO_LAYER
+    for stream_id, picture_size in CAMERA_LAYERS:
+        if window_size[0] <= picture_size[0] * MAX_LAYER_UPSCALE and \
+                window_size[1] <= picture_size[1] * MAX_LAYER_UPSCALE:
+            return stream_id
+    return CAMERA_LAYERS[-1][0]
+
+
+def pack_subscription(sender_source_id, stream_id):
+    """
+    :param sender_source_id: int, the source id of the participant whose camera the subscription is for.
+    :param stream_id: int, the stream id of the layer, or NO_LAYER.
+    :return: str, the data of a subscription packet.
+    """
+    return SUBSCRIPTION_STRUCT.pack(sender_source_id, stream_id)
+
+
+def parse_subscription(data):
+    """
+    Raises SubscriptionException if the data is not a valid subscription.
+    :param data: str, the data of a subscription packet.
+    :return: [0]: int, the source id of the participant whose camera the subscription is for.
+    [1]: int, the stream id of the layer, or NO_LAYER.
+    """
+    if len(data) != SUBSCRIPTION_STRUCT.size:
+        raise SubscriptionException("Subscription of " + str(len(data)) + " bytes")
+    sender_source_id, stream_id = SUBSCRIPTION_STRUCT.unpack(data)
+    if stream_id != NO_LAYER and stream_id not in CAMERA_LAYER_STREAM_IDS:
+        raise SubscriptionException("Unknown camera layer " + str(stream_id))
+    return sender_source_id, stream_id
+
+
+class LayerSubscriptions(object):
+    """
+    The camera layer that every receiver subscribed to, of a single sender. A receiver that did not subscribe gets
+    none of the layers, so the camera is only sent to the receivers that show it, in the size that they show it in.
+    Receivers send their subscriptions again once in a while, so a subscription that was lost is repaired, and a
+    subscription is kept until it changes or the receiver leaves.
+    The subscriptions are changed by the receiving thread and read by the sending thread.
+    """
+    def __init__(self):
+        """
+        *source_id_stream_id_dict - {int:int}, the stream id of the layer of every subscribed receiver by its source id.
+        The dictionary is never changed in place, it is replaced by a changed copy.
+        """
+        self.source_id_stream_id_dict = {}
+
+    def subscribe(self, receiver_source_id, stream_id):
+        """
+        :param receiver_source_id: int, the source id of the receiver.
+        :param stream_id: int, the stream id of the layer, or NO_LAYER.
+        :return: Bool, True if the subscription of the receiver changed.
+        """
+        if self.source_id_stream_id_dict.get(receiver_source_id, NO_LAYER) == stream_id:
+            return False
+        source_id_stream_id_dict = dict(self.source_id_stream_id_dict)
+        if stream_id == NO_LAYER:
+            del source_id_stream_id_dict[receiver_source_id]
+        else:
+            source_id_stream_id_dict[receiver_source_id] = stream_id
+        self.source_id_stream_id_dict = source_id_stream_id_dict
+        return True
+
+    def remove_receiver(self, receiver_source_id):
+        """
+        :param receiver_source_id: int, the source id of a receiver that left the call.
+        """
+        self.subscribe(receiver_source_id, NO_LAYER)
+
+    def get_subscribers(self, stream_id):
+        """
+        :param stream_id: int, the stream id of a layer.
+        :return: [int], the source ids of the receivers that subscribed to the layer.
+        """
+        return [source_id for source_id, subscribed_stream_id in self.source_id_stream_id_dict.iteritems()
+                if subscribed_stream_id == stream_id]
+
+    def get_subscribed_stream_ids(self):
+        """
+        :return: set, the stream ids of the layers that someone subscribed to.
+        """
+        return set(self.source_id_stream_id_dict.itervalues())
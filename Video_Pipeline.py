@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+
+INACTIVE_WAIT_TIME = 0.1  # seconds between the checks of whether sharing started again
+MAX_FRAME_AGE_PERIODS = 2  # frames that waited longer than this many frame periods to be encoded are stale
+REPORT_INTERVAL = 10.0  # seconds between the reports of the pipeline's statistics
+
+
+class VideoFrame(object):
+    """
+    A frame that goes through the pipeline, with the times that it passed the stages in.
+    """
+    def __init__(self, data, capture_time):
+        """
+        *data - the captured frame, replaced by the encoded frame once it is encoded.
+        *encode_start_time - float or None, the time that the encoding of the frame started in.
+        *encode_end_time - float or None, the time that the encoding of the frame ended in.
+        :param data: the captured frame.
+        :param capture_time: float, the time that the frame was captured in.
+        """
+        self.data = data
+        self.capture_time = capture_time
+        self.encode_start_time = None
+        self.encode_end_time = None
+
+
+class FrameSlot(object):
+    """
+    Hands frames from one stage of the pipeline to the next. The slot holds a single frame - a new frame replaces the
+    frame that was not taken yet, so a stage that falls behind always gets the newest frame instead of a queue of old
+    ones.
+    """
+    def __init__(self):
+        """
+        *frame - VideoFrame or None, the frame that waits for the next stage.
+        """
+        self.condition = threading.Condition()
+        self.frame = None
+        self.is_closed = False
+
+    def put(self, frame):
+        """
+        :param frame: VideoFrame, the newest frame of the stage.
+        """
+        with self.condition:
+            self.frame = frame
+            self.condition.notify()
+
+    def take(self):
+        """
+        Takes the frame out of the slot, waiting for one if the slot is empty. The wait has no timeout, since a timed
+        wait of a condition polls with growing sleeps, which would delay the frames.
+        :return: VideoFrame or None, the newest frame, None once the slot is closed.
+        """
+        with self.condition:
+            while self.frame is None and not self.is_closed:
+                self.condition.wait()
+            frame = self.frame
+            self.frame = None
+            return frame
+
+    def close(self):
+        """
+        Wakes up the waiting stage for good.
+        """
+        with self.condition:
+            self.is_closed = True
+            self.condition.notify_all()
+
+
+class FramePacer(object):
+    """
+    Paces the encoding of frames by deadlines - frame n is due at the start time plus n frame periods - instead of
+    sleeping a period after the work of every frame, so the time that the work takes does not slow down the frame rate.
+    When the work falls behind by more than a period the missed deadlines are skipped instead of caught up in a burst.
+    """
+    def __init__(self, fps):
+        """
+        *next_deadline - float or None, the time that the next frame is due in, None until the pacing starts.
+        *missed_deadlines - int, the deadlines that were skipped since the work fell behind.
+        :param fps: int, the target frame rate.
+        """
+        self.period = 1.0 / fps
+        self.next_deadline = None
+        self.missed_deadlines = 0
+
+    def set_fps(self, fps):
+        """
+        Changes the target frame rate from the next frame on.
+        :param fps: int, the target frame rate.
+        """
+        self.period = 1.0 / fps
+
+    def reset(self):
+        """
+        Starts the pacing again from the next frame, after a pause.
+        """
+        self.next_deadline = None
+
+    def wait_for_deadline(self):
+        """
+        Waits until the next frame is due.
+        :return: float, the deadline of the frame.
+        """
+        current_time = time.time()
+        if self.next_deadline is None:
+            self.next_deadline = current_time
+        elif current_time > self.next_deadline + self.period:
+            missed_deadlines = int((current_time - self.next_deadline) / self.period)
+            self.missed_deadlines += missed_deadlines
+            self.next_deadline += missed_deadlines * self.period
+        wait_time = self.next_deadline - current_time
+        if wait_time > 0:
+            time.sleep(wait_time)
+        deadline = self.next_deadline
+        self.next_deadline += self.period
+        return deadline
+
+
+class VideoPipelineStatistics(object):
+    """
+    The frame rate that a video pipeline achieved and the time that its frames spent in every stage, since the
+    statistics were started.
+    """
+    def __init__(self, name, fps):
+        """
+        *captured_frames - int, the frames that the capture stage captured.
+        *stale_frames - int, the frames that waited too long to be encoded and were dropped.
+        *failed_frames - int, the frames that could not be encoded or were too big to send.
+        *[x]_time_sum - float, the sum of the times that the sent frames spent in the different stages, in seconds:
+        waiting to be encoded, encoding, waiting to be sent and sending, and all of them together.
+        :param name: str, the name of the pipeline.
+        :param fps: int, the target frame rate.
+        """
+        self.name = name
+        self.fps = fps
+        self.start_time = time.time()
+        self.captured_frames = 0
+        self.stale_frames = 0
+        self.failed_frames = 0
+        self.sent_frames = 0
+        self.queue_time_sum = 0.0
+        self.encode_time_sum = 0.0
+        self.send_time_sum = 0.0
+        self.total_time_sum = 0.0
+
+    def add_sent_frame(self, frame, sent_time):
+        """
+        :param frame: VideoFrame, a frame that was sent.
+        :param sent_time: float, the time that the frame was sent in.
+        """
+        self.sent_frames += 1
+        self.queue_time_sum += frame.encode_start_time - frame.capture_time
+        self.encode_time_sum += frame.encode_end_time - frame.encode_start_time
+        self.send_time_sum += sent_time - frame.encode_end_time
+        self.total_time_sum += sent_time - frame.capture_time
+
+    def get_achieved_fps(self, current_time=None):
+        """
+        :param current_time: float or None, the time to measure up to, now if None.
+        :return: float, the number of frames that were sent every second.
+        """
+        elapsed_time = (current_time or time.time()) - self.start_time
+        if elapsed_time <= 0:
+            return 0.0
+        return self.sent_frames / elapsed_time
+
+    def get_average_latencies(self):
+        """
+        :return: [0]: float, the average time that a sent frame waited to be encoded, in seconds.
+        [1]: float, the average time that a sent frame was encoded for.
+        [2]: float, the average time that a sent frame waited to be sent and was sent for.
+        [3]: float, the average time from the capture of a sent frame until it was sent.
+        """
+        if not self.sent_frames:
+            return 0.0, 0.0, 0.0, 0.0
+        return self.queue_time_sum / self.sent_frames, self.encode_time_sum / self.sent_frames, \
+            self.send_time_sum / self.sent_frames, self.total_time_sum / self.sent_frames
+
+    def __str__(self):
+        queue_time, encode_time, send_time, total_time = self.get_average_latencies()
+        return "{0}: {1:.1f} of {2} fps, {3} captured, {4} sent, {5} stale, {6} failed, queue {7:.1f} ms, " \
+               "encode {8:.1f} ms, send {9:.1f} ms, total {10:.1f} ms".format(
+                   self.name, self.get_achieved_fps(), self.fps, self.captured_frames, self.sent_frames,
+                   self.stale_frames, self.failed_frames, queue_time * 1000, encode_time * 1000, send_time * 1000,
+                   total_time * 1000)
+
+
+class VideoPipeline(object):
+    """
+    Captures, encodes and sends video frames in three stages that run at once - a capture thread, an encoding thread
+    and the sending thread - instead of a single thread that captures, encodes, sends and only then sleeps.
+    The capture thread reads frames as fast as the device gives them, so the device never hands over frames that
+    waited in its own buffer. The encoding thread is paced by deadlines and encodes the newest frame at every deadline,
+    and frames that were replaced by newer ones or got too old are dropped instead of queued. Every frame is encoded
+    once and the encoded frame is sent to everyone.
+    When the pipeline stops, every stage closes the slot after it on its way out, which wakes up the next stage.
+    """
+    def __init__(self, name, capture_frame, encode_frame, send_frame, is_active, is_running, fps):
+        """
+        *captured_frames_slot - FrameSlot, the newest captured frame, waiting for the encoding thread.
+        *encoded_frames_slot - FrameSlot, the newest encoded frame, waiting for the sending thread.
+        *is_stopped - Bool, True once the pipeline was stopped, also if sending failed.
+        *statistics - VideoPipelineStatistics, replaced by new statistics whenever they are reported.
+        :param name: str, the name of the pipeline, for its reports.
+        :param capture_frame: function, returns a captured frame, or None if the capture failed. May block until the
+        device has a new frame.
+        :param encode_frame: function, gets a captured frame and returns it encoded, or None if it cannot be sent.
+        :param send_frame: function, gets an encoded frame and sends it.
+        :param is_active: function, returns True while frames should be captured and sent.
+        :param is_running: function, returns False once the pipeline should stop for good.
+        :param fps: int, the target frame rate.
+        """
+        self.name = name
+        self.capture_frame = capture_frame
+        self.encode_frame = encode_frame
+        self.send_frame = send_frame
+        self.is_active = is_active
+        self.is_running = is_running
+        self.fps = fps
+        self.pacer = FramePacer(fps)
+        self.max_frame_age = MAX_FRAME_AGE_PERIODS * self.pacer.period
+        self.captured_frames_slot = FrameSlot()
+        self.encoded_frames_slot = FrameSlot()
+        self.capture_thread = threading.Thread(target=self.capture_loop)
+        self.encode_thread = threading.Thread(target=self.encode_loop)
+        self.is_stopped = False
+        self.statistics = VideoPipelineStatistics(name, fps)
+
+    def set_fps(self, fps):
+        """
+        Changes the target frame rate of the pipeline, for the rate control. Called by the encoding thread.
+        :param fps: int, the target frame rate.
+        """
+        if fps == self.fps:
+            return
+        self.fps = fps
+        self.pacer.set_fps(fps)
+        self.max_frame_age = MAX_FRAME_AGE_PERIODS * self.pacer.period
+
+    def should_run(self):
+        """
+        :return: Bool, True while the pipeline should keep running.
+        """
+        return not self.is_stopped and self.is_running()
+
+    def capture_loop(self):
+        """
+        Captures frames while the pipeline runs and hands the newest one to the encoding thread.
+        """
+        try:
+            while self.should_run():
+                if not self.is_active():
+                    time.sleep(INACTIVE_WAIT_TIME)
+                    continue
+                data = self.capture_frame()
+                if data is None:
+                    continue
+                self.statistics.captured_frames += 1
+                self.captured_frames_slot.put(VideoFrame(data, time.time()))
+        finally:
+            self.captured_frames_slot.close()
+
+    def encode_loop(self):
+        """
+        Encodes the newest captured frame at every deadline while the pipeline runs, and hands it to the sending thread.
+        """
+        try:
+            while self.should_run():
+                if not self.is_active():
+                    self.pacer.reset()
+                    time.sleep(INACTIVE_WAIT_TIME)
+                    continue
+                self.pacer.wait_for_deadline()
+                frame = self.captured_frames_slot.take()
+                if frame is None:
+                    return
+                frame.encode_start_time = time.time()
+                if frame.encode_start_time - frame.capture_time > self.max_frame_age:
+                    self.statistics.stale_frames += 1
+                    continue
+                frame.data = self.encode_frame(frame.data)
+                frame.encode_end_time = time.time()
+                if frame.data is None:
+                    self.statistics.failed_frames += 1
+                    continue
+                self.encoded_frames_slot.put(frame)
+        finally:
+            self.encoded_frames_slot.close()
+
+    def send_encoded_frame(self, frame):
+        """
+        Sends an encoded frame and reports the statistics once in a while.
+        :param frame: VideoFrame, the newest encoded frame.
+        """
+        self.send_frame(frame.data)
+        sent_time = time.time()
+        self.statistics.add_sent_frame(frame, sent_time)
+        if sent_time - self.statistics.start_time >= REPORT_INTERVAL:
+            print "DEBUG - " + str(self.statistics)
+            self.statistics = VideoPipelineStatistics(self.name, self.fps)
+
+    def run(self):
+        """
+        Starts the capture and encoding threads and sends the encoded frames in the calling thread, until the pipeline
+        stops. The other threads are stopped before returning, also if sending failed.
+        """
+        self.capture_thread.start()
+        self.encode_thread.start()
+        try:
+            frame = self.encoded_frames_slot.take()
+            while frame is not None:
+                self.send_encoded_frame(frame)
+                frame = self.encoded_frames_slot.take()
+        finally:
+            self.stop()
+
+    def stop(self):
+        """
+        Stops the capture and encoding threads and waits for them.
+        """
+        self.is_stopped = True
+        self.captured_frames_slot.close()
+        self.encoded_frames_slot.close()
+        for thread in [self.capture_thread, self.encode_thread]:
+            if thread.is_alive():
+                thread.join()
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import audioop
+import math
+from collections import deque
+
+SAMPLE_WIDTH = 2
+MIN_SPEECH_DECIBELS = 30.0  # quieter frames are never speech, the fixed gate used to be 40 dB
+SPEECH_MARGIN_DECIBELS = 9.0  # frames this much louder than the noise floor are speech
+# A frame this much louder than both the noise floor and the frame before it starts speech. The start of a word rises
+# quickly but is still quiet, while steady noise does not rise from frame to frame.
+ONSET_RISE_DECIBELS = 3.0
+# Seconds, the noise floor is the loudness of the quietest frame in this window. Speech always has short pauses that
+# show the noise under it, while steady noise like a fan raises the floor once it fills the window.
+NOISE_FLOOR_WINDOW_TIME = 2.0
+HANGOVER_TIME = 0.3  # seconds of sending after the speech gets quiet, so the ends of words are not cut
+PRE_ROLL_TIME = 0.2  # seconds of audio before the speech is detected that are sent with it, the starts of words
+COMFORT_NOISE_INTERVAL = 1.0  # seconds between comfort noise updates while the user is silent
+
+
+def get_decibel_volume(frame):
+    """
+    :param frame: str, 16-bit mono PCM.
+    :return: float, the loudness of the frame in decibels, 0 for silence.
+    """
+    rms = audioop.rms(frame, SAMPLE_WIDTH)
+    if rms <= 1:
+        return 0.0
+    return 20 * math.log10(rms)
+
+
+class VoiceActivityDetector(object):
+    """
+    Decides which recorded frames are speech and should be sent, so no bandwidth is used while the user is silent.
+    The speech threshold follows the background noise of the room - the quietest frame of the last couple of
+    seconds - so a quiet voice is still heard in a quiet room and a fan is not sent in a loud one. A quiet frame that
+rises sharply above the noise starts the speech too, so the quiet start of a word is not missed. The sending goes on
+    for a hangover time after the speech gets quiet, and the frames right before the speech was detected are sent with
+    it, so the starts and the ends of words are not chopped.
+    While the user is silent, the detector asks for comfort noise to be sent every once in a while, so the receivers
+    can play the user's background noise instead of dead air.
+    """
+    def __init__(self, frame_duration):
+        """
+        recent_volumes - deque, the loudness of the frames in the noise floor window, in decibels.
+        noise_floor - float, the estimated loudness of the background noise, in decibels.
+        last_decibel_volume - float, the loudness of the previous frame, in decibels.
+        is_speaking - Bool, True while frames are being sent.
+        hangover_frames - int, the frames that are still sent before the speech is over.
+        pre_roll_frames - deque, the last frames that were not sent, to be sent if speech starts.
+        frames_since_comfort_noise - int or None, the frames that passed since comfort noise was last asked for, None
+        while the user speaks.
+        :param frame_duration: float, the duration of a recorded frame in seconds.
+        """
+        self.frame_duration = frame_duration
+        self.recent_volumes = deque(maxlen=int(math.ceil(NOISE_FLOOR_WINDOW_TIME / frame_duration)))
+        self.noise_floor = 0.0
+        self.last_decibel_volume = 0.0
+        self.is_speaking = False
+        self.hangover_frames = 0
+        self.max_hangover_frames = int(math.ceil(HANGOVER_TIME / frame_duration))
+        self.pre_roll_frames = deque(maxlen=int(math.ceil(PRE_ROLL_TIME / frame_duration)))
+        self.comfort_noise_interval_frames = int(math.ceil(COMFORT_NOISE_INTERVAL / frame_duration))
+        self.frames_since_comfort_noise = self.comfort_noise_interval_frames  # comfort noise is sent from the start
+        self.speech_frames = 0
+        self.silent_frames = 0
+
+    def get_threshold(self):
+        """
+        :return: float, the loudness that a frame needs to be speech, in decibels.
+        """
+        return max(MIN_SPEECH_DECIBELS, self.noise_floor + SPEECH_MARGIN_DECIBELS)
+
+    def is_speech_onset(self, decibel_volume):
+        """
+        :param decibel_volume: float, the loudness of a recorded frame.
+        :return: Bool, True if the frame rises sharply above the noise floor and the frame before it.
+        """
+        return decibel_volume >= self.noise_floor + ONSET_RISE_DECIBELS and \
+            decibel_volume >= self.last_decibel_volume + ONSET_RISE_DECIBELS
+
+    def update_noise_floor(self, decibel_volume):
+        """
+        :param decibel_volume: float, the loudness of a recorded frame.
+        """
+        self.recent_volumes.append(decibel_volume)
+        self.noise_floor = min(self.recent_volumes)
+
+    def process(self, frame):
+        """
+        Decides whether a recorded frame is sent.
+        :param frame: str, a recorded frame, 16-bit mono PCM.
+        :return: [str], the frames to send now, oldest first - nothing while the user is silent, the pre-roll frames
+        and the frame when speech starts, and the frame alone while the user speaks.
+        """
+        decibel_volume = get_decibel_volume(frame)
+        self.update_noise_floor(decibel_volume)
+        is_speech = decibel_volume >= self.get_threshold() or self.is_speech_onset(decibel_volume)
+        self.last_decibel_volume = decibel_volume
+        if is_speech:
+            self.hangover_frames = self.max_hangover_frames
+        elif self.hangover_frames:
+            self.hangover_frames -= 1
+        if is_speech or self.hangover_frames:
+            frames = list(self.pre_roll_frames) + [frame]
+            self.pre_roll_frames.clear()
+            self.is_speaking = True
+            self.frames_since_comfort_noise = None
+            self.speech_frames += 1
+            return frames
+        if self.is_speaking:  # the speech is over, comfort noise is sent right away
+            self.is_speaking = False
+            self.frames_since_comfort_noise = self.comfort_noise_interval_frames
+        elif self.frames_since_comfort_noise is not None:
+            self.frames_since_comfort_noise += 1
+        self.pre_roll_frames.append(frame)
+        self.silent_frames += 1
+        return []
+
+    def should_send_comfort_noise(self):
+        """
+        Tells whether comfort noise should be sent with the last frame - when the speech is over, and every
+        COMFORT_NOISE_INTERVAL while the user is silent.
+        :return: Bool, True if the last frame should be sent as comfort noise.
+        """
+        if self.frames_since_comfort_noise is None or \
+                self.frames_since_comfort_noise < self.comfort_noise_interval_frames:
+            return False
+        self.frames_since_comfort_noise = 0
+        return True
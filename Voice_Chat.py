@@ -1,52 +1,48 @@
 
 import pyaudio
 import socket
+from functools import partial
 from threading import Thread
-import Queue
 import numpy as np
 import cv2
 from io import BytesIO
 from PIL import Image, ImageGrab
 import time
-import audioop
-import math
 from Common_Elements import ParticipantStoppedScreenShareMessage, ParticipantStoppedCameraShareMessage, ParticipantStartedCameraShareMessage, \
     ParticipantStartedScreenShareMessage, ParticipantLeaveVoiceChatMessage, LeaveVoiceChatMessage, StartedScreenShareMessage, \
     StartedCameraShareMessage, StoppedScreenShareMessage, StoppedCameraShareMessage
-from Common_Elements import AESCipher
+from Audio_Codecs import AudioEncoder, AudioDecoder, choose_audio_codec, is_comfort_noise_packet, DEFAULT_AUDIO_CODEC, \
+    COMFORT_NOISE_CODEC, VOICE_RATE, VOICE_FRAME_SIZE, VOICE_FRAME_MILLISECONDS
+from Jitter_Buffer import JitterBuffer, PacketLossConcealer
+from Media_Header import MediaStreamSender, get_video_timestamp, VOICE_STREAM_ID, CAMERA_STREAM_ID, SCREEN_STREAM_ID, \
+    FEEDBACK_STREAM_ID, CAMERA_LOW_STREAM_ID, SUBSCRIPTION_STREAM_ID, VIDEO_CLOCK_RATE, STREAM_ID_NAME_DICT
+from Media_Statistics import MediaStreamStatistics
+from Call_Socket import CallSocket
+from Audio_Mixer import parse_mixed_voice_data, AudioMixerException
+from Playback_Mixer import PlaybackMixer, clip_voice_gain, DEFAULT_VOICE_GAIN
+from Voice_Activity import VoiceActivityDetector
+from Audio_Ring_Buffer import AudioRingBuffer, get_playback_buffer_frames, CAPTURE_BUFFER_FRAMES, RING_BUFFER_WAIT_TIME
+from Video_Pipeline import VideoPipeline, FramePacer, INACTIVE_WAIT_TIME
+from Rate_Control import RateController, ReceiverReport, parse_receiver_reports, RECEIVER_REPORT_INTERVAL
+from Screen_Encoder import ScreenEncoder
+from Simulcast import LayerSubscriptions, choose_camera_layer, pack_subscription, parse_subscription, \
+    SubscriptionException, CAMERA_LAYER_STREAM_IDS, CAMERA_LOW_LAYER_PICTURE_SIZE, CAMERA_LOW_LAYER_QUALITY, NO_LAYER
+from Frame_Fragments import FrameFragmenter, FrameReassembler, FrameFragmentException, MAX_FRAME_SIZE
 import wx
 
-SERVER_IP = "0.0.0.0"
-# SERVER_PORT = 6666
-ADDRESS_IP_INDEX = 0
-ADDRESS_PORT_INDEX = 1
-
-# Communication Constants
-VOICE_DATA_BYTES = 3000
-CAMERA_DATA_BYTES = 65536
-SCREEN_DATA_BYTES = 65536
-MAX_QUEUE_DELAY = 20
-
 # Camera/Screen Constants
-MAX_PACKET_SIZE = 65000
+# The resolution, frame rate and quality of the camera and the screen are picked by the rate controller, up to these.
 FPS = 24
-FPS_PERIOD_TIME = 1.0 / FPS
-SCREEN_PICTURE_SIZE = (800, 600)
 CAMERA_PICTURE_SIZE = (848, 480)
-MAXIMUM_QUALITY = 100
-MINIMUM_QUALITY = 45
-QUALITY_CHANGE_RATE = 3
-MIN_QUALITY_THRESHOLD = MINIMUM_QUALITY + QUALITY_CHANGE_RATE
-MAX_QUALITY_THRESHOLD = MAXIMUM_QUALITY - QUALITY_CHANGE_RATE
-HIGHER_QUALITY_SIGN_BYTES = 55000
 
 
 # Audio Constants
-CHUNK = 1024
+CHUNK = VOICE_FRAME_SIZE
 FORMAT = pyaudio.paInt16
+SAMPLE_WIDTH = 2
+CHUNK_BYTES = CHUNK * SAMPLE_WIDTH
 CHANNELS = 1
-RATE = 44100
-MINIMUM_DECIBEL_VOLUME = 40
+RATE = VOICE_RATE
 INDICATOR_SHOW_TIME = 0.2
 
 
@@ -58,65 +54,125 @@ class ParticipantNotInCallException(Exception):
 class UdpCommunicationHandler(object):
     """
     A UDP communication handler that fully handles the sending and receiving
-    of data.
+    of data. All the data of the call is sent and received through a single call socket.
     """
-    def __init__(self):
-        """
-        Constructs the CommunicationHandler and starts the AESCipher which allows it to encrypt/decrypt messages.
-        """
-        self.cipher = AESCipher()
+    def __init__(self, media_source_id):
+        """
+        Constructs the CommunicationHandler and opens the call socket, which encrypts/decrypts the messages.
+        Every data type is sent as a media stream of its own, whose packets start with a media header.
+        The rate controller decides how the camera and screen streams are sent, by the reports of the receivers.
+        The camera is sent in layers of different sizes, every layer only to the participants that subscribed to it.
+        relay_address - (IP, PORT) or None, the address of the server's media relay if the call's media goes through
+        it, else None and the media is sent to every participant.
+        :param media_source_id: int, the source id of the user's media packets.
+        """
+        self.call_socket = CallSocket()
+        self.relay_address = None
+        self.voice_stream_sender = MediaStreamSender(media_source_id, VOICE_STREAM_ID)
+        self.camera_stream_sender = MediaStreamSender(media_source_id, CAMERA_STREAM_ID)
+        self.screen_stream_sender = MediaStreamSender(media_source_id, SCREEN_STREAM_ID)
+        self.feedback_stream_sender = MediaStreamSender(media_source_id, FEEDBACK_STREAM_ID)
+        self.subscription_stream_sender = MediaStreamSender(media_source_id, SUBSCRIPTION_STREAM_ID)
+        self.camera_fragmenter = FrameFragmenter()
+        self.screen_fragmenter = FrameFragmenter()
+        self.camera_stream_id_sender_dict = {CAMERA_STREAM_ID: self.camera_stream_sender,
+                                             CAMERA_LOW_STREAM_ID: MediaStreamSender(media_source_id,
+                                                                                     CAMERA_LOW_STREAM_ID)}
+        self.camera_stream_id_fragmenter_dict = {CAMERA_STREAM_ID: self.camera_fragmenter,
+                                                 CAMERA_LOW_STREAM_ID: FrameFragmenter()}
+        self.camera_subscriptions = LayerSubscriptions()
+        self.rate_controller = RateController([self.camera_stream_sender, self.screen_stream_sender])
 
-    def broadcast_voice_data(self, sock, raw_voice_data, participants_list):
+    def broadcast_voice_data(self, raw_voice_data, timestamp, participants_list):
         """
         This function sends raw voice data to a list of participants.
-        :param sock: socket, the socket that should send the data.
-        :param raw_voice_data: str, the raw voice data as it was recorded by the microphone.
+        :param raw_voice_data: str, the encoded voice data.
+        :param timestamp: int, the time that the voice data was recorded in, in samples.
         :param participants_list: [Participant], a list of participants to send the data to.
         """
-        for participant in participants_list:
-            self.send_ready_message(sock, raw_voice_data, participant.voice_address)
+        voice_packet = self.voice_stream_sender.create_packet(raw_voice_data, timestamp)
+        for address in self.get_media_addresses(participants_list):
+            self.send_ready_message(voice_packet, address)
 
-    def broadcast_camera_data(self, sock, raw_camera_data, participants_list):
+    def broadcast_camera_data(self, raw_camera_data, participants_list, stream_id=CAMERA_STREAM_ID):
         """
         This function sends raw camera data to a list of participants.
-        :param sock: socket, the socket that should send the data.
         :param raw_camera_data: str, the raw camera data.
         :param participants_list: [Participant], a list of participants to send the data to.
+        :param stream_id: int, the stream id of the camera layer of the data.
         """
-        for participant in participants_list:
-            self.send_ready_message(sock, raw_camera_data, participant.camera_address)
+        self.broadcast_frame(raw_camera_data, self.camera_stream_id_sender_dict[stream_id],
+                             self.camera_stream_id_fragmenter_dict[stream_id], participants_list)
 
-    def broadcast_screen_data(self, sock, raw_screen_data, participants_list):
+    def broadcast_screen_data(self, raw_screen_data, participants_list):
         """
         This function sends raw screen data to a list of participants.
-        :param sock: socket, the socket that should send the data.
         :param raw_screen_data: str, the raw screen data.
         :param participants_list: [Participant], a list of participants to send the data to.
         """
-        for participant in participants_list:
-            self.send_ready_message(sock, raw_screen_data, participant.screen_address)
+        self.broadcast_frame(raw_screen_data, self.screen_stream_sender, self.screen_fragmenter, participants_list)
 
-    def send_ready_message(self, sock, ready_message, address):
+    def broadcast_frame(self, frame_bytes, stream_sender, fragmenter, participants_list):
+        """
+        Sends a camera or screen frame to a list of participants, in fragments that each fit in a single datagram.
+        The fragments are media packets of their own, with the timestamp of the frame.
+        :param frame_bytes: str, the encoded frame.
+        :param stream_sender: MediaStreamSender, the sender of the frame's stream.
+        :param fragmenter: FrameFragmenter, the fragmenter of the frame's stream.
+        :param participants_list: [Participant], a list of participants to send the frame to.
+        """
+        timestamp = get_video_timestamp()
+        addresses = self.get_media_addresses(participants_list)
+        if not addresses:
+            return  # not counted as sent, for the rate controller
+        for fragment in fragmenter.fragment(frame_bytes):
+            fragment_packet = stream_sender.create_packet(fragment, timestamp)
+            for address in addresses:
+                self.send_ready_message(fragment_packet, address)
+
+    def send_receiver_reports(self, reports, participant):
         """
-        The basic sending of data through a UDP socket.
-        Is called to send every message part.
-        :param sock: socket, the socket that sends the data.
-        :param ready_message: str, data that needs to be sent, usually a single message part.
-        :param address: (IP, PORT), the address to send the data to.
+        Sends the reports about the streams that a participant sends, back to the participant.
+        :param reports: [ReceiverReport], the reports.
+        :param participant: Participant, the participant that the reports are about.
         """
-        encrypted_message = self.cipher.encrypt_message(ready_message)
-        sock.sendto(encrypted_message, address)
+        feedback_packet = self.feedback_stream_sender.create_packet("".join(report.pack() for report in reports),
+                                                                    get_video_timestamp())
+        for address in self.get_media_addresses([participant]):
+            self.send_ready_message(feedback_packet, address)
 
-    def receive_udp_message(self, sock, bytes_num):
+    def send_camera_subscription(self, stream_id, participant):
         """
-        receives a UDP message with a constant amount of BYTES.
-        :param sock: socket, the receiving socket
-        :return: data - str, the message that the socket received
-        address - the address of the sender (IP, PORT).
+        Tells a participant which layer of its camera the user wants.
+        :param stream_id: int, the stream id of the camera layer, or NO_LAYER.
+        :param participant: Participant, the participant whose camera the subscription is for.
         """
-        encrypted_data, address = sock.recvfrom(bytes_num)
-        data = self.cipher.decrypt_message(encrypted_data)
-        return data, address
+        subscription_packet = self.subscription_stream_sender.create_packet(
+            pack_subscription(participant.media_source_id, stream_id), get_video_timestamp())
+        for address in self.get_media_addresses([participant]):
+            self.send_ready_message(subscription_packet, address)
+
+    def get_media_addresses(self, participants_list):
+        """
+        Gets the addresses that the media should be sent to - only the media relay if the call uses it, so every
+        packet leaves the user once, else every participant.
+        :param participants_list: [Participant], the participants that the media is for.
+        :return: [(IP, PORT)], the addresses to send to.
+        """
+        if not participants_list:
+            return []
+        if self.relay_address is not None:
+            return [self.relay_address]
+        return [participant.media_address for participant in participants_list]
+
+    def send_ready_message(self, ready_message, address):
+        """
+        The basic sending of data through the call socket.
+        Is called to send every message part.
+        :param ready_message: str, data that needs to be sent, usually a single message part.
+        :param address: (IP, PORT), the address to send the data to.
+        """
+        self.call_socket.send_packet(ready_message, address)
 
 
 class Participant(object):
@@ -125,82 +181,102 @@ class Participant(object):
     the relevant information about a participant and the communication tools
     that connect the user with the participant.
     """
-    def __init__(self, username, ip, receive_voice_stream, voice_ports_pair, screen_ports_pair, camera_ports_pair):
+    def __init__(self, username, ip, media_ports_pair, media_source_id, audio_codecs, is_playing_voice=True):
         """
         *username - str, the username of the participant.
-        *receive_stream - the audio stream to which audio data from this user will be written.
+        *media_address - (IP, PORT), the address of the participant's call socket, all the data is sent to it.
+        *media_source_id - int, the source id in the media headers of the participant's packets.
+        *audio_codecs - [str], the names of the audio codecs that the participant can decode.
+        *audio_decoder - AudioDecoder, decodes the voice packets that the participant sends.
         *is_in_call - Bool, True if the participant is still in the call, else False
-        *process_thread - the thread that continuously reads data that this participant sent and handles it.
-        *voice_queue -  Queue, a queue which contains the voice data that the receive thread receives and the process
-        thread processes.
-        *addresses - different addresses of the participant for different data types.
-        *receive sockets - different receives sockets that receive different data types from the participant.
-        *receive threads - threads that receive different data types from the participant and handles them.
-        *voice_indication_thread - a thread that is responsible for indicating that the
-        participant is speaking in the GUI.
+        *is_playing_voice - Bool, False if the participant's voice is played as a part of the voice that the
+        server mixes, instead of by itself.
+        *voice_gain - float, the volume that the participant's voice is mixed into the output stream with.
+        *jitter_buffer - JitterBuffer, holds the voice packets that the call socket receives until it is their turn
+        to be played by the playback mixer.
+        *loss_concealer - PacketLossConcealer, fills the place of voice packets that were lost.
+        *[x]_statistics - MediaStreamStatistics, the statistics of the different data types that the participant sends.
+        *[x]_reassembler - FrameReassembler, reassembles the camera or screen frames from their fragments.
+        *camera_layer_stream_id - int, the stream id of the layer of the participant's camera that the user subscribed
+        to, by the size of the camera window, NO_LAYER while the window is closed.
+        *last_receiver_report_time - float, the time that the user last reported the participant's streams in.
         *indiciation_time - the time up until which the participant's picture needs to be emphasized
-        (because he sent voice data)
+        (because he sent voice data). Set by the receiving loop and read by the speaking indicators timer of the GUI.
         """
         self.username = username
-        self.voice_address = (ip, voice_ports_pair.send_to_port)
-        self.screen_address = (ip, screen_ports_pair.send_to_port)
-        self.camera_address = (ip, camera_ports_pair.send_to_port)
-        self.receive_voice_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.receive_screen_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.receive_camera_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        self.open_receiving_sockets(voice_ports_pair, screen_ports_pair, camera_ports_pair)
-        self.receive_voice_thread = None
-        self.process_voice_thread = None
-        self.camera_thread = None
-        self.screen_thread = None
-        self.voice_indication_thread = None
-        self.receive_voice_stream = receive_voice_stream
-        self.voice_queue = Queue.Queue()
+        self.media_address = (ip, media_ports_pair.send_to_port)
+        self.media_source_id = media_source_id
+        self.audio_codecs = audio_codecs
+        self.audio_decoder = AudioDecoder(RATE)
+        self.jitter_buffer = JitterBuffer(RATE, CHUNK)
+        self.loss_concealer = PacketLossConcealer()
+        self.voice_statistics = MediaStreamStatistics(VOICE_STREAM_ID, RATE)
+        self.camera_statistics = MediaStreamStatistics(CAMERA_STREAM_ID, VIDEO_CLOCK_RATE)
+        self.camera_low_statistics = MediaStreamStatistics(CAMERA_LOW_STREAM_ID, VIDEO_CLOCK_RATE)
+        self.screen_statistics = MediaStreamStatistics(SCREEN_STREAM_ID, VIDEO_CLOCK_RATE)
+        self.camera_reassembler = FrameReassembler()
+        self.camera_low_reassembler = FrameReassembler()
+        self.screen_reassembler = FrameReassembler()
+        self.camera_layer_stream_id = NO_LAYER
+        self.last_receiver_report_time = 0
         self.indication_time = 0
         self.is_in_call = True
+        self.is_playing_voice = is_playing_voice
+        self.voice_gain = DEFAULT_VOICE_GAIN
+
+    def get_voice_statistics(self):
+        """
+        Gets the state of the participant's jitter buffer - its depth and the packets that were lost.
+        :return: JitterBufferStatistics, the statistics of the participant's voice packets.
+        """
+        return self.jitter_buffer.get_statistics()
+
+    def get_media_statistics(self):
+        """
+        Gets the statistics of all the data types that the participant sends.
+        :return: [MediaStreamStatistics], the voice, camera layers and screen statistics.
+        """
+        return [self.voice_statistics, self.camera_statistics, self.camera_low_statistics, self.screen_statistics]
 
-    def open_receiving_sockets(self, voice_ports_pair, screen_ports_pair, camera_ports_pair):
+    def stop(self):
         """
-        Opens the receiving sockets of the different data types of the participant.
-        :param voice_ports_pair: PortsPair, a pair of ports to send to and receive from voice data.
-        :param screen_ports_pair: PortsPair, a pair of ports to send to and receive from screen data.
-        :param camera_ports_pair: PortsPair, a pair of ports to send to and receive from camera data.
+        Marks the participant as out of the call and wakes up its threads so they end.
         """
-        self.receive_voice_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)  # allows sockets to reuse the same ports.
-        self.receive_voice_socket.bind((SERVER_IP, voice_ports_pair.receive_port))
-        self.receive_screen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.receive_screen_socket.bind((SERVER_IP, screen_ports_pair.receive_port))
-        self.receive_camera_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.receive_camera_socket.bind((SERVER_IP, camera_ports_pair.receive_port))
+        self.is_in_call = False
+        self.jitter_buffer.close()
 
-    def close_sockets(self):
+    def stop_playing_voice(self):
         """
-        Closes the participant's receiving sockets.
+        Stops playing the participant's voice by itself, since the server mixes it with the voice of the others.
         """
-        self.receive_voice_socket.close()
-        self.receive_camera_socket.close()
-        self.receive_screen_socket.close()
+        self.is_playing_voice = False
+        self.jitter_buffer.close()
+
 
-    def get_used_ports_list(self):
+class MixedVoice(object):
+    """
+    The voice of all the other participants of a very large call, mixed by the server's media relay.
+    It is played like the voice of a single participant, no matter how many participants are in the call.
+    """
+    def __init__(self, mixer_source_id):
         """
-        Gets the list of ports that this participant's receiving sockets use.
-        :return: [int], a list of ports that the participant's sockets use.
+        *mixer_source_id - int, the source id in the media headers of the mixed voice packets.
+        The rest of the attributes are the voice attributes of a Participant.
         """
-        used_ports_list = []
-        used_ports_list.append(self.receive_voice_socket.getsockname()[ADDRESS_PORT_INDEX])
-        used_ports_list.append(self.receive_screen_socket.getsockname()[ADDRESS_PORT_INDEX])
-        used_ports_list.append(self.receive_camera_socket.getsockname()[ADDRESS_PORT_INDEX])
-        return used_ports_list
+        self.mixer_source_id = mixer_source_id
+        self.audio_decoder = AudioDecoder(RATE)
+        self.jitter_buffer = JitterBuffer(RATE, CHUNK)
+        self.loss_concealer = PacketLossConcealer()
+        self.voice_statistics = MediaStreamStatistics(VOICE_STREAM_ID, RATE)
+        self.is_in_call = True
+        self.voice_gain = DEFAULT_VOICE_GAIN
 
-    def clean_voice_queue(self):
+    def stop(self):
         """
-        Entirely cleans the data queue of the participant.
-        Used in order to cancel delay and make the call "real-time" if it has been delayed.
+        Stops playing the mixed voice.
         """
-        print "BEFORE CLEAN - " + str(self.voice_queue.qsize())
-        with self.voice_queue.mutex:
-            self.voice_queue.queue.clear()
-        print "DEBUG - DATA QUEUE CLEANED"
+        self.is_in_call = False
+        self.jitter_buffer.close()
 
 
 class VoiceChat(object):
@@ -218,36 +294,68 @@ class VoiceChat(object):
         *using_client - MainClient, the client who opened this VoiceChat object.
         *active_call_group_name - str, the name of the call group that this voice chat belongs to.
         """
-        self.communication_handler = UdpCommunicationHandler()
+        self.communication_handler = UdpCommunicationHandler(using_client.media_source_id)
         self.audio = pyaudio.PyAudio()
         self.participants = []  # [Participant]
         self.using_client = using_client
-        self.voice_chat_server = VoiceChatServer(self.communication_handler, self.participants, self.using_client)
+        self.voice_chat_server = VoiceChatServer(self.audio, self.communication_handler, self.participants, self.using_client)
         self.voice_chat_client = VoiceChatClient(self.audio, self.communication_handler, self.participants, self.using_client)
         self.active_call_group_name = active_call_group_name
 
-    def add_participant(self, username, ip, voice_ports_pair, screen_ports_pair, camera_ports_pair):
+    def add_participant(self, username, ip, media_ports_pair, media_source_id, audio_codecs):
         """
-        Adds a new participant to the voice chat.
+        Adds a new participant to the voice chat. The call socket is opened with the first participant.
         :param username: str, the participant's username.
         :param ip: str, the participant's ip.
-        :param voice_ports_pair: PortsPair, a pair of ports to send to and receive from voice data.
-        :param screen_ports_pair: PortsPair, a pair of ports to send to and receive from screen data.
-        :param camera_ports_pair: PortsPair, a pair of ports to send to and receive from camera data.
-        """
-        receive_stream = self.audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, output=True, frames_per_buffer=CHUNK)
-        participant = Participant(username, ip, receive_stream, voice_ports_pair, screen_ports_pair, camera_ports_pair)
+        :param media_ports_pair: PortsPair, the ports of the user's and the participant's call sockets.
+        :param media_source_id: int, the source id of the participant's media packets.
+        :param audio_codecs: [str], the names of the audio codecs that the participant can decode.
+        """
+        if not self.communication_handler.call_socket.is_bound:
+            self.open_call_socket(media_ports_pair.receive_port)
+        is_playing_voice = self.voice_chat_server.mixed_voice is None  # else its voice is a part of the mixed voice
+        participant = Participant(username, ip, media_ports_pair, media_source_id, audio_codecs, is_playing_voice)
         self.participants.append(participant)
         self.voice_chat_server.start_participant_threads(participant)
         self.voice_chat_client.send_sharing_messages_to_new_participant(participant)
         wx.CallAfter(wx.GetApp().set_voice_chat_participants_names, self.voice_chat_server.get_participant_names_list())
 
+    def open_call_socket(self, call_port):
+        """
+        Binds the call socket and starts the loop that receives the data of all the participants through it.
+        :param call_port: int, the port that the participants send to.
+        """
+        call_socket = self.communication_handler.call_socket
+        call_socket.bind(call_port)
+        Thread(target=call_socket.receive_loop).start()
+
+    def use_audio_mixer(self, mixer_source_id):
+        """
+        Plays the voice of all the participants as a single stream that the server mixes, instead of a stream for
+        every participant.
+        :param mixer_source_id: int, the source id of the mixed voice packets.
+        """
+        if self.voice_chat_server.mixed_voice is not None:
+            return
+        self.voice_chat_server.start_mixed_voice(MixedVoice(mixer_source_id))
+        for participant in self.participants:
+            participant.stop_playing_voice()
+            self.voice_chat_server.playback_mixer.remove_source(participant)
+
+    def set_participant_voice_gain(self, username, gain):
+        """
+        Sets the volume that a participant's voice is played with.
+        :param username: str, the name of the participant.
+        :param gain: float, the volume relative to the participant's original volume.
+        """
+        participant = self.voice_chat_server.find_participant_through_username(username)
+        participant.voice_gain = clip_voice_gain(gain)
+
     def leave_call(self):
         """
         Leaves the call entirely by informing everyone about leaving and then closing their connections.
         """
         self.voice_chat_client.broadcast_leave_call_message()
-        self.voice_chat_client.client_socket.close()
         self.voice_chat_client.cap.release()
         self.voice_chat_server.stop_listening_to_all_participants()
 
@@ -283,30 +391,51 @@ class VoiceChatClient(object):
         (Same as the main VoiceChat)
         *participants - dict, a dictionary that contains the ip of the participants as keys
          and the Participant objects as values. (same as the main VoiceChat)
-        *send_stream - the audio stream that gets audio input from the user.
-        *client_socket - the socket that sends data to all the participants.
+        *send_stream - the audio stream that gets audio input from the user. The stream calls capture_callback with
+        every recorded frame.
+        *capture_ring_buffer - AudioRingBuffer, holds the recorded audio until the sending thread sends it.
         *using_client - access to the main client object.
         *cap - allows us to take camera pictures.
+        *camera_pipeline - VideoPipeline, captures, encodes and sends the camera pictures while the camera is shared.
         *sending_[x]_data - booleans that tell whether the user is currently sending some type of data.
         *is_in_call - Bool, tells whether the user is still in the call.
-        *screen_share_quality - the current quality of screen images in percentages.
+        *camera_settings - VideoSettings or None, the resolution, frame rate and quality of the camera's high layer
+        now, None until the camera is shared.
+        *screen_settings - VideoSettings or None, the resolution, frame rate and quality that the screen is sent with
+        now, None until the screen is shared.
+        *screen_pacer - FramePacer, paces the screenshots by the frame rate of the screen settings.
+        *screen_encoder - ScreenEncoder, encodes the screenshots as updates that only hold the tiles that changed.
+        *audio_encoder - AudioEncoder, encodes the voice data with the codec of the call.
+        *voice_activity_detector - VoiceActivityDetector, decides which recorded frames are speech and are sent.
+        *comfort_noise_encoder - AudioEncoder, encodes the background noise while the user is silent.
+        *is_sending_comfort_noise - Bool, True if all the participants can play comfort noise.
+        *voice_timestamp - int, the number of samples that were recorded so far.
         """
         self.communication_handler = communication_handler
-        self.send_stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK)
-        self.client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.capture_ring_buffer = AudioRingBuffer(CAPTURE_BUFFER_FRAMES * CHUNK_BYTES)
+        self.send_stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, input=True, frames_per_buffer=CHUNK,
+                                      stream_callback=self.capture_callback)
         self.participants = participants
         self.using_client = using_client
         self.cap = cv2.VideoCapture(0)
         self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, CAMERA_PICTURE_SIZE[0])
         self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, CAMERA_PICTURE_SIZE[1])
+        self.camera_pipeline = VideoPipeline("camera", self.capture_camera_frame, self.encode_camera_frame,
+                                             self.send_camera_frame, lambda: self.sending_camera_data,
+                                             lambda: self.is_in_call, FPS)
         self.sending_voice_data = True
         self.sending_camera_data = False
         self.sending_screen_data = False
         self.is_in_call = True
-        self.screen_share_quality = 76
-        #---- TO ALLOW CONNECTION BETWEEN DIFFERENT NETWORKS (ONLY 1 COMPUTER PER NETWORK) 
-        #self.client_socket.bind(("0.0.0.0", SERVER_PORT))
-        #print "*** - OPENED CLINET SOCKET ON ADDRESS " + str(self.client_socket.getsockname())
+        self.camera_settings = None
+        self.screen_settings = None
+        self.screen_pacer = FramePacer(FPS)
+        self.screen_encoder = ScreenEncoder(self.encode_screen_picture)
+        self.audio_encoder = AudioEncoder(DEFAULT_AUDIO_CODEC, RATE)
+        self.voice_activity_detector = VoiceActivityDetector(float(CHUNK) / RATE)
+        self.comfort_noise_encoder = AudioEncoder(COMFORT_NOISE_CODEC, RATE)
+        self.is_sending_comfort_noise = False
+        self.voice_timestamp = 0
 
     def get_participants_names_list(self):
         """
@@ -344,6 +473,7 @@ class VoiceChatClient(object):
         self.sending_screen_data = not self.sending_screen_data
         if self.sending_screen_data:
             toggle_message = StartedScreenShareMessage(self.get_participants_names_list())
+            self.screen_encoder.request_keyframe()
         else:
             toggle_message = StoppedScreenShareMessage(self.get_participants_names_list())
         self.using_client.communication_handler.send_message(toggle_message)
@@ -359,27 +489,46 @@ class VoiceChatClient(object):
         if self.sending_screen_data:
             message = StartedScreenShareMessage([participant.username])
             self.using_client.communication_handler.send_message(message)
+            self.screen_encoder.request_keyframe()
 
-    def broadcast_voice_data(self, voice_data):
+    def broadcast_voice_data(self, voice_data, timestamp):
         """
         Sends voice data to all participants.
-        :param voice_data: bytes, the raw voice data.
+        :param voice_data: bytes, the encoded voice data.
+        :param timestamp: int, the time that the voice data was recorded in, in samples.
         """
-        self.communication_handler.broadcast_voice_data(self.client_socket, voice_data, self.participants)
+        self.communication_handler.broadcast_voice_data(voice_data, timestamp, self.participants)
+
+    def update_audio_encoder(self):
+        """
+        Makes sure that the voice data is encoded with the best codec that all the current participants can decode.
+        The codec is chosen again whenever the participants change, and the receivers follow it by the codec id
+        of every voice packet. Comfort noise is only sent if all the participants can play it.
+        """
+        codec_name = choose_audio_codec([participant.audio_codecs for participant in self.participants])
+        self.is_sending_comfort_noise = all(COMFORT_NOISE_CODEC in participant.audio_codecs
+                                            for participant in self.participants)
+        if codec_name != self.audio_encoder.codec_name:
+            self.audio_encoder = AudioEncoder(codec_name, RATE)
+            print "DEBUG - voice chat audio codec: " + codec_name
 
-    def broadcast_camera_data(self, camera_data_bytes):
+    def broadcast_camera_data(self, camera_data_bytes, stream_id):
         """
-        Sends camera data to all participants.
+        Sends a layer of camera data to the participants that subscribed to it.
         :param camera_data_bytes: bytes, the raw camera data.
+        :param stream_id: int, the stream id of the camera layer.
         """
-        self.communication_handler.broadcast_camera_data(self.client_socket, camera_data_bytes, self.participants)
+        subscribers = self.communication_handler.camera_subscriptions.get_subscribers(stream_id)
+        self.communication_handler.broadcast_camera_data(
+            camera_data_bytes, [participant for participant in self.participants
+                                if participant.media_source_id in subscribers], stream_id)
 
     def broadcast_screen_data(self, screen_data_bytes):
         """
         Sends screen data to all participants.
         :param screen_data_bytes: bytes, the raw screen data.
         """
-        self.communication_handler.broadcast_screen_data(self.client_socket, screen_data_bytes, self.participants)
+        self.communication_handler.broadcast_screen_data(screen_data_bytes, self.participants)
 
     def broadcast_leave_call_message(self):
         """
@@ -388,92 +537,167 @@ class VoiceChatClient(object):
         leave_call_message = LeaveVoiceChatMessage(self.get_participants_names_list())
         self.using_client.communication_handler.send_message(leave_call_message)
 
+    def capture_callback(self, in_data, frame_count, time_info, status):
+        """
+        Called by the send stream with every recorded frame, from a real-time thread of its own. Only copies the
+        audio to the capture ring buffer, so the recording never waits for the network.
+        :param in_data: str, the recorded audio.
+        :param frame_count: int, the number of recorded frames.
+        :param time_info: dict, the timing of the stream.
+        :param status: int, the underflow and overflow flags of the stream.
+        :return: [0]: None, the send stream has no output.
+        [1]: int, pyaudio.paContinue to keep recording.
+        """
+        self.capture_ring_buffer.write(in_data)
+        return None, pyaudio.paContinue
+
     def send_voice_data(self):
         """
-        Continuously gets audio input from the user and sends it to all the participants after checking
-        its loud enough to be considered speaking.
+        Continuously takes the recorded audio out of the capture ring buffer and sends the speech in it to all the
+        participants, as the voice activity detector decides. The audio is encoded with the codec of the call.
+        While the user is silent, comfort noise is sent every once in a while instead.
+        The timestamp advances with every recorded chunk, including the silent ones and the muted ones that are not
+        sent, and the frames that were recorded before the speech started are sent with their own timestamps.
+        The send stream is closed when the user leaves the call.
         """
         try:
             while self.is_in_call:
+                if not self.capture_ring_buffer.wait_for_data(CHUNK_BYTES, RING_BUFFER_WAIT_TIME):
+                    continue
+                data = self.capture_ring_buffer.read(CHUNK_BYTES)
                 if self.sending_voice_data:
-                    data = self.send_stream.read(CHUNK)
-                    rms = audioop.rms(data, 2)
-                    decibel_volume = 0
-                    if rms > 0:
-                        decibel_volume = 20 * math.log10(rms)
-                    if decibel_volume >= MINIMUM_DECIBEL_VOLUME:
-                        self.broadcast_voice_data(data)
+                    self.update_audio_encoder()
+                    speech_frames = self.voice_activity_detector.process(data)
+                    for frame_index, frame in enumerate(speech_frames):
+                        frame_timestamp = self.voice_timestamp - (len(speech_frames) - 1 - frame_index) * CHUNK
+                        self.broadcast_voice_data(self.audio_encoder.encode(frame), frame_timestamp)
+                    if self.voice_activity_detector.should_send_comfort_noise() and self.is_sending_comfort_noise:
+                        self.broadcast_voice_data(self.comfort_noise_encoder.encode(data), self.voice_timestamp)
+                self.voice_timestamp += CHUNK
         except socket.error as e:
             print "send_voice_data error: " + str(e)
         finally:
-            self.client_socket.close()
+            self.send_stream.stop_stream()
+            self.send_stream.close()
+
+    def capture_camera_frame(self):
+        """
+        Reads a picture from the camera. Called by the capture thread of the camera pipeline.
+        :return: numpy.ndarray or None, the BGR picture, None if the camera did not give one.
+        """
+        ret, frame = self.cap.read()
+        if not ret:
+            return None
+        return frame
+
+    def encode_camera_picture(self, frame, picture_size, quality):
+        """
+        Encodes a mirrored camera picture to JPEG straight from its BGR pixels.
+        :param frame: numpy.ndarray, the mirrored BGR picture.
+        :param picture_size: (int, int), the width and the height to encode the picture in.
+        :param quality: int, the JPEG quality.
+        :return: str or None, the JPEG bytes, None if the picture could not be encoded or is too big to send.
+        """
+        try:
+            if (frame.shape[1], frame.shape[0]) != picture_size:
+                frame = cv2.resize(frame, picture_size, interpolation=cv2.INTER_AREA)
+            ret, jpeg_frame = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        except cv2.error as e:
+            print "DEBUG - camera picture encoding failed: " + str(e)
+            return None
+        frame_bytes = jpeg_frame.tostring()
+        if not ret or len(frame_bytes) > MAX_FRAME_SIZE:
+            return None
+        return frame_bytes
+
+    def encode_camera_frame(self, frame):
+        """
+        Mirrors a camera picture and encodes its layers. The high layer is always encoded, since the user sees it, with
+        the resolution and quality that the rate controller picked, and the low layer only while someone subscribed
+        to it. Called by the encoding thread of the camera pipeline, which also takes the frame rate that the rate
+        controller picked.
+        :param frame: numpy.ndarray, the BGR picture.
+        :return: [(int, str)] or None, the stream id and the JPEG bytes of every layer, None if the picture could not
+        be encoded.
+        """
+        subscribed_stream_ids = self.communication_handler.camera_subscriptions.get_subscribed_stream_ids()
+        rate_controller = self.communication_handler.rate_controller
+        if CAMERA_STREAM_ID in subscribed_stream_ids:
+            settings = rate_controller.get_settings(CAMERA_STREAM_ID, time.time())
+        else:  # the high layer is only shown to the user, and takes no part of the bandwidth
+            settings = rate_controller.get_current_settings(CAMERA_STREAM_ID)
+        if settings is not self.camera_settings:
+            print "DEBUG - camera settings: " + str(settings)
+            self.camera_settings = settings
+        self.camera_pipeline.set_fps(settings.fps)
+        frame = cv2.flip(frame, 1)
+        layer_frames = [(CAMERA_STREAM_ID, self.encode_camera_picture(frame, settings.picture_size, settings.quality))]
+        if CAMERA_LOW_STREAM_ID in subscribed_stream_ids:
+            layer_frames.append((CAMERA_LOW_STREAM_ID, self.encode_camera_picture(frame, CAMERA_LOW_LAYER_PICTURE_SIZE,
+                                                                                  CAMERA_LOW_LAYER_QUALITY)))
+        layer_frames = [(stream_id, frame_bytes) for stream_id, frame_bytes in layer_frames if frame_bytes is not None]
+        return layer_frames or None
+
+    def send_camera_frame(self, layer_frames):
+        """
+        Sends the layers of an encoded camera picture to the participants that subscribed to them, and shows the
+        high layer to the user.
+        :param layer_frames: [(int, str)], the stream id and the JPEG bytes of every layer.
+        """
+        for stream_id, frame_bytes in layer_frames:
+            self.broadcast_camera_data(frame_bytes, stream_id)
+            if stream_id == CAMERA_STREAM_ID:
+                wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.set_own_camera_image,
+                             frame_bytes)
 
     def send_camera_data(self):
         """
-        Continuously gets camera pictures from the user and sends them to all the participants after
-        checking their size.
+        Runs the camera pipeline until the user leaves the call: the pictures are captured and encoded by threads of
+        the pipeline, at the target frame rate, and sent by this thread.
         """
         try:
-            while self.is_in_call:
-                if self.sending_camera_data:
-                    try:
-                        ret, frame = self.cap.read()
-                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                        frame = cv2.flip(frame, 1)
-                        image = Image.fromarray(frame)
-                        frame_save = BytesIO()
-                        image.save(frame_save, format='jpeg')
-                        frame_bytes = frame_save.getvalue()
-                        image.close()
-                        if len(frame_bytes) <= 65000:
-                            self.broadcast_camera_data(frame_bytes)
-                            wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.set_own_camera_image, frame_bytes)
-                        time.sleep(FPS_PERIOD_TIME)
-                    except cv2.error as e:
-                        pass  # print "SEND CAMERA ERROR - " + str(e)
+            self.camera_pipeline.run()
         except socket.error as e:
             print e
         finally:
             self.cap.release()
-            self.client_socket.close()
+
+    def encode_screen_picture(self, picture):
+        """
+        Encodes a screenshot, or a tile of it, to JPEG with the quality of the screen settings.
+        :param picture: numpy.ndarray, the RGB pixels.
+        :return: str, the JPEG bytes.
+        """
+        picture_save = BytesIO()
+        Image.fromarray(picture).save(picture_save, format="jpeg", optimize=True, quality=self.screen_settings.quality)
+        return picture_save.getvalue()
 
     def send_screen_data(self):
         """
-        Continuously gets screenshots from the user and sends them to all the participants after
-        checking their size. also handles their quality to allow as many screenshots as possible to
-        be sent.
+        Continuously gets screenshots from the user and sends the parts that changed to all the participants after
+        checking their size. Nothing is sent while the screen does not change. The resolution, frame rate and quality
+        of the screenshots are picked by the rate controller before every screenshot.
         """
         try:
             while self.is_in_call:
                 if self.sending_screen_data:
+                    screen_settings = self.communication_handler.rate_controller.get_settings(SCREEN_STREAM_ID,
+                                                                                              time.time())
+                    if screen_settings is not self.screen_settings:
+                        print "DEBUG - screen settings: " + str(screen_settings)
+                        self.screen_settings = screen_settings
+                    self.screen_pacer.set_fps(self.screen_settings.fps)
                     screenshot = ImageGrab.grab()
-                    screenshot = screenshot.resize(SCREEN_PICTURE_SIZE, Image.ANTIALIAS)
-                    screenshot_save = BytesIO()
-                    screenshot.save(screenshot_save, format="jpeg", optimize=True, quality=self.screen_share_quality)
-                    screenshot_bytes = screenshot_save.getvalue()
-                    self.handle_screen_share_quality(screenshot_bytes)
-                    if len(screenshot_bytes) <= MAX_PACKET_SIZE:
-                        self.broadcast_screen_data(screenshot_bytes)
-                    time.sleep(FPS_PERIOD_TIME)
+                    screenshot = screenshot.resize(self.screen_settings.picture_size, Image.ANTIALIAS)
+                    update_bytes = self.screen_encoder.encode(np.asarray(screenshot.convert("RGB")))[0]
+                    if update_bytes is not None and len(update_bytes) <= MAX_FRAME_SIZE:
+                        self.broadcast_screen_data(update_bytes)
+                    self.screen_pacer.wait_for_deadline()
+                else:
+                    self.screen_pacer.reset()
+                    time.sleep(INACTIVE_WAIT_TIME)
         except socket.error as e:
             print e
-        finally:
-            self.client_socket.close()
-
-    def handle_screen_share_quality(self, screenshot_bytes):
-        """
-        Handles the screen share quality in order to make the screenshots small enough in
-        size and maintain the best quality possible. The pictures size cannot be over 64kb and thus
-        we need to dynamically change their quality in order to allow as many pictures as possible to be
-        This function gets the current screenshot and changes the quality of the next screenshot according to it.
-        sent through the socket.
-        :param screenshot_bytes: bytes, the bytes of the screenshot.
-        """
-        if len(screenshot_bytes) < HIGHER_QUALITY_SIGN_BYTES and self.screen_share_quality <= MAX_QUALITY_THRESHOLD:
-            self.screen_share_quality += QUALITY_CHANGE_RATE
-        elif len(screenshot_bytes) > MAX_PACKET_SIZE:
-            if self.screen_share_quality >= MIN_QUALITY_THRESHOLD:
-                self.screen_share_quality -= QUALITY_CHANGE_RATE
 
 
 class VoiceChatServer(object):
@@ -481,64 +705,198 @@ class VoiceChatServer(object):
     This class represents the server of the p2p voice chat.
     It is responsible for receiving data from the participants and handling it.
     """
-    def __init__(self, communication_handler, participants, using_client):
+    def __init__(self, audio, communication_handler, participants, using_client):
         """
         *communication_handler - CommunicationHandler, the communication handler of the voice chat.
         (Same as the main VoiceChat)
         *participants - dict, a dictionary that contains the ip of the participants as keys
          and the Participant objects as values. (same as the main VoiceChat)
          *using_client - MainClient, the client that uses this voice chat object.
+        *playback_mixer - PlaybackMixer, mixes the voice of all the participants.
+        *playback_ring_buffer - AudioRingBuffer, holds the mixed audio until the playback stream plays it.
+        *playback_stream - the single audio stream that plays the voice of all the participants, or None once it is
+        closed. The stream calls playback_callback whenever the device needs more audio.
+        *playback_thread - the thread that mixes the voice of the participants into the playback ring buffer.
+        *playback_underruns - int, how many times the device needed audio that was not mixed in time.
         """
         self.communication_handler = communication_handler
         self.participants = participants
         self.using_client = using_client
+        self.mixed_voice = None
+        self.playback_mixer = PlaybackMixer(CHUNK)
+        self.playback_ring_buffer = AudioRingBuffer(get_playback_buffer_frames(VOICE_FRAME_MILLISECONDS) * CHUNK_BYTES)
+        self.playback_underruns = 0
+        self.is_playing = True
+        self.playback_stream = audio.open(format=FORMAT, channels=CHANNELS, rate=RATE, output=True, frames_per_buffer=CHUNK,
+                                          stream_callback=self.playback_callback)
+        self.playback_thread = Thread(target=self.mix_playback_loop)
+        self.playback_thread.start()
+
+    def handle_media_packet(self, participant, header, data, arrival_time):
+        """
+        Handles a packet of a participant, by the type of its data. Called by the loop that receives the data of
+        all the participants through the call socket.
+        :param participant: Participant, the participant that sent the packet.
+        :param header: MediaHeader, the header of the packet.
+        :param data: str, the data of the packet.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        if header.stream_id == VOICE_STREAM_ID:
+            self.handle_voice_data(participant, header, data, arrival_time)
+        elif header.stream_id in CAMERA_LAYER_STREAM_IDS:
+            self.handle_camera_data(participant, header, data, arrival_time)
+        elif header.stream_id == SCREEN_STREAM_ID:
+            self.handle_screen_data(participant, header, data, arrival_time)
+        elif header.stream_id == FEEDBACK_STREAM_ID:
+            self.handle_receiver_reports(participant, data, arrival_time)
+        elif header.stream_id == SUBSCRIPTION_STREAM_ID:
+            self.handle_camera_subscription(participant, data)
+        if arrival_time - participant.last_receiver_report_time >= RECEIVER_REPORT_INTERVAL:
+            self.send_receiver_reports(participant, arrival_time)
+            # sent again with the reports, so a subscription that was lost is repaired
+            self.communication_handler.send_camera_subscription(participant.camera_layer_stream_id, participant)
 
-    def receive_voice_data(self, participant):
+    def set_camera_window_size(self, participant_name, window_size):
         """
-        Continuously receive data from a given participant through its unique socket
-        and puts the data in the data queue to let the process thread handle it.
-        :param participant: Participant, the participant that the user should listen to.
+        Subscribes to the layer of a participant's camera that fits the window that shows it. Called by the GUI when
+        the camera window of the participant opens, changes its size or closes.
+        :param participant_name: str, the name of the participant.
+        :param window_size: (int, int) or None, the width and the height of the camera window, None if it is closed.
         """
         try:
-            while participant.is_in_call:
-                try:
-                    data, address = self.communication_handler.receive_udp_message(participant.receive_voice_socket, VOICE_DATA_BYTES)
-                    participant.voice_queue.put(data)
-                    participant.indication_time = time.time() + INDICATOR_SHOW_TIME
-                    # print "DEBUG QUEUE START - " + str(participant.voice_queue.qsize())
-                except socket.error as e:
-                    print "VOICE DATA ERROR " + str(e)
-        finally:
-            participant.receive_voice_socket.close()
+            participant = self.find_participant_through_username(participant_name)
+        except ParticipantNotInCallException:
+            return
+        stream_id = choose_camera_layer(window_size)
+        if stream_id != participant.camera_layer_stream_id:
+            participant.camera_layer_stream_id = stream_id
+            self.communication_handler.send_camera_subscription(stream_id, participant)
 
-    def process_voice_data(self, participant):
+    def handle_camera_subscription(self, participant, data):
         """
-        Continuously reads data from the participant's data queue and handles the
-        participants messages.
-        If the data queue has a bigger delay than the constant max delay value, then the
-        queue is cleared.
-        :param participant: Participant, the participant whose messages the function handles.
+        Handles the subscription of a participant to a layer of the user's camera. With the media relay, the
+        subscriptions of the participants to each other's cameras arrive too, and are ignored.
+        :param participant: Participant, the participant that subscribed.
+        :param data: str, the data of the subscription packet.
         """
-        while participant.is_in_call:
-            voice_data = participant.voice_queue.get()
-            participant.voice_queue.task_done()
-            # print "DEBUG QUEUE STOP - " + str(participant.voice_queue.qsize())
-            if participant.voice_queue.qsize() > MAX_QUEUE_DELAY:
-                participant.clean_voice_queue()
-            participant.receive_voice_stream.write(voice_data)
+        try:
+            sender_source_id, stream_id = parse_subscription(data)
+        except SubscriptionException as e:
+            print "DEBUG - invalid camera subscription: " + str(e)
+            return
+        if sender_source_id == self.communication_handler.subscription_stream_sender.source_id and \
+                self.communication_handler.camera_subscriptions.subscribe(participant.media_source_id, stream_id):
+            print "DEBUG - " + participant.username + " subscribed to camera layer: " + \
+                  STREAM_ID_NAME_DICT.get(stream_id, "none")
+
+    def send_receiver_reports(self, participant, current_time):
+        """
+        Reports the loss, the jitter, the queuing delay and the receive rate of the camera and screen streams that a
+        participant sends, back to the participant, so it can fit its video to the network. Sent once every
+        RECEIVER_REPORT_INTERVAL, with the packets of the participant that arrive.
+        :param participant: Participant, the participant that the reports are about.
+        :param current_time: float, the time now.
+        """
+        participant.last_receiver_report_time = current_time
+        reports = []
+        for statistics in [participant.camera_statistics, participant.camera_low_statistics,
+                           participant.screen_statistics]:
+            if statistics.has_interval_packets():
+                fraction_lost, receive_rate = statistics.get_interval_report(current_time)
+                reports.append(ReceiverReport(participant.media_source_id, statistics.stream_id, fraction_lost,
+                                              statistics.jitter, statistics.get_queuing_delay(), receive_rate))
+        if reports:
+            self.communication_handler.send_receiver_reports(reports, participant)
+
+    def handle_receiver_reports(self, participant, data, arrival_time):
+        """
+        Hands the reports of a participant about the user's streams to the rate controller. With the media relay,
+        the reports of the participants about each other arrive too, and are ignored.
+        :param participant: Participant, the participant that sent the reports.
+        :param data: str, the data of the feedback packet.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        own_source_id = self.communication_handler.feedback_stream_sender.source_id
+        reports = [report for report in parse_receiver_reports(data) if report.source_id == own_source_id]
+        if reports:
+            self.communication_handler.rate_controller.handle_receiver_reports(participant.media_source_id, reports,
+                                                                                arrival_time)
+
+    def handle_voice_data(self, participant, header, voice_data, arrival_time):
+        """
+        Puts voice data of a participant in its jitter buffer to let the playback mixer play it. Comfort noise goes
+        through the jitter buffer too, so it is played in order with the speech, but it does not mean that the
+        participant speaks.
+        :param participant: Participant, the participant that sent the data.
+        :param header: MediaHeader, the header of the packet.
+        :param voice_data: str, the encoded voice data.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        participant.voice_statistics.update(header, len(voice_data), arrival_time)
+        if participant.is_playing_voice:
+            participant.jitter_buffer.put(header.sequence_number, header.timestamp, voice_data, arrival_time)
+        if not is_comfort_noise_packet(voice_data):
+            participant.indication_time = arrival_time + INDICATOR_SHOW_TIME
+
+    def handle_mixed_voice_packet(self, mixed_voice, header, data, arrival_time):
+        """
+        Puts the mixed voice of the call in its jitter buffer to let the process thread play it, and indicates that
+        the participants that were mixed into it are speaking.
+        :param mixed_voice: MixedVoice, the mixed voice of the call.
+        :param header: MediaHeader, the header of the packet.
+        :param data: str, the data of the packet.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        if header.stream_id != VOICE_STREAM_ID:
+            return
+        try:
+            contributing_source_ids, voice_data = parse_mixed_voice_data(data)
+        except AudioMixerException as e:
+            print "DEBUG - invalid mixed voice packet: " + str(e)
+            return
+        mixed_voice.voice_statistics.update(header, len(voice_data), arrival_time)
+        mixed_voice.jitter_buffer.put(header.sequence_number, header.timestamp, voice_data, arrival_time)
+        for participant in self.participants:
+            if participant.media_source_id in contributing_source_ids:
+                participant.indication_time = arrival_time + INDICATOR_SHOW_TIME
 
-    def voice_indication_loop(self, participant):
+    def mix_playback_loop(self):
         """
-        Continuously checks whether the picture of the participant should be emphasized in the GUI.
-        The picture is emphasized as long as the participant is sending voice data.
-        :param participant: Participant, the participant that the function handles.
+        Continuously mixes the voice of the participants into the playback ring buffer, until the playback stream is
+        closed. The buffer only has room for a few frames, and the playback stream makes room in it at the playing
+        pace, so the voice packets are taken out of the jitter buffers at the playing pace too.
         """
-        while participant.is_in_call:
-            if time.time() < participant.indication_time:
-                wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.emphasize_participant_panel, participant.username)
-                while participant.is_in_call and time.time() < participant.indication_time:
-                    pass
-                wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.stop_participant_panel_emphasize, participant.username)
+        while self.is_playing:
+            if self.playback_ring_buffer.wait_for_space(CHUNK_BYTES, RING_BUFFER_WAIT_TIME):
+                self.playback_ring_buffer.write(self.playback_mixer.get_frames(CHUNK))
+
+    def playback_callback(self, in_data, frame_count, time_info, status):
+        """
+        Called by the playback stream whenever the device needs more audio, from a real-time thread of its own.
+        Only copies the mixed audio out of the playback ring buffer, so the playing never waits for the decoding and
+        the mixing. Audio that was not mixed in time is played as silence.
+        :param in_data: None, the playback stream has no input.
+        :param frame_count: int, the number of frames that the device needs.
+        :param time_info: dict, the timing of the stream.
+        :param status: int, the underflow and overflow flags of the stream.
+        :return: [0]: str, the mixed frames.
+        [1]: int, pyaudio.paContinue to keep playing.
+        """
+        frames_bytes = frame_count * SAMPLE_WIDTH
+        data = self.playback_ring_buffer.read(frames_bytes)
+        if len(data) < frames_bytes:
+            self.playback_underruns += 1
+            data += "\0" * (frames_bytes - len(data))
+        return data, pyaudio.paContinue
+
+    def get_speaking_participants_names(self):
+        """
+        Gets the participants whose pictures should be emphasized in the GUI - the participants that sent voice data
+        in the last INDICATOR_SHOW_TIME. Called by the speaking indicators timer of the GUI.
+        :return: [str], the names of the participants that are speaking.
+        """
+        current_time = time.time()
+        return [participant.username for participant in self.participants if current_time < participant.indication_time]
 
     def handle_pickled_voice_chat_messages(self, message):
         """
@@ -574,65 +932,116 @@ class VoiceChatServer(object):
                 return participant
         raise ParticipantNotInCallException
 
-    def handle_camera_data(self, participant):
+    def reassemble_frame(self, reassembler, fragment, arrival_time):
         """
-        Receives and handles camera data from a participant.
-        :param participant: Participant, the participant that the function handles.
+        Adds a fragment of a camera or screen frame to the frame.
+        :param reassembler: FrameReassembler, the reassembler of the frame's stream.
+        :param fragment: str, the data of the packet.
+        :param arrival_time: float, the time that the packet arrived in.
+        :return: str or None, the frame if the fragment completed it, else None.
         """
         try:
-            while participant.is_in_call:
-                frame_bytes, address = self.communication_handler.receive_udp_message(participant.receive_camera_socket, CAMERA_DATA_BYTES)
-                wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.set_participant_camera_image, participant.username, frame_bytes)
-        except socket.error as e:
-            print e
-        finally:
-            participant.receive_camera_socket.close()
-            cv2.destroyAllWindows()
+            return reassembler.add_fragment(fragment, arrival_time)
+        except FrameFragmentException as e:
+            print "DEBUG - invalid frame fragment: " + str(e)
+            return None
 
-    def handle_screen_data(self, participant):
-        """
-        Receives and handles screen data from a participant.
-        :param participant: Participant, the participant that the function handles.
-        """
-        try:
-            while participant.is_in_call:
-                screenshot_bytes, address = self.communication_handler.receive_udp_message(participant.receive_screen_socket, SCREEN_DATA_BYTES)
-                wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.set_participant_screen_share_image, participant.username, screenshot_bytes)
-        except socket.error as e:
-            print e
-        finally:
-            participant.receive_screen_socket.close()
+    def handle_camera_data(self, participant, header, fragment, arrival_time):
+        """
+        Shows camera data of a participant, once all the fragments of a frame arrived. Every camera layer is
+        reassembled by itself, and the frames of the layer that the user just left are still shown until the frames
+        of the new layer arrive.
+        Frames that are completed after a newer frame of their layer was already shown are not shown.
+        :param participant: Participant, the participant that sent the data.
+        :param header: MediaHeader, the header of the packet.
+        :param fragment: str, a fragment of a camera frame.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        if header.stream_id == CAMERA_LOW_STREAM_ID:
+            statistics, reassembler = participant.camera_low_statistics, participant.camera_low_reassembler
+        else:
+            statistics, reassembler = participant.camera_statistics, participant.camera_reassembler
+        statistics.update(header, len(fragment), arrival_time)
+        frame_bytes = self.reassemble_frame(reassembler, fragment, arrival_time)
+        if frame_bytes is not None:
+            wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.set_participant_camera_image, participant.username, frame_bytes)
+
+    def handle_screen_data(self, participant, header, fragment, arrival_time):
+        """
+        Shows screen data of a participant, once all the fragments of a screen update arrived. The update is drawn
+        over the screen that is shown by the screen share frame.
+        Updates that are completed after a newer update was already shown are not shown.
+        :param participant: Participant, the participant that sent the data.
+        :param header: MediaHeader, the header of the packet.
+        :param fragment: str, a fragment of a screen update.
+        :param arrival_time: float, the time that the packet arrived in.
+        """
+        participant.screen_statistics.update(header, len(fragment), arrival_time)
+        screenshot_bytes = self.reassemble_frame(participant.screen_reassembler, fragment, arrival_time)
+        if screenshot_bytes is not None:
+            wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.set_participant_screen_share_image, participant.username, screenshot_bytes)
 
     def start_participant_threads(self, participant):
         """
-        Starts the threads that listen and process the given participant's data.
+        Starts handling the given participant's packets that the call socket receives, and starts playing its voice.
         :param participant: Participant, the participant that the user should listen to.
         """
-        #---- TO ALLOW CONNECTION BETWEEN DIFFERENT NETWORKS (ONLY 1 COMPUTER PER NETWORK) 
-        #participant.receive_voice_socket.sendto("a", (participant.address[0], SERVER_PORT))
-        #print "*** CONNECTED TO ADDRESS " + str((participant.address[0], SERVER_PORT))
-        participant.receive_voice_thread = Thread(target=self.receive_voice_data, args=[participant])
-        participant.process_voice_thread = Thread(target=self.process_voice_data, args=[participant])
-        participant.camera_thread = Thread(target=self.handle_camera_data, args=[participant])
-        participant.screen_thread = Thread(target=self.handle_screen_data, args=[participant])
-        participant.voice_indication_thread = Thread(target=self.voice_indication_loop, args=[participant])
-        participant.receive_voice_thread.start()
-        participant.process_voice_thread.start()
-        participant.camera_thread.start()
-        participant.screen_thread.start()
-        participant.voice_indication_thread.start()
+        self.communication_handler.call_socket.add_source(participant.media_source_id, partial(self.handle_media_packet, participant))
+        if participant.is_playing_voice:
+            self.playback_mixer.add_source(participant)
+
+    def start_mixed_voice(self, mixed_voice):
+        """
+        Starts playing the mixed voice of the call that the call socket receives.
+        :param mixed_voice: MixedVoice, the mixed voice of the call.
+        """
+        self.mixed_voice = mixed_voice
+        self.communication_handler.call_socket.add_source(mixed_voice.mixer_source_id, partial(self.handle_mixed_voice_packet, mixed_voice))
+        self.playback_mixer.add_source(mixed_voice)
+
+    def stop_mixed_voice(self):
+        """
+        Stops playing the mixed voice of the call, if the call is mixed.
+        """
+        if self.mixed_voice is not None:
+            self.mixed_voice.stop()
+            self.communication_handler.call_socket.remove_source(self.mixed_voice.mixer_source_id)
+            self.playback_mixer.remove_source(self.mixed_voice)
 
     def stop_listening_to_all_participants(self):
         """
-        Stops listening to all the participants by closing their sockets and then
-        informing the server about newly opened ports.
+        Stops listening to all the participants by closing the call socket and then
+        informing the server about the newly opened port.
         """
-        new_open_ports = []
         for participant in self.participants:
-            new_open_ports.extend(participant.get_used_ports_list())
-            participant.is_in_call = False
-            participant.close_sockets()
-        self.using_client.communication_handler.send_new_open_ports_message(new_open_ports)
+            participant.stop()
+        self.stop_mixed_voice()
+        self.close_call_socket()
+        self.close_playback_stream()
+
+    def close_playback_stream(self):
+        """
+        Stops playing the voice of the call and closes the playback stream, if it is still open.
+        """
+        if self.playback_stream is None:
+            return
+        self.is_playing = False
+        self.playback_ring_buffer.close()
+        self.playback_stream.stop_stream()
+        self.playback_stream.close()
+        self.playback_stream = None
+
+    def close_call_socket(self):
+        """
+        Closes the call socket, and informs the server that its port is open again.
+        """
+        call_socket = self.communication_handler.call_socket
+        if not call_socket.is_open:
+            return
+        new_open_ports = [call_socket.get_port()] if call_socket.is_bound else []
+        call_socket.close()
+        if new_open_ports:
+            self.using_client.communication_handler.send_new_open_ports_message(new_open_ports)
 
     def remove_participant(self, participant):
         """
@@ -640,15 +1049,23 @@ class VoiceChatServer(object):
         if there are no more participants afterwards, closes the voice chat for good.
         :param participant: Participant, the participant the left the voice chat.
         """
-        new_open_ports = participant.get_used_ports_list()
-        participant.is_in_call = False
-        participant.close_sockets()
+        participant.stop()
+        self.communication_handler.call_socket.remove_source(participant.media_source_id)
+        self.communication_handler.rate_controller.remove_receiver(participant.media_source_id)
+        self.communication_handler.camera_subscriptions.remove_receiver(participant.media_source_id)
+        self.playback_mixer.remove_source(participant)
         self.participants.remove(participant)
-        print "DEBUG - REMOVED " + participant.username
-        self.using_client.communication_handler.send_new_open_ports_message(new_open_ports)
+        print "DEBUG - REMOVED " + participant.username + ", jitter buffer: " + str(participant.get_voice_statistics())
+        for statistics in participant.get_media_statistics():
+            print "DEBUG - " + str(statistics)
+        print "DEBUG - camera " + str(participant.camera_reassembler) + ", camera low " + \
+              str(participant.camera_low_reassembler) + ", screen " + str(participant.screen_reassembler)
         wx.CallAfter(wx.GetApp().set_voice_chat_participants_names, self.get_participant_names_list())
         wx.CallAfter(wx.GetApp().program_frame.main_panel.current_voice_chat_panel.participant_viewer.remove_participant_panel, participant.username)
         if not self.participants:  # there are no more participants, so voice chat is over and Chat Group is over too.
+            self.stop_mixed_voice()
+            self.close_call_socket()
+            self.close_playback_stream()
             self.using_client.close_voice_chat()
         self.using_client.update_called_user_information()
 